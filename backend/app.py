@@ -19,6 +19,7 @@ import os
 import requests
 import atexit
 import json
+from urllib.parse import parse_qsl
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -214,6 +215,16 @@ except ImportError:
 except Exception as e:
     logger.warning(f"⚠️ TIF Martin 服务路由注册失败: {str(e)}")
 
+# 后台任务队列路由
+try:
+    from routes.job_routes import job_bp
+    app.register_blueprint(job_bp, url_prefix='/api/jobs')
+    logger.info("✅ 后台任务队列路由注册成功")
+except ImportError:
+    logger.info("后台任务队列路由不存在，跳过")
+except Exception as e:
+    logger.warning(f"⚠️ 后台任务队列路由注册失败: {str(e)}")
+
 # GIS 通用路由
 try:
     from routes.gis import gis_bp
@@ -291,10 +302,33 @@ try:
 except Exception as e:
     martin_service = None
     logger.warning(f"⚠️ Martin服务模块加载失败: {str(e)}")
+
+# 启动后台任务队列（任务持久化在本地SQLite，重启后继续执行未完成的任务）
+job_queue = None
+try:
+    from config import JOB_QUEUE_CONFIG
+    if JOB_QUEUE_CONFIG.get('enabled', True):
+        from services.job_queue import get_job_queue
+        job_queue = get_job_queue()
+        job_queue.start()
+        logger.info("✅ 后台任务队列启动成功")
+except Exception as e:
+    job_queue = None
+    logger.warning(f"⚠️ 后台任务队列启动失败: {str(e)}")
+
+# 后台补算已有图层的EPSG:4326范围（新发布的图层在发布时计算）
+try:
+    from services.layer_extent_service import start_extent_backfill
+    start_extent_backfill()
+except Exception as e:
+    logger.warning(f"⚠️ 图层范围补算启动失败: {str(e)}")
+
 # GeoServer代理路由（解决CORS问题）
 @app.route('/geoserver/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
 def geoserver_proxy(path):
     """GeoServer代理，解决CORS跨域问题"""
+    from services.capabilities_cache import capabilities_cache, is_capabilities_request
+
     # 处理预检请求
     if request.method == 'OPTIONS':
         response = Response()
@@ -313,6 +347,15 @@ def geoserver_proxy(path):
     logger.info(f"代理请求: {request.method} {target_url}")
     
     try:
+        # GetCapabilities 文档较大且生成较慢，走进程内共享缓存
+        query_params = parse_qsl(request.query_string.decode('utf-8'), keep_blank_values=True)
+        if request.method == 'GET' and is_capabilities_request(query_params):
+            document = capabilities_cache.get_document(path, query_params)
+            response = Response(document.content, status=document.status_code,
+                                content_type=document.content_type)
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            return response
+
         # 转发请求到GeoServer
         if request.method == 'GET':
             resp = requests.get(target_url, timeout=30, allow_redirects=False)
@@ -362,6 +405,18 @@ def api_health_check():
         'service': 'shpservice-api'
     })
 
+@app.route('/api/health/db-pool')
+def db_pool_stats():
+    """数据库连接池指标接口"""
+    try:
+        from models.db import get_pool_stats
+        return jsonify({
+            'status': 'ok',
+            'pool': get_pool_stats()
+        })
+    except Exception as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
 @app.route('/')
 def index():
     """首页"""
@@ -391,6 +446,25 @@ def cleanup_martin():
         except Exception as e:
             logger.warning(f"⚠️ 清理Martin服务时出错: {str(e)}")
 
+def cleanup_db_pool():
+    """关闭数据库连接池"""
+    try:
+        from models.db import close_pool
+        close_pool()
+    except Exception as e:
+        logger.warning(f"⚠️ 关闭数据库连接池时出错: {str(e)}")
+
+def cleanup_job_queue():
+    """停止后台任务执行线程"""
+    if job_queue:
+        try:
+            job_queue.stop()
+        except Exception as e:
+            logger.warning(f"⚠️ 停止任务队列时出错: {str(e)}")
+
+atexit.register(cleanup_db_pool)
+atexit.register(cleanup_job_queue)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5030))
     debug = os.environ.get('DEBUG', 'True').lower() == 'true'    
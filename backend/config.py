@@ -21,7 +21,13 @@ DB_CONFIG = {
     'database': 'Geometry',
     'user': 'postgres',
     'password': '123456',
-    'schema': 'public'
+    'schema': 'public',
+    # 连接池配置
+    'pool_min_size': 2,  # 最小连接数
+    'pool_max_size': 20,  # 最大连接数
+    'pool_max_lifetime': 1800,  # 连接最大存活时间（秒），超时后回收重建
+    'pool_health_check_interval': 30,  # 空闲超过该时间（秒）的连接借出前做健康检查
+    'pool_acquire_timeout': 30,  # 获取连接最长等待时间（秒）
 }
 
 # PostGIS专用配置
@@ -34,6 +40,8 @@ POSTGIS_CONFIG = {
     'use_geopandas': True,  # 优先使用GeoPandas
     'create_spatial_index': True,  # 自动创建空间索引
     'optimize_for_geoserver': True,  # 针对GeoServer优化
+    'import_method': 'copy',  # 手动导入方式: copy(批量COPY) 或 insert(逐要素INSERT)
+    'copy_batch_size': 5000,  # COPY每批要素数
 }
 
 # Martin 瓦片服务配置
@@ -53,6 +61,42 @@ MARTIN_CONFIG = {
     'martin_executable': r'F:\code\martin\martin-x86_64-pc-windows-msvc\martin.exe',
 }
 
+# Martin 重启调度配置（发布/取消发布时合并重启请求）
+MARTIN_RELOAD_CONFIG = {
+    'debounce_seconds': 2,  # 最后一次请求后静默该时间再重启，期间的请求合并为一次
+    'max_delay_seconds': 10,  # 第一次请求后最多等待该时间（持续有请求时也会重启）
+    'ready_timeout': 30,  # 等待新进程HTTP就绪探针通过（或旧进程端口释放）的最长时间
+    'probe_interval': 0.2,  # 就绪探针轮询间隔（秒）
+    'publish_wait_seconds': 60,  # 发布接口等待重启完成的最长时间
+}
+
+# TIF瓦片渲染配置
+TIF_TILING_CONFIG = {
+    'workers': 0,  # 渲染进程数，0 表示使用CPU核数
+    'max_workers': 64,  # 允许请求的最大进程数
+    'gdal_cachemax': 512,  # 每个渲染进程的 GDAL_CACHEMAX（MB）
+    'partitions_per_worker': 8,  # 每个进程平均分到的分区数，越大进度越平滑
+    'max_partition_tiles': 1024,  # 单个分区最多瓦片数（内存流水线下限制单次回传数据量）
+    'pipeline': 'memory',  # memory: 内存重投影后直接写入MBTiles；directory: 先写瓦片目录再打包
+    'job_stale_seconds': 180,  # 其他进程的转换工作文件超过该时间未更新时视为已中断，允许重新转换或续传
+    'mbtiles_batch_size': 1000,  # 写入MBTiles时每个事务的瓦片数
+    'pyramid': True,  # 金字塔模式：只从源数据渲染最大级别，低级别由4个子瓦片降采样合成
+    'footprint': True,  # 构建有效数据footprint索引，重投影前跳过不含数据的瓦片
+    'footprint_cells_per_tile': 4,  # footprint掩膜中每个瓦片的单元数（每个方向）
+    'footprint_max_cells': 2048,  # footprint掩膜单边最大单元数
+    'store_empty_tiles': True,  # 范围内完全透明的瓦片是否写入MBTiles（去重后只存一份）
+    'start_method': None,  # 进程启动方式 fork/spawn，None 使用平台默认
+    'transparent_tolerance': 5,  # 像素与nodata比较的容差（nodata为0时即黑色透明化容差）
+    'nodata': 0,  # 源波段未登记nodata时使用的值，None 表示不按nodata透明
+    'use_source_nodata': True,  # 优先使用源数据集各波段登记的nodata
+    'tile_format': 'png',  # 瓦片编码 png / jpeg / webp / auto（auto: 全部为webp，完全不透明瓦片有损、其余无损）
+    'tile_quality': 85,  # jpeg / webp 压缩质量（1-100）
+    'clamp_to_native_zoom': True,  # max_zoom 超过源数据原始分辨率对应的级别时截断（False 只提示）
+    'estimate_sample_tiles': 16,  # 估算工作量时在最大级别抽样渲染的瓦片数
+    'estimate_compose_ratio': 0.3,  # 金字塔模式下由子瓦片合成一个瓦片相对重投影渲染的耗时比例
+    'reuse_duplicate_mbtiles': True,  # 相同内容的TIF按相同参数转换时复用已有MBTiles（硬链接），不重新切片
+}
+
 # GeoServer配置
 GEOSERVER_CONFIG = {
     'url': 'http://localhost:8083/geoserver',
@@ -95,6 +139,56 @@ FILE_STORAGE = {
     'max_content_length': 50 * 1024 * 1024 * 1024,  # 50GB
     'chunk_size': 10 * 1024 * 1024,  # 分片大小: 10MB
     'chunk_cleanup_hours': 24,  # 分片文件清理时间: 24小时
+    'chunk_complete_timeout_seconds': 600,  # 完成步骤超过该时间未结束视为中断，允许重新完成
+    'deduplicate_uploads': True,  # 按内容摘要去重：相同内容的上传硬链接到已保存的文件，每条记录有自己的路径（引用计数，最后一个引用删除时才删除文件）
+}
+
+# 文件列表查询配置
+FILE_LIST_CONFIG = {
+    'max_page_size': 200,  # 单页最多返回的文件数
+    'count_cache_seconds': 60,  # 列表总数缓存时间（秒），翻页时不再每次执行COUNT
+}
+
+# 图层范围配置（发布时计算并保存EPSG:4326范围，见 services/layer_extent_service.py）
+LAYER_EXTENT_CONFIG = {
+    'estimate_rows_threshold': 1000000,  # PostGIS表行数超过该值时使用 ST_EstimatedExtent 估算
+    'backfill_on_startup': True,  # 启动时在后台补算已有图层的范围
+    'backfill_batch_size': 50,  # 每批补算的图层数
+    'retry_after_seconds': 600,  # 范围计算失败后，边界接口间隔该时间才重新计算
+}
+
+# 场景文档缓存配置（打开场景时返回的场景和图层列表）
+SCENE_CACHE_CONFIG = {
+    'revalidate_seconds': 5,  # 超过该时间后核对一次场景版本号（其他进程的修改在此时间内可见）
+    'max_age_seconds': 300,  # 缓存最长保留时间（图层引用的服务、文件在场景外被修改时的最大延迟）
+    'max_scenes': 256,  # 每个进程最多缓存的场景数
+}
+
+# 坐标系目录（spatial_ref_sys 内存索引）配置
+CRS_CATALOG_CONFIG = {
+    'revalidate_seconds': 60,  # 超过该时间后核对一次表的行数、最大srid和定义长度（其他进程新增坐标系在此时间内可见）
+}
+
+# GeoServer GetCapabilities 缓存配置（代理、图层能力接口、发布后校验共享）
+CAPABILITIES_CACHE_CONFIG = {
+    'ttl_seconds': 300,  # 文档缓存时间（其他进程发布/删除图层后的最大延迟）
+    'fetch_timeout': 30,  # 请求GeoServer的超时时间（秒）
+    'max_documents': 16,  # 每个进程最多缓存的文档数（按服务、版本、工作空间区分）
+}
+
+# 后台任务队列配置（任务持久化在本地SQLite中，进程重启后继续执行）
+JOB_QUEUE_CONFIG = {
+    'enabled': True,  # 是否在应用进程中启动任务执行线程
+    'db_path': None,  # 任务库路径，None 使用 upload_folder/jobs/jobs.db
+    'concurrency': {
+        'cpu': 1,  # CPU密集任务（TIF切片，单个任务已使用多进程渲染）
+        'io': 2,  # IO密集任务（DXF/GeoJSON/SHP导入PostGIS）
+    },
+    'poll_interval': 2,  # 空闲时轮询任务表的间隔（秒）
+    'max_attempts': 3,  # 默认最大执行次数（含首次）
+    'retry_delay': 30,  # 首次重试延迟（秒），之后按2的幂次增长
+    'lease_seconds': 120,  # 运行中任务的心跳租约，超时视为所在进程已退出并重新排队
+    'retention_days': 7,  # 已结束任务的保留天数
 }
 
 # 应用配置
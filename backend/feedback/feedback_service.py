@@ -13,6 +13,7 @@ from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 from werkzeug.utils import secure_filename
 from models.db import execute_query, insert_with_snowflake_id
+from utils.text_search import TextSearch, FEEDBACK_SEARCH_COLUMNS, named_binder
 
 
 class FeedbackService:
@@ -242,22 +243,28 @@ class FeedbackService:
                 where_conditions.append("user_id = %(user_id)s")
                 params['user_id'] = user_id
             
-            # 关键词搜索
-            if filters.get('keyword'):
-                where_conditions.append("(title LIKE %(keyword)s OR description LIKE %(keyword)s)")
-                params['keyword'] = f"%{filters['keyword']}%"
+            # 关键词搜索（标题、描述，走 pg_trgm 表达式索引）
+            text_search = TextSearch(FEEDBACK_SEARCH_COLUMNS, filters.get('keyword'), primary='title')
+            if text_search:
+                where_conditions.append(text_search.condition(named_binder(params, 'keyword')))
             
-            # 构建排序
+            # 构建排序（有关键词时可用 relevance 按相关度排序）
             valid_sort_fields = [
                 'created_at', 'updated_at', 'support_count', 
                 'oppose_count', 'comment_count', 'view_count'
             ]
+            if text_search:
+                valid_sort_fields.append('relevance')
             if sort_by not in valid_sort_fields:
                 sort_by = 'created_at'
             
             if sort_order.lower() not in ['asc', 'desc']:
                 sort_order = 'desc'
             
+            order_by = sort_by
+            if sort_by == 'relevance':
+                order_by = text_search.rank(named_binder(params, 'keyword'))
+            
             # 构建SQL
             where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
             
@@ -279,7 +286,7 @@ class FeedbackService:
                 view_count, has_attachments, created_at, updated_at
             FROM feedback_items
             {where_clause}
-            ORDER BY {sort_by} {sort_order.upper()}
+            ORDER BY {order_by} {sort_order.upper()}, id {sort_order.upper()}
             LIMIT %(limit)s OFFSET %(offset)s
             """
             
@@ -6,19 +6,27 @@
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import AsIs
 from config import DB_CONFIG
 import time
 import json
 import os
+import re
+import threading
+from contextlib import contextmanager
+from models.db_pool import ConnectionPool
 
-def get_connection():
-    """获取数据库连接"""
+# 设置环境变量强制使用英文错误信息（进程级别，只需设置一次）
+os.environ['LC_ALL'] = 'C'
+os.environ['LANG'] = 'C'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _create_raw_connection():
+    """创建新的原生数据库连接（供连接池调用）"""
     try:
         # 使用明确的参数连接，避免编码问题
-        # 设置环境变量强制使用英文错误信息
-        os.environ['LC_ALL'] = 'C'
-        os.environ['LANG'] = 'C'
-        
         conn = psycopg2.connect(
             host=DB_CONFIG['host'],
             port=DB_CONFIG['port'],
@@ -65,6 +73,57 @@ def get_connection():
         print(error_msg)
         raise Exception(error_msg)
 
+def get_pool():
+    """获取（必要时创建）进程内的数据库连接池
+    
+    fork出的子进程（如gunicorn worker）会重新创建自己的连接池，
+    不会复用父进程的连接。
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(
+                _create_raw_connection,
+                min_size=DB_CONFIG.get('pool_min_size', 1),
+                max_size=DB_CONFIG.get('pool_max_size', 20),
+                max_lifetime=DB_CONFIG.get('pool_max_lifetime', 1800),
+                health_check_interval=DB_CONFIG.get('pool_health_check_interval', 30),
+                acquire_timeout=DB_CONFIG.get('pool_acquire_timeout', 30)
+            )
+        return _pool
+
+def get_pool_stats():
+    """获取连接池指标（借出次数、等待时间、耗尽次数等）"""
+    return get_pool().get_stats()
+
+def close_pool():
+    """关闭连接池中的所有连接"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+def get_connection():
+    """获取数据库连接
+    
+    连接从连接池借出，调用 close() 时归还连接池；with 语句只负责提交或回滚，不归还连接。
+    """
+    return get_pool().getconn()
+
+@contextmanager
+def pooled_connection():
+    """借出连接，退出时提交（异常时回滚）并归还连接池"""
+    conn = get_connection()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
 def execute_query(query, params=None, fetch=True):
     """执行SQL查询
     
@@ -119,7 +178,9 @@ def execute_query(query, params=None, fetch=True):
                 
     except psycopg2.OperationalError as e:
         if conn:
-            conn.rollback()
+            # 连接可能已损坏，不再归还连接池
+            conn.discard()
+            conn = None
         error_msg = f"执行查询失败 - 连接错误: {str(e)}"
         print(error_msg)
         raise Exception(error_msg)
@@ -179,23 +240,157 @@ def execute_transaction(queries):
         if conn:
             conn.close()
 
-def execute_batch(query, params_list):
+# 批量执行策略阈值
+BATCH_PAGE_SIZE = 1000       # 每页行数
+BATCH_COPY_THRESHOLD = 20000 # 达到该行数且为简单INSERT时使用COPY
+
+# 匹配 "INSERT INTO table (col1, col2) VALUES (...)" 形式的语句
+_INSERT_VALUES_RE = re.compile(
+    r"^\s*INSERT\s+INTO\s+(?P<table>[\w\.\"]+)\s*\((?P<columns>[^)]*)\)\s*VALUES\s*"
+    r"(?P<template>\((?:[^()]|\([^()]*\))*\))(?P<tail>.*)$",
+    re.IGNORECASE | re.DOTALL
+)
+
+def _parse_insert_values(query):
+    """解析单行INSERT语句，返回 (表名, 列名列表, VALUES模板, 剩余子句)，无法解析时返回None"""
+    match = _INSERT_VALUES_RE.match(query)
+    if not match:
+        return None
+    columns = [c.strip() for c in match.group('columns').split(',') if c.strip()]
+    return match.group('table'), columns, match.group('template'), match.group('tail').strip()
+
+def _format_array_element(value):
+    """将数组元素转换为PostgreSQL数组字面量中的元素"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, list):
+        return format_array_literal(value)
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+def format_array_literal(values):
+    """将列表转换为PostgreSQL数组字面量（如 {1,2,"a b",NULL}），与 execute_values 中列表适配为 ARRAY 的结果一致"""
+    return '{' + ','.join(_format_array_element(v) for v in values) + '}'
+
+def format_copy_value(value):
+    """将Python值转换为COPY文本格式的字段值
+    
+    与 psycopg2 的参数适配保持一致：列表转换为数组字面量，dict 和 Json 适配器转换为JSON文本
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        value = format_array_literal(value)
+    elif isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False)
+    elif hasattr(value, 'adapted'):
+        # psycopg2.extras.Json 等适配器
+        value = json.dumps(value.adapted, ensure_ascii=False)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return (value.replace('\\', '\\\\')
+                 .replace('\t', '\\t')
+                 .replace('\n', '\\n')
+                 .replace('\r', '\\r'))
+
+def _choose_batch_method(query, total):
+    """根据语句形式和批量大小选择执行方式
+    
+    - copy: 大批量的简单INSERT（VALUES全部为%s占位符，无ON CONFLICT/RETURNING）
+    - values: INSERT ... VALUES，使用 execute_values 多行VALUES分页
+    - statements: 其他语句（UPDATE/DELETE等），在同一事务中逐条执行
+    """
+    parsed = _parse_insert_values(query)
+    if not parsed:
+        return 'statements', None
+    _, columns, template, tail = parsed
+    placeholders = [p.strip() for p in template.strip()[1:-1].split(',')]
+    is_plain = not tail and len(placeholders) == len(columns) and all(p == '%s' for p in placeholders)
+    if is_plain and total >= BATCH_COPY_THRESHOLD:
+        return 'copy', parsed
+    return 'values', parsed
+
+def execute_batch(query, params_list, page_size=None, method=None, progress_callback=None):
     """批量执行SQL查询
     
+    根据批量大小自动在 execute_values（多行VALUES分页）、逐条执行语句、
+    COPY FROM STDIN 之间选择，INSERT 避免逐行网络往返。所有页在同一事务中提交。
+    
     Args:
-        query: SQL查询语句
+        query: 单行SQL语句，如 "INSERT INTO t (a, b) VALUES (%s, %s)"
         params_list: 参数列表
+        page_size: 每页行数，默认 BATCH_PAGE_SIZE
+        method: 强制指定 'copy' / 'values' / 'statements'，默认自动选择
+        progress_callback: 每页完成后回调 progress_callback(已处理行数, 总行数)
         
     Returns:
-        None
+        影响的行数（copy 模式为写入的行数）
     """
+    from psycopg2 import extras
+    import io
+    
+    params_list = list(params_list)
+    total = len(params_list)
+    if total == 0:
+        return 0
+    page_size = page_size or BATCH_PAGE_SIZE
+    
+    auto_method, parsed = _choose_batch_method(query, total)
+    method = method or auto_method
+    if method in ('copy', 'values') and not parsed:
+        raise ValueError(f"{method} 模式只支持 INSERT ... VALUES (...) 形式的语句")
+    
     conn = None
+    affected = 0
+    processed = 0
     try:
         conn = get_connection()
         with conn.cursor() as cursor:
-            for params in params_list:
-                cursor.execute(query, params)
+            for offset in range(0, total, page_size):
+                page = params_list[offset:offset + page_size]
+                
+                if method == 'copy':
+                    table, columns, _, _ = parsed
+                    buffer = io.StringIO()
+                    for params in page:
+                        buffer.write('\t'.join(format_copy_value(v) for v in params))
+                        buffer.write('\n')
+                    buffer.seek(0)
+                    cursor.copy_expert(
+                        f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+                        buffer
+                    )
+                    affected += len(page)
+                elif method == 'values':
+                    table, columns, template, tail = parsed
+                    values_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s {tail}"
+                    extras.execute_values(cursor, values_sql, page,
+                                          template=template, page_size=len(page))
+                    affected += max(cursor.rowcount, 0)
+                else:
+                    # 多条语句合并执行时 rowcount 只反映最后一条，逐条执行以累计影响行数
+                    for params in page:
+                        cursor.execute(query, params)
+                        affected += max(cursor.rowcount, 0)
+                
+                processed += len(page)
+                if progress_callback:
+                    progress_callback(processed, total)
+            
             conn.commit()
+        return affected
                 
     except Exception as e:
         if conn:
@@ -394,6 +589,32 @@ def init_database():
         )
         """
         
+        # 按内容去重的文件存储：同一内容（摘要+扩展名）只保存一份数据，file_path 为登记的文件，
+        # 各files记录使用指向它的硬链接（路径各不相同），ref_count 为引用它的files记录数
+        create_file_blobs_table = """
+        CREATE TABLE IF NOT EXISTS file_blobs (
+            content_hash VARCHAR(80) NOT NULL,
+            extension VARCHAR(20) NOT NULL,
+            file_path VARCHAR(200) NOT NULL,
+            file_size BIGINT NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (content_hash, extension)
+        )
+        """
+        
+        # 由文件内容派生的产物（如TIF切片得到的MBTiles），相同内容和参数再次处理时直接复用
+        create_file_blob_artifacts_table = """
+        CREATE TABLE IF NOT EXISTS file_blob_artifacts (
+            content_hash VARCHAR(80) NOT NULL,
+            artifact_key VARCHAR(100) NOT NULL,
+            artifact_path TEXT NOT NULL,
+            params JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (content_hash, artifact_key)
+        )
+        """
+        
         # 创建GeoServer工作空间表
         create_geoserver_workspaces_table = """
         CREATE TABLE IF NOT EXISTS geoserver_workspaces (
@@ -743,7 +964,9 @@ def init_database():
             "CREATE INDEX IF NOT EXISTS idx_vector_martin_services_vector_type ON vector_martin_services(vector_type)",
             "CREATE INDEX IF NOT EXISTS idx_vector_martin_services_status ON vector_martin_services(status)",
             "CREATE INDEX IF NOT EXISTS idx_vector_martin_services_user_id ON vector_martin_services(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_vector_martin_services_service_url ON vector_martin_services(service_url)"
+            "CREATE INDEX IF NOT EXISTS idx_vector_martin_services_service_url ON vector_martin_services(service_url)",
+            "CREATE INDEX IF NOT EXISTS idx_vector_martin_services_source_file ON vector_martin_services(source_file_id, id) WHERE status = 'active'",
+            "CREATE INDEX IF NOT EXISTS idx_vector_martin_services_extent_pending ON vector_martin_services(id) WHERE extent_updated_at IS NULL"
         ]
         
         # 创建GeoJSON文件表的索引
@@ -806,12 +1029,24 @@ def init_database():
         
         # 创建其他表的索引（为了保持一致性）
         create_users_indexes = []
-        create_files_indexes = []
+        create_files_indexes = [
+            "CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash)",
+            # 文件列表键集分页：每个可排序字段的排序表达式与id组成复合索引（见 utils/pagination.py）
+            "CREATE INDEX IF NOT EXISTS idx_files_upload_date_id ON files(upload_date, id)",
+            "CREATE INDEX IF NOT EXISTS idx_files_file_name_id ON files(file_name, id)",
+            "CREATE INDEX IF NOT EXISTS idx_files_file_size_sort_id ON files((COALESCE(file_size, 0)), id)",
+            "CREATE INDEX IF NOT EXISTS idx_files_file_type_sort_id ON files((COALESCE(file_type, '')), id)",
+            "CREATE INDEX IF NOT EXISTS idx_files_discipline_sort_id ON files((COALESCE(discipline, '')), id)",
+            "CREATE INDEX IF NOT EXISTS idx_files_user_id_upload_date ON files(user_id, upload_date, id)"
+        ]
         create_geoserver_workspaces_indexes = []
         create_geoserver_stores_indexes = []
         create_geoserver_featuretypes_indexes = []
         create_geoserver_coverages_indexes = []
-        create_geoserver_layers_indexes = []
+        create_geoserver_layers_indexes = [
+            "CREATE INDEX IF NOT EXISTS idx_geoserver_layers_file_id ON geoserver_layers(file_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_geoserver_layers_extent_pending ON geoserver_layers(id) WHERE extent_updated_at IS NULL"
+        ]
         create_geoserver_styles_indexes = []
         create_geoserver_layergroups_indexes = []
         create_scenes_indexes = []
@@ -820,6 +1055,8 @@ def init_database():
         tables = [
             create_users_table,
             create_files_table,
+            create_file_blobs_table,
+            create_file_blob_artifacts_table,
             create_geoserver_workspaces_table,
             create_geoserver_stores_table,
             create_geoserver_featuretypes_table,
@@ -843,6 +1080,22 @@ def init_database():
         for table_sql in tables:
             execute_query(table_sql, fetch=False)
         
+        # 已有数据库补充新增的列
+        alter_columns = [
+            "ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(80)",
+            # Martin服务与文件的外键（file_id 列为字符串，部分服务不对应files记录，保持不变）
+            "ALTER TABLE vector_martin_services ADD COLUMN IF NOT EXISTS source_file_id BIGINT REFERENCES files(id) ON DELETE SET NULL",
+            # 场景文档版本号（场景或场景图层每次修改时递增，用于场景文档缓存）
+            "ALTER TABLE scenes ADD COLUMN IF NOT EXISTS doc_version BIGINT NOT NULL DEFAULT 0",
+            # 图层EPSG:4326范围（发布时计算，边界接口直接读取），extent_updated_at 为空表示尚未计算
+            "ALTER TABLE geoserver_layers ADD COLUMN IF NOT EXISTS extent_4326 JSONB",
+            "ALTER TABLE geoserver_layers ADD COLUMN IF NOT EXISTS extent_updated_at TIMESTAMP",
+            "ALTER TABLE vector_martin_services ADD COLUMN IF NOT EXISTS extent_4326 JSONB",
+            "ALTER TABLE vector_martin_services ADD COLUMN IF NOT EXISTS extent_updated_at TIMESTAMP"
+        ]
+        for alter_sql in alter_columns:
+            execute_query(alter_sql, fetch=False)
+        
         # 创建所有索引
         all_indexes = (
             create_users_indexes +
@@ -1024,6 +1277,70 @@ def init_database():
         except Exception as e:
             print(f"⚠️ 反馈系统触发器创建失败: {str(e)}")
         
+        # 关键词搜索索引（pg_trgm）：LIKE '%关键词%' 走三元组索引，索引随写入自动维护
+        try:
+            execute_query("CREATE EXTENSION IF NOT EXISTS pg_trgm", fetch=False)
+            
+            from utils.text_search import search_expression, FILE_SEARCH_COLUMNS, FEEDBACK_SEARCH_COLUMNS
+            search_indexes = [
+                f"CREATE INDEX IF NOT EXISTS idx_files_search_trgm ON files USING gin (({search_expression(FILE_SEARCH_COLUMNS)}) gin_trgm_ops)",
+                "CREATE INDEX IF NOT EXISTS idx_files_file_name_trgm ON files USING gin (file_name gin_trgm_ops)",
+                "CREATE INDEX IF NOT EXISTS idx_files_tags_trgm ON files USING gin (tags gin_trgm_ops)",
+                f"CREATE INDEX IF NOT EXISTS idx_feedback_items_search_trgm ON feedback_items USING gin (({search_expression(FEEDBACK_SEARCH_COLUMNS)}) gin_trgm_ops)",
+                "CREATE INDEX IF NOT EXISTS idx_geoserver_layers_name_trgm ON geoserver_layers USING gin (name gin_trgm_ops)"
+            ]
+            for index_sql in search_indexes:
+                execute_query(index_sql, fetch=False)
+            
+            print("✅ 关键词搜索索引创建成功")
+        except Exception as e:
+            print(f"⚠️ 关键词搜索索引创建失败（需要pg_trgm扩展）: {str(e)}")
+        
+        # Martin服务关联到files记录：插入时按 file_id（文件ID字符串）或原文件名自动填写 source_file_id
+        try:
+            create_source_file_function = """
+            CREATE OR REPLACE FUNCTION set_vector_martin_source_file() RETURNS TRIGGER AS $$
+            BEGIN
+                IF NEW.source_file_id IS NULL THEN
+                    IF NEW.file_id ~ '^[0-9]{1,18}$' THEN
+                        SELECT id INTO NEW.source_file_id FROM files WHERE id = NEW.file_id::BIGINT;
+                    END IF;
+                    IF NEW.source_file_id IS NULL THEN
+                        SELECT id INTO NEW.source_file_id FROM files
+                        WHERE file_name = NEW.original_filename
+                        ORDER BY upload_date DESC, id DESC LIMIT 1;
+                    END IF;
+                END IF;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+            execute_query(create_source_file_function, fetch=False)
+            
+            source_file_statements = [
+                "DROP TRIGGER IF EXISTS trigger_set_vector_martin_source_file ON vector_martin_services",
+                "CREATE TRIGGER trigger_set_vector_martin_source_file BEFORE INSERT ON vector_martin_services FOR EACH ROW EXECUTE FUNCTION set_vector_martin_source_file()",
+                # 回填已有记录
+                """
+                UPDATE vector_martin_services v SET source_file_id = f.id
+                FROM files f
+                WHERE v.source_file_id IS NULL AND v.file_id ~ '^[0-9]{1,18}$' AND f.id = v.file_id::BIGINT
+                """,
+                """
+                UPDATE vector_martin_services v SET source_file_id = (
+                    SELECT f.id FROM files f WHERE f.file_name = v.original_filename
+                    ORDER BY f.upload_date DESC, f.id DESC LIMIT 1
+                )
+                WHERE v.source_file_id IS NULL
+                """
+            ]
+            for statement in source_file_statements:
+                execute_query(statement, fetch=False)
+            
+            print("✅ Martin服务与文件关联创建成功")
+        except Exception as e:
+            print(f"⚠️ Martin服务与文件关联创建失败: {str(e)}")
+        
         print("数据库表创建成功")
         
       
@@ -1159,5 +1476,72 @@ def insert_with_snowflake_id(table_name, data):
         
         raise
 
+# 多行VALUES中表示列默认值的占位参数
+_SQL_DEFAULT = AsIs('DEFAULT')
+
+def insert_many_with_snowflake_ids(table_name, rows, page_size=None, progress_callback=None):
+    """
+    批量插入数据，一次性为所有行分配雪花算法ID
+    
+    Args:
+        table_name: 表名
+        rows: 要插入的数据字典列表（行中缺失的列使用数据库默认值）
+        page_size: 每页行数，默认 BATCH_PAGE_SIZE
+        progress_callback: 每页完成后回调 progress_callback(已处理行数, 总行数)
+        
+    Returns:
+        按输入顺序排列的ID列表
+    """
+    if not rows:
+        return []
+    
+    from utils.snowflake import get_snowflake_ids
+    ids = get_snowflake_ids(len(rows))
+    
+    # 收集所有列；所有行的值都为NOW()的列交给SQL处理
+    columns = []
+    for row in rows:
+        for key in row:
+            if key != 'id' and key not in columns:
+                columns.append(key)
+    
+    now_columns = []
+    for column in list(columns):
+        now_rows = sum(1 for row in rows if row.get(column) == 'NOW()')
+        if now_rows == 0:
+            continue
+        if now_rows != len(rows):
+            raise ValueError(f"列 {column} 在部分行中为NOW()、部分行中为其他值，无法批量插入")
+        columns.remove(column)
+        now_columns.append(column)
+    
+    all_columns = ['id'] + columns + now_columns
+    placeholders = ['%s'] * (1 + len(columns)) + ['NOW()'] * len(now_columns)
+    query = f"""
+    INSERT INTO {table_name} ({', '.join(all_columns)})
+    VALUES ({', '.join(placeholders)})
+    """
+    # 缺失的列写入 DEFAULT；COPY 无法逐行使用默认值，此时改用多行VALUES
+    has_missing = any(col not in row for row in rows for col in columns)
+    params_list = [
+        tuple([row_id] + [row[col] if col in row else _SQL_DEFAULT for col in columns])
+        for row_id, row in zip(ids, rows)
+    ]
+    
+    try:
+        execute_batch(query, params_list, page_size=page_size,
+                      method='values' if has_missing else None,
+                      progress_callback=progress_callback)
+    except Exception as e:
+        print(f"批量插入数据到{table_name}失败: {str(e)}")
+        if "integer out of range" in str(e).lower():
+            print("错误: 雪花算法ID超出了INTEGER范围，请确保数据库表的ID字段类型是BIGINT")
+            print(f"ALTER TABLE {table_name} ALTER COLUMN id TYPE BIGINT;")
+        raise
+    
+    for row_id, row in zip(ids, rows):
+        row['id'] = row_id
+    return ids
+
 if __name__ == "__main__":
     init_database() 
\ No newline at end of file
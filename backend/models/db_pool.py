@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库连接池模块
+
+为 models.db.get_connection 提供线程安全的连接复用，支持:
+- 最小/最大连接数 (DB_CONFIG['pool_min_size'] / DB_CONFIG['pool_max_size'])
+- 空闲连接健康检查
+- 连接最大存活时间回收
+- 连接池指标统计（借出次数、等待时间、耗尽次数）
+"""
+
+import os
+import time
+import threading
+from collections import deque
+
+
+class PoolExhaustedError(Exception):
+    """在等待超时后仍无法从连接池获取连接"""
+    pass
+
+
+class PooledConnection:
+    """连接池中借出的连接代理
+
+    行为与 psycopg2 连接一致，区别在于 close() 将连接归还连接池而不是真正关闭。
+    与 psycopg2 相同，作为上下文管理器使用时退出只提交/回滚事务，不归还连接，
+    仍需调用 close()（或由 __del__ 兜底归还）
+    """
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_released', False)
+
+    @property
+    def raw(self):
+        """底层 psycopg2 连接（需要原生连接对象的场景使用）"""
+        return self._conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # autocommit 等属性直接设置到底层连接
+        setattr(self._conn, name, value)
+
+    def close(self):
+        """归还连接到连接池"""
+        if self._released:
+            return
+        object.__setattr__(self, '_released', True)
+        self._pool.putconn(self._conn)
+
+    def discard(self):
+        """关闭并丢弃连接（连接已损坏时使用）"""
+        if self._released:
+            return
+        object.__setattr__(self, '_released', True)
+        self._pool.putconn(self._conn, discard=True)
+
+    @property
+    def closed(self):
+        return self._released or self._conn.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._released and not self._conn.closed:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        return False
+
+    def __del__(self):
+        # 调用方忘记 close() 时兜底归还，避免连接池泄漏
+        try:
+            if not self._released:
+                self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """线程安全的 psycopg2 连接池"""
+
+    def __init__(self, connect_factory, min_size=1, max_size=20,
+                 max_lifetime=1800, health_check_interval=30, acquire_timeout=30):
+        """
+        Args:
+            connect_factory: 创建新的原生连接的函数
+            min_size: 保持的最小连接数
+            max_size: 最大连接数
+            max_lifetime: 连接最大存活时间（秒），超过后回收重建
+            health_check_interval: 空闲超过该时间（秒）的连接在借出前执行健康检查
+            acquire_timeout: 获取连接的最长等待时间（秒）
+        """
+        if max_size < 1:
+            raise ValueError("连接池最大连接数必须大于0")
+        self._connect_factory = connect_factory
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition(threading.Lock())
+        # 空闲连接: (conn, created_at, last_used_at)
+        self._idle = deque()
+        # 已借出连接: id(conn) -> created_at
+        self._in_use = {}
+        self._opening = 0
+        self._closed = False
+        self.pid = os.getpid()
+
+        self._stats = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'exhausted': 0,
+            'health_check_failures': 0,
+            'recycled': 0,
+        }
+
+        for _ in range(self.min_size):
+            try:
+                conn = self._open()
+                self._idle.append((conn, time.time(), time.time()))
+            except Exception:
+                # 最小连接预热失败不影响后续按需创建
+                break
+
+    def _total(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _count(self, name):
+        """更新指标（调用方不能持有 self._cond）"""
+        with self._cond:
+            self._stats[name] += 1
+
+    def _open(self):
+        conn = self._connect_factory()
+        self._count('connections_created')
+        return conn
+
+    def _close_raw(self, conn):
+        self._count('connections_closed')
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, created_at, now):
+        return bool(self.max_lifetime) and now - created_at > self.max_lifetime
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            self._count('health_check_failures')
+            return False
+
+    def getconn(self, timeout=None):
+        """从连接池获取连接
+
+        Returns:
+            PooledConnection 对象
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        waited_since = None
+
+        while True:
+            candidate = None
+            need_open = False
+            with self._cond:
+                if self._closed:
+                    raise PoolExhaustedError("数据库连接池已关闭")
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._total() < self.max_size:
+                    self._opening += 1
+                    need_open = True
+                else:
+                    if waited_since is None:
+                        waited_since = time.time()
+                        self._stats['exhausted'] += 1
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            f"数据库连接池已耗尽: {self.max_size} 个连接均在使用中，等待 {timeout} 秒超时"
+                        )
+                    self._cond.wait(remaining)
+                    continue
+
+            if need_open:
+                try:
+                    conn = self._open()
+                    created_at = time.time()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        # 建立连接失败时空出的名额要交给等待中的线程
+                        self._cond.notify()
+                return self._checkout(conn, created_at, waited_since)
+
+            conn, created_at, last_used = candidate
+            now = time.time()
+            if self._is_expired(created_at, now):
+                self._count('recycled')
+                self._close_raw(conn)
+                continue
+            if conn.closed or (now - last_used > self.health_check_interval and not self._is_healthy(conn)):
+                self._close_raw(conn)
+                continue
+            return self._checkout(conn, created_at, waited_since)
+
+    def _checkout(self, conn, created_at, waited_since):
+        with self._cond:
+            self._in_use[id(conn)] = created_at
+            self._stats['checkouts'] += 1
+            if waited_since is not None:
+                waited = time.time() - waited_since
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn, discard=False):
+        """归还连接到连接池"""
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+
+        if created_at is None:
+            # 不属于本连接池的连接（例如fork前创建的），直接关闭
+            self._close_raw(conn)
+            return
+
+        keep = not discard and not self._closed and not conn.closed
+        if keep and self._is_expired(created_at, time.time()):
+            self._count('recycled')
+            keep = False
+
+        if keep:
+            try:
+                # 清理未结束的事务并恢复默认会话设置
+                conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                keep = False
+
+        if not keep:
+            self._close_raw(conn)
+
+        with self._cond:
+            if keep:
+                self._idle.append((conn, created_at, time.time()))
+            self._cond.notify()
+
+    def closeall(self):
+        """关闭连接池中的所有空闲连接，并拒绝新的借出"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_raw(conn)
+
+    def get_stats(self):
+        """获取连接池指标"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'total': self._total(),
+            })
+        stats['wait_time_avg'] = (
+            stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+        )
+        return stats
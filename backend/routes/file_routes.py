@@ -5,7 +5,14 @@ from flask import Blueprint, request, jsonify, current_app
 from services.file_service import FileService
 from models.db import execute_query
 from werkzeug.utils import secure_filename
-from config import FILE_STORAGE
+from config import FILE_STORAGE, FILE_LIST_CONFIG
+from utils.chunk_file import create_part_file, write_chunk_at, finalize_part_file, ChunkChecksumError
+from services.upload_session_store import get_upload_session_store, STATUS_UPLOADING
+from utils.pagination import (encode_cursor, decode_cursor, keyset_condition, InvalidCursorError,
+                              FILE_SORT_EXPRESSIONS, file_sort_expression, rounded_rank)
+from utils.text_search import TextSearch, FILE_SEARCH_COLUMNS, positional_binder
+from services.crs_catalog import get_crs_catalog, refresh_crs_catalog
+from services.capabilities_cache import capabilities_cache
 # 登录认证模块 - 一行代码实现文件上传权限验证
 from auth.auth_service import require_auth, get_current_user
 import os
@@ -100,7 +107,9 @@ def upload_file():
                 'feature_count': file_data.get('feature_count', 0),
                 'bbox': file_data.get('bbox'),
                 'upload_date': file_data.get('upload_date', '')
-            }
+            },
+            'deduplicated': file_data.get('deduplicated', False),  # 相同内容已存在，复用了已保存的文件
+            'duplicate_of': file_data.get('duplicate_of', [])
         }), 200
     
     except ValueError as e:
@@ -114,20 +123,64 @@ def upload_file():
 
 # ========== 分片上传相关路由 ==========
 
-# 存储分片上传的临时信息
-chunked_uploads = {}
+# 分片上传会话保存在共享的SQLite存储中，多进程部署和重启后都可以继续上传
+
+# 单个分片允许的最大字节数
+MAX_CHUNK_SIZE = 1024 * 1024 * 1024
+
+
+def _positive_int(value):
+    """解析正整数参数，无效时返回None"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _current_user_id():
+    current_user = get_current_user() or {}
+    return current_user.get('id', current_user.get('username', 'unknown'))  # 优先使用数据库ID，回退到用户名
+
+
+def _load_upload_session(upload_id):
+    """读取当前用户的上传会话
+
+    Returns:
+        tuple: (会话, 错误响应)，会话不存在或属于其他用户时返回错误响应
+    """
+    if not upload_id:
+        return None, (jsonify({'error': '缺少upload_id'}), 400)
+    session = get_upload_session_store().get(upload_id)
+    if session is None:
+        return None, (jsonify({'error': '无效的上传ID'}), 400)
+    if session['user_id'] is not None and session['user_id'] != str(_current_user_id()):
+        return None, (jsonify({'error': '无权访问该上传'}), 403)
+    return session, None
+
 
 @file_bp.route('/upload/chunked/init', methods=['POST'])
 @require_auth  # 一行代码实现登录验证
 def init_chunked_upload():
-    """初始化分片上传"""
+    """初始化分片上传，预分配目标文件
+    
+    同一 upload_id 的会话仍然有效且参数一致时直接返回已有会话（resumed 为 true），
+    客户端根据 received_ranges / missing_ranges 续传。
+    
+    Request Body:
+        upload_id, file_name, total_chunks, metadata
+        file_size: 文件总字节数（可选，提供时预分配空间并校验每个分片的大小）
+        chunk_size: 分片字节数（可选，默认 FILE_STORAGE['chunk_size']）
+    """
     print("=== 初始化分片上传 ===")
     
     data = request.get_json()
     upload_id = data.get('upload_id')
     file_name = data.get('file_name')
-    total_chunks = data.get('total_chunks')
+    total_chunks = _positive_int(data.get('total_chunks'))
     metadata = data.get('metadata', {})
+    file_size = data.get('file_size')
+    chunk_size = data.get('chunk_size') or FILE_STORAGE.get('chunk_size', 10 * 1024 * 1024)
     
     print(f"上传ID: {upload_id}")
     print(f"文件名: {file_name}")
@@ -137,138 +190,209 @@ def init_chunked_upload():
     if not all([upload_id, file_name, total_chunks]):
         return jsonify({'error': '缺少必要参数'}), 400
     
-    # 创建临时目录
-    temp_base = FILE_STORAGE.get('temp_folder', 'temp')
-    temp_dir = os.path.join(temp_base, 'chunks', upload_id)
-    os.makedirs(temp_dir, exist_ok=True)
+    if secure_filename(upload_id) != upload_id:
+        return jsonify({'error': '无效的上传ID'}), 400
+    
+    chunk_size = _positive_int(chunk_size)
+    if not chunk_size or chunk_size > MAX_CHUNK_SIZE:
+        return jsonify({'error': f'chunk_size必须是1-{MAX_CHUNK_SIZE}之间的整数'}), 400
     
-    # 存储上传信息
-    chunked_uploads[upload_id] = {
-        'file_name': file_name,
-        'total_chunks': total_chunks,
-        'received_chunks': set(),
-        'temp_dir': temp_dir,
-        'metadata': metadata,
-        'created_at': time.time()
-    }
+    if file_size is not None:
+        file_size = _positive_int(file_size)
+        if not file_size:
+            return jsonify({'error': 'file_size必须是正整数'}), 400
+        if file_size > FILE_STORAGE.get('max_content_length', file_size):
+            return jsonify({'error': '文件太大'}), 400
+        if (file_size + chunk_size - 1) // chunk_size != total_chunks:
+            return jsonify({'error': 'file_size、chunk_size与total_chunks不匹配'}), 400
     
-    print(f"分片上传初始化成功，临时目录: {temp_dir}")
-    return jsonify({'message': '分片上传初始化成功', 'upload_id': upload_id})
+    store = get_upload_session_store()
+    user_id = _current_user_id()
+    
+    # 已有会话：参数一致时续传，否则拒绝覆盖
+    existing = store.get(upload_id)
+    if existing is not None:
+        if (existing['user_id'] != str(user_id) or existing['file_name'] != file_name
+                or existing['total_chunks'] != total_chunks or existing['chunk_size'] != chunk_size
+                or existing['file_size'] != file_size):
+            return jsonify({'error': '上传ID已被其他上传使用'}), 409
+        print(f"继续已有的分片上传: {upload_id}，已接收 {len(existing['received_chunks'])}/{total_chunks}")
+        return jsonify({
+            'message': '继续已有的分片上传',
+            'upload_id': upload_id,
+            'chunk_size': chunk_size,
+            'resumed': True,
+            'upload': store.status(existing)
+        })
+    
+    # 预分配目标文件，分片到达后直接写入各自的偏移
+    part_path = store.part_path(upload_id)
+    try:
+        create_part_file(part_path, file_size)
+    except OSError as e:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        print(f"预分配上传文件失败: {str(e)}")
+        return jsonify({'error': f'预分配上传文件失败: {str(e)}'}), 507
+    
+    session = store.create(upload_id, file_name, total_chunks, chunk_size,
+                           file_size=file_size, metadata=metadata, user_id=user_id)
+    if session is None:
+        # 另一个进程同时创建了同一 upload_id 的会话
+        return jsonify({'error': '上传ID已被其他上传使用'}), 409
+    
+    print(f"分片上传初始化成功，目标文件: {part_path}")
+    return jsonify({
+        'message': '分片上传初始化成功',
+        'upload_id': upload_id,
+        'chunk_size': chunk_size,
+        'resumed': False,
+        'upload': store.status(session)
+    })
+
+@file_bp.route('/upload/chunked/status/<string:upload_id>', methods=['GET'])
+@require_auth  # 一行代码实现登录验证
+def get_chunked_upload_status(upload_id):
+    """分片上传状态：已接收和缺失的分片区间（闭区间 [起, 止]），用于断点续传"""
+    session, error = _load_upload_session(upload_id)
+    if error:
+        return error
+    return jsonify({'success': True, 'upload': get_upload_session_store().status(session)})
 
 @file_bp.route('/upload/chunked/chunk', methods=['POST'])
 @require_auth  # 一行代码实现登录验证
 def upload_chunk():
-    """上传单个分片"""
-    upload_id = request.form.get('upload_id')
-    chunk_index = int(request.form.get('chunk_index'))
+    """上传单个分片，直接写入目标文件的 chunk_index * chunk_size 偏移处
     
-    if 'chunk' not in request.files:
-        return jsonify({'error': '未找到分片文件'}), 400
+    支持 multipart 表单（字段 chunk）或 application/octet-stream 请求体（参数放在查询字符串）；
+    可选的 checksum（'sha256:<hex>' 或配合 checksum_algorithm 的十六进制摘要）在写入时校验。
+    """
+    params = request.form if request.form else request.args
+    upload_id = params.get('upload_id')
+    chunk_index = params.get('chunk_index', type=int)
+    checksum = params.get('checksum') or request.headers.get('X-Chunk-Checksum')
+    checksum_algorithm = params.get('checksum_algorithm')
     
-    chunk_file = request.files['chunk']
+    if 'chunk' in request.files:
+        stream = request.files['chunk'].stream
+    elif request.mimetype == 'application/octet-stream':
+        stream = request.stream
+    else:
+        return jsonify({'error': '未找到分片文件'}), 400
     
-    print(f"接收分片: upload_id={upload_id}, chunk_index={chunk_index}, size={len(chunk_file.read())}B")
-    chunk_file.seek(0)  # 重置文件指针
+    upload_info, error = _load_upload_session(upload_id)
+    if error:
+        return error
+    if upload_info['status'] != STATUS_UPLOADING:
+        return jsonify({'error': '上传正在完成，不能再写入分片'}), 409
     
-    if upload_id not in chunked_uploads:
-        return jsonify({'error': '无效的上传ID'}), 400
+    if chunk_index is None or chunk_index < 0 or chunk_index >= upload_info['total_chunks']:
+        return jsonify({'error': f"chunk_index必须是0-{upload_info['total_chunks'] - 1}之间的整数"}), 400
     
-    upload_info = chunked_uploads[upload_id]
+    offset = chunk_index * upload_info['chunk_size']
+    expected_size = None
+    if upload_info['file_size']:
+        expected_size = min(upload_info['chunk_size'], upload_info['file_size'] - offset)
     
-    # 保存分片文件
-    chunk_path = os.path.join(upload_info['temp_dir'], f'chunk_{chunk_index}')
-    chunk_file.save(chunk_path)
+    try:
+        written, digest = write_chunk_at(upload_info['part_path'], offset, stream,
+                                         expected_size=expected_size,
+                                         checksum=checksum,
+                                         algorithm=checksum_algorithm,
+                                         max_size=upload_info['chunk_size'])
+    except ChunkChecksumError as e:
+        print(f"分片 {chunk_index} 校验失败: {str(e)}")
+        return jsonify({'error': str(e), 'chunk_index': chunk_index}), 422
     
-    # 记录已接收的分片
-    upload_info['received_chunks'].add(chunk_index)
+    # 分片写入成功后才记录，中途失败的分片会在状态中显示为缺失
+    received_count = get_upload_session_store().record_chunk(upload_id, chunk_index, written, digest)
     
-    print(f"分片 {chunk_index} 保存成功，已接收: {len(upload_info['received_chunks'])}/{upload_info['total_chunks']}")
+    print(f"分片 {chunk_index} 写入偏移 {offset} 成功（{written}B），已接收: {received_count}/{upload_info['total_chunks']}")
     
     return jsonify({
         'message': '分片上传成功',
         'chunk_index': chunk_index,
-        'received_chunks': len(upload_info['received_chunks']),
+        'chunk_bytes': written,
+        'checksum': digest,
+        'received_chunks': received_count,
         'total_chunks': upload_info['total_chunks']
     })
 
 @file_bp.route('/upload/chunked/complete', methods=['POST'])
 @require_auth  # 一行代码实现登录验证
 def complete_chunked_upload():
-    """完成分片上传，合并文件"""
+    """完成分片上传：分片已写入目标文件，只需校验并移动到上传目录"""
     print("=== 完成分片上传 ===")
     
     data = request.get_json()
     upload_id = data.get('upload_id')
     
-    if upload_id not in chunked_uploads:
-        return jsonify({'error': '无效的上传ID'}), 400
+    upload_info, error = _load_upload_session(upload_id)
+    if error:
+        return error
     
-    upload_info = chunked_uploads[upload_id]
+    store = get_upload_session_store()
     
     # 检查是否所有分片都已接收
     expected_chunks = set(range(upload_info['total_chunks']))
     if upload_info['received_chunks'] != expected_chunks:
         missing_chunks = expected_chunks - upload_info['received_chunks']
-        return jsonify({'error': f'缺少分片: {list(missing_chunks)}'}), 400
+        return jsonify({
+            'error': f'缺少分片: {sorted(missing_chunks)}',
+            'upload': store.status(upload_info)
+        }), 400
+    
+    # 除最后一个分片外都必须是完整的 chunk_size，否则文件中会留下空洞
+    last_index = upload_info['total_chunks'] - 1
+    short_chunks = [index for index, size in upload_info['chunk_sizes'].items()
+                    if index != last_index and size != upload_info['chunk_size']]
+    if short_chunks:
+        return jsonify({'error': f'分片大小不完整: {sorted(short_chunks)}'}), 400
+    
+    final_size = last_index * upload_info['chunk_size'] + upload_info['chunk_sizes'][last_index]
+    if upload_info['file_size'] and final_size != upload_info['file_size']:
+        return jsonify({'error': f"文件大小不一致: 期望 {upload_info['file_size']}，实际 {final_size}"}), 400
+    
+    # 同一上传的完成请求可能同时到达不同进程，只有一个可以继续
+    if not store.begin_complete(upload_id):
+        return jsonify({'error': '上传正在完成中'}), 409
     
     try:
-        # 合并文件
-        print("开始合并文件...")
-        final_file_path = os.path.join(upload_info['temp_dir'], upload_info['file_name'])
-        
-        with open(final_file_path, 'wb') as final_file:
-            for chunk_index in range(upload_info['total_chunks']):
-                chunk_path = os.path.join(upload_info['temp_dir'], f'chunk_{chunk_index}')
-                with open(chunk_path, 'rb') as chunk_file:
-                    final_file.write(chunk_file.read())
-                # 删除分片文件
-                os.remove(chunk_path)
+        part_path = finalize_part_file(upload_info['part_path'], final_size)
         
-        print(f"文件合并完成: {final_file_path}")
+        print(f"分片已全部写入: {part_path}（{final_size}B）")
         
-        # 创建文件对象用于保存
+        # 创建文件对象用于保存（save 为同一文件系统内的重命名）
         class FileObject:
             def __init__(self, file_path, filename):
                 self.file_path = file_path
                 self.filename = filename
-                with open(file_path, 'rb') as f:
-                    f.seek(0, os.SEEK_END)
-                    self.size = f.tell()
+                self.size = os.path.getsize(file_path)
             
             def save(self, destination):
-                import shutil
-                shutil.move(self.file_path, destination)
+                os.replace(self.file_path, destination)
                 return destination
-            
-            def read(self):
-                with open(self.file_path, 'rb') as f:
-                    return f.read()
         
-        file_obj = FileObject(final_file_path, upload_info['file_name'])
-        
-        # 获取当前登录用户信息
-        current_user = get_current_user()
-        user_id = current_user.get('id', current_user.get('username', 'unknown'))  # 优先使用数据库ID，回退到用户名
+        file_obj = FileObject(part_path, upload_info['file_name'])
         
         # 使用现有的文件保存逻辑
         metadata = upload_info['metadata']
         metadata['file_name'] = metadata.get('file_name') or secure_filename(upload_info['file_name'])
         metadata['original_name'] = upload_info['file_name']
-        metadata['user_id'] = user_id  # 使用当前登录用户ID
+        metadata['user_id'] = _current_user_id()  # 使用当前登录用户ID
         
         # 验证必填字段
         required_fields = ['file_name', 'original_name', 'discipline', 'dimension', 'file_type']
         for field in required_fields:
             if not metadata.get(field):
+                store.reset_complete(upload_id)
                 return jsonify({'error': f'缺少必填字段: {field}'}), 400
         
         # 保存文件并记录元数据
         file_id, file_data = file_service.save_file(file_obj, metadata)
         
-        # 清理临时数据
-        import shutil
-        shutil.rmtree(upload_info['temp_dir'], ignore_errors=True)
-        del chunked_uploads[upload_id]
+        # 清理会话（目标文件已移动到上传目录）
+        store.delete(upload_id, remove_file=False)
         
         print(f"分片上传完成，文件ID: {file_id}")
         
@@ -289,15 +413,21 @@ def complete_chunked_upload():
                 'feature_count': file_data.get('feature_count', 0),
                 'bbox': file_data.get('bbox'),
                 'upload_date': file_data.get('upload_date', '')
-            }
+            },
+            'deduplicated': file_data.get('deduplicated', False),  # 相同内容已存在，复用了已保存的文件
+            'duplicate_of': file_data.get('duplicate_of', [])
         }), 200
     
     except Exception as e:
-        print(f"合并文件失败: {str(e)}")
-        current_app.logger.error(f"分片上传合并失败: {str(e)}")
-        return jsonify({'error': '文件合并失败'}), 500
+        # 目标文件仍在时允许客户端重试完成
+        if os.path.exists(upload_info['part_path']):
+            store.reset_complete(upload_id)
+        print(f"完成分片上传失败: {str(e)}")
+        current_app.logger.error(f"完成分片上传失败: {str(e)}")
+        return jsonify({'error': '文件保存失败'}), 500
 
 @file_bp.route('/upload/chunked/abort', methods=['POST'])
+@require_auth  # 一行代码实现登录验证
 def abort_chunked_upload():
     """取消分片上传"""
     print("=== 取消分片上传 ===")
@@ -305,15 +435,12 @@ def abort_chunked_upload():
     data = request.get_json()
     upload_id = data.get('upload_id')
     
-    if upload_id not in chunked_uploads:
-        return jsonify({'error': '无效的上传ID'}), 400
-    
-    upload_info = chunked_uploads[upload_id]
+    upload_info, error = _load_upload_session(upload_id)
+    if error:
+        return error
     
-    # 清理临时文件
-    import shutil
-    shutil.rmtree(upload_info['temp_dir'], ignore_errors=True)
-    del chunked_uploads[upload_id]
+    # 删除会话和目标文件
+    get_upload_session_store().delete(upload_id)
     
     print(f"分片上传已取消: {upload_id}")
     return jsonify({'message': '分片上传已取消'})
@@ -345,6 +472,17 @@ def get_file_list():
         required: false
         default: 20
         description: 每页数量
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: 上一页返回的 next_cursor，提供时按键集分页（忽略page）
+      - name: include_total
+        in: query
+        type: boolean
+        required: false
+        default: true
+        description: 是否返回总数（缓存的计数）
       - name: user_id
         in: query
         type: integer
@@ -385,7 +523,7 @@ def get_file_list():
         type: string
         required: false
         default: upload_date
-        description: 排序字段
+        description: 排序字段（提供search时可用 relevance 按相关度排序）
       - name: sort_order
         in: query
         type: string
@@ -405,8 +543,10 @@ def get_file_list():
         current_user_id = current_user.get('id')
         #current_app.logger.info(f"当前用户ID: {current_user_id}")
         # 获取查询参数
-        page = int(request.args.get('page', 1))
-        page_size = int(request.args.get('page_size', 20))
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 20)), 1), FILE_LIST_CONFIG.get('max_page_size', 200))
+        cursor = request.args.get('cursor')
+        include_total = request.args.get('include_total', 'true').lower() != 'false'
         user_id = request.args.get('user_id')
         discipline = request.args.get('discipline')
         file_type = request.args.get('file_type')
@@ -417,28 +557,6 @@ def get_file_list():
         sort_by = request.args.get('sort_by', 'upload_date')
         sort_order = request.args.get('sort_order', 'desc')
         
-        # 构建基础查询 - 使用统一的vector_martin_services表
-        base_query = """
-        SELECT f.*, u.username as uploader,
-               gl.id as geoserver_layer_id, 
-               CONCAT(gw.name, ':', gl.name) as geoserver_layer_name, 
-               gl.wms_url as geoserver_wms_url, 
-               gl.wfs_url as geoserver_wfs_url,
-               vms.id as martin_service_id,
-               vms.file_id as martin_file_id,
-               vms.vector_type as martin_vector_type,
-               vms.table_name as martin_table_name,
-               vms.mvt_url as martin_mvt_url,
-               vms.tilejson_url as martin_tilejson_url,
-               vms.style as martin_style,
-               vms.status as martin_status
-        FROM files f
-        LEFT JOIN users u ON f.user_id = u.id
-        LEFT JOIN geoserver_layers gl ON f.id = gl.file_id
-        LEFT JOIN geoserver_workspaces gw ON gl.workspace_id = gw.id
-        LEFT JOIN vector_martin_services vms ON f.file_name = vms.original_filename AND vms.status = 'active'
-        """
-        
         # 构建WHERE条件
         where_conditions = []
         params = []
@@ -471,47 +589,109 @@ def get_file_list():
             where_conditions.append("f.geometry_type = %s")
             params.append(geometry_type)
         
-        if search:
-            where_conditions.append("(f.file_name ILIKE %s OR f.description ILIKE %s OR f.tags ILIKE %s)")
-            search_param = f"%{search}%"
-            params.extend([search_param, search_param, search_param])
+        # 关键词搜索走 pg_trgm 表达式索引
+        text_search = TextSearch(FILE_SEARCH_COLUMNS, search, alias='f', primary='file_name')
+        if text_search:
+            where_conditions.append(text_search.condition(positional_binder(params)))
         
-        # 添加WHERE子句
-        if where_conditions:
-            base_query += " WHERE " + " AND ".join(where_conditions)
+        where_sql = " WHERE " + " AND ".join(where_conditions)
         
-        # 添加排序
-        allowed_sort_fields = ['upload_date', 'file_name', 'file_size', 'file_type', 'discipline']
+        # 获取总数（缓存的计数，翻页时不再重复COUNT）
+        total = file_service.count_files(where_sql, params) if include_total else None
+        
+        # 添加排序（id 作为第二排序键，保证键集分页顺序稳定）；relevance 按搜索相关度排序
+        allowed_sort_fields = list(FILE_SORT_EXPRESSIONS)
+        if text_search:
+            allowed_sort_fields.append('relevance')
         if sort_by not in allowed_sort_fields:
             sort_by = 'upload_date'
         
         if sort_order.lower() not in ['asc', 'desc']:
             sort_order = 'desc'
-        
-        base_query += f" ORDER BY f.{sort_by} {sort_order.upper()}"
-        
-        # 添加分页
-        offset = (page - 1) * page_size
-        query = base_query + f" LIMIT {page_size} OFFSET {offset}"
-        
-        # 执行查询
-        files = execute_query(query, params)
-        #current_app.logger.info(f"查询结果: {files}")
-        # 获取总数
-        count_query = """
-        SELECT COUNT(DISTINCT f.id)
-        FROM files f
-        LEFT JOIN users u ON f.user_id = u.id
-        LEFT JOIN geoserver_layers gl ON f.id = gl.file_id
-        LEFT JOIN geoserver_workspaces gw ON gl.workspace_id = gw.id
-        LEFT JOIN vector_martin_services vms ON f.file_name = vms.original_filename AND vms.status = 'active'
+        sort_order = sort_order.lower()
+        
+        # 参数按SQL中出现的顺序绑定：排序值（SELECT）、过滤条件、游标条件、分页
+        # 排序值单独作为一列返回，游标直接取该列，保证与键集条件中的表达式完全一致
+        page_params = []
+        bind = positional_binder(page_params)
+        if sort_by == 'relevance':
+            sort_key = 'search_rank'
+            make_sort_expression = lambda: rounded_rank(text_search.rank(bind))
+        else:
+            sort_key = 'sort_value'
+            make_sort_expression = lambda: file_sort_expression(sort_by, alias='f')
+        select_sql = f"f.*, {make_sort_expression()} AS {sort_key}"
+        cte_order_sql = f"{sort_key} {sort_order.upper()}, f.id {sort_order.upper()}"
+        
+        # 分页：提供 cursor 时按 (排序字段, id) 键集分页，否则按页码
+        page_conditions = list(where_conditions)
+        page_params.extend(params)
+        pagination_sql = "LIMIT %s"
+        if cursor:
+            try:
+                sort_value, last_id = decode_cursor(cursor, sort_by, sort_order)
+            except InvalidCursorError as e:
+                return jsonify({'error': str(e)}), 400
+            page_conditions.append(keyset_condition(make_sort_expression(), "f.id", sort_order))
+            page_params.extend([sort_value, last_id])
+            page_params.append(page_size + 1)
+        else:
+            pagination_sql += " OFFSET %s"
+            page_params.extend([page_size + 1, (page - 1) * page_size])
+        
+        order_sql = f"page.{sort_key} {sort_order.upper()}, page.id {sort_order.upper()}"
+        
+        # 先在files上分页（走 (排序字段, id) 索引），再为这一页关联用户和服务信息；
+        # 每个文件只取一条GeoServer图层和Martin服务，避免关联放大行数
+        query = f"""
+        WITH page AS (
+            SELECT {select_sql} FROM files f
+            WHERE {" AND ".join(page_conditions)}
+            ORDER BY {cte_order_sql}
+            {pagination_sql}
+        )
+        SELECT page.*, u.username as uploader,
+               gl.id as geoserver_layer_id, 
+               gl.layer_name as geoserver_layer_name, 
+               gl.wms_url as geoserver_wms_url, 
+               gl.wfs_url as geoserver_wfs_url,
+               vms.id as martin_service_id,
+               vms.file_id as martin_file_id,
+               vms.vector_type as martin_vector_type,
+               vms.table_name as martin_table_name,
+               vms.mvt_url as martin_mvt_url,
+               vms.tilejson_url as martin_tilejson_url,
+               vms.style as martin_style,
+               vms.status as martin_status
+        FROM page
+        LEFT JOIN users u ON page.user_id = u.id
+        LEFT JOIN LATERAL (
+            SELECT gl.id, CONCAT(gw.name, ':', gl.name) as layer_name, gl.wms_url, gl.wfs_url
+            FROM geoserver_layers gl
+            LEFT JOIN geoserver_workspaces gw ON gl.workspace_id = gw.id
+            WHERE gl.file_id = page.id
+            ORDER BY gl.id DESC
+            LIMIT 1
+        ) gl ON true
+        LEFT JOIN LATERAL (
+            SELECT * FROM vector_martin_services v
+            WHERE v.source_file_id = page.id AND v.status = 'active'
+            ORDER BY v.id DESC
+            LIMIT 1
+        ) vms ON true
+        ORDER BY {order_sql}
         """
         
-        if where_conditions:
-            count_query += " WHERE " + " AND ".join(where_conditions)
-        
-        total_result = execute_query(count_query, params)
-        total = total_result[0]['count'] if total_result else 0
+        # 执行查询（多取一行判断是否还有下一页）
+        files = execute_query(query, page_params)
+        next_cursor = None
+        if len(files) > page_size:
+            files = files[:page_size]
+            last = files[-1]
+            next_cursor = encode_cursor(last[sort_key], last['id'], sort_by, sort_order)
+        if sort_key == 'sort_value':
+            for file in files:
+                file.pop('sort_value', None)
         
         # 处理结果
         for file in files:
@@ -602,7 +782,9 @@ def get_file_list():
             'total': total,
             'page': page,
             'page_size': page_size,
-            'total_pages': (total + page_size - 1) // page_size
+            'total_pages': (total + page_size - 1) // page_size if total is not None else None,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         }), 200
     
     except Exception as e:
@@ -1375,6 +1557,7 @@ def unpublish_geoserver_service(file_id):
             delete_layer_sql = "DELETE FROM geoserver_layers WHERE id = %s"
             affected_rows = execute_query(delete_layer_sql, (layer_id,), fetch=False)
             print(f"✅ 删除图层记录: layer_id={layer_id} (影响行数: {affected_rows})")
+            capabilities_cache.invalidate()
             
             # 5.2 删除关联的featuretype或coverage记录
             if layer_info['featuretype_id']:
@@ -1449,9 +1632,26 @@ def unpublish_geoserver_service(file_id):
         traceback.print_exc()
         return jsonify({'success': False, 'error': f'取消发布失败: {str(e)}'}), 500
 
+def _coordinate_system_info(entry):
+    """坐标系目录条目转换为接口返回格式"""
+    display_name = f"EPSG:{entry['auth_srid']}"
+    if entry['name']:
+        display_name += f" - {entry['name']}"
+
+    return {
+        'srid': entry['srid'],
+        'auth_name': entry['auth_name'],
+        'auth_srid': entry['auth_srid'],
+        'epsg_code': f"EPSG:{entry['auth_srid']}",
+        'name': entry['name'],
+        'display_name': display_name,
+        'srtext': entry['srtext'] or '',
+        'proj4text': entry['proj4text']
+    }
+
 @file_bp.route('/coordinate-systems/search', methods=['GET'])
 def search_coordinate_systems():
-    """搜索坐标系"""
+    """搜索坐标系（内存倒排索引，见 services/crs_catalog.py）"""
     try:
         # 获取搜索关键词
         keyword = request.args.get('keyword', '').strip()
@@ -1466,80 +1666,10 @@ def search_coordinate_systems():
         if not keywords:
             return jsonify({'error': '请提供有效的搜索关键词'}), 400
         
-        # 构建多关键词搜索SQL
-        # 每个关键词都要在所有字段中搜索，使用AND连接不同关键词
-        keyword_conditions = []
-        params = []
-        
-        for i, kw in enumerate(keywords):
-            # 为每个关键词构建OR条件（在不同字段中搜索）
-            keyword_condition = f"""
-            (
-                LOWER(srtext) LIKE LOWER(%s) 
-                OR LOWER(proj4text) LIKE LOWER(%s)
-                OR CAST(srid AS TEXT) LIKE %s
-                OR CAST(auth_srid AS TEXT) LIKE %s
-            )
-            """
-            keyword_conditions.append(keyword_condition)
-            
-            # 添加参数（每个关键词需要4个参数）
-            search_pattern = f'%{kw}%'
-            params.extend([search_pattern, search_pattern, search_pattern, search_pattern])
-        
-        # 使用AND连接所有关键词条件
-        where_clause = " AND ".join(keyword_conditions)
-        
-        search_sql = f"""
-        SELECT 
-            srid,
-            auth_name,
-            auth_srid,
-            srtext,
-            proj4text
-        FROM spatial_ref_sys 
-        WHERE {where_clause}
-        ORDER BY 
-            CASE 
-                WHEN CAST(srid AS TEXT) = %s THEN 1
-                WHEN CAST(auth_srid AS TEXT) = %s THEN 2
-                WHEN LOWER(srtext) LIKE LOWER(%s) THEN 3
-                ELSE 4
-            END,
-            srid
-        LIMIT %s
-        """
-        
-        # 添加排序和限制参数
-        # 使用第一个关键词进行排序优先级判断
-        first_keyword = keywords[0]
-        params.extend([first_keyword, first_keyword, f'%{first_keyword}%', limit])
-        
-        # 执行查询
-        results = execute_query(search_sql, params)
-        
-        # 处理结果，提取有用信息
-        coordinate_systems = []
-        for row in results:
-            # 从srtext中提取坐标系名称
-            srtext = row['srtext'] or ''
-            name = extract_coordinate_system_name(srtext)
-            
-            # 构建显示名称
-            display_name = f"EPSG:{row['auth_srid']}"
-            if name:
-                display_name += f" - {name}"
-            
-            coordinate_systems.append({
-                'srid': row['srid'],
-                'auth_name': row['auth_name'],
-                'auth_srid': row['auth_srid'],
-                'epsg_code': f"EPSG:{row['auth_srid']}",
-                'name': name,
-                'display_name': display_name,
-                'srtext': srtext,
-                'proj4text': row['proj4text']
-            })
+        # 每个关键词都要匹配（srtext、proj4text、srid、auth_srid 任一包含即可），
+        # 排序与原SQL一致：srid相等 > auth_srid相等 > srtext包含 > 其他，再按srid
+        catalog = get_crs_catalog()
+        coordinate_systems = [_coordinate_system_info(entry) for entry in catalog.search(keywords, limit)]
         
         return jsonify({
             'success': True,
@@ -1553,35 +1683,26 @@ def search_coordinate_systems():
         current_app.logger.error(f"搜索坐标系失败: {str(e)}")
         return jsonify({'error': f'搜索坐标系失败: {str(e)}'}), 500
 
-def extract_coordinate_system_name(srtext):
-    """从srtext中提取坐标系名称"""
+@file_bp.route('/coordinate-systems/refresh', methods=['POST'])
+@require_auth
+def refresh_coordinate_systems():
+    """重新加载坐标系目录（向 spatial_ref_sys 添加自定义坐标系后调用）"""
     try:
-        if not srtext:
-            return None
-            
-        # 使用正则表达式提取PROJCS或GEOGCS中的名称
-        import re
-        
-        # 匹配PROJCS["name",...] 或 GEOGCS["name",...]
-        pattern = r'(?:PROJCS|GEOGCS)\["([^"]+)"'
-        match = re.search(pattern, srtext)
-        
-        if match:
-            name = match.group(1)
-            # 清理名称，移除一些常见的后缀
-            name = re.sub(r'\s*\(.*?\)\s*$', '', name)  # 移除括号内容
-            return name
-            
-        return None
-        
-    except Exception:
-        return None
+        catalog = refresh_crs_catalog()
+        return jsonify({
+            'success': True,
+            'total': len(catalog),
+            'version': catalog.version
+        }), 200
+    except Exception as e:
+        current_app.logger.error(f"刷新坐标系目录失败: {str(e)}")
+        return jsonify({'error': f'刷新坐标系目录失败: {str(e)}'}), 500
 
 @file_bp.route('/coordinate-systems/common', methods=['GET'])
 def get_common_coordinate_systems():
     """获取常用坐标系列表"""
     try:
-        # 定义常用坐标系的EPSG代码
+        # 定义常用坐标系的EPSG代码（按返回顺序）
         common_epsgs = [
             4326,   # WGS 84
             3857,   # Web Mercator
@@ -1595,50 +1716,12 @@ def get_common_coordinate_systems():
             4546,   # CGCS2000 / 3-degree Gauss-Kruger CM 105E
         ]
         
-        # 构建查询SQL
-        placeholders = ','.join(['%s'] * len(common_epsgs))
-        sql = f"""
-        SELECT 
-            srid,
-            auth_name,
-            auth_srid,
-            srtext,
-            proj4text
-        FROM spatial_ref_sys 
-        WHERE auth_srid IN ({placeholders})
-        ORDER BY 
-            CASE auth_srid
-                WHEN 4326 THEN 1
-                WHEN 3857 THEN 2  
-                WHEN 4490 THEN 3
-                WHEN 4214 THEN 4
-                WHEN 4610 THEN 5
-                ELSE 6
-            END
-        """
-        
-        results = execute_query(sql, common_epsgs)
-        
-        # 处理结果
+        catalog = get_crs_catalog()
         coordinate_systems = []
-        for row in results:
-            srtext = row['srtext'] or ''
-            name = extract_coordinate_system_name(srtext)
-            
-            display_name = f"EPSG:{row['auth_srid']}"
-            if name:
-                display_name += f" - {name}"
-            
-            coordinate_systems.append({
-                'srid': row['srid'],
-                'auth_name': row['auth_name'],
-                'auth_srid': row['auth_srid'],
-                'epsg_code': f"EPSG:{row['auth_srid']}",
-                'name': name,
-                'display_name': display_name,
-                'srtext': srtext,
-                'proj4text': row['proj4text']
-            })
+        for epsg in common_epsgs:
+            entry = catalog.get(epsg)
+            if entry:
+                coordinate_systems.append(_coordinate_system_info(entry))
         
         return jsonify({
             'success': True,
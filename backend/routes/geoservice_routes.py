@@ -9,6 +9,7 @@ import tempfile
 import requests
 from services.file_service import FileService
 from config import GEOSERVER_CONFIG
+from services.capabilities_cache import capabilities_cache
 
 geoservice_bp = Blueprint('geoservice', __name__)
 geoserver_service = GeoServerService()
@@ -47,16 +48,28 @@ def get_wms_capabilities():
     ---
     tags:
       - GeoServer服务
+    parameters:
+      - name: layer
+        in: query
+        type: string
+        required: false
+        description: 图层名（工作空间:图层名），指定时同时返回该图层在GetCapabilities中的信息
     responses:
       200:
         description: WMS服务能力
     """
     try:
         url = f"{geoserver_service.url}/wms?service=WMS&version=1.3.0&request=GetCapabilities"
+        result = {'wms_capabilities_url': url}
         
-        return jsonify({
-            'wms_capabilities_url': url
-        }), 200
+        layer_name = request.args.get('layer')
+        if layer_name:
+            layer = capabilities_cache.get_layer(layer_name, service='WMS')
+            if not layer:
+                return jsonify({'error': f'图层 {layer_name} 不在WMS GetCapabilities中'}), 404
+            result['layer'] = layer
+        
+        return jsonify(result), 200
     
     except Exception as e:
         current_app.logger.error(f"获取WMS服务能力错误: {str(e)}")
@@ -68,16 +81,28 @@ def get_wfs_capabilities():
     ---
     tags:
       - GeoServer服务
+    parameters:
+      - name: layer
+        in: query
+        type: string
+        required: false
+        description: 图层名（工作空间:图层名），指定时同时返回该图层在GetCapabilities中的信息
     responses:
       200:
         description: WFS服务能力
     """
     try:
         url = f"{geoserver_service.url}/wfs?service=WFS&version=2.0.0&request=GetCapabilities"
+        result = {'wfs_capabilities_url': url}
         
-        return jsonify({
-            'wfs_capabilities_url': url
-        }), 200
+        layer_name = request.args.get('layer')
+        if layer_name:
+            layer = capabilities_cache.get_layer(layer_name, service='WFS')
+            if not layer:
+                return jsonify({'error': f'图层 {layer_name} 不在WFS GetCapabilities中'}), 404
+            result['layer'] = layer
+        
+        return jsonify(result), 200
     
     except Exception as e:
         current_app.logger.error(f"获取WFS服务能力错误: {str(e)}")
@@ -564,6 +589,7 @@ def unpublish_service(file_id):
         delete_layer_sql = "DELETE FROM geoserver_layers WHERE id = %s"
         affected_rows = execute_query(delete_layer_sql, (layer_info['layer_id'],), fetch=False)
         print(f"✅ 删除图层记录: {layer_info['layer_id']} (影响行数: {affected_rows})")
+        capabilities_cache.invalidate()
         
         # 2. 删除存储记录（如果存在）
         if store_info:
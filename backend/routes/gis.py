@@ -3,6 +3,7 @@
 
 from flask import Blueprint, request, jsonify, current_app
 from models.db import get_connection as get_db_connection
+from services.crs_catalog import get_crs_catalog
 import json
 import logging
 
@@ -139,30 +140,16 @@ def get_layer_crs_info(layer_id):
             epsg_code = 'EPSG:4326'
             logger.warning(f"坐标系格式不标准{coordinate_system}，使用默认值EPSG:4326")
         
-        # 从spatial_ref_sys表获取完整的坐标系信息
-        cursor.execute("""
-            SELECT 
-                srid,
-                auth_name,
-                auth_srid,
-                srtext,
-                proj4text
-            FROM spatial_ref_sys 
-            WHERE auth_srid = %s
-            LIMIT 1
-        """, (epsg_number,))
-        
-        spatial_ref_record = cursor.fetchone()
+        # 从坐标系目录（spatial_ref_sys 内存缓存）获取完整的坐标系信息
+        spatial_ref_record = get_crs_catalog().get(epsg_number)
         
         if spatial_ref_record:
-            srid = spatial_ref_record[0]
-            auth_name = spatial_ref_record[1]
-            auth_srid = spatial_ref_record[2]
-            srtext = spatial_ref_record[3]
-            proj4text = spatial_ref_record[4]
-            
-            # 从srtext中提取坐标系名称
-            name = extract_coordinate_system_name(srtext)
+            srid = spatial_ref_record['srid']
+            auth_name = spatial_ref_record['auth_name']
+            auth_srid = spatial_ref_record['auth_srid']
+            srtext = spatial_ref_record['srtext']
+            proj4text = spatial_ref_record['proj4text']
+            name = spatial_ref_record['name']
             
             logger.info(f"从spatial_ref_sys表获取到坐标系信息: EPSG:{auth_srid}")
         else:
@@ -213,41 +200,25 @@ def get_layer_crs_info(layer_id):
             "message": f"获取坐标系信息失败: {str(e)}"
         }), 500
 
-def extract_coordinate_system_name(srtext):
-    """从srtext中提取坐标系名称"""
-    try:
-        if not srtext:
-            return None
-            
-        # 使用正则表达式提取PROJCS或GEOGCS中的名称
-        import re
-        
-        # 匹配PROJCS["name",...] 或 GEOGCS["name",...]
-        pattern = r'(?:PROJCS|GEOGCS)\["([^"]+)"'
-        match = re.search(pattern, srtext)
-        
-        if match:
-            name = match.group(1)
-            # 清理名称，移除一些常见的后缀
-            name = re.sub(r'\s*\(.*?\)\s*$', '', name)  # 移除括号内容
-            return name
-            
-        return None
-        
-    except Exception:
-        return None
+def _conditional_response(payload, etag):
+    """带ETag的JSON响应，客户端缓存未变化时返回304"""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    # 允许缓存但每次校验，坐标系目录刷新后客户端能立即拿到新定义
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @gis_bp.route('/coordinate-systems/proj4-definitions', methods=['GET'])
 def get_proj4_definitions():
     """获取常用坐标系的proj4定义，用于前端初始化
     
+    定义来自坐标系目录缓存，响应带ETag（目录版本），未变化时返回304。
+    
     Returns:
         常用坐标系的proj4定义字典
     """
     try:
-        # 获取数据库连接
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        catalog = get_crs_catalog()
         
         # 定义常用坐标系的EPSG代码
         common_epsgs = [
@@ -263,50 +234,26 @@ def get_proj4_definitions():
             4547,   # CGCS2000 / 3-degree Gauss-Kruger CM 102E
         ]
         
-        # 查询spatial_ref_sys表获取proj4定义
-        placeholders = ','.join(['%s'] * len(common_epsgs))
-        sql = f"""
-        SELECT 
-            auth_srid,
-            proj4text,
-            srtext
-        FROM spatial_ref_sys 
-        WHERE auth_srid IN ({placeholders})
-        AND proj4text IS NOT NULL
-        ORDER BY auth_srid
-        """
-        
-        cursor.execute(sql, common_epsgs)
-        results = cursor.fetchall()
-        
         # 构建proj4定义字典
         proj4_definitions = {}
-        for row in results:
-            epsg_code = f"EPSG:{row[0]}"
-            proj4_def = row[1]
-            srtext = row[2]
-            
-            # 提取坐标系名称
-            name = extract_coordinate_system_name(srtext)
+        for epsg in sorted(common_epsgs):
+            entry = catalog.get(epsg)
+            if not entry or entry['proj4text'] is None:
+                continue
             
+            epsg_code = f"EPSG:{entry['auth_srid']}"
             proj4_definitions[epsg_code] = {
-                'proj4': proj4_def,
-                'name': name,
+                'proj4': entry['proj4text'],
+                'name': entry['name'],
                 'epsg_code': epsg_code,
-                'auth_srid': row[0]
+                'auth_srid': entry['auth_srid']
             }
         
-        # 关闭数据库连接
-        cursor.close()
-        conn.close()
-        
-        logger.info(f"获取到{len(proj4_definitions)}个常用坐标系的proj4定义")
-        
-        return jsonify({
+        return _conditional_response({
             "success": True,
             "proj4_definitions": proj4_definitions,
             "total": len(proj4_definitions)
-        })
+        }, f"crs-common-{catalog.version}")
         
     except Exception as e:
         logger.error(f"获取proj4定义失败: {str(e)}")
@@ -317,7 +264,7 @@ def get_proj4_definitions():
 
 @gis_bp.route('/coordinate-systems/<epsg_code>/proj4', methods=['GET'])
 def get_single_proj4_definition(epsg_code):
-    """获取单个坐标系的proj4定义
+    """获取单个坐标系的proj4定义（坐标系目录缓存，支持ETag/304）
     
     Args:
         epsg_code: EPSG代码，如'EPSG:2379'或'2379'
@@ -332,57 +279,27 @@ def get_single_proj4_definition(epsg_code):
         else:
             epsg_number = int(epsg_code)
         
-        # 获取数据库连接
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 查询spatial_ref_sys表
-        cursor.execute("""
-            SELECT 
-                srid,
-                auth_name,
-                auth_srid,
-                srtext,
-                proj4text
-            FROM spatial_ref_sys 
-            WHERE auth_srid = %s
-            LIMIT 1
-        """, (epsg_number,))
-        
-        result = cursor.fetchone()
+        catalog = get_crs_catalog()
+        entry = catalog.get(epsg_number)
         
-        if not result:
+        if not entry:
             return jsonify({
                 "success": False,
                 "message": f"未找到EPSG:{epsg_number}的定义"
             }), 404
         
-        # 提取信息
-        srid = result[0]
-        auth_name = result[1]
-        auth_srid = result[2]
-        srtext = result[3]
-        proj4text = result[4]
-        
-        # 提取坐标系名称
-        name = extract_coordinate_system_name(srtext)
-        
-        # 关闭数据库连接
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
+        return _conditional_response({
             "success": True,
             "crs_info": {
-                "epsg_code": f"EPSG:{auth_srid}",
-                "srid": srid,
-                "auth_name": auth_name,
-                "auth_srid": auth_srid,
-                "name": name,
-                "srtext": srtext,
-                "proj4_definition": proj4text
+                "epsg_code": f"EPSG:{entry['auth_srid']}",
+                "srid": entry['srid'],
+                "auth_name": entry['auth_name'],
+                "auth_srid": entry['auth_srid'],
+                "name": entry['name'],
+                "srtext": entry['srtext'],
+                "proj4_definition": entry['proj4text']
             }
-        })
+        }, f"crs-{epsg_number}-{catalog.version}")
         
     except ValueError:
         return jsonify({
@@ -394,4 +311,4 @@ def get_single_proj4_definition(epsg_code):
         return jsonify({
             "success": False,
             "message": f"获取proj4定义失败: {str(e)}"
-        }), 500 
\ No newline at end of file
+        }), 500
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+后台任务队列 API 路由
+提交、查询、取消和重试持久化后台任务
+"""
+
+from flask import Blueprint, jsonify, request
+import logging
+from services.job_queue import get_job_queue, job_progress_view, FINISHED_STATUSES
+from auth.auth_service import require_auth, get_current_user
+from config import TIF_TILING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+job_bp = Blueprint('jobs', __name__)
+
+# 可通过通用接口提交的任务类型；TIF转换参数较多，通过 /api/tif-martin/convert-async 提交
+SUBMITTABLE_JOB_TYPES = ('dxf_import', 'geojson_import', 'shp_import')
+
+
+def _current_user_id():
+    current_user = get_current_user() or {}
+    return current_user.get('id', current_user.get('username'))
+
+
+def _is_admin():
+    return (get_current_user() or {}).get('role') == 'admin'
+
+
+def _can_access(job):
+    """管理员可以访问所有任务，其他用户只能访问自己提交的任务"""
+    return _is_admin() or str(job.get('user_id')) == str(_current_user_id())
+
+
+@job_bp.route('', methods=['POST'])
+@require_auth
+def submit_job():
+    """提交导入任务
+
+    Request Body:
+        {
+            "job_type": "dxf_import" | "geojson_import" | "shp_import",
+            "payload": {"file_id": ..., "coordinate_system": ...},
+            "priority": 0
+        }
+    """
+    try:
+        data = request.get_json() or {}
+        job_type = data.get('job_type')
+        payload = data.get('payload') or {}
+        priority = data.get('priority', 0)
+
+        if job_type not in SUBMITTABLE_JOB_TYPES:
+            return jsonify({'error': f"job_type必须是 {', '.join(SUBMITTABLE_JOB_TYPES)} 之一"}), 400
+        if not isinstance(payload, dict) or not payload.get('file_id'):
+            return jsonify({'error': 'payload.file_id是必需的'}), 400
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            return jsonify({'error': 'priority必须是整数'}), 400
+
+        job = get_job_queue().submit(job_type, payload=payload, priority=priority, user_id=_current_user_id())
+        return jsonify({'success': True, 'job': job}), 200
+
+    except Exception as e:
+        logger.error(f"提交任务失败: {str(e)}")
+        return jsonify({'error': f'提交任务失败: {str(e)}'}), 500
+
+
+@job_bp.route('', methods=['GET'])
+@require_auth
+def list_jobs():
+    """任务列表，支持 status / job_type / mine 过滤；非管理员只能看到自己的任务"""
+    try:
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        offset = request.args.get('offset', 0, type=int)
+        mine = request.args.get('mine', 'false').lower() == 'true'
+        user_id = _current_user_id() if mine or not _is_admin() else None
+
+        jobs = get_job_queue().list_jobs(
+            status=request.args.get('status'),
+            job_type=request.args.get('job_type'),
+            user_id=user_id,
+            limit=limit,
+            offset=offset
+        )
+        return jsonify({'success': True, 'jobs': jobs, 'limit': limit, 'offset': offset}), 200
+
+    except Exception as e:
+        logger.error(f"获取任务列表失败: {str(e)}")
+        return jsonify({'error': f'获取任务列表失败: {str(e)}'}), 500
+
+
+@job_bp.route('/<string:job_id>', methods=['GET'])
+@require_auth
+def get_job(job_id):
+    """任务详情和进度"""
+    try:
+        job = get_job_queue().get_job(job_id)
+        if not job:
+            return jsonify({'error': '任务不存在'}), 404
+        if not _can_access(job):
+            return jsonify({'error': '无权访问该任务'}), 403
+        return jsonify({'success': True, 'job': job, 'progress': job_progress_view(job)}), 200
+
+    except Exception as e:
+        logger.error(f"获取任务失败: {str(e)}")
+        return jsonify({'error': f'获取任务失败: {str(e)}'}), 500
+
+
+@job_bp.route('/<string:job_id>/cancel', methods=['POST'])
+@require_auth
+def cancel_job(job_id):
+    """取消任务；运行中的任务在下一次进度更新时停止"""
+    try:
+        queue = get_job_queue()
+        job = queue.get_job(job_id)
+        if not job:
+            return jsonify({'error': '任务不存在'}), 404
+        if not _can_access(job):
+            return jsonify({'error': '无权访问该任务'}), 403
+        if job['status'] in FINISHED_STATUSES:
+            return jsonify({'error': f"任务已结束，当前状态: {job['status']}"}), 400
+
+        job = queue.cancel(job_id)
+        return jsonify({'success': True, 'job': job}), 200
+
+    except Exception as e:
+        logger.error(f"取消任务失败: {str(e)}")
+        return jsonify({'error': f'取消任务失败: {str(e)}'}), 500
+
+
+@job_bp.route('/<string:job_id>/retry', methods=['POST'])
+@require_auth
+def retry_job(job_id):
+    """重新执行失败或已取消的任务"""
+    try:
+        queue = get_job_queue()
+        job = queue.get_job(job_id)
+        if not job:
+            return jsonify({'error': '任务不存在'}), 404
+        if not _can_access(job):
+            return jsonify({'error': '无权访问该任务'}), 403
+        if job['status'] not in ('failed', 'cancelled'):
+            return jsonify({'error': f"只能重试失败或已取消的任务，当前状态: {job['status']}"}), 400
+
+        payload_updates = None
+        if job['job_type'] == 'tif_convert':
+            pipeline = (job['payload'] or {}).get('pipeline') or TIF_TILING_CONFIG.get('pipeline', 'memory')
+            if pipeline == 'memory':
+                # 重试会重置执行次数，显式要求从上一次的断点继续
+                payload_updates = {'resume': True}
+        job = queue.retry(job_id, payload_updates=payload_updates)
+        return jsonify({'success': True, 'job': job}), 200
+
+    except Exception as e:
+        logger.error(f"重试任务失败: {str(e)}")
+        return jsonify({'error': f'重试任务失败: {str(e)}'}), 500
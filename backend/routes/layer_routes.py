@@ -4,7 +4,8 @@
 from flask import Blueprint, request, jsonify, current_app
 from services.layer_service import LayerService
 from services.geoserver_service import GeoServerService
-from models.db import get_connection as get_db_connection
+from services.layer_extent_service import get_layer_extent
+from models.db import pooled_connection
 import json
 import logging
 
@@ -723,7 +724,7 @@ def get_scene_layer_bounds(scene_layer_id):
         scene_layer_id: 图层ID（scenes_layers表的ID）
     """
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             from psycopg2.extras import RealDictCursor
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             
@@ -781,14 +782,10 @@ def get_scene_layer_bounds(scene_layer_id):
               file_id = layer_record['file_id']
               coordinate_system = layer_record['coordinate_system'] or 'EPSG:4326'
               
-              # 构建完整图层名称用于GetCapabilities查询
-              full_layer_name = f"{layer_record['workspace_name']}:{layer_record['name']}"
-              wms_url = layer_record['wms_url']
+              # 发布时计算的图层范围（EPSG:4326），尚未计算时按需计算并保存
+              bbox = get_layer_extent('geoserver', layer_id)
               
-              # 尝试从GeoServer GetCapabilities获取边界
-              bbox = get_geoserver_layer_bounds(full_layer_name, wms_url)
-              
-              # 如果GetCapabilities失败，尝试从文件bbox获取
+              # 范围不可用时，尝试从文件bbox获取
               if not bbox and layer_record.get('bbox'):
                   if isinstance(layer_record['bbox'], str):
                       try:
@@ -854,11 +851,11 @@ def get_scene_layer_bounds(scene_layer_id):
                 file_id = martin_record['file_id']
                 coordinate_system = martin_record['coordinate_system'] or 'EPSG:4326'
                 
-                # 从Martin服务获取边界
-                bbox = get_martin_service_bounds(layer_id)
+                # 发布时计算的图层范围（EPSG:4326），尚未计算时按需计算并保存
+                bbox = get_layer_extent('martin', layer_id)
                 
                 if not bbox and martin_record.get('bbox'):
-                    # 如果Martin服务获取失败，尝试从文件bbox获取
+                    # 范围不可用时，尝试从文件bbox获取
                     if isinstance(martin_record['bbox'], str):
                         try:
                             bbox = json.loads(martin_record['bbox'])
@@ -915,7 +912,7 @@ def get_layer_bounds(layer_id):
         layer_id: 图层ID
     """
     try:
-        with get_db_connection() as conn:
+        with pooled_connection() as conn:
             from psycopg2.extras import RealDictCursor
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             # 首先尝试从geoserver_layers表获取图层信息
@@ -947,14 +944,10 @@ def get_layer_bounds(layer_id):
               file_id = layer_record['file_id']
               coordinate_system = layer_record['coordinate_system'] or 'EPSG:4326'
               
-              # 构建完整图层名称用于GetCapabilities查询
-              full_layer_name = f"{layer_record['workspace_name']}:{layer_record['name']}"
-              wms_url = layer_record['wms_url']
-              
-              # 尝试从GeoServer GetCapabilities获取边界
-              bbox = get_geoserver_layer_bounds(full_layer_name, wms_url)
+              # 发布时计算的图层范围（EPSG:4326），尚未计算时按需计算并保存
+              bbox = get_layer_extent('geoserver', layer_id)
               
-              # 如果GetCapabilities失败，尝试从文件bbox获取
+              # 范围不可用时，尝试从文件bbox获取
               if not bbox and layer_record.get('bbox'):
                   if isinstance(layer_record['bbox'], str):
                       try:
@@ -1007,11 +1000,11 @@ def get_layer_bounds(layer_id):
                 file_id = martin_record['file_id']
                 coordinate_system = martin_record['coordinate_system'] or 'EPSG:4326'
                 
-                # 从Martin服务获取边界
-                bbox = get_martin_service_bounds(layer_id)
+                # 发布时计算的图层范围（EPSG:4326），尚未计算时按需计算并保存
+                bbox = get_layer_extent('martin', layer_id)
                 
                 if not bbox and martin_record.get('bbox'):
-                    # 如果Martin服务获取失败，尝试从文件bbox获取
+                    # 范围不可用时，尝试从文件bbox获取
                     if isinstance(martin_record['bbox'], str):
                         try:
                             bbox = json.loads(martin_record['bbox'])
@@ -1046,169 +1039,3 @@ def get_layer_bounds(layer_id):
             'success': False,
             'error': f'获取图层边界失败: {str(e)}'
         }), 500
-
-
-def get_martin_service_bounds(martin_service_id):
-    """从Martin服务获取PostGIS表的边界"""
-    try:
-        with get_db_connection() as conn:
-            from psycopg2.extras import RealDictCursor
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # 获取Martin服务信息
-            cursor.execute("""
-            SELECT table_name, original_filename
-            FROM vector_martin_services 
-            WHERE id = %s AND status = 'active'
-            """, (martin_service_id,))
-            
-            service = cursor.fetchone()
-            if not service:
-                return None
-                
-            table_name = service['table_name']
-            
-            # 动态获取几何字段名称
-            cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = %s 
-            AND data_type = 'USER-DEFINED' 
-            AND udt_name = 'geometry'
-            ORDER BY ordinal_position
-            LIMIT 1
-            """, (table_name,))
-            
-            geom_column_result = cursor.fetchone()
-            if not geom_column_result:
-                logger.error(f"表 {table_name} 中未找到几何字段")
-                return None
-                
-            geom_column = geom_column_result['column_name']
-            logger.info(f"表 {table_name} 中找到几何字段: {geom_column}")
-            
-            # 获取几何字段的SRID和边界
-            cursor.execute(f"""
-            SELECT 
-                ST_SRID((SELECT "{geom_column}" FROM "{table_name}" WHERE "{geom_column}" IS NOT NULL LIMIT 1)) as srid,
-                ST_XMin(extent) as minx, 
-                ST_YMin(extent) as miny,
-                ST_XMax(extent) as maxx, 
-                ST_YMax(extent) as maxy
-            FROM (
-                SELECT ST_Extent("{geom_column}") as extent
-                FROM "{table_name}"
-                WHERE "{geom_column}" IS NOT NULL
-            ) t
-            """)
-            
-            result = cursor.fetchone()
-            if not result or not all(v is not None for v in [result['minx'], result['miny'], result['maxx'], result['maxy']]):
-                logger.error(f"表 {table_name} 中无法计算有效的边界框")
-                return None
-            
-            # 获取原始坐标系SRID
-            source_srid = result['srid']
-            minx, miny = float(result['minx']), float(result['miny'])
-            maxx, maxy = float(result['maxx']), float(result['maxy'])
-            
-            logger.info(f"表 {table_name}, 原始坐标系: EPSG:{source_srid}, 边界框: [{minx}, {miny}, {maxx}, {maxy}]")
-            
-            # 如果不是地理坐标系（4326），则进行坐标转换
-            if source_srid != 4326:
-                try:
-                    # 使用PostGIS进行坐标转换
-                    cursor.execute("""
-                    SELECT 
-                        ST_X(ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), %s), 4326)) as min_lon,
-                        ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), %s), 4326)) as min_lat,
-                        ST_X(ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), %s), 4326)) as max_lon,
-                        ST_Y(ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), %s), 4326)) as max_lat
-                    """, (minx, miny, source_srid, minx, miny, source_srid, 
-                          maxx, maxy, source_srid, maxx, maxy, source_srid))
-                    
-                    transform_result = cursor.fetchone()
-                    if transform_result:
-                        converted_bbox = {
-                            'minx': float(transform_result['min_lon']),
-                            'miny': float(transform_result['min_lat']),
-                            'maxx': float(transform_result['max_lon']),
-                            'maxy': float(transform_result['max_lat'])
-                        }
-                        logger.info(f"转换后地理坐标: {converted_bbox}")
-                        return converted_bbox
-                except Exception as transform_error:
-                    logger.error(f"坐标转换失败: {transform_error}")
-                    # 转换失败时返回原始坐标
-                    pass
-            
-            # 如果已经是地理坐标系或转换失败，返回原始坐标
-            return {
-                'minx': minx,
-                'miny': miny,
-                'maxx': maxx,
-                'maxy': maxy
-            }
-                
-    except Exception as e:
-        logger.error(f"获取Martin服务边界失败: {str(e)}")
-        
-    return None
-
-
-def get_geoserver_layer_bounds(layer_name, wms_url):
-    """从GeoServer WMS GetCapabilities获取图层边界"""
-    try:
-        import requests
-        from xml.etree import ElementTree as ET
-        
-        if not wms_url:
-            return None
-            
-        # 构造GetCapabilities请求
-        base_url = wms_url.split('?')[0]
-        capabilities_url = f"{base_url}?service=WMS&version=1.3.0&request=GetCapabilities"
-        
-        response = requests.get(capabilities_url, timeout=30)
-        response.raise_for_status()
-        
-        # 解析XML响应
-        root = ET.fromstring(response.content)
-        
-        # 查找指定图层
-        namespaces = {
-            'wms': 'http://www.opengis.net/wms',
-            'xlink': 'http://www.w3.org/1999/xlink'
-        }
-        
-        # 查找图层
-        for layer in root.findall('.//wms:Layer', namespaces):
-            name_elem = layer.find('wms:Name', namespaces)
-            if name_elem is not None and name_elem.text == layer_name:
-                # 查找边界框
-                bbox_elem = layer.find('wms:BoundingBox[@CRS="EPSG:4326"]', namespaces)
-                if bbox_elem is not None:
-                    #logger.info(f"找到EPSG:4326的边界框: {bbox_elem.get('minx')}, {bbox_elem.get('miny')}, {bbox_elem.get('maxx')}, {bbox_elem.get('maxy')}")
-                    return {
-                        # 20250617测试Geojson数据，坐标x是纬度，y是经度，数据可以在地图正常加载，这里需要交换minx和miny，maxx和maxy
-                        'minx': float(bbox_elem.get('miny')),
-                        'miny': float(bbox_elem.get('minx')),
-                        'maxx': float(bbox_elem.get('maxy')),
-                        'maxy': float(bbox_elem.get('maxx'))
-                    }
-                    
-                # 如果没有找到EPSG:4326的边界框，尝试其他CRS
-                bbox_elem = layer.find('wms:BoundingBox', namespaces)
-                if bbox_elem is not None:
-                    #logger.info(f"找到其他CRS的边界框: {bbox_elem.get('minx')}, {bbox_elem.get('miny')}, {bbox_elem.get('maxx')}, {bbox_elem.get('maxy')}")
-                    return {
-                        'minx': float(bbox_elem.get('minx')),
-                        'miny': float(bbox_elem.get('miny')),
-                        'maxx': float(bbox_elem.get('maxx')),
-                        'maxy': float(bbox_elem.get('maxy'))
-                    }
-                    
-    except Exception as e:
-        logger.error(f"获取GeoServer图层边界失败: {str(e)}")
-        
-    return None 
\ No newline at end of file
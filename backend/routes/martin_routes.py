@@ -6,6 +6,7 @@ from flask import Blueprint, jsonify, request
 from flask_restx import Api, Resource, fields
 import logging
 from services.martin_service import MartinService
+from services.martin_reload_scheduler import martin_reload_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -195,7 +196,7 @@ class RefreshTables(Resource):
     def post(self):
         """刷新表配置（重新扫描数据库并重启服务）"""
         try:
-            success = martin_service.refresh_tables()
+            success = martin_reload_scheduler.reload_and_wait(reason="手动刷新Martin表配置")
             if success:
                 tables_count = len(martin_service.get_postgis_tables())
                 return {
@@ -242,7 +243,7 @@ class ReloadConfig(Resource):
                 except Exception as e:
                     logger.warning(f"信号发送失败，回退到重启服务: {e}")
                     # 回退到重启服务
-                    success = martin_service.refresh_tables()
+                    success = martin_reload_scheduler.reload_and_wait(reason="手动刷新Martin表配置")
                     if success:
                         tables_count = len(martin_service.get_postgis_tables())
                         return {
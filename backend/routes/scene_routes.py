@@ -306,18 +306,16 @@ def get_scene(scene_id):
         description: 场景不存在
     """
     try:
-        # 获取场景信息
-        scene = scene_service.get_scene_by_id(scene_id)
-        if not scene:
+        # 场景文档（场景信息和图层列表）优先从缓存获取，见 services/scene_document_cache.py
+        document = scene_service.get_scene_document(scene_id, current_app.json.dumps)
+        if document is None:
             return jsonify({'error': '场景不存在'}), 404
         
-        # 获取场景图层
-        layers = scene_service.get_layers_by_scene(scene_id)
-        
-        return jsonify({
-            'scene': scene,
-            'layers': layers
-        }), 200
+        response = current_app.response_class(document.body, mimetype='application/json')
+        response.set_etag(document.etag)
+        # 允许客户端缓存，每次打开时用 If-None-Match 校验，未修改时返回304
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     
     except Exception as e:
         current_app.logger.error(f"获取场景详情错误: {str(e)}")
@@ -733,6 +731,7 @@ def delete_layer(scene_id, layer_id):
         # 删除图层记录（直接从scene_layers表删除，不是从geoserver_layers删除）
         delete_sql = "DELETE FROM scene_layers WHERE scene_id = %s AND layer_id = %s"
         execute_query(delete_sql, (scene_id, layer_id))
+        scene_service.bump_scene_version(scene_id)
         
         current_app.logger.info(f"图层删除成功: scene_id={scene_id}, layer_id={layer_id}")
         
@@ -11,7 +11,10 @@ import logging
 from services.tif_martin_service import TifMartinService
 from services.file_service import FileService
 from auth.auth_service import require_auth, get_current_user
-import threading
+from services.job_queue import get_job_queue, job_progress_view
+from services.tif_zoom_planner import plan_tif_tiling
+from utils.tile_encoding import TILE_FORMATS
+from config import TIF_TILING_CONFIG
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +25,71 @@ tif_martin_bp = Blueprint('tif_martin', __name__)
 tif_martin_service = TifMartinService()
 file_service = FileService()
 
+def _parse_tiling_options(data):
+    """解析瓦片渲染参数（渲染进程数、每进程GDAL缓存、渲染流水线、透明掩膜、金字塔模式、断点续传、瓦片编码、缩放级别截断）
+    
+    Returns:
+        tuple: (参数字典, 错误信息)
+    """
+    workers = data.get('workers')
+    gdal_cachemax = data.get('gdal_cachemax')
+    pipeline = data.get('pipeline')
+    tolerance = data.get('tolerance')
+    nodata = data.get('nodata')
+    pyramid = data.get('pyramid')
+    resume = data.get('resume', False)
+    tile_format = data.get('tile_format')
+    quality = data.get('quality')
+    clamp_zoom = data.get('clamp_zoom')
+    max_workers = TIF_TILING_CONFIG.get('max_workers', 64)
+    
+    if workers is not None and (not isinstance(workers, int) or isinstance(workers, bool)
+                                or workers < 0 or workers > max_workers):
+        return None, f'workers必须是0-{max_workers}之间的整数（0表示使用CPU核数）'
+    
+    if gdal_cachemax is not None and (not isinstance(gdal_cachemax, int) or isinstance(gdal_cachemax, bool)
+                                      or gdal_cachemax < 16 or gdal_cachemax > 65536):
+        return None, 'gdal_cachemax必须是16-65536之间的整数（MB）'
+    
+    if pipeline is not None and pipeline not in ('memory', 'directory'):
+        return None, 'pipeline必须是 memory 或 directory'
+    
+    if tolerance is not None and (not isinstance(tolerance, (int, float)) or isinstance(tolerance, bool)
+                                  or tolerance < 0):
+        return None, 'tolerance必须是非负数'
+    
+    if nodata is not None and (not isinstance(nodata, (int, float)) or isinstance(nodata, bool)):
+        return None, 'nodata必须是数值'
+    
+    if pyramid is not None and not isinstance(pyramid, bool):
+        return None, 'pyramid必须是布尔值'
+    
+    if not isinstance(resume, bool):
+        return None, 'resume必须是布尔值'
+    
+    if tile_format is not None and tile_format not in TILE_FORMATS:
+        return None, f"tile_format必须是 {' / '.join(TILE_FORMATS)} 之一"
+    
+    if quality is not None and (not isinstance(quality, int) or isinstance(quality, bool)
+                                or quality < 1 or quality > 100):
+        return None, 'quality必须是1-100之间的整数'
+    
+    if clamp_zoom is not None and not isinstance(clamp_zoom, bool):
+        return None, 'clamp_zoom必须是布尔值'
+    
+    return {
+        'workers': workers,
+        'gdal_cachemax': gdal_cachemax,
+        'pipeline': pipeline,
+        'tolerance': tolerance,
+        'nodata': nodata,
+        'pyramid': pyramid,
+        'resume': resume,
+        'tile_format': tile_format,
+        'quality': quality,
+        'clamp_zoom': clamp_zoom
+    }, None
+
 @tif_martin_bp.route('/convert-and-publish/<string:file_id>', methods=['POST'])
 @require_auth
 def convert_tif_and_publish_martin(file_id):
@@ -77,6 +145,10 @@ def convert_tif_and_publish_martin(file_id):
         if not isinstance(min_zoom, int) or min_zoom < 0 or min_zoom >= max_zoom:
             return jsonify({'error': 'min_zoom必须是0到max_zoom-1之间的整数'}), 400
         
+        tiling_options, tiling_error = _parse_tiling_options(data)
+        if tiling_error:
+            return jsonify({'error': tiling_error}), 400
+        
         # 获取当前用户信息
         current_user = get_current_user()
         user_id = current_user.get('id', current_user.get('username', 'unknown'))
@@ -84,6 +156,7 @@ def convert_tif_and_publish_martin(file_id):
         print(f"开始转换TIF文件: {file_info['file_name']}")
         print(f"文件路径: {file_info['file_path']}")
         print(f"缩放级别: {min_zoom}-{max_zoom}")
+        print(f"渲染参数: {tiling_options}")
         print(f"用户ID: {user_id}")
         
         # 启动异步转换任务
@@ -94,7 +167,8 @@ def convert_tif_and_publish_martin(file_id):
                 original_filename=file_info['file_name'],
                 user_id=user_id,
                 max_zoom=max_zoom,
-                min_zoom=min_zoom
+                min_zoom=min_zoom,
+                **tiling_options
             )
         
         # 先同步启动以获取task_id
@@ -104,7 +178,8 @@ def convert_tif_and_publish_martin(file_id):
             original_filename=file_info['file_name'],
             user_id=user_id,
             max_zoom=max_zoom,
-            min_zoom=min_zoom
+            min_zoom=min_zoom,
+            **tiling_options
         )
         
         if result['success']:
@@ -181,53 +256,33 @@ def convert_tif_async(file_id):
         if not isinstance(min_zoom, int) or min_zoom < 0 or min_zoom >= max_zoom:
             return jsonify({'error': 'min_zoom必须是0到max_zoom-1之间的整数'}), 400
         
+        tiling_options, tiling_error = _parse_tiling_options(data)
+        if tiling_error:
+            return jsonify({'error': tiling_error}), 400
+        
         # 获取当前用户信息
         current_user = get_current_user()
         user_id = current_user.get('id', current_user.get('username', 'unknown'))
         
-        # 生成task_id并初始化进度
-        import uuid
-        task_id = str(uuid.uuid4())
-        tif_martin_service.progress_data[task_id] = {
-            'status': 'queued',
-            'progress': 0,
-            'message': '任务已排队...',
-            'current_step': 'queued'
-        }
-        
-        # 启动异步转换任务
-        def async_convert():
-            try:
-                # 在异步任务中，使用传递的task_id来跟踪进度
-                result = tif_martin_service.tif_to_mbtiles_and_publish(
-                    file_id=str(file_id_int),
-                    file_path=file_info['file_path'],
-                    original_filename=file_info['file_name'],
-                    user_id=user_id,
-                    max_zoom=max_zoom,
-                    min_zoom=min_zoom,
-                    task_id=task_id  # 传递task_id
-                )
-                
-                # 更新最终结果到进度数据中
-                if task_id in tif_martin_service.progress_data:
-                    tif_martin_service.progress_data[task_id]['result'] = result
-                    
-            except Exception as e:
-                print(f"❌ 异步处理失败: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                if task_id in tif_martin_service.progress_data:
-                    tif_martin_service.progress_data[task_id].update({
-                        'status': 'error',
-                        'message': f'异步处理失败: {str(e)}',
-                        'current_step': 'error'
-                    })
-        
-        # 启动后台线程
-        thread = threading.Thread(target=async_convert)
-        thread.daemon = True
-        thread.start()
+        priority = data.get('priority', 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            return jsonify({'error': 'priority必须是整数'}), 400
+        
+        # 提交到持久化任务队列，task_id 即任务ID
+        job = get_job_queue().submit(
+            'tif_convert',
+            payload={
+                'file_id': str(file_id_int),
+                'file_path': file_info['file_path'],
+                'original_filename': file_info['file_name'],
+                'max_zoom': max_zoom,
+                'min_zoom': min_zoom,
+                **tiling_options
+            },
+            priority=priority,
+            user_id=user_id
+        )
+        task_id = job['id']
         
         print(f"✅ 异步转换任务已启动，task_id: {task_id}")
         
@@ -235,6 +290,7 @@ def convert_tif_async(file_id):
             'success': True,
             'message': '异步转换任务已启动',
             'task_id': task_id,
+            'job_status': job['status'],
             'file_info': {
                 'id': str(file_id_int),
                 'name': file_info['file_name'],
@@ -242,7 +298,8 @@ def convert_tif_async(file_id):
             },
             'conversion_params': {
                 'min_zoom': min_zoom,
-                'max_zoom': max_zoom
+                'max_zoom': max_zoom,
+                **tiling_options
             }
         }), 200
         
@@ -250,12 +307,86 @@ def convert_tif_async(file_id):
         logger.error(f"异步TIF转换启动失败: {str(e)}")
         return jsonify({'error': f'启动异步任务失败: {str(e)}'}), 500
 
+@tif_martin_bp.route('/dry-run/<string:file_id>', methods=['POST'])
+@require_auth
+def dry_run_tif_conversion(file_id):
+    """估算TIF转换的缩放级别、瓦片数、输出大小和耗时，不执行转换"""
+    try:
+        # 转换文件ID
+        try:
+            if isinstance(file_id, str) and file_id.isdigit():
+                file_id_int = int(file_id)
+            else:
+                file_id_int = file_id
+        except (ValueError, TypeError):
+            return jsonify({'error': '无效的文件ID格式'}), 400
+        
+        file_info = file_service.get_file_by_id(file_id_int)
+        if not file_info:
+            return jsonify({'error': '文件不存在'}), 404
+        
+        file_type = file_info.get('file_type', '').lower()
+        if file_type not in ['tif', 'tiff', 'dem.tif', 'dom.tif']:
+            return jsonify({'error': '只支持TIF/TIFF文件'}), 400
+        
+        data = request.get_json() or {}
+        max_zoom = data.get('max_zoom', 18)
+        min_zoom = data.get('min_zoom', 2)
+        sample_tiles = data.get('sample_tiles')
+        
+        if not isinstance(max_zoom, int) or max_zoom < 1 or max_zoom > 25:
+            return jsonify({'error': 'max_zoom必须是1-25之间的整数'}), 400
+        
+        if not isinstance(min_zoom, int) or min_zoom < 0 or min_zoom >= max_zoom:
+            return jsonify({'error': 'min_zoom必须是0到max_zoom-1之间的整数'}), 400
+        
+        if sample_tiles is not None and (not isinstance(sample_tiles, int) or isinstance(sample_tiles, bool)
+                                         or sample_tiles < 0 or sample_tiles > 256):
+            return jsonify({'error': 'sample_tiles必须是0-256之间的整数'}), 400
+        
+        tiling_options, tiling_error = _parse_tiling_options(data)
+        if tiling_error:
+            return jsonify({'error': tiling_error}), 400
+        
+        plan = plan_tif_tiling(
+            file_info['file_path'],
+            min_zoom,
+            max_zoom,
+            tile_format=tiling_options['tile_format'],
+            quality=tiling_options['quality'],
+            workers=tiling_options['workers'],
+            pyramid=tiling_options['pyramid'],
+            tolerance=tiling_options['tolerance'],
+            nodata=tiling_options['nodata'],
+            clamp=tiling_options['clamp_zoom'],
+            sample_tiles=sample_tiles
+        )
+        
+        return jsonify({
+            'success': True,
+            'file_info': {
+                'id': str(file_id_int),
+                'name': file_info['file_name'],
+                'type': file_info['file_type']
+            },
+            'plan': plan.to_dict()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"TIF转换估算失败: {str(e)}")
+        return jsonify({'error': f'估算失败: {str(e)}'}), 500
+
 @tif_martin_bp.route('/progress/<string:task_id>', methods=['GET'])
 @require_auth
 def get_conversion_progress(task_id):
     """获取转换任务的实时进度"""
     try:
         progress = tif_martin_service.get_progress(task_id)
+        if progress.get('status') == 'not_found':
+            # 异步任务的进度保存在任务队列中
+            job = get_job_queue().get_job(task_id)
+            if job:
+                progress = job_progress_view(job)
         
         return jsonify({
             'success': True,
@@ -308,6 +439,18 @@ def batch_convert_tif_files():
         if not isinstance(min_zoom, int) or min_zoom < 0 or min_zoom >= max_zoom:
             return jsonify({'error': 'min_zoom必须是0到max_zoom-1之间的整数'}), 400
         
+        tiling_options, tiling_error = _parse_tiling_options(data)
+        if tiling_error:
+            return jsonify({'error': tiling_error}), 400
+        
+        # async=true 时每个文件提交为一个后台任务，立即返回task_id
+        async_mode = data.get('async', False)
+        priority = data.get('priority', 0)
+        if not isinstance(async_mode, bool):
+            return jsonify({'error': 'async必须是布尔值'}), 400
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            return jsonify({'error': 'priority必须是整数'}), 400
+        
         # 获取当前用户信息
         current_user = get_current_user()
         user_id = current_user.get('id', current_user.get('username', 'unknown'))
@@ -347,6 +490,29 @@ def batch_convert_tif_files():
                 
                 print(f"处理文件: {file_info['file_name']}")
                 
+                if async_mode:
+                    job = get_job_queue().submit(
+                        'tif_convert',
+                        payload={
+                            'file_id': str(file_id_int),
+                            'file_path': file_info['file_path'],
+                            'original_filename': file_info['file_name'],
+                            'max_zoom': max_zoom,
+                            'min_zoom': min_zoom,
+                            **tiling_options
+                        },
+                        priority=priority,
+                        user_id=user_id
+                    )
+                    batch_results.append({
+                        'file_id': str(file_id_int),
+                        'file_name': file_info['file_name'],
+                        'success': True,
+                        'task_id': job['id'],
+                        'job_status': job['status']
+                    })
+                    continue
+                
                 # 执行转换
                 result = tif_martin_service.tif_to_mbtiles_and_publish(
                     file_id=str(file_id_int),
@@ -354,7 +520,8 @@ def batch_convert_tif_files():
                     original_filename=file_info['file_name'],
                     user_id=user_id,
                     max_zoom=max_zoom,
-                    min_zoom=min_zoom
+                    min_zoom=min_zoom,
+                    **tiling_options
                 )
                 
                 if result['success']:
@@ -399,7 +566,9 @@ def batch_convert_tif_files():
                 'success_count': success_count,
                 'error_count': error_count,
                 'min_zoom': min_zoom,
-                'max_zoom': max_zoom
+                'max_zoom': max_zoom,
+                'async': async_mode,
+                **tiling_options
             },
             'results': batch_results
         }), 200
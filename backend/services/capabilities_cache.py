@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GeoServer GetCapabilities 文档缓存
+
+GetCapabilities 文档包含所有图层，图层多时有数MB，GeoServer 生成一次需要数秒。
+同一进程内所有使用方（/geoserver 代理、图层能力接口、发布后的图层校验）共享缓存：
+- 每种请求（服务、版本、format、sections 等全部查询参数）缓存一份原始文档，
+  CAPABILITIES_CACHE_CONFIG['ttl_seconds'] 秒后过期；只有客户端附加的防缓存参数
+  （如 jQuery 的 _=时间戳）不参与缓存键，也不转发给GeoServer
+- 首次按图层查询时把文档解析为 {图层名: 图层信息} 索引，之后按名称直接查找
+- 同一文档同时只有一个请求访问GeoServer，其他并发请求等待该请求的结果（single-flight）
+- 本进程发布、删除图层时调用 invalidate() 立即失效；其他进程的缓存在TTL后过期
+"""
+
+import threading
+import time
+from urllib.parse import urlencode
+from xml.etree import ElementTree as ET
+
+import requests
+
+from config import CAPABILITIES_CACHE_CONFIG, GEOSERVER_CONFIG
+
+
+# 客户端附加的防缓存参数（小写），不影响文档内容，不进入缓存键也不转发；其余参数全部参与
+CAPABILITIES_IGNORED_PARAMS = ('_', '_dc')
+
+
+class CapabilitiesTimeout(requests.Timeout):
+    """等待其他请求获取文档超时（requests.Timeout 的子类，代理按请求异常处理）"""
+    pass
+
+
+def capabilities_key(path, params):
+    """缓存键：服务路径 + 规范化（参数名小写、排序，去掉防缓存参数）后的查询参数"""
+    normalized = sorted((key.lower(), value) for key, value in params
+                        if key.lower() not in CAPABILITIES_IGNORED_PARAMS)
+    return path.strip('/'), urlencode(normalized)
+
+
+def is_capabilities_request(params):
+    """查询参数是否为 GetCapabilities 请求"""
+    return any(key.lower() == 'request' and value.lower() == 'getcapabilities' for key, value in params)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child(element, name):
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child
+    return None
+
+
+def _child_text(element, name):
+    child = _child(element, name)
+    return child.text.strip() if child is not None and child.text else None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _layer_bbox(element):
+    """图层的经纬度范围（兼容 WMS 1.3.0 / 1.1.1 和 WFS 2.0.0）"""
+    geographic = _child(element, 'EX_GeographicBoundingBox')
+    if geographic is not None:
+        values = [_float(_child_text(geographic, name)) for name in
+                  ('westBoundLongitude', 'southBoundLatitude', 'eastBoundLongitude', 'northBoundLatitude')]
+    else:
+        lat_lon = _child(element, 'LatLonBoundingBox')
+        wgs84 = _child(element, 'WGS84BoundingBox')
+        if lat_lon is not None:
+            values = [_float(lat_lon.get(name)) for name in ('minx', 'miny', 'maxx', 'maxy')]
+        elif wgs84 is not None:
+            lower = (_child_text(wgs84, 'LowerCorner') or '').split()
+            upper = (_child_text(wgs84, 'UpperCorner') or '').split()
+            values = [_float(value) for value in lower + upper] if len(lower) == 2 and len(upper) == 2 else []
+        else:
+            values = []
+
+    if len(values) != 4 or any(value is None for value in values):
+        return None
+    return dict(zip(('minx', 'miny', 'maxx', 'maxy'), values))
+
+
+def parse_capabilities_layers(content):
+    """把 GetCapabilities 文档解析为 {图层名: 图层信息}"""
+    layers = {}
+    root = ET.fromstring(content)
+    for element in root.iter():
+        kind = _local_name(element.tag)
+        if kind not in ('Layer', 'FeatureType'):
+            continue
+        name = _child_text(element, 'Name')
+        if not name:
+            continue
+        layers[name] = {
+            'name': name,
+            'title': _child_text(element, 'Title'),
+            'abstract': _child_text(element, 'Abstract'),
+            'bbox': _layer_bbox(element),
+            'queryable': element.get('queryable') == '1' if kind == 'Layer' else True,
+        }
+    return layers
+
+
+class CapabilitiesDocument:
+    """一份已获取的 GetCapabilities 响应"""
+
+    def __init__(self, content, status_code, content_type):
+        self.content = content
+        self.status_code = status_code
+        self.content_type = content_type
+        self.fetched_at = time.time()
+        self._layers = None
+
+    @property
+    def ok(self):
+        return self.status_code == 200
+
+    @property
+    def layers(self):
+        """图层索引（首次访问时解析）"""
+        if self._layers is None:
+            try:
+                self._layers = parse_capabilities_layers(self.content) if self.ok else {}
+            except ET.ParseError as e:
+                print(f"⚠️ 解析GetCapabilities文档失败: {str(e)}")
+                self._layers = {}
+        return self._layers
+
+
+class _Flight:
+    """一次进行中的获取，并发请求等待其结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.document = None
+        self.error = None
+
+
+class CapabilitiesCache:
+    """进程内共享的 GetCapabilities 缓存"""
+
+    def __init__(self, ttl=None, fetch_timeout=None, max_documents=None):
+        self.ttl = CAPABILITIES_CACHE_CONFIG['ttl_seconds'] if ttl is None else ttl
+        self.fetch_timeout = CAPABILITIES_CACHE_CONFIG['fetch_timeout'] if fetch_timeout is None else fetch_timeout
+        self.max_documents = CAPABILITIES_CACHE_CONFIG['max_documents'] if max_documents is None else max_documents
+        self._documents = {}
+        self._flights = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _fetch(self, path, query):
+        url = f"{GEOSERVER_CONFIG['url']}/{path}?{query}"
+        response = requests.get(url, timeout=self.fetch_timeout, allow_redirects=False)
+        return CapabilitiesDocument(response.content, response.status_code,
+                                    response.headers.get('Content-Type', 'text/xml'))
+
+    def get_document(self, path, params):
+        """获取 GetCapabilities 文档
+
+        Args:
+            path: GeoServer 下的服务路径，如 'wms'、'shpservice/wfs'
+            params: 查询参数 [(名称, 值), ...]
+
+        Returns:
+            CapabilitiesDocument（GeoServer 返回错误时 ok 为False，错误响应不缓存）
+        """
+        key = capabilities_key(path, params)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None and time.time() - document.fetched_at < self.ttl:
+                return document
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                generation = self._generation
+
+        if not leader:
+            # 等待进行中的请求，不再单独访问GeoServer
+            if not flight.event.wait(self.fetch_timeout + 5):
+                raise CapabilitiesTimeout("等待GetCapabilities文档超时")
+            if flight.error is not None:
+                raise flight.error
+            return flight.document
+
+        try:
+            document = self._fetch(*key)
+            flight.document = document
+            with self._lock:
+                # 获取期间发生过失效（发布/删除图层）时不缓存可能过期的结果
+                if document.ok and generation == self._generation:
+                    self._documents[key] = document
+                    if len(self._documents) > self.max_documents:
+                        oldest = min(self._documents, key=lambda k: self._documents[k].fetched_at)
+                        del self._documents[oldest]
+            return document
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def get_layer(self, layer_name, service='WMS', version=None):
+        """按图层名查找图层信息（'工作空间:图层名'），不存在时返回None"""
+        service = service.upper()
+        if version is None:
+            version = '1.3.0' if service == 'WMS' else '2.0.0'
+        params = [('service', service), ('version', version), ('request', 'GetCapabilities')]
+        document = self.get_document(service.lower(), params)
+        if not document.ok:
+            return None
+        return document.layers.get(layer_name)
+
+    def invalidate(self):
+        """清空缓存（发布、删除图层后调用）"""
+        with self._lock:
+            self._documents.clear()
+            self._generation += 1
+
+
+capabilities_cache = CapabilitiesCache()
+
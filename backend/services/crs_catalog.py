@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+坐标系目录缓存
+
+spatial_ref_sys 只在首次使用（或手动刷新）时整表加载到进程内，建立词元倒排索引：
+- 词元为 srtext、proj4text、srid、auth_srid 小写后的连续字母数字（\\w+）片段
+- 关键词只含字母数字时，"关键词出现在原文中" 等价于 "关键词出现在某个词元中"，
+  先在去重后的词表中查找包含关键词的词元，再合并其倒排列表，结果与原来的
+  LOWER(...) LIKE '%关键词%' 完全一致，但不再每次按键都扫描整张表
+- 含其他字符的关键词退回到对候选项原文做子串匹配（仍在内存中）
+
+排序与原SQL一致：srid 等于第一个关键词 > auth_srid 等于第一个关键词 >
+srtext 包含第一个关键词 > 其他，同级按 srid 升序。
+
+version 为整表内容的摘要，proj4 接口据此生成 ETag。
+刷新时在局部变量中建好全部索引后一次性替换，并发的查询要么用旧目录、要么用新目录。
+其他进程的修改通过定期核对表的指纹（行数、最大srid、定义文本总长度）发现，
+间隔见 CRS_CATALOG_CONFIG['revalidate_seconds']，指纹变化时重新加载。
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import defaultdict
+
+from config import CRS_CATALOG_CONFIG
+from models.db import execute_query
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+_NAME_PATTERN = re.compile(r'(?:PROJCS|GEOGCS)\["([^"]+)"')
+
+
+def extract_coordinate_system_name(srtext):
+    """从srtext中提取坐标系名称"""
+    if not srtext:
+        return None
+    match = _NAME_PATTERN.search(srtext)
+    if not match:
+        return None
+    # 清理名称，移除括号内容
+    return re.sub(r'\s*\(.*?\)\s*$', '', match.group(1))
+
+
+class _CatalogState:
+    """一次加载得到的目录内容，加载完成后整体替换，读取方不会看到新旧混合的索引"""
+
+    def __init__(self, entries=(), by_auth_srid=None, postings=None, version=None, loaded_at=None,
+                 fingerprint=None):
+        self.entries = entries
+        self.by_auth_srid = by_auth_srid or {}
+        self.postings = postings or {}
+        self.vocabulary = sorted(self.postings)
+        self.version = version
+        self.loaded_at = loaded_at
+        self.fingerprint = fingerprint
+        self.checked_at = loaded_at
+        # 关键词匹配结果缓存，随状态一起替换
+        self.match_cache = {}
+
+
+class CoordinateSystemCatalog:
+    """spatial_ref_sys 的内存目录和倒排索引"""
+
+    def __init__(self, revalidate_seconds=None):
+        self.revalidate_seconds = (CRS_CATALOG_CONFIG['revalidate_seconds']
+                                   if revalidate_seconds is None else revalidate_seconds)
+        self._lock = threading.Lock()
+        self._state = _CatalogState()
+
+    @property
+    def loaded(self):
+        return self._state.version is not None
+
+    @property
+    def version(self):
+        return self._state.version
+
+    @property
+    def loaded_at(self):
+        return self._state.loaded_at
+
+    def __len__(self):
+        return len(self._state.entries)
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self._load()
+        elif time.time() - self._state.checked_at >= self.revalidate_seconds:
+            self._revalidate()
+        return self
+
+    @staticmethod
+    def _fingerprint():
+        result = execute_query("""
+            SELECT COUNT(*) AS total, MAX(srid) AS max_srid,
+                   COALESCE(SUM(LENGTH(srtext)), 0) + COALESCE(SUM(LENGTH(proj4text)), 0) AS text_length
+            FROM spatial_ref_sys
+        """)
+        row = result[0]
+        return int(row['total']), row['max_srid'], int(row['text_length'])
+
+    def _revalidate(self):
+        """核对表指纹，其他进程新增或修改坐标系后重新加载；只由一个线程核对，其余线程继续用当前目录"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            state = self._state
+            if time.time() - state.checked_at < self.revalidate_seconds:
+                return
+            try:
+                fingerprint = self._fingerprint()
+            except Exception as e:
+                print(f"⚠️ 核对坐标系目录失败，继续使用已加载的目录: {str(e)}")
+                state.checked_at = time.time()
+                return
+            if fingerprint == state.fingerprint:
+                state.checked_at = time.time()
+                return
+            print("♻️ spatial_ref_sys 已变化，重新加载坐标系目录")
+            self._load()
+        finally:
+            self._lock.release()
+
+    def refresh(self):
+        """重新加载 spatial_ref_sys（新增自定义坐标系后调用）"""
+        with self._lock:
+            self._load()
+        return self
+
+    def _load(self):
+        started = time.time()
+        rows = execute_query("""
+            SELECT srid, auth_name, auth_srid, srtext, proj4text
+            FROM spatial_ref_sys
+            ORDER BY srid
+        """)
+
+        entries = []
+        by_auth_srid = {}
+        postings = defaultdict(set)
+        digest = hashlib.sha1()
+        text_length = 0
+        for row in rows:
+            srtext = row['srtext'] or ''
+            proj4text = row['proj4text'] or ''
+            entry = {
+                'srid': row['srid'],
+                'auth_name': row['auth_name'],
+                'auth_srid': row['auth_srid'],
+                'srtext': row['srtext'],
+                'proj4text': row['proj4text'],
+                'name': extract_coordinate_system_name(srtext),
+                'srtext_lower': srtext.lower(),
+                'search_text': ' '.join([srtext.lower(), proj4text.lower(), str(row['srid']),
+                                         str(row['auth_srid'])]),
+            }
+            index = len(entries)
+            entries.append(entry)
+            for token in set(_TOKEN_PATTERN.findall(entry['search_text'])):
+                postings[token].add(index)
+
+            # 同一 auth_srid 优先 EPSG 定义，其次 srid 最小的
+            auth_srid = row['auth_srid']
+            current = by_auth_srid.get(auth_srid)
+            if current is None or (entries[current]['auth_name'] != 'EPSG' and row['auth_name'] == 'EPSG'):
+                by_auth_srid[auth_srid] = index
+
+            text_length += len(srtext) + len(proj4text)
+            digest.update(f"{row['srid']}|{row['auth_name']}|{row['auth_srid']}|{proj4text}|{srtext}\n".encode('utf-8'))
+
+        state = _CatalogState(
+            entries=tuple(entries),
+            by_auth_srid=by_auth_srid,
+            postings={token: frozenset(indexes) for token, indexes in postings.items()},
+            version=digest.hexdigest()[:16],
+            loaded_at=time.time(),
+            fingerprint=(len(entries), entries[-1]['srid'] if entries else None, text_length),
+        )
+        self._state = state
+        print(f"✅ 坐标系目录已加载: {len(state.entries)} 个坐标系，{len(state.vocabulary)} 个词元，"
+              f"耗时 {time.time() - started:.2f} 秒")
+
+    @staticmethod
+    def _match_keyword(state, keyword, candidates=None):
+        """包含关键词的条目序号集合"""
+        if _TOKEN_PATTERN.fullmatch(keyword):
+            matched = state.match_cache.get(keyword)
+            if matched is None:
+                matched = set()
+                for token in state.vocabulary:
+                    if keyword in token:
+                        matched |= state.postings[token]
+                matched = frozenset(matched)
+                if len(state.match_cache) > 1024:
+                    state.match_cache.clear()
+                state.match_cache[keyword] = matched
+            return matched if candidates is None else matched & candidates
+
+        # 含空白以外的分隔符（如 "+proj=tmerc"），对候选项原文做子串匹配
+        pool = range(len(state.entries)) if candidates is None else candidates
+        return {index for index in pool if keyword in state.entries[index]['search_text']}
+
+    def search(self, keywords, limit=20):
+        """多关键词搜索（每个关键词都要匹配），返回排序后的条目"""
+        state = self.ensure_loaded()._state
+        keywords = [keyword.lower() for keyword in keywords if keyword]
+        if not keywords:
+            return []
+
+        # 先处理可走索引的关键词，缩小候选集
+        ordered = sorted(keywords, key=lambda keyword: 0 if _TOKEN_PATTERN.fullmatch(keyword) else 1)
+        candidates = None
+        for keyword in ordered:
+            candidates = self._match_keyword(state, keyword, candidates)
+            if not candidates:
+                return []
+
+        first = keywords[0]
+
+        def rank(index):
+            entry = state.entries[index]
+            if str(entry['srid']) == first:
+                level = 1
+            elif str(entry['auth_srid']) == first:
+                level = 2
+            elif first in entry['srtext_lower']:
+                level = 3
+            else:
+                level = 4
+            return level, entry['srid']
+
+        return [state.entries[index] for index in sorted(candidates, key=rank)[:limit]]
+
+    def get(self, auth_srid):
+        """按 auth_srid（EPSG代码）查找，不存在时返回None"""
+        state = self.ensure_loaded()._state
+        index = state.by_auth_srid.get(auth_srid)
+        return state.entries[index] if index is not None else None
+
+
+_catalog = CoordinateSystemCatalog()
+
+
+def get_crs_catalog():
+    """获取已加载的坐标系目录（首次调用时加载）"""
+    return _catalog.ensure_loaded()
+
+
+def refresh_crs_catalog():
+    """重新加载坐标系目录（未加载过时只加载一次）"""
+    return _catalog.refresh()
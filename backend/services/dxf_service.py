@@ -15,8 +15,10 @@ from werkzeug.utils import secure_filename
 
 from config import FILE_STORAGE, DB_CONFIG
 from models.db import execute_query, insert_with_snowflake_id
+from services.layer_extent_service import refresh_layer_extent
 from services.dxf_processor import DXFProcessor
 from services.martin_service import MartinService
+from services.martin_reload_scheduler import martin_reload_scheduler
 from services.geoserver_service import GeoServerService
 
 logger = logging.getLogger(__name__)
@@ -255,12 +257,12 @@ class DXFService:
                     "message": "Martin服务未启用"
                 }
             
-            # 刷新Martin配置
-            success = self.martin_service.refresh_tables()
+            # 请求重启Martin（与同一时间窗口内的其他发布合并为一次），等待新数据源可用
+            source_id = f"public.{table_name}"
+            success = martin_reload_scheduler.reload_and_wait(source_id, reason=f"发布DXF {table_name}")
             
             if success:
                 # 生成MVT服务URL
-                source_id = f"public.{table_name}"
                 mvt_url = self.martin_service.get_mvt_url(source_id)
                 tilejson_url = f"{self.martin_service.base_url}/{source_id}"
                 
@@ -307,6 +309,7 @@ class DXFService:
             }
             
             service_id = insert_with_snowflake_id('vector_martin_services', params)
+            refresh_layer_extent('martin', service_id)
             
             logger.info(f"✅ Martin服务记录成功，ID: {service_id}")
             
@@ -397,7 +400,7 @@ class DXFService:
             
             # 刷新Martin服务
             try:
-                self.martin_service.refresh_tables()
+                martin_reload_scheduler.request_reload(reason="取消发布DXF服务")
             except Exception as e:
                 logger.warning(f"刷新Martin服务失败: {e}")
             
@@ -11,6 +11,7 @@ import json
 from osgeo import ogr, gdal
 from sqlalchemy import create_engine, text
 from config import DB_CONFIG
+from models.db import get_connection
 import logging
 import uuid
 import psycopg2
@@ -530,13 +531,7 @@ class EnhancedDXFProcessor:
             logger.info(f"已加载 {len(layer_colors)} 个图层的颜色信息")
             
             # 连接到PostgreSQL数据库
-            conn = psycopg2.connect(
-                host=DB_CONFIG['host'],
-                port=DB_CONFIG['port'],
-                dbname=DB_CONFIG['database'],
-                user=DB_CONFIG['user'],
-                password=DB_CONFIG['password']
-            )
+            conn = get_connection()
             conn.autocommit = False  # 使用事务
             cursor = conn.cursor()
             
@@ -757,14 +752,8 @@ class EnhancedDXFProcessor:
                         except:
                             # 如果回滚失败，重新连接
                             cursor.close()
-                            conn.close()
-                            conn = psycopg2.connect(
-                                host=DB_CONFIG['host'],
-                                port=DB_CONFIG['port'],
-                                dbname=DB_CONFIG['database'],
-                                user=DB_CONFIG['user'],
-                                password=DB_CONFIG['password']
-                            )
+                            conn.discard()
+                            conn = get_connection()
                             conn.autocommit = False
                             cursor = conn.cursor()
                             logger.info("已重新连接数据库")
@@ -9,6 +9,14 @@ from werkzeug.utils import secure_filename
 from config import FILE_STORAGE
 from models.db import execute_query, insert_with_snowflake_id
 from utils.snowflake import get_snowflake_id
+from utils.file_hash import save_stream_with_hash, hash_file, FileTooLargeError
+from utils.pagination import encode_cursor, decode_cursor, keyset_condition, file_sort_expression, rounded_rank
+from utils.ttl_cache import TTLCache
+from utils.text_search import TextSearch, FILE_SEARCH_COLUMNS, named_binder
+from config import FILE_LIST_CONFIG
+
+# 文件列表总数缓存（各进程独立，过期时间内可能与实际数量略有偏差）
+file_count_cache = TTLCache(ttl=FILE_LIST_CONFIG.get('count_cache_seconds', 60))
 
 class FileService:
     """文件服务类，用于处理文件上传、存储和元数据管理"""
@@ -17,6 +25,9 @@ class FileService:
         self.upload_folder = FILE_STORAGE['upload_folder']
         self.allowed_extensions = FILE_STORAGE['allowed_extensions']
         self.max_file_size = FILE_STORAGE['max_content_length']
+        self.deduplicate = FILE_STORAGE.get('deduplicate_uploads', True)
+        # 上传暂存目录（与上传目录在同一文件系统，保存时重命名即可）
+        self.incoming_folder = os.path.join(self.upload_folder, '.incoming')
         
         # 延迟初始化GeoServer服务，避免启动时的连接问题
         self.geoserver = None
@@ -66,30 +77,34 @@ class FileService:
         # 提取扩展名
         extension = original_filename.rsplit('.', 1)[1].lower()
         
-        # 生成安全的文件名（使用UUID避免中文问题）
-        unique_filename = f"{uuid.uuid4().hex}.{extension}"
         # 构建文件路径
         if original_filename.lower().endswith('.mbtiles'):
-            # 确保mbtiles子目录存在
-            mbtiles_folder = os.path.join(self.upload_folder, 'mbtiles')
-            if not os.path.exists(mbtiles_folder):
-                os.makedirs(mbtiles_folder)
-            file_path = os.path.join(mbtiles_folder, unique_filename)
+            target_folder = os.path.join(self.upload_folder, 'mbtiles')
         else:
-            file_path = os.path.join(self.upload_folder, unique_filename)
-        # 构建文件路径
-        #file_path = os.path.join(self.upload_folder, unique_filename)
-        
-        # 保存文件
-        file.save(file_path)
+            target_folder = self.upload_folder
         
-        # 获取文件大小
-        file_size = os.path.getsize(file_path)
-        
-        # 检查文件大小
-        if file_size > self.max_file_size:
-            os.remove(file_path)
-            raise ValueError(f"文件太大，最大允许: {self.max_file_size / 1024 / 1024}MB")
+        # 先写入同一文件系统下的暂存目录，边写边计算内容摘要
+        os.makedirs(self.incoming_folder, exist_ok=True)
+        incoming_path = os.path.join(self.incoming_folder, f"{uuid.uuid4().hex}.{extension}")
+        try:
+            if hasattr(file, 'stream'):
+                # 普通上传（werkzeug FileStorage）：流式写入并计算摘要，超过大小上限立即停止
+                file_size, content_hash = save_stream_with_hash(file.stream, incoming_path,
+                                                                max_size=self.max_file_size)
+            else:
+                # 分片上传：分片乱序并行写入，完成后的文件再顺序计算一次摘要
+                file.save(incoming_path)
+                file_size = os.path.getsize(incoming_path)
+                if file_size > self.max_file_size:
+                    raise FileTooLargeError(f"文件太大，最大允许: {self.max_file_size / 1024 / 1024}MB")
+                content_hash = hash_file(incoming_path)
+            
+            # 相同内容已存在时复用已保存的文件
+            file_path, deduplicated = self._store_blob(incoming_path, target_folder, extension,
+                                                       file_size, content_hash)
+        finally:
+            if os.path.exists(incoming_path):
+                os.remove(incoming_path)
         
         # 准备元数据（使用原始文件名作为original_name）
         file_data = {
@@ -104,17 +119,161 @@ class FileService:
             'coordinate_system': metadata.get('coordinate_system'),
             'tags': metadata.get('tags', ''),
             'description': metadata.get('description', ''),
-            'user_id': metadata.get('user_id')
+            'user_id': metadata.get('user_id'),
+            'content_hash': content_hash
         }
         
         # 使用雪花算法生成ID并插入数据库
-        file_id = insert_with_snowflake_id('files', file_data)
+        try:
+            file_id = insert_with_snowflake_id('files', file_data)
+        except Exception:
+            self._release_blob(content_hash, extension, file_path)
+            raise
+        
+        file_count_cache.clear()
+        
+        if deduplicated:
+            file_data['deduplicated'] = True
+            file_data['duplicate_of'] = self.find_files_by_content(content_hash, exclude_id=file_id)
         
         # 注释掉自动发布逻辑，改为手动发布
         # self._publish_to_geoserver(file_path, file_id, metadata)
         
         return file_id, file_data
     
+    def _link_blob(self, blob_path, target_folder, extension):
+        """为复用的内容创建本记录自己的文件路径（硬链接，不支持时复制）
+        
+        每条文件记录的路径互不相同：GeoServer存储等按文件路径命名的资源不会在记录之间共用，
+        删除其中一条记录的发布结果不影响其他记录
+        """
+        file_path = os.path.join(target_folder, f"{uuid.uuid4().hex}.{extension}")
+        os.makedirs(target_folder, exist_ok=True)
+        try:
+            os.link(blob_path, file_path)
+        except OSError as e:
+            print(f"⚠️ 创建硬链接失败，改为复制文件: {str(e)}")
+            shutil.copy2(blob_path, file_path)
+        return file_path
+    
+    def _store_blob(self, incoming_path, target_folder, extension, file_size, content_hash):
+        """把暂存文件登记为内容存储，相同内容已存在时只增加引用计数并链接到已有文件
+        
+        Returns:
+            tuple: (本记录的文件路径, 是否复用了已有文件)
+        """
+        if not self.deduplicate:
+            file_path = os.path.join(target_folder, f"{uuid.uuid4().hex}.{extension}")
+            os.makedirs(target_folder, exist_ok=True)
+            os.replace(incoming_path, file_path)
+            return file_path, False
+        
+        existing = execute_query(
+            "SELECT file_path FROM file_blobs WHERE content_hash = %s AND extension = %s",
+            (content_hash, extension)
+        )
+        if existing and os.path.exists(existing[0]['file_path']):
+            # 增加引用；返回空说明记录刚被删除，按新文件保存
+            result = execute_query("""
+                UPDATE file_blobs SET ref_count = ref_count + 1
+                WHERE content_hash = %s AND extension = %s
+                RETURNING file_path
+            """, (content_hash, extension))
+            if result and os.path.exists(result[0]['file_path']):
+                print(f"♻️ 内容已存在，复用文件: {result[0]['file_path']}")
+                try:
+                    return self._link_blob(result[0]['file_path'], target_folder, extension), True
+                except Exception:
+                    self._release_blob(content_hash, extension, result[0]['file_path'])
+                    raise
+            if result:
+                self._release_blob(content_hash, extension, result[0]['file_path'])
+        
+        # 生成安全的文件名（使用UUID避免中文问题）
+        file_path = os.path.join(target_folder, f"{uuid.uuid4().hex}.{extension}")
+        os.makedirs(target_folder, exist_ok=True)
+        os.replace(incoming_path, file_path)
+        
+        # 并发上传同一内容时以先登记的文件为准；已登记的文件丢失时改为本次的文件
+        result = execute_query("""
+            INSERT INTO file_blobs (content_hash, extension, file_path, file_size, ref_count)
+            VALUES (%s, %s, %s, %s, 1)
+            ON CONFLICT (content_hash, extension)
+            DO UPDATE SET ref_count = file_blobs.ref_count + 1
+            RETURNING file_path
+        """, (content_hash, extension, file_path, file_size))
+        blob_path = result[0]['file_path']
+        if blob_path == file_path:
+            return file_path, False
+        if os.path.exists(blob_path):
+            # 并发上传的文件已先登记：保留本次写入的文件作为本记录的路径，引用计数已增加
+            print(f"♻️ 内容已存在，复用内容存储: {blob_path}")
+            return file_path, True
+        execute_query(
+            "UPDATE file_blobs SET file_path = %s WHERE content_hash = %s AND extension = %s",
+            (file_path, content_hash, extension), fetch=False
+        )
+        return file_path, False
+    
+    def _release_blob(self, content_hash, extension, file_path):
+        """释放一条记录对内容的引用
+        
+        记录自己的链接文件直接删除；内容存储登记的文件在其他记录仍引用时保留
+        （之后的相同内容上传从它创建链接），最后一个引用释放后删除
+        
+        Returns:
+            bool: 是否删除了本记录的物理文件
+        """
+        updated = execute_query("""
+            UPDATE file_blobs SET ref_count = ref_count - 1
+            WHERE content_hash = %s AND extension = %s
+            RETURNING ref_count, file_path
+        """, (content_hash, extension))
+        if not updated:
+            # 未登记到内容存储的文件（关闭去重时保存）直接删除
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                return True
+            return False
+        
+        blob_path = updated[0]['file_path']
+        removed = False
+        if file_path != blob_path and os.path.exists(file_path):
+            os.remove(file_path)
+            removed = True
+        
+        # 条件删除是原子的：并发上传刚增加的引用会使这里不匹配
+        deleted = execute_query("""
+            DELETE FROM file_blobs
+            WHERE content_hash = %s AND extension = %s AND ref_count <= 0
+            RETURNING file_path
+        """, (content_hash, extension))
+        if not deleted:
+            if file_path == blob_path:
+                print(f"♻️ 文件仍被其他记录引用，保留: {file_path}")
+            return removed
+        
+        # 由该内容派生的产物（复用的MBTiles等）一并删除记录
+        execute_query("DELETE FROM file_blob_artifacts WHERE content_hash = %s", (content_hash,), fetch=False)
+        if os.path.exists(blob_path):
+            os.remove(blob_path)
+        return removed or file_path == blob_path
+    
+    def find_files_by_content(self, content_hash, exclude_id=None):
+        """查找内容相同的其他文件记录（及其已发布的服务），供复用已导入的数据"""
+        sql = """
+        SELECT f.id, f.file_name, f.file_type, f.status, f.upload_date,
+               v.table_name, v.service_url AS vector_service_url
+        FROM files f
+        LEFT JOIN vector_martin_services v ON v.file_id = CAST(f.id AS VARCHAR) AND v.status = 'active'
+        WHERE f.content_hash = %s AND (%s IS NULL OR f.id <> %s)
+        ORDER BY f.upload_date
+        """
+        files = execute_query(sql, (content_hash, exclude_id, exclude_id))
+        for item in files:
+            item['id'] = str(item['id'])  # 雪花ID超出JS安全整数范围
+        return files
+    
     def _publish_to_geoserver(self, file_path, file_id, metadata):
         """根据文件类型发布到GeoServer"""
         geoserver = self._get_geoserver()
@@ -178,89 +337,141 @@ class FileService:
             except Exception as e:
                 print(f"更新数据库GeoServer信息失败: {str(e)}")
     
-    def get_files(self, filters=None, page=1, page_size=12, sort_by='upload_date', sort_order='desc'):
-        """获取文件列表"""
-        # 构建基础查询
-        base_sql = """
-        SELECT f.*, u.username as uploader 
-        FROM files f 
-        LEFT JOIN users u ON f.user_id = u.id
-        WHERE 1=1
-        """
-        count_sql = "SELECT COUNT(*) FROM files f WHERE 1=1"
+    def get_files(self, filters=None, page=1, page_size=12, sort_by='upload_date', sort_order='desc',
+                  cursor=None, include_total=True):
+        """获取文件列表
+        
+        Args:
+            filters: 过滤条件，search 为关键词搜索（sort_by 可用 relevance 按相关度排序）
+            cursor: 上一页返回的游标；提供时按键集分页（忽略 page），翻页深度不影响查询耗时
+            include_total: 是否返回总数（总数来自缓存的计数，见 count_files）
         
+        Returns:
+            tuple: (文件列表, 总数或None, 下一页游标或None)
+        """
+        # 构建基础查询
+        where_sql = " WHERE 1=1"
         params = {}
         
         # 添加过滤条件
         if filters:
             if 'user_id' in filters and filters['user_id']:
-                base_sql += " AND f.user_id = %(user_id)s"
-                count_sql += " AND f.user_id = %(user_id)s"
+                where_sql += " AND f.user_id = %(user_id)s"
                 params['user_id'] = filters['user_id']
             
             if 'discipline' in filters and filters['discipline']:
-                base_sql += " AND f.discipline = %(discipline)s"
-                count_sql += " AND f.discipline = %(discipline)s"
+                where_sql += " AND f.discipline = %(discipline)s"
                 params['discipline'] = filters['discipline']
             
             if 'file_type' in filters and filters['file_type']:
-                base_sql += " AND f.file_type = %(file_type)s"
-                count_sql += " AND f.file_type = %(file_type)s"
+                where_sql += " AND f.file_type = %(file_type)s"
                 params['file_type'] = filters['file_type']
             
             if 'dimension' in filters and filters['dimension']:
-                base_sql += " AND f.dimension = %(dimension)s"
-                count_sql += " AND f.dimension = %(dimension)s"
+                where_sql += " AND f.dimension = %(dimension)s"
                 params['dimension'] = filters['dimension']
             
             if 'status' in filters and filters['status']:
-                base_sql += " AND f.status = %(status)s"
-                count_sql += " AND f.status = %(status)s"
+                where_sql += " AND f.status = %(status)s"
                 params['status'] = filters['status']
             
             if 'geometry_type' in filters and filters['geometry_type']:
-                base_sql += " AND f.geometry_type = %(geometry_type)s"
-                count_sql += " AND f.geometry_type = %(geometry_type)s"
+                where_sql += " AND f.geometry_type = %(geometry_type)s"
                 params['geometry_type'] = filters['geometry_type']
             
             if 'tags' in filters and filters['tags']:
-                base_sql += " AND f.tags LIKE %(tags)s"
-                count_sql += " AND f.tags LIKE %(tags)s"
+                where_sql += " AND f.tags LIKE %(tags)s"
                 params['tags'] = f"%{filters['tags']}%"
             
             if 'file_name' in filters and filters['file_name']:
-                base_sql += " AND f.file_name LIKE %(file_name)s"
-                count_sql += " AND f.file_name LIKE %(file_name)s"
+                where_sql += " AND f.file_name LIKE %(file_name)s"
                 params['file_name'] = f"%{filters['file_name']}%"
             
             if 'is_public' in filters and filters['is_public'] is not None:
-                base_sql += " AND f.is_public = %(is_public)s"
-                count_sql += " AND f.is_public = %(is_public)s"
+                where_sql += " AND f.is_public = %(is_public)s"
                 params['is_public'] = filters['is_public']
         
-        # 获取总数
-        count_result = execute_query(count_sql, params)
-        total = count_result[0]['count'] if count_result else 0
+        # 关键词搜索（文件名、标签、描述，走 pg_trgm 表达式索引）
+        text_search = TextSearch(FILE_SEARCH_COLUMNS, (filters or {}).get('search'), alias='f', primary='file_name')
+        if text_search:
+            where_sql += " AND " + text_search.condition(named_binder(params))
         
-        # 添加排序
+        # 获取总数（缓存）
+        total = self.count_files(where_sql, params) if include_total else None
+        
+        # 添加排序（id 作为第二排序键，保证顺序稳定）
         valid_sort_fields = ['id', 'file_name', 'file_size', 'upload_date', 'discipline', 'file_type']
+        if text_search:
+            valid_sort_fields.append('relevance')
         if sort_by not in valid_sort_fields:
             sort_by = 'upload_date'
         
         if sort_order.lower() not in ['asc', 'desc']:
             sort_order = 'desc'
+        sort_order = sort_order.lower()
         
-        base_sql += f" ORDER BY f.{sort_by} {sort_order.upper()}"
+        # relevance 按搜索相关度（固定精度）排序；其他字段使用与索引一致的排序表达式，
+        # 排序值作为单独的列返回，游标取该列，保证与键集条件中的表达式完全一致
+        if sort_by == 'relevance':
+            sort_expression = rounded_rank(text_search.rank(named_binder(params)))
+            sort_key = 'search_rank'
+        elif sort_by == 'id':
+            sort_expression = "f.id"
+            sort_key = 'id'
+        else:
+            sort_expression = file_sort_expression(sort_by, alias='f')
+            sort_key = 'sort_value'
         
-        # 添加分页
-        base_sql += " LIMIT %(limit)s OFFSET %(offset)s"
-        params['limit'] = page_size
-        params['offset'] = (page - 1) * page_size
+        page_sql = where_sql
+        if cursor:
+            sort_value, last_id = decode_cursor(cursor, sort_by, sort_order)
+            page_sql += " AND " + keyset_condition(sort_expression, "f.id", sort_order,
+                                                   ('%(cursor_value)s', '%(cursor_id)s'))
+            params['cursor_value'] = sort_value
+            params['cursor_id'] = last_id
+        
+        base_sql = f"""
+        SELECT f.*, u.username as uploader{f", {sort_expression} as {sort_key}" if sort_key != 'id' else ''}
+        FROM files f 
+        LEFT JOIN users u ON f.user_id = u.id
+        {page_sql}
+        ORDER BY {sort_expression} {sort_order.upper()}, f.id {sort_order.upper()}
+        LIMIT %(limit)s
+        """
+        # 多取一行判断是否还有下一页
+        params['limit'] = page_size + 1
+        if not cursor:
+            base_sql += " OFFSET %(offset)s"
+            params['offset'] = (page - 1) * page_size
         
         # 执行查询
         files = execute_query(base_sql, params)
         
-        return files, total
+        next_cursor = None
+        if len(files) > page_size:
+            files = files[:page_size]
+            last = files[-1]
+            next_cursor = encode_cursor(last[sort_key], last['id'], sort_by, sort_order)
+        if sort_key == 'sort_value':
+            for file in files:
+                file.pop('sort_value', None)
+        
+        return files, total, next_cursor
+    
+    def count_files(self, where_sql, params):
+        """文件数（缓存 FILE_LIST_CONFIG['count_cache_seconds'] 秒）
+        
+        只统计 files 表，不关联服务表；文件保存和删除时本进程的缓存立即失效。
+        """
+        sql = f"SELECT COUNT(*) FROM files f {where_sql}"
+        key = (where_sql, tuple(sorted((k, str(v)) for k, v in params.items()))
+               if isinstance(params, dict) else tuple(str(v) for v in params))
+        
+        def load():
+            result = execute_query(sql, params)
+            return result[0]['count'] if result else 0
+        
+        return file_count_cache.get_or_load(key, load)
     
     def get_file_by_id(self, file_id):
         """根据ID获取文件"""
@@ -340,9 +551,13 @@ class FileService:
             print(f"从GeoServer删除服务失败: {str(e)}")
             errors.append(f"从GeoServer删除服务失败: {str(e)}")
         
-        # 从文件系统删除
+        # 从文件系统删除（内容去重的文件只在最后一个引用删除时删除）
         try:
-            if os.path.exists(file_info['file_path']):
+            if file_info.get('content_hash'):
+                extension = file_info['file_path'].rsplit('.', 1)[-1].lower()
+                if self._release_blob(file_info['content_hash'], extension, file_info['file_path']):
+                    print(f"已删除物理文件: {file_info['file_path']}")
+            elif os.path.exists(file_info['file_path']):
                 os.remove(file_info['file_path'])
                 print(f"已删除物理文件: {file_info['file_path']}")
             else:
@@ -357,6 +572,7 @@ class FileService:
             sql = "DELETE FROM files WHERE id = %(file_id)s"
             params = {'file_id': file_id}
             execute_query(sql, params)
+            file_count_cache.clear()
             print(f"已删除文件数据库记录: {file_id}")
         except Exception as e:
             print(f"从数据库删除文件记录失败: {str(e)}")
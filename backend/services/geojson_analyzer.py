@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GeoJSON 分析引擎
+
+在一次流式遍历中同时得到要素数量、几何类型集合、属性字段类型、坐标系和边界框，
+供 GeoJsonDirectService、GeoJsonMartinService 和 PostGISService 共用。
+坐标按块收集为 NumPy 数组后向量化求边界框，属性类型根据全部要素推断。
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.geojson_stream import iter_features
+
+# 默认坐标系
+DEFAULT_SRID = 4326
+DEFAULT_CRS = 'EPSG:4326'
+
+# 每累计多少个坐标点做一次向量化边界框归约
+COORDINATE_FLUSH_SIZE = 200000
+
+# PostgreSQL integer 取值范围
+_INT32_MIN = -2147483648
+_INT32_MAX = 2147483647
+
+
+@dataclass
+class GeoJSONAnalysis:
+    """GeoJSON分析结果"""
+    feature_count: int = 0
+    geometry_types: List[str] = field(default_factory=list)
+    properties: Dict[str, str] = field(default_factory=dict)  # 字段名 -> PostgreSQL类型
+    bbox: Optional[List[float]] = None  # [min_x, min_y, max_x, max_y]
+    srid: int = DEFAULT_SRID
+    crs: str = DEFAULT_CRS
+
+    @property
+    def geometry_type(self):
+        """单一几何类型；混合或未检测到时返回通用类型 Geometry"""
+        if len(self.geometry_types) == 1:
+            return self.geometry_types[0]
+        return 'Geometry'
+
+    @property
+    def is_mixed(self):
+        return len(self.geometry_types) > 1
+
+    @property
+    def property_names(self):
+        return list(self.properties.keys())
+
+    def to_feature_info(self):
+        """转换为PostGIS导入使用的 feature_info 字典"""
+        return {
+            'geometry_type': self.geometry_type,
+            'geometry_types': list(self.geometry_types),
+            'properties': dict(self.properties),
+            'feature_count': self.feature_count,
+            'srid': self.srid,
+            'crs': self.crs,
+            'bbox': self.bbox,
+        }
+
+    def to_dict(self):
+        return {
+            'feature_count': self.feature_count,
+            'geometry_types': list(self.geometry_types),
+            'geometry_type': self.geometry_type,
+            'properties': dict(self.properties),
+            'bbox': self.bbox,
+            'srid': self.srid,
+            'crs': self.crs,
+        }
+
+
+def extract_crs(geojson):
+    """从GeoJSON顶层 crs 成员中解析坐标系
+
+    Returns:
+        tuple: (srid, crs_string)
+    """
+    crs_info = geojson.get('crs') if geojson is not None else None
+    if not crs_info:
+        return DEFAULT_SRID, DEFAULT_CRS
+    if not isinstance(crs_info, dict):
+        print(f"⚠️ CRS信息格式不正确: {crs_info}")
+        return DEFAULT_SRID, DEFAULT_CRS
+
+    properties = crs_info.get('properties') or {}
+    code = None
+    if crs_info.get('type') == 'name':
+        # {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::4547"}} 或 "EPSG:4547"
+        name = properties.get('name', '')
+        if 'EPSG::' in name:
+            code = name.split('EPSG::')[-1]
+        elif 'EPSG:' in name:
+            code = name.split('EPSG:')[-1]
+        else:
+            print(f"⚠️ 不支持的CRS格式: {name}")
+            return DEFAULT_SRID, DEFAULT_CRS
+    elif crs_info.get('type') == 'EPSG':
+        # {"type": "EPSG", "properties": {"code": 4547}}
+        code = properties.get('code')
+    else:
+        print(f"⚠️ 不支持的CRS类型: {crs_info.get('type')}")
+        return DEFAULT_SRID, DEFAULT_CRS
+
+    try:
+        srid = int(code)
+    except (TypeError, ValueError):
+        print(f"⚠️ 解析EPSG代码失败: {code}")
+        return DEFAULT_SRID, DEFAULT_CRS
+    return srid, f'EPSG:{srid}'
+
+
+def _infer_value_kind(value):
+    """属性值的类别: bool / int / bigint / float / text"""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int' if _INT32_MIN <= value <= _INT32_MAX else 'bigint'
+    if isinstance(value, float):
+        return 'float'
+    return 'text'
+
+
+def _resolve_column_type(kinds):
+    """根据一个字段出现过的所有值类别确定列类型"""
+    if not kinds:
+        return 'text'
+    if kinds == {'bool'}:
+        return 'boolean'
+    if 'text' in kinds or 'bool' in kinds:
+        return 'text'
+    if 'float' in kinds:
+        return 'double precision'
+    if 'bigint' in kinds:
+        return 'bigint'
+    return 'integer'
+
+
+class _BBoxAccumulator:
+    """按块收集坐标并用NumPy向量化计算边界框"""
+
+    def __init__(self, flush_size=COORDINATE_FLUSH_SIZE):
+        self.flush_size = flush_size
+        self._positions = []
+        self._bounds = None
+
+    def add_geometry(self, geometry):
+        geom_type = geometry.get('type')
+        if geom_type == 'GeometryCollection':
+            for member in geometry.get('geometries') or []:
+                if member:
+                    self.add_geometry(member)
+            return
+
+        coordinates = geometry.get('coordinates')
+        if not coordinates:
+            return
+        # list.extend 在C层完成，不为每个坐标创建新的元组
+        if geom_type == 'Point':
+            self._positions.append(coordinates)
+        elif geom_type in ('LineString', 'MultiPoint'):
+            self._positions.extend(coordinates)
+        elif geom_type in ('Polygon', 'MultiLineString'):
+            for part in coordinates:
+                self._positions.extend(part)
+        elif geom_type == 'MultiPolygon':
+            for polygon in coordinates:
+                for ring in polygon:
+                    self._positions.extend(ring)
+
+        if len(self._positions) >= self.flush_size:
+            self.flush()
+
+    def _to_array(self):
+        try:
+            array = np.asarray(self._positions, dtype=float)
+            if array.ndim == 2 and array.shape[1] >= 2:
+                return array[:, :2]
+        except (ValueError, TypeError):
+            pass
+        # 坐标维度不一致（2D/3D混合）或包含非法值时逐点处理
+        cleaned = []
+        for position in self._positions:
+            try:
+                cleaned.append((float(position[0]), float(position[1])))
+            except (TypeError, ValueError, IndexError):
+                continue
+        return np.asarray(cleaned, dtype=float).reshape(-1, 2)
+
+    def flush(self):
+        if not self._positions:
+            return
+        array = self._to_array()
+        self._positions = []
+        array = array[np.isfinite(array).all(axis=1)]
+        if array.size == 0:
+            return
+        mins = array.min(axis=0)
+        maxs = array.max(axis=0)
+        if self._bounds is None:
+            self._bounds = [mins[0], mins[1], maxs[0], maxs[1]]
+        else:
+            self._bounds = [
+                min(self._bounds[0], mins[0]), min(self._bounds[1], mins[1]),
+                max(self._bounds[2], maxs[0]), max(self._bounds[3], maxs[1]),
+            ]
+
+    def result(self):
+        self.flush()
+        if self._bounds is None:
+            return None
+        return [float(v) for v in self._bounds]
+
+
+def analyze_geojson(geojson):
+    """单次遍历分析GeoJSON
+
+    Args:
+        geojson: 已解析的GeoJSON字典或 utils.geojson_stream.GeoJSONDocument
+
+    Returns:
+        GeoJSONAnalysis
+    """
+    analysis = GeoJSONAnalysis()
+    geometry_types = set()
+    property_kinds = {}
+    bbox = _BBoxAccumulator()
+
+    for feature in iter_features(geojson):
+        analysis.feature_count += 1
+
+        geometry = feature.get('geometry') if isinstance(feature, dict) else None
+        if geometry and geometry.get('type'):
+            geometry_types.add(geometry['type'])
+            try:
+                bbox.add_geometry(geometry)
+            except (TypeError, AttributeError):
+                pass
+
+        properties = feature.get('properties') if isinstance(feature, dict) else None
+        if properties:
+            for key, value in properties.items():
+                kinds = property_kinds.setdefault(key, set())
+                if value is not None:
+                    kinds.add(_infer_value_kind(value))
+
+    # crs 可能位于features之后，遍历完成后再读取
+    analysis.srid, analysis.crs = extract_crs(geojson)
+    analysis.geometry_types = sorted(geometry_types)
+    analysis.properties = {
+        key: _resolve_column_type(kinds)
+        for key, kinds in property_kinds.items()
+        if kinds
+    }
+    analysis.bbox = bbox.result()
+    return analysis
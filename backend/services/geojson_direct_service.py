@@ -12,6 +12,8 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 from config import FILE_STORAGE
 from models.db import execute_query, insert_with_snowflake_id
+from utils.geojson_stream import open_geojson, save_upload_stream
+from services.geojson_analyzer import analyze_geojson
 
 class GeoJsonDirectService:
     """GeoJSON直接服务类，用于处理GeoJSON文件的上传和检索"""
@@ -42,31 +44,30 @@ class GeoJsonDirectService:
             if not original_filename.lower().endswith(('.geojson', '.json')):
                 raise ValueError("只支持.geojson或.json文件")
                 
-            # 读取文件内容并验证
-            file_content = file_obj.read()
-            geojson_data = json.loads(file_content)
-            
-            # 分析GeoJSON内容
-            analysis = self._analyze_geojson(geojson_data)
-            
             # 生成唯一文件ID
             file_id = str(uuid.uuid4())
             
-            # 保存文件
+            # 分块保存文件，不在内存中保留整个文件
             file_path = os.path.join(self.upload_folder, f"{file_id}.geojson")
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
+            file_size = save_upload_stream(file_obj, file_path)
+            
+            # 增量读取并分析GeoJSON内容
+            try:
+                analysis = self._analyze_geojson(open_geojson(file_path))
+            except Exception:
+                os.remove(file_path)
+                raise
             
             # 记录到数据库
             params = {
                 'file_id': file_id,
                 'original_filename': original_filename,
                 'file_path': file_path,
-                'file_size': len(file_content),
-                'feature_count': analysis['feature_count'],
-                'geometry_types': json.dumps(list(analysis['geometry_types'])),
-                'property_fields': json.dumps(analysis['properties']),
-                'bbox': json.dumps(analysis.get('bbox')),
+                'file_size': file_size,
+                'feature_count': analysis.feature_count,
+                'geometry_types': json.dumps(analysis.geometry_types),
+                'property_fields': json.dumps(analysis.property_names),
+                'bbox': json.dumps(analysis.bbox),
                 'status': 'active',
                 'user_id': file_info.get('user_id')
             }
@@ -78,9 +79,9 @@ class GeoJsonDirectService:
                 "success": True,
                 "file_id": file_id,
                 "original_filename": original_filename,
-                "file_size": len(file_content),
-                "feature_count": analysis['feature_count'],
-                "geometry_types": list(analysis['geometry_types']),
+                "file_size": file_size,
+                "feature_count": analysis.feature_count,
+                "geometry_types": analysis.geometry_types,
                 "access_url": f"{self.public_url_base}/{file_id}",
                 "upload_date": datetime.now().isoformat()
             }
@@ -250,111 +251,12 @@ class GeoJsonDirectService:
         """分析GeoJSON数据
         
         Args:
-            geojson_data: GeoJSON数据对象
-            
-        Returns:
-            分析结果
-        """
-        analysis = {
-            'feature_count': 0,
-            'geometry_types': set(),
-            'properties': []
-        }
-        
-        # 提取要素
-        features = []
-        if geojson_data.get('type') == 'FeatureCollection':
-            features = geojson_data.get('features', [])
-        elif geojson_data.get('type') == 'Feature':
-            features = [geojson_data]
-        
-        # 设置要素数量
-        analysis['feature_count'] = len(features)
-        
-        # 分析第一个要素的属性
-        if features:
-            first_feature = features[0]
-            if 'properties' in first_feature and isinstance(first_feature['properties'], dict):
-                analysis['properties'] = list(first_feature['properties'].keys())
-        
-        # 分析几何类型
-        for feature in features:
-            if 'geometry' in feature and feature['geometry'] and 'type' in feature['geometry']:
-                analysis['geometry_types'].add(feature['geometry']['type'])
-        
-        # 计算边界框
-        if features:
-            try:
-                min_x, min_y = float('inf'), float('inf')
-                max_x, max_y = float('-inf'), float('-inf')
-                
-                has_valid_coords = False
-                
-                for feature in features:
-                    if 'geometry' not in feature or not feature['geometry']:
-                        continue
-                    
-                    geometry = feature['geometry']
-                    coords = self._extract_coordinates(geometry)
-                    
-                    for x, y in coords:
-                        if isinstance(x, (int, float)) and isinstance(y, (int, float)):
-                            min_x = min(min_x, x)
-                            min_y = min(min_y, y)
-                            max_x = max(max_x, x)
-                            max_y = max(max_y, y)
-                            has_valid_coords = True
-                
-                if has_valid_coords:
-                    analysis['bbox'] = [min_x, min_y, max_x, max_y]
-            except Exception as e:
-                print(f"计算边界框失败: {str(e)}")
-        
-        return analysis
-    
-    def _extract_coordinates(self, geometry):
-        """从几何对象中提取所有坐标
-        
-        Args:
-            geometry: GeoJSON几何对象
+            geojson_data: GeoJSON数据对象或流式文档
             
         Returns:
-            坐标列表 [(x, y), ...]
+            GeoJSONAnalysis 分析结果
         """
-        coords = []
-        
-        if not geometry or 'type' not in geometry:
-            return coords
-        
-        geom_type = geometry['type']
-        
-        if geom_type == 'Point':
-            coords.append(tuple(geometry['coordinates'][:2]))
-        
-        elif geom_type == 'LineString':
-            coords.extend([tuple(p[:2]) for p in geometry['coordinates']])
-        
-        elif geom_type == 'Polygon':
-            for ring in geometry['coordinates']:
-                coords.extend([tuple(p[:2]) for p in ring])
-        
-        elif geom_type == 'MultiPoint':
-            coords.extend([tuple(p[:2]) for p in geometry['coordinates']])
-        
-        elif geom_type == 'MultiLineString':
-            for line in geometry['coordinates']:
-                coords.extend([tuple(p[:2]) for p in line])
-        
-        elif geom_type == 'MultiPolygon':
-            for polygon in geometry['coordinates']:
-                for ring in polygon:
-                    coords.extend([tuple(p[:2]) for p in ring])
-        
-        elif geom_type == 'GeometryCollection':
-            for geom in geometry.get('geometries', []):
-                coords.extend(self._extract_coordinates(geom))
-        
-        return coords
+        return analyze_geojson(geojson_data)
     
     def _generate_leaflet_config(self, geojson_url, analysis):
         """生成Leaflet地图配置
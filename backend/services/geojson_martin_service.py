@@ -17,6 +17,9 @@ from config import FILE_STORAGE, DB_CONFIG
 from models.db import execute_query, insert_with_snowflake_id
 from services.postgis_service import PostGISService
 from services.martin_service import MartinService
+from services.martin_reload_scheduler import martin_reload_scheduler
+from utils.geojson_stream import open_geojson, has_features, save_upload_stream
+from services.geojson_analyzer import analyze_geojson
 
 
 class GeoJsonMartinService:
@@ -59,30 +62,31 @@ class GeoJsonMartinService:
             if not original_filename.lower().endswith(('.geojson', '.json')):
                 raise ValueError("只支持.geojson或.json文件")
             
-            # 2. 读取和验证GeoJSON内容
-            file_content = file_obj.read()
-            geojson_data = json.loads(file_content)
-            
-            # 验证GeoJSON格式
-            self._validate_geojson(geojson_data)
-            
-            # 3. 生成唯一文件ID和表名
+            # 2. 生成唯一文件ID和表名
             file_id = str(uuid.uuid4())
             table_name = f"geojson_{file_id.replace('-', '_')}"
             
             print(f"文件ID: {file_id}")
             print(f"表名: {table_name}")
             
-            # 4. 保存GeoJSON文件到本地
-            file_path = self._save_geojson_file(file_content, file_id, original_filename)
+            # 3. 流式保存GeoJSON文件到本地（不在内存中保留整个文件）
+            file_path = self._save_geojson_file(file_obj, file_id, original_filename)
+            file_size = os.path.getsize(file_path)
             
-            # 5. 分析GeoJSON特性
-            analysis = self._analyze_geojson(geojson_data)
+            # 4. 增量读取并验证GeoJSON格式，5. 分析GeoJSON特性
+            # 验证或分析失败时删除刚保存的上传文件
+            try:
+                geojson_data = open_geojson(file_path)
+                self._validate_geojson(geojson_data)
+                analysis = self._analyze_geojson(geojson_data)
+            except Exception:
+                self._remove_saved_file(file_path)
+                raise
             print(f"GeoJSON分析结果: {analysis}")
             
             # 6. 使用PostGIS服务将数据存入数据库
             print("\n--- 将GeoJSON存入PostGIS ---")
-            postgis_result = self.postgis_service.store_geojson(file_path, file_id)
+            postgis_result = self.postgis_service.store_geojson(file_path, file_id, analysis=analysis)
             
             if not postgis_result.get('success'):
                 raise Exception("PostGIS数据存储失败")
@@ -109,10 +113,10 @@ class GeoJsonMartinService:
                 
                 # GeoJSON文件信息
                 "geojson_info": {
-                    "file_size": len(file_content),
-                    "feature_count": analysis['feature_count'],
-                    "geometry_types": analysis['geometry_types'],
-                    "bbox": analysis.get('bbox'),
+                    "file_size": file_size,
+                    "feature_count": analysis.feature_count,
+                    "geometry_types": analysis.geometry_types,
+                    "bbox": analysis.bbox,
                     "file_path": file_path
                 },
                 
@@ -398,8 +402,8 @@ class GeoJsonMartinService:
             
             # 4. 刷新Martin服务
             try:
-                self.martin_service.refresh_tables()
-                print("✅ Martin服务已刷新")
+                martin_reload_scheduler.request_reload(reason="取消发布GeoJSON服务")
+                print("✅ 已请求重启Martin服务（合并后在后台执行）")
             except Exception as e:
                 print(f"⚠️ 刷新Martin服务失败: {e}")
             
@@ -482,9 +486,8 @@ class GeoJsonMartinService:
             if not os.path.exists(file_path):
                 raise ValueError(f"文件不存在: {file_path}")
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                file_content = f.read()
-                geojson_data = json.loads(file_content)
+            file_size = os.path.getsize(file_path)
+            geojson_data = open_geojson(file_path)
             
             # 验证GeoJSON格式
             self._validate_geojson(geojson_data)
@@ -502,7 +505,7 @@ class GeoJsonMartinService:
             
             # 6. 使用PostGIS服务将数据存入数据库
             print("\n--- 将GeoJSON存入PostGIS ---")
-            postgis_result = self.postgis_service.store_geojson(file_path, service_file_id)
+            postgis_result = self.postgis_service.store_geojson(file_path, service_file_id, analysis=analysis)
             
             if not postgis_result.get('success'):
                 raise Exception("PostGIS数据存储失败")
@@ -530,10 +533,10 @@ class GeoJsonMartinService:
                 
                 # GeoJSON文件信息
                 "geojson_info": {
-                    "file_size": len(file_content),
-                    "feature_count": analysis['feature_count'],
-                    "geometry_types": analysis['geometry_types'],
-                    "bbox": analysis.get('bbox'),
+                    "file_size": file_size,
+                    "feature_count": analysis.feature_count,
+                    "geometry_types": analysis.geometry_types,
+                    "bbox": analysis.bbox,
                     "file_path": file_path
                 },
                 
@@ -562,85 +565,41 @@ class GeoJsonMartinService:
             
         except Exception as e:
             print(f"❌ 发布已存在文件到Martin服务失败: {str(e)}")
-            # 清理可能创建的资源
-            self._cleanup_failed_publish(locals())
+            # 清理可能创建的资源（源文件属于文件管理，不删除）
+            self._cleanup_failed_publish(locals(), remove_file=False)
             raise
     
     # === 私有方法 ===
     
     def _validate_geojson(self, geojson_data):
         """验证GeoJSON格式"""
-        if not isinstance(geojson_data, dict):
-            raise ValueError("无效的GeoJSON格式：必须是JSON对象")
+        try:
+            geojson_type = geojson_data.get('type')
+        except ValueError as e:
+            raise ValueError(f"无效的GeoJSON格式：必须是JSON对象 ({e})")
         
-        geojson_type = geojson_data.get('type')
         if geojson_type not in ['FeatureCollection', 'Feature', 'Point', 'LineString', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon', 'GeometryCollection']:
             raise ValueError(f"无效的GeoJSON类型: {geojson_type}")
         
-        # 检查是否有要素
+        # 检查是否有要素（只读取到第一个要素）
         if geojson_type == 'FeatureCollection':
-            features = geojson_data.get('features', [])
-            if not features:
+            if not has_features(geojson_data):
                 raise ValueError("FeatureCollection中没有要素")
         
         print("✅ GeoJSON格式验证通过")
     
-    def _save_geojson_file(self, file_content, file_id, original_filename):
-        """保存GeoJSON文件到本地"""
+    def _save_geojson_file(self, file_obj, file_id, original_filename):
+        """分块保存上传的GeoJSON文件到本地"""
         file_path = os.path.join(self.upload_folder, f"{file_id}.geojson")
         
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
+        save_upload_stream(file_obj, file_path)
         
         print(f"✅ 文件已保存: {file_path}")
         return file_path
     
     def _analyze_geojson(self, geojson_data):
-        """分析GeoJSON数据"""
-        analysis = {
-            "feature_count": 0,
-            "geometry_types": set(),
-            "properties": {},
-            "bbox": None
-        }
-        
-        # 处理FeatureCollection
-        if geojson_data.get('type') == 'FeatureCollection':
-            features = geojson_data.get('features', [])
-            analysis['feature_count'] = len(features)
-            
-            # 分析几何类型和属性
-            for feature in features:
-                if 'geometry' in feature and feature['geometry']:
-                    geom_type = feature['geometry'].get('type')
-                    if geom_type:
-                        analysis['geometry_types'].add(geom_type)
-                
-                # 分析属性（使用第一个有属性的要素）
-                if 'properties' in feature and feature['properties'] and not analysis['properties']:
-                    for key, value in feature['properties'].items():
-                        if value is not None:
-                            if isinstance(value, int):
-                                analysis['properties'][key] = 'integer'
-                            elif isinstance(value, float):
-                                analysis['properties'][key] = 'double precision'
-                            elif isinstance(value, bool):
-                                analysis['properties'][key] = 'boolean'
-                            else:
-                                analysis['properties'][key] = 'text'
-        
-        # 处理单个Feature
-        elif geojson_data.get('type') == 'Feature':
-            analysis['feature_count'] = 1
-            if 'geometry' in geojson_data and geojson_data['geometry']:
-                geom_type = geojson_data['geometry'].get('type')
-                if geom_type:
-                    analysis['geometry_types'].add(geom_type)
-        
-        # 转换set为list
-        analysis['geometry_types'] = sorted(list(analysis['geometry_types']))
-        
-        return analysis
+        """分析GeoJSON数据（单次流式遍历）"""
+        return analyze_geojson(geojson_data)
     
     def _record_to_database(self, file_id, original_filename, file_path, analysis, postgis_result, user_id):
         """记录服务信息到数据库"""
@@ -685,7 +644,7 @@ class GeoJsonMartinService:
                 'mvt_url': mvt_url,
                 'tilejson_url': tilejson_url,
                 'style': json.dumps(default_style),
-                'geojson_info': json.dumps(analysis),
+                'geojson_info': json.dumps(analysis.to_dict()),
                 'postgis_info': json.dumps(postgis_result),
                 'user_id': user_id
             }
@@ -712,12 +671,12 @@ class GeoJsonMartinService:
                     "message": "Martin服务未启用"
                 }
             
-            # 刷新Martin配置和服务
-            success = self.martin_service.refresh_tables()
+            # 请求重启Martin（与同一时间窗口内的其他发布合并为一次），等待新数据源可用
+            source_id = f"public.{table_name}"
+            success = martin_reload_scheduler.reload_and_wait(source_id, reason=f"发布GeoJSON {table_name}")
             
             if success:
                 # 获取MVT URL
-                source_id = f"public.{table_name}"
                 mvt_url = self.martin_service.get_mvt_url(source_id)
                 tilejson_url = f"{self.martin_service.base_url}/{source_id}"
                 
@@ -773,15 +732,22 @@ class GeoJsonMartinService:
             if conn:
                 conn.close()
     
-    def _cleanup_failed_publish(self, local_vars):
+    def _remove_saved_file(self, file_path):
+        """删除发布过程中保存的上传文件"""
+        if not file_path or not os.path.exists(file_path):
+            return
+        try:
+            os.remove(file_path)
+            print(f"🧹 已删除上传文件: {file_path}")
+        except OSError as e:
+            print(f"⚠️ 删除上传文件失败: {file_path}, {e}")
+    
+    def _cleanup_failed_publish(self, local_vars, remove_file=True):
         """清理发布失败时可能创建的资源"""
         try:
             # 清理文件
-            if 'file_path' in local_vars and local_vars['file_path']:
-                try:
-                    os.unlink(local_vars['file_path'])
-                except:
-                    pass
+            if remove_file:
+                self._remove_saved_file(local_vars.get('file_path'))
             
             # 清理PostGIS表
             if 'postgis_result' in local_vars and local_vars['postgis_result']:
@@ -1091,6 +1091,9 @@ class GeoServerService:
             execute_query(delete_layer_sql, (layer_id,), fetch=False)
             print(f"✅ 删除图层记录: layer_id={layer_id}")
             
+            from services.capabilities_cache import capabilities_cache
+            capabilities_cache.invalidate()
+            
             # 删除相关的要素类型或覆盖记录
             if layer_info.get('featuretype_id'):
                 delete_featuretype_sql = "DELETE FROM geoserver_featuretypes WHERE id = %s"
@@ -1275,16 +1278,19 @@ class GeoServerService:
                 print(f"⚠️ 图层信息查询失败，状态码: {response.status_code}")
                 print(f"响应内容: {response.text}")
             
-            # 方法2: 尝试通过WMS GetCapabilities验证
+            # 方法2: 尝试通过WMS GetCapabilities验证（使用共享的能力文档缓存）
             print(f"尝试方法2: WMS GetCapabilities验证")
-            wms_capabilities_url = f"{self.url}/wms?service=WMS&version=1.1.1&request=GetCapabilities"
+            from services.capabilities_cache import capabilities_cache
             
-            wms_response = requests.get(wms_capabilities_url, timeout=15)
-            print(f"WMS Capabilities响应状态码: {wms_response.status_code}")
+            # 刚发布的图层可能不在缓存的文档中，失效后重新获取一次
+            capabilities_cache.invalidate()
+            wms_document = capabilities_cache.get_document(
+                'wms', [('service', 'WMS'), ('version', '1.1.1'), ('request', 'GetCapabilities')])
+            print(f"WMS Capabilities响应状态码: {wms_document.status_code}")
             
-            if wms_response.status_code == 200:
-                capabilities_text = wms_response.text
-                if layer_name in capabilities_text:
+            if wms_document.ok:
+                capability_layers = wms_document.layers
+                if layer_name in capability_layers:
                     print(f"图层 {layer_name} 在WMS Capabilities中找到")
                     return True
                 else:
@@ -1292,26 +1298,22 @@ class GeoServerService:
                     
                     # 检查是否有类似的图层名
                     workspace = layer_name.split(':')[0] if ':' in layer_name else ''
-                    if workspace and workspace in capabilities_text:
+                    prefix = f"{workspace}:"
+                    matches = [name[len(prefix):] for name in capability_layers if workspace and name.startswith(prefix)]
+                    if matches:
                         print(f"工作空间 {workspace} 存在于WMS Capabilities中")
+                        print(f"工作空间中的图层: {matches}")
                         
-                        # 提取所有该工作空间的图层
-                        import re
-                        pattern = f'<Name>{workspace}:([^<]+)</Name>'
-                        matches = re.findall(pattern, capabilities_text)
-                        if matches:
-                            print(f"工作空间中的图层: {matches}")
-                            
-                            # 检查是否有匹配的图层
-                            target_layer = layer_name.split(':')[1] if ':' in layer_name else layer_name
-                            for match in matches:
-                                if target_layer in match or match in target_layer:
-                                    print(f"找到相似图层: {workspace}:{match}")
-                                    return True
+                        # 检查是否有匹配的图层
+                        target_layer = layer_name.split(':')[1] if ':' in layer_name else layer_name
+                        for match in matches:
+                            if target_layer in match or match in target_layer:
+                                print(f"找到相似图层: {workspace}:{match}")
+                                return True
                     else:
                         print(f"工作空间 {workspace} 不存在于WMS Capabilities中")
             else:
-                print(f"WMS Capabilities请求失败，状态码: {wms_response.status_code}")
+                print(f"WMS Capabilities请求失败，状态码: {wms_document.status_code}")
             
             # 方法3: 尝试直接WMS GetMap请求
             print(f"尝试方法3: WMS GetMap请求验证")
@@ -2031,28 +2033,31 @@ class GeoServerService:
         
         # 验证JSON格式和GeoJSON结构
         try:
-            with open(geojson_path, 'r', encoding='utf-8') as f:
-                geojson_data = json.load(f)
-                
-                # 检查GeoJSON基本结构
-                if not isinstance(geojson_data, dict):
-                    raise Exception("GeoJSON必须是一个对象")
-                
+            # 增量读取，避免一次性加载整个文件
+            from utils.geojson_stream import open_geojson, iter_features
+            try:
+                geojson_data = open_geojson(geojson_path)
                 geojson_type = geojson_data.get('type')
-                if geojson_type not in ['FeatureCollection', 'Feature', 'Point', 'LineString', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon', 'GeometryCollection']:
-                    raise Exception(f"无效的GeoJSON类型: {geojson_type}")
+            except ValueError:
+                raise Exception("GeoJSON必须是一个对象")
+            
+            if geojson_type not in ['FeatureCollection', 'Feature', 'Point', 'LineString', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon', 'GeometryCollection']:
+                raise Exception(f"无效的GeoJSON类型: {geojson_type}")
+            
+            print(f"GeoJSON类型: {geojson_type}")
+            
+            # 如果是FeatureCollection，检查要素数量（同时校验整个文件的JSON格式）
+            if geojson_type == 'FeatureCollection':
+                try:
+                    feature_count = sum(1 for _ in iter_features(geojson_data))
+                except ValueError as e:
+                    raise json.JSONDecodeError(str(e), '', 0)
+                print(f"要素数量: {feature_count}")
                 
-                print(f"GeoJSON类型: {geojson_type}")
+                if feature_count == 0:
+                    print("⚠️ GeoJSON中没有要素")
                 
-                # 如果是FeatureCollection，检查要素数量
-                if geojson_type == 'FeatureCollection':
-                    features = geojson_data.get('features', [])
-                    print(f"要素数量: {len(features)}")
-                    
-                    if len(features) == 0:
-                        print("⚠️ GeoJSON中没有要素")
-                    
-                print("GeoJSON格式验证通过")
+            print("GeoJSON格式验证通过")
                 
         except json.JSONDecodeError as e:
             raise Exception(f"GeoJSON文件JSON格式无效: {e}")
@@ -2334,6 +2339,14 @@ class GeoServerService:
             
             layer_id = insert_with_snowflake_id('geoserver_layers', layer_params)
             
+            # 发布时计算图层范围，边界接口直接读取
+            from services.layer_extent_service import refresh_layer_extent
+            refresh_layer_extent('geoserver', layer_id)
+            
+            # 新图层需要出现在GetCapabilities中
+            from services.capabilities_cache import capabilities_cache
+            capabilities_cache.invalidate()
+            
             # 构建完整的图层信息返回
             full_layer_name = f"{self.workspace}:{name}"
             layer_result = {
@@ -2361,6 +2374,9 @@ class GeoServerService:
         layer_sql = "DELETE FROM geoserver_layers WHERE name = %s"
         execute_query(layer_sql, (store_name,), fetch=False)
         
+        from services.capabilities_cache import capabilities_cache
+        capabilities_cache.invalidate()
+        
         # 删除要素类型记录
         featuretype_sql = "DELETE FROM geoserver_featuretypes WHERE name = %s"
         execute_query(featuretype_sql, (store_name,), fetch=False)
@@ -3797,6 +3813,9 @@ AbsolutePath=false
                 logger.info(f"创建图层记录: ID {result[0]['id']}")
                 logger.info(f"服务URL: WMS={wms_url}, WFS={wfs_url}, WCS={wcs_url}")
             
+            from services.capabilities_cache import capabilities_cache
+            capabilities_cache.invalidate()
+            
             # 更新文件状态 - 检查files表结构并适配更新
             try:
                 # 首先检查表结构，查询字段列表
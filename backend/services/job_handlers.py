@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+内置后台任务类型
+
+- tif_convert: TIF转MBTiles并发布Martin服务（CPU密集）
+- dxf_import: DXF导入PostGIS并发布Martin服务
+- geojson_import: GeoJSON导入PostGIS并发布Martin服务
+- shp_import: SHP导入PostGIS并发布Martin服务
+
+服务实例在首次执行任务时创建，避免应用启动时加载GDAL等重量级依赖。
+"""
+
+import threading
+
+from config import TIF_TILING_CONFIG
+from services.job_queue import PermanentJobError, RESOURCE_CPU, RESOURCE_IO
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def _get_service(name, factory):
+    if name not in _services:
+        with _services_lock:
+            if name not in _services:
+                _services[name] = factory()
+    return _services[name]
+
+
+def _get_file_info(file_id):
+    from services.file_service import FileService
+    file_info = _get_service('file', FileService).get_file_by_id(file_id)
+    if not file_info:
+        raise PermanentJobError(f"文件不存在: {file_id}")
+    return file_info
+
+
+def run_tif_convert(job):
+    """TIF转MBTiles任务，进度同步到任务记录；重试时从断点继续"""
+    from services.tif_martin_service import TifMartinService
+    service = _get_service('tif', TifMartinService)
+
+    params = dict(job.payload)
+    for key in ('file_id', 'file_path', 'original_filename'):
+        if not params.get(key):
+            raise PermanentJobError(f"缺少参数: {key}")
+    pipeline = params.get('pipeline') or TIF_TILING_CONFIG.get('pipeline', 'memory')
+    if job.attempt > 1 and pipeline == 'memory':
+        params['resume'] = True
+
+    task_id = job.id
+    service.progress_data[task_id] = {
+        'status': 'starting',
+        'progress': 0,
+        'message': '开始处理...',
+        'current_step': 'init',
+        'logs': []
+    }
+    service.progress_hooks[task_id] = job.report
+    try:
+        result = service.tif_to_mbtiles_and_publish(
+            user_id=job.user_id,
+            task_id=task_id,
+            **params
+        )
+    finally:
+        service.progress_hooks.pop(task_id, None)
+        service.cleanup_progress(task_id)
+
+    job.check_cancelled(force=True)
+    if not result.get('success'):
+        raise Exception(result.get('error') or 'TIF转换失败')
+    return result
+
+
+def run_dxf_import(job):
+    """DXF导入PostGIS并发布Martin服务"""
+    from services.dxf_service import DXFService
+    file_id = job.payload.get('file_id')
+    file_info = _get_file_info(file_id)
+    if (file_info.get('file_type') or '').lower() != 'dxf':
+        raise PermanentJobError(f"不是DXF文件: {file_id}")
+
+    job.update_progress(progress=10, message=f"📥 开始导入DXF: {file_info['file_name']}", current_step='import')
+    result = _get_service('dxf', DXFService).publish_dxf_martin_service(
+        file_id=str(file_id),
+        file_path=file_info['file_path'],
+        original_filename=file_info['file_name'],
+        coordinate_system=job.payload.get('coordinate_system', 'EPSG:4326'),
+        user_id=job.user_id
+    )
+    if not result.get('success'):
+        raise Exception(result.get('error') or 'DXF导入失败')
+    return result
+
+
+def _run_existing_file_publish(job, service_name, factory, label):
+    file_id = job.payload.get('file_id')
+    if not file_id:
+        raise PermanentJobError("缺少参数: file_id")
+    job.update_progress(progress=10, message=f"📥 开始导入{label}: {file_id}", current_step='import')
+    try:
+        return _get_service(service_name, factory).publish_existing_file(file_id, job.user_id)
+    except ValueError as e:
+        # 文件不存在、类型不符、无权限等，重试无意义
+        raise PermanentJobError(str(e))
+
+
+def run_geojson_import(job):
+    """GeoJSON导入PostGIS并发布Martin服务"""
+    from services.geojson_martin_service import GeoJsonMartinService
+    return _run_existing_file_publish(job, 'geojson', GeoJsonMartinService, 'GeoJSON')
+
+
+def run_shp_import(job):
+    """SHP导入PostGIS并发布Martin服务"""
+    from services.shp_martin_service import ShpMartinService
+    return _run_existing_file_publish(job, 'shp', ShpMartinService, 'SHP')
+
+
+def register_default_handlers(queue):
+    queue.register('tif_convert', run_tif_convert, resource_class=RESOURCE_CPU)
+    queue.register('dxf_import', run_dxf_import, resource_class=RESOURCE_IO)
+    queue.register('geojson_import', run_geojson_import, resource_class=RESOURCE_IO)
+    queue.register('shp_import', run_shp_import, resource_class=RESOURCE_IO)
@@ -0,0 +1,605 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+持久化后台任务队列
+
+任务保存在本地SQLite任务库中，替代进程内字典 + 临时线程的做法：
+- 进程重启后未完成的任务继续执行，多个应用进程共享同一个任务库
+- 按资源类别（cpu / io）分别限制并发，TIF切片不会挤占导入任务
+- 支持优先级、取消、失败重试（指数退避）
+- 运行中的任务定期写入心跳，所在进程退出后由其他进程在租约超时后重新排队
+
+任务处理函数通过 register() 按任务类型注册，签名为 handler(job: JobContext)，
+返回值（可JSON序列化）作为任务结果保存。
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from config import FILE_STORAGE, JOB_QUEUE_CONFIG
+
+# 任务状态
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED)
+
+# 资源类别
+RESOURCE_CPU = 'cpu'
+RESOURCE_IO = 'io'
+
+# 取消标记的检查间隔（秒），避免每次进度更新都查询任务库
+CANCEL_CHECK_INTERVAL = 1.0
+
+# 进度快照的写入间隔（秒）；快照包含最多100条日志，每个分区完成都写入会频繁锁住任务库
+PROGRESS_SAVE_INTERVAL = 1.0
+
+
+class JobCancelled(BaseException):
+    """任务已被取消，处理函数应停止执行
+
+    继承 BaseException 而不是 Exception：处理函数内部大量 except Exception 的容错代码
+    （转换失败返回错误结果、记录日志后继续等）不会吞掉取消，取消总能传到任务执行器
+    """
+    pass
+
+
+class PermanentJobError(Exception):
+    """不可重试的任务错误（参数错误、文件不存在等）"""
+    pass
+
+
+@dataclass
+class JobHandler:
+    """任务类型的处理函数及默认执行参数"""
+    func: Callable
+    resource_class: str = RESOURCE_IO
+    max_attempts: Optional[int] = None
+
+
+class JobContext:
+    """传给处理函数的任务上下文"""
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.id = job['id']
+        self.job_type = job['job_type']
+        self.payload = job['payload'] or {}
+        self.user_id = job['user_id']
+        self.attempt = job['attempts']
+        self.max_attempts = job['max_attempts']
+        self._attempt_token = (job['worker_id'], job['attempts'])
+        self._last_cancel_check = 0.0
+        self._cancelled = False
+        self._last_saved_at = 0.0
+        self._last_saved_step = None
+        self._pending_snapshot = None
+
+    def is_cancelled(self, force=False):
+        now = time.time()
+        if not self._cancelled and (force or now - self._last_cancel_check >= CANCEL_CHECK_INTERVAL):
+            self._last_cancel_check = now
+            self._cancelled = self.queue._cancel_requested(self.id)
+        return self._cancelled
+
+    def check_cancelled(self, force=False):
+        """任务已被取消时抛出 JobCancelled"""
+        if self.is_cancelled(force=force):
+            raise JobCancelled(f"任务已取消: {self.id}")
+
+    def update_progress(self, progress=None, message=None, current_step=None, **extra):
+        """更新任务进度，任务已被取消时抛出 JobCancelled"""
+        snapshot = dict(extra)
+        if progress is not None:
+            snapshot['progress'] = progress
+        if message is not None:
+            snapshot['message'] = message
+        if current_step is not None:
+            snapshot['current_step'] = current_step
+        self.report(snapshot)
+
+    def report(self, snapshot):
+        """保存完整的进度快照（字典），任务已被取消时抛出 JobCancelled
+
+        状态或步骤变化时立即写入，否则最多每 PROGRESS_SAVE_INTERVAL 秒写入一次，
+        期间的快照只保留最新一份，任务结束前由 flush_progress() 写入
+        """
+        now = time.time()
+        step = (snapshot.get('status'), snapshot.get('current_step'))
+        if step != self._last_saved_step or now - self._last_saved_at >= PROGRESS_SAVE_INTERVAL:
+            self._save(snapshot, now)
+        else:
+            self._pending_snapshot = snapshot
+        self.check_cancelled()
+
+    def flush_progress(self):
+        """写入尚未保存的最新进度快照"""
+        if self._pending_snapshot is not None:
+            self._save(self._pending_snapshot, time.time())
+
+    def _save(self, snapshot, now):
+        self.queue._save_progress(self, snapshot)
+        self._last_saved_at = now
+        self._last_saved_step = (snapshot.get('status'), snapshot.get('current_step'))
+        self._pending_snapshot = None
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    for key in ('payload', 'progress', 'result'):
+        if job.get(key):
+            job[key] = json.loads(job[key])
+    job['cancel_requested'] = bool(job.get('cancel_requested'))
+    return job
+
+
+class JobQueue:
+    """基于SQLite的持久化任务队列"""
+
+    def __init__(self, db_path=None, config=None):
+        self.config = dict(JOB_QUEUE_CONFIG, **(config or {}))
+        self.db_path = db_path or self.config.get('db_path') or os.path.join(
+            FILE_STORAGE['upload_folder'], 'jobs', 'jobs.db')
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        self.handlers = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.local()
+        self._threads = []
+        self._running_jobs = set()
+        self._running_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wakeup = {}
+        self._started = False
+
+        self._init_schema()
+
+    # ------------------------------------------------------------------
+    # 任务库
+    # ------------------------------------------------------------------
+
+    def _connect(self):
+        """每个线程一个连接；isolation_level=None 下显式控制事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                resource_class TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                payload TEXT,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 1,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                user_id TEXT,
+                worker_id TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                run_after REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            )
+        ''')
+        # 领取任务：按资源类别取优先级最高、最早可执行的排队任务
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS jobs_claim_index
+            ON jobs (status, resource_class, priority DESC, run_after, created_at)
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_user_index ON jobs (user_id, created_at)')
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f'{key} = ?' for key in fields)
+        self._connect().execute(f'UPDATE jobs SET {columns} WHERE id = ?', list(fields.values()) + [job_id])
+
+    def _update_owned(self, context, **fields):
+        """更新本次执行仍持有的任务
+
+        任务心跳超时后可能已被回收、重新排队并由其他进程（或本进程的下一次执行）领取，
+        只在 worker_id、执行次数与本次领取时一致且仍为运行中时更新，返回是否更新成功
+        """
+        worker_id, attempts = context._attempt_token
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f'{key} = ?' for key in fields)
+        cursor = self._connect().execute(
+            f'UPDATE jobs SET {columns} WHERE id = ? AND worker_id = ? AND attempts = ? AND status = ?',
+            list(fields.values()) + [context.id, worker_id, attempts, STATUS_RUNNING]
+        )
+        return cursor.rowcount > 0
+
+    # ------------------------------------------------------------------
+    # 任务管理
+    # ------------------------------------------------------------------
+
+    def register(self, job_type, func, resource_class=RESOURCE_IO, max_attempts=None):
+        """注册任务类型的处理函数"""
+        if resource_class not in self.config['concurrency']:
+            raise Exception(f"未知的资源类别: {resource_class}")
+        self.handlers[job_type] = JobHandler(func=func, resource_class=resource_class, max_attempts=max_attempts)
+
+    def submit(self, job_type, payload=None, priority=0, user_id=None, resource_class=None,
+               max_attempts=None, job_id=None):
+        """提交任务
+
+        Args:
+            job_type: 任务类型（需已注册处理函数）
+            payload: 任务参数（可JSON序列化）
+            priority: 优先级，数值大的先执行
+            resource_class: 资源类别，None 使用处理函数注册时的类别
+            max_attempts: 最大执行次数，None 使用处理函数或全局默认值
+
+        Returns:
+            dict: 任务记录
+        """
+        handler = self.handlers.get(job_type)
+        if handler is None:
+            raise Exception(f"未注册的任务类型: {job_type}")
+        resource_class = resource_class or handler.resource_class
+        if resource_class not in self.config['concurrency']:
+            raise Exception(f"未知的资源类别: {resource_class}")
+        max_attempts = max_attempts or handler.max_attempts or self.config.get('max_attempts', 3)
+
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        self._connect().execute('''
+            INSERT INTO jobs (id, job_type, resource_class, priority, status, payload, progress,
+                              max_attempts, user_id, created_at, updated_at, run_after)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (job_id, job_type, resource_class, int(priority), STATUS_QUEUED,
+              json.dumps(payload or {}, ensure_ascii=False),
+              json.dumps({'progress': 0, 'message': '任务已排队...', 'current_step': 'queued'}, ensure_ascii=False),
+              int(max_attempts), None if user_id is None else str(user_id), now, now, now))
+        print(f"📥 任务已入队: {job_type} {job_id} (资源类别: {resource_class}, 优先级: {priority})")
+        self._notify(resource_class)
+        return self.get_job(job_id)
+
+    def get_job(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return _row_to_job(row)
+
+    def list_jobs(self, status=None, job_type=None, user_id=None, limit=50, offset=0):
+        conditions = []
+        params = []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if job_type:
+            conditions.append('job_type = ?')
+            params.append(job_type)
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(str(user_id))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self._connect().execute(
+            f'SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?',
+            params + [int(limit), int(offset)]
+        ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def cancel(self, job_id):
+        """取消任务：排队中的任务直接取消，运行中的任务在下一次进度更新时停止
+
+        Returns:
+            dict: 任务记录，任务不存在时返回None
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ?, updated_at = ?
+                WHERE id = ? AND status = ?
+            ''', (STATUS_CANCELLED, now, now, job_id, STATUS_QUEUED))
+            conn.execute('''
+                UPDATE jobs SET cancel_requested = 1, updated_at = ?
+                WHERE id = ? AND status = ?
+            ''', (now, job_id, STATUS_RUNNING))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get_job(job_id)
+
+    def retry(self, job_id, payload_updates=None):
+        """重新执行失败或已取消的任务
+
+        Args:
+            payload_updates: 合并到任务参数中的字段（如 {'resume': True}），执行次数重置后
+                处理函数无法再从 attempt 判断是否为重试，需要显式传入
+        """
+        job = self.get_job(job_id)
+        if job is None:
+            return None
+        if job['status'] not in (STATUS_FAILED, STATUS_CANCELLED):
+            raise Exception(f"只能重试失败或已取消的任务，当前状态: {job['status']}")
+        now = time.time()
+        fields = {}
+        if payload_updates:
+            payload = dict(job['payload'] or {})
+            payload.update(payload_updates)
+            fields['payload'] = json.dumps(payload, ensure_ascii=False)
+        self._update(job_id, status=STATUS_QUEUED, attempts=0, cancel_requested=0, error=None,
+                     run_after=now, finished_at=None, **fields)
+        self._notify(job['resource_class'])
+        return self.get_job(job_id)
+
+    def _cancel_requested(self, job_id):
+        row = self._connect().execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def _save_progress(self, context, snapshot):
+        now = time.time()
+        self._update_owned(context, progress=json.dumps(snapshot, ensure_ascii=False, default=str), heartbeat_at=now)
+
+    # ------------------------------------------------------------------
+    # 执行
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """按资源类别启动执行线程和心跳线程"""
+        if self._started:
+            return
+        self._started = True
+        self._stop_event.clear()
+        for resource_class, concurrency in self.config['concurrency'].items():
+            self._wakeup[resource_class] = threading.Event()
+            for index in range(max(0, int(concurrency))):
+                thread = threading.Thread(target=self._worker_loop, args=(resource_class,),
+                                          name=f'job-{resource_class}-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        thread = threading.Thread(target=self._maintenance_loop, name='job-maintenance', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        print(f"✅ 任务队列已启动: {self.db_path} 并发 {self.config['concurrency']}")
+
+    def stop(self, timeout=5):
+        """停止领取新任务；运行中的任务随进程退出，由租约机制重新排队"""
+        if not self._started:
+            return
+        self._stop_event.set()
+        for event in self._wakeup.values():
+            event.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        self._started = False
+
+    def _notify(self, resource_class):
+        event = self._wakeup.get(resource_class)
+        if event is not None:
+            event.set()
+
+    def _claim(self, resource_class):
+        """原子地领取一个可执行的任务"""
+        job_types = list(self.handlers.keys())
+        if not job_types:
+            return None
+        conn = self._connect()
+        now = time.time()
+        placeholders = ', '.join('?' for _ in job_types)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(f'''
+                SELECT * FROM jobs
+                WHERE status = ? AND resource_class = ? AND run_after <= ? AND job_type IN ({placeholders})
+                ORDER BY priority DESC, run_after, created_at
+                LIMIT 1
+            ''', [STATUS_QUEUED, resource_class, now] + job_types).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute('''
+                UPDATE jobs SET status = ?, attempts = attempts + 1, worker_id = ?,
+                                started_at = ?, heartbeat_at = ?, updated_at = ?
+                WHERE id = ?
+            ''', (STATUS_RUNNING, self.worker_id, now, now, now, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get_job(row['id'])
+
+    def _worker_loop(self, resource_class):
+        wakeup = self._wakeup[resource_class]
+        poll_interval = self.config.get('poll_interval', 2)
+        while not self._stop_event.is_set():
+            try:
+                job = self._claim(resource_class)
+            except Exception as e:
+                print(f"⚠️ 领取任务失败: {str(e)}")
+                job = None
+            if job is None:
+                wakeup.wait(poll_interval)
+                wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        job_id = job['id']
+        handler = self.handlers[job['job_type']]
+        context = JobContext(self, job)
+        with self._running_lock:
+            self._running_jobs.add(job_id)
+        print(f"🚀 开始执行任务: {job['job_type']} {job_id} (第 {job['attempts']}/{job['max_attempts']} 次)")
+        try:
+            if context.is_cancelled(force=True):
+                raise JobCancelled(f"任务已取消: {job_id}")
+            result = handler.func(context)
+            if self._finish(context, STATUS_COMPLETED, result=result):
+                print(f"✅ 任务完成: {job['job_type']} {job_id}")
+        except JobCancelled:
+            if self._finish(context, STATUS_CANCELLED, error='任务已取消'):
+                print(f"⏹️ 任务已取消: {job['job_type']} {job_id}")
+        except Exception as e:
+            if context.is_cancelled(force=True):
+                if self._finish(context, STATUS_CANCELLED, error='任务已取消'):
+                    print(f"⏹️ 任务已取消: {job['job_type']} {job_id}")
+            elif isinstance(e, PermanentJobError) or job['attempts'] >= job['max_attempts']:
+                if self._finish(context, STATUS_FAILED, error=str(e)):
+                    print(f"❌ 任务失败: {job['job_type']} {job_id}: {str(e)}")
+            else:
+                delay = self.config.get('retry_delay', 30) * (2 ** (job['attempts'] - 1))
+                context.flush_progress()
+                if self._update_owned(context, status=STATUS_QUEUED, error=str(e),
+                                      run_after=time.time() + delay, worker_id=None):
+                    print(f"⚠️ 任务执行失败，{delay} 秒后重试: {job['job_type']} {job_id}: {str(e)}")
+                else:
+                    print(f"⚠️ 任务已被回收或由其他进程执行，放弃本次结果: {job['job_type']} {job_id}")
+        finally:
+            with self._running_lock:
+                self._running_jobs.discard(job_id)
+
+    def _finish(self, context, status, result=None, error=None):
+        """写入任务结束状态，任务已不归本次执行所有时放弃写入并返回False"""
+        context.flush_progress()
+        now = time.time()
+        fields = {'status': status, 'finished_at': now, 'error': error}
+        if result is not None:
+            fields['result'] = json.dumps(result, ensure_ascii=False, default=str)
+        if not self._update_owned(context, **fields):
+            print(f"⚠️ 任务已被回收或由其他进程执行，放弃本次结果: {context.job_type} {context.id}")
+            return False
+        return True
+
+    # ------------------------------------------------------------------
+    # 心跳与回收
+    # ------------------------------------------------------------------
+
+    def _maintenance_loop(self):
+        lease = self.config.get('lease_seconds', 120)
+        interval = max(1, lease / 4)
+        while not self._stop_event.wait(interval):
+            try:
+                self._heartbeat()
+                self._requeue_stale(lease)
+                self._purge_finished()
+            except Exception as e:
+                print(f"⚠️ 任务队列维护失败: {str(e)}")
+
+    def _heartbeat(self):
+        with self._running_lock:
+            job_ids = list(self._running_jobs)
+        if not job_ids:
+            return
+        now = time.time()
+        placeholders = ', '.join('?' for _ in job_ids)
+        self._connect().execute(
+            f'UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND id IN ({placeholders})',
+            [now, STATUS_RUNNING] + job_ids
+        )
+
+    def _requeue_stale(self, lease):
+        """心跳超时的运行中任务：所在进程已退出，重新排队或标记失败"""
+        conn = self._connect()
+        now = time.time()
+        deadline = now - lease
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            stale = conn.execute('''
+                SELECT id, job_type, attempts, max_attempts, cancel_requested FROM jobs
+                WHERE status = ? AND heartbeat_at < ?
+            ''', (STATUS_RUNNING, deadline)).fetchall()
+            for row in stale:
+                if row['cancel_requested']:
+                    status, error = STATUS_CANCELLED, '任务已取消'
+                elif row['attempts'] >= row['max_attempts']:
+                    status, error = STATUS_FAILED, '执行进程已退出，重试次数已用完'
+                else:
+                    status, error = STATUS_QUEUED, '执行进程已退出，任务重新排队'
+                conn.execute('''
+                    UPDATE jobs SET status = ?, error = ?, worker_id = NULL, run_after = ?, updated_at = ?,
+                                    finished_at = CASE WHEN ? = ? THEN NULL ELSE ? END
+                    WHERE id = ?
+                ''', (status, error, now, now, status, STATUS_QUEUED, now, row['id']))
+                print(f"♻️ 回收超时任务: {row['job_type']} {row['id']} -> {status}")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if stale:
+            for event in self._wakeup.values():
+                event.set()
+
+    def _purge_finished(self):
+        retention_days = self.config.get('retention_days')
+        if not retention_days:
+            return
+        deadline = time.time() - retention_days * 86400
+        placeholders = ', '.join('?' for _ in FINISHED_STATUSES)
+        self._connect().execute(
+            f'DELETE FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?',
+            list(FINISHED_STATUSES) + [deadline]
+        )
+
+
+def job_progress_view(job):
+    """把任务记录转换为与 TifMartinService.get_progress 相同结构的进度字典"""
+    progress = dict(job.get('progress') or {})
+    status = job['status']
+    if status == STATUS_QUEUED:
+        progress['status'] = 'queued'
+    elif status == STATUS_RUNNING:
+        progress.setdefault('status', 'processing')
+    elif status == STATUS_COMPLETED:
+        progress.update({'status': 'completed', 'progress': 100})
+    elif status == STATUS_FAILED:
+        progress.update({'status': 'error', 'current_step': 'error',
+                         'message': f"处理失败: {job.get('error')}"})
+    elif status == STATUS_CANCELLED:
+        progress.update({'status': 'cancelled', 'message': '任务已取消'})
+    progress.setdefault('progress', 0)
+    if job.get('result') is not None:
+        progress['result'] = job['result']
+    progress['job'] = {
+        'id': job['id'],
+        'job_type': job['job_type'],
+        'status': status,
+        'attempts': job['attempts'],
+        'max_attempts': job['max_attempts'],
+        'error': job.get('error'),
+    }
+    return progress
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """进程内共享的任务队列实例（首次调用时注册内置任务类型）"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                from services.job_handlers import register_default_handlers
+                queue = JobQueue()
+                register_default_handlers(queue)
+                _job_queue = queue
+    return _job_queue
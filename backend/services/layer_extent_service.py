@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+图层范围服务
+
+图层范围（EPSG:4326 经纬度 {minx, miny, maxx, maxy}）在发布时计算一次，保存在
+geoserver_layers.extent_4326 / vector_martin_services.extent_4326 中，所有边界接口直接读取，
+不再每次请求下载并解析整个 WMS GetCapabilities 文档：
+- PostGIS表（Martin矢量服务、PostGIS数据源的GeoServer图层）：ST_Extent，
+  大表（行数估计超过 estimate_rows_threshold）使用 ST_EstimatedExtent
+- 栅格（GeoServer覆盖）：GDAL读取源TIF的范围
+- MBTiles（Martin栅格/矢量瓦片服务）：metadata 表中的 bounds
+- 以上都不可用时（如Shapefile数据源），读取一次GeoServer REST中资源的 latLonBoundingBox
+
+已有图层由后台线程补算（start_extent_backfill），extent_updated_at 为空的记录才会处理，
+计算失败的记录也会写入 extent_updated_at，之后由边界接口按需重试；extent_updated_at 同时作为
+失败结果的缓存，距上次计算不足 LAYER_EXTENT_CONFIG['retry_after_seconds'] 秒时不再重算，
+避免每次边界请求都等待GeoServer REST超时。
+"""
+
+import json
+import math
+import os
+import sqlite3
+import threading
+
+import requests
+
+from config import GEOSERVER_CONFIG, LAYER_EXTENT_CONFIG
+from models.db import execute_query
+
+# 图层类型对应的表
+EXTENT_TABLES = {
+    'geoserver': 'geoserver_layers',
+    'martin': 'vector_martin_services',
+}
+
+# 使用MBTiles文件的Martin服务类型（其余类型为PostGIS表）
+MBTILES_VECTOR_TYPES = ('mbtiles', 'raster', 'vector', 'raster.mbtiles', 'vector.mbtiles')
+
+
+def normalize_extent(minx, miny, maxx, maxy):
+    """规范化经纬度范围，数值无效或超出经纬度范围时返回None"""
+    try:
+        values = [float(minx), float(miny), float(maxx), float(maxy)]
+    except (TypeError, ValueError):
+        return None
+    if not all(math.isfinite(value) for value in values):
+        return None
+
+    minx, miny, maxx, maxy = values
+    if minx > maxx:
+        minx, maxx = maxx, minx
+    if miny > maxy:
+        miny, maxy = maxy, miny
+    # 允许少量越界（投影误差），超出较多说明不是经纬度
+    if minx < -180.5 or maxx > 180.5 or miny < -90.5 or maxy > 90.5:
+        return None
+
+    return {
+        'minx': max(minx, -180.0),
+        'miny': max(miny, -90.0),
+        'maxx': min(maxx, 180.0),
+        'maxy': min(maxy, 90.0)
+    }
+
+
+def compute_table_extent(table_name, schema='public', geom_column=None):
+    """计算PostGIS表几何字段的范围（转换到EPSG:4326）"""
+    if not geom_column:
+        result = execute_query("""
+            SELECT f_geometry_column AS column_name, srid
+            FROM geometry_columns
+            WHERE f_table_schema = %s AND f_table_name = %s
+            LIMIT 1
+        """, (schema, table_name))
+        if not result:
+            print(f"⚠️ 表 {schema}.{table_name} 中未找到几何字段")
+            return None
+        geom_column = result[0]['column_name']
+
+    qualified = f'"{schema}"."{table_name}"'
+    srid_result = execute_query(
+        f'SELECT ST_SRID("{geom_column}") AS srid FROM {qualified} WHERE "{geom_column}" IS NOT NULL LIMIT 1'
+    )
+    if not srid_result:
+        return None
+    srid = srid_result[0]['srid'] or 4326
+
+    # 大表使用统计信息估算范围，避免全表扫描
+    exact_query = (f'SELECT ST_Extent("{geom_column}")::geometry AS box FROM {qualified}', ())
+    queries = [exact_query]
+    rows_result = execute_query("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (qualified,))
+    estimated_rows = rows_result[0]['reltuples'] if rows_result else 0
+    if estimated_rows and estimated_rows > LAYER_EXTENT_CONFIG.get('estimate_rows_threshold', 1000000):
+        queries.insert(0, ("SELECT ST_EstimatedExtent(%s, %s, %s)::geometry AS box", (schema, table_name, geom_column)))
+
+    for box_query, box_params in queries:
+        # 先转换整个范围框再取外包框（只转换两个角点在投影坐标系下会偏小）
+        try:
+            result = execute_query(f"""
+                SELECT ST_XMin(g) AS minx, ST_YMin(g) AS miny, ST_XMax(g) AS maxx, ST_YMax(g) AS maxy
+                FROM (
+                    SELECT CASE WHEN %s = 4326 THEN ST_SetSRID(box, 4326)
+                                ELSE ST_Transform(ST_SetSRID(box, %s), 4326) END AS g
+                    FROM ({box_query}) b
+                    WHERE box IS NOT NULL
+                ) t
+            """, (srid, srid) + box_params)
+        except Exception as e:
+            if (box_query, box_params) == exact_query:
+                raise
+            # 没有统计信息时 ST_EstimatedExtent 会报错，改为精确计算
+            print(f"⚠️ 估算表 {schema}.{table_name} 范围失败，改为精确计算: {str(e)}")
+            continue
+        if result:
+            row = result[0]
+            return normalize_extent(row['minx'], row['miny'], row['maxx'], row['maxy'])
+    return None
+
+
+def compute_raster_extent(path):
+    """用GDAL计算栅格文件的范围（转换到EPSG:4326）"""
+    from osgeo import gdal, osr
+
+    dataset = gdal.Open(path)
+    if dataset is None:
+        return None
+    try:
+        projection = dataset.GetProjection()
+        gt = dataset.GetGeoTransform()
+        width, height = dataset.RasterXSize, dataset.RasterYSize
+    finally:
+        dataset = None
+
+    # 四条边上各取若干点，投影变换后边界可能弯曲
+    steps = 8
+    points = []
+    for i in range(steps + 1):
+        for px, py in ((width * i / steps, 0), (width * i / steps, height),
+                       (0, height * i / steps), (width, height * i / steps)):
+            points.append((gt[0] + px * gt[1] + py * gt[2], gt[3] + px * gt[4] + py * gt[5]))
+
+    if projection:
+        src_srs = osr.SpatialReference()
+        src_srs.ImportFromWkt(projection)
+        dst_srs = osr.SpatialReference()
+        dst_srs.ImportFromEPSG(4326)
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            dst_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(src_srs, dst_srs)
+        points = [transform.TransformPoint(x, y)[:2] for x, y in points]
+
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return normalize_extent(min(xs), min(ys), max(xs), max(ys))
+
+
+def read_mbtiles_bounds(path):
+    """读取MBTiles metadata 中的 bounds（"西,南,东,北"）"""
+    if not path or not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT value FROM metadata WHERE name = 'bounds'").fetchone()
+    finally:
+        conn.close()
+    if not row or not row[0]:
+        return None
+    parts = str(row[0]).split(',')
+    if len(parts) != 4:
+        return None
+    return normalize_extent(*parts)
+
+
+def fetch_geoserver_resource_extent(workspace, store_name, store_type, resource_name):
+    """从GeoServer REST读取单个资源的 latLonBoundingBox（只请求该资源，不读取GetCapabilities）"""
+    if store_type == 'coveragestore':
+        url = f"{GEOSERVER_CONFIG['url']}/rest/workspaces/{workspace}/coveragestores/{store_name}/coverages/{resource_name}.json"
+        key = 'coverage'
+    else:
+        url = f"{GEOSERVER_CONFIG['url']}/rest/workspaces/{workspace}/datastores/{store_name}/featuretypes/{resource_name}.json"
+        key = 'featureType'
+
+    response = requests.get(url, auth=(GEOSERVER_CONFIG['user'], GEOSERVER_CONFIG['password']), timeout=10)
+    if response.status_code != 200:
+        return None
+    bbox = response.json().get(key, {}).get('latLonBoundingBox') or {}
+    return normalize_extent(bbox.get('minx'), bbox.get('miny'), bbox.get('maxx'), bbox.get('maxy'))
+
+
+def compute_geoserver_layer_extent(layer_id):
+    """计算GeoServer图层的范围"""
+    result = execute_query("""
+        SELECT gl.id, gl.name, gl.featuretype_id, gl.coverage_id,
+               gw.name AS workspace_name,
+               COALESCE(ft.name, cv.name) AS resource_name,
+               COALESCE(ft.native_name, ft.name) AS table_name,
+               gs.name AS store_name, gs.store_type, gs.data_type,
+               f.file_path, f.file_type
+        FROM geoserver_layers gl
+        LEFT JOIN geoserver_workspaces gw ON gl.workspace_id = gw.id
+        LEFT JOIN geoserver_featuretypes ft ON gl.featuretype_id = ft.id
+        LEFT JOIN geoserver_coverages cv ON gl.coverage_id = cv.id
+        LEFT JOIN geoserver_stores gs ON gs.id = COALESCE(ft.store_id, cv.store_id)
+        LEFT JOIN files f ON gl.file_id = f.id
+        WHERE gl.id = %s
+    """, (layer_id,))
+    if not result:
+        return None
+    layer = result[0]
+
+    extent = None
+    try:
+        if layer['featuretype_id'] and layer['data_type'] == 'PostGIS' and layer['table_name']:
+            extent = compute_table_extent(layer['table_name'])
+        elif layer['coverage_id'] and layer['file_path'] and os.path.exists(layer['file_path']):
+            extent = compute_raster_extent(layer['file_path'])
+    except Exception as e:
+        print(f"⚠️ 从数据源计算GeoServer图层 {layer_id} 范围失败，改为读取GeoServer资源信息: {str(e)}")
+
+    if extent is None and layer['store_name'] and layer['resource_name']:
+        store_type = 'coveragestore' if layer['coverage_id'] else 'datastore'
+        extent = fetch_geoserver_resource_extent(layer['workspace_name'] or GEOSERVER_CONFIG['workspace'],
+                                                 layer['store_name'], store_type, layer['resource_name'])
+    return extent
+
+
+def compute_martin_service_extent(service_id):
+    """计算Martin服务的范围"""
+    result = execute_query("""
+        SELECT vms.id, vms.vector_type, vms.table_name, vms.file_path,
+               f.file_path AS source_path, f.file_type AS source_type
+        FROM vector_martin_services vms
+        LEFT JOIN files f ON vms.source_file_id = f.id
+        WHERE vms.id = %s
+    """, (service_id,))
+    if not result:
+        return None
+    service = result[0]
+
+    is_mbtiles = (service['vector_type'] in MBTILES_VECTOR_TYPES
+                  or (service['file_path'] or '').lower().endswith('.mbtiles'))
+    if not is_mbtiles:
+        return compute_table_extent(service['table_name'])
+
+    extent = read_mbtiles_bounds(service['file_path'])
+    # 没有 bounds 元数据的MBTiles（如由瓦片目录打包生成）从源TIF计算
+    if extent is None and service['source_type'] in ('tif', 'tiff', 'dem', 'dom') \
+            and service['source_path'] and os.path.exists(service['source_path']):
+        extent = compute_raster_extent(service['source_path'])
+    return extent
+
+
+def store_extent(layer_type, layer_id, extent):
+    """保存范围（extent 为None时只记录计算时间）"""
+    table = EXTENT_TABLES[layer_type]
+    execute_query(
+        f"UPDATE {table} SET extent_4326 = %s, extent_updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+        (json.dumps(extent) if extent else None, layer_id),
+        fetch=False
+    )
+
+
+def refresh_layer_extent(layer_type, layer_id):
+    """计算并保存图层范围（发布后调用），失败时只打印日志，不影响发布
+
+    Returns:
+        dict: 范围，无法计算时返回None
+    """
+    try:
+        if layer_type == 'geoserver':
+            extent = compute_geoserver_layer_extent(layer_id)
+        else:
+            extent = compute_martin_service_extent(layer_id)
+        store_extent(layer_type, layer_id, extent)
+        if extent:
+            print(f"✅ 图层范围已计算: {layer_type} {layer_id} {extent}")
+        else:
+            print(f"⚠️ 无法计算图层范围: {layer_type} {layer_id}")
+        return extent
+    except Exception as e:
+        print(f"⚠️ 计算图层范围失败 {layer_type} {layer_id}: {str(e)}")
+        return None
+
+
+def get_layer_extent(layer_type, layer_id):
+    """读取图层范围，尚未计算时按需计算并保存
+
+    上次计算失败不足 retry_after_seconds 秒时直接返回None；重算前先更新 extent_updated_at
+    领取该记录，并发请求中只有一个执行计算
+    """
+    table = EXTENT_TABLES[layer_type]
+    result = execute_query(f"SELECT extent_4326 FROM {table} WHERE id = %s", (layer_id,))
+    if not result:
+        return None
+    extent = result[0]['extent_4326']
+    if extent:
+        return extent
+
+    claimed = execute_query(f"""
+        UPDATE {table} SET extent_updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND extent_4326 IS NULL
+          AND (extent_updated_at IS NULL
+               OR extent_updated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+        RETURNING id
+    """, (layer_id, LAYER_EXTENT_CONFIG.get('retry_after_seconds', 600)))
+    if not claimed:
+        return None
+    return refresh_layer_extent(layer_type, layer_id)
+
+
+def backfill_extents(batch_size=None):
+    """补算已有图层的范围
+
+    每批先把记录标记为已处理（SKIP LOCKED），多个进程同时补算时不会重复计算。
+
+    Returns:
+        int: 处理的图层数
+    """
+    batch_size = batch_size or LAYER_EXTENT_CONFIG.get('backfill_batch_size', 50)
+    processed = 0
+    for layer_type, table in EXTENT_TABLES.items():
+        while True:
+            rows = execute_query(f"""
+                UPDATE {table} SET extent_updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE extent_updated_at IS NULL
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id
+            """, (batch_size,))
+            if not rows:
+                break
+            for row in rows:
+                refresh_layer_extent(layer_type, row['id'])
+                processed += 1
+    if processed:
+        print(f"✅ 图层范围补算完成，共处理 {processed} 个图层")
+    return processed
+
+
+_backfill_thread = None
+
+
+def start_extent_backfill():
+    """在后台线程中补算已有图层的范围"""
+    global _backfill_thread
+    if _backfill_thread is not None or not LAYER_EXTENT_CONFIG.get('backfill_on_startup', True):
+        return
+
+    def run():
+        try:
+            backfill_extents()
+        except Exception as e:
+            print(f"⚠️ 图层范围补算失败: {str(e)}")
+
+    _backfill_thread = threading.Thread(target=run, name='extent-backfill', daemon=True)
+    _backfill_thread.start()
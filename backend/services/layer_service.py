@@ -16,6 +16,7 @@ from models.db import execute_query, insert_with_snowflake_id
 from services.file_service import FileService
 from services.geoserver_service import GeoServerService
 from services.style_service import StyleService
+from services.capabilities_cache import capabilities_cache
 import requests
 from requests.auth import HTTPBasicAuth
 from datetime import datetime
@@ -447,7 +448,9 @@ class LayerService:
                 'file_id': layer_data['file_id']
             }
             
-            return insert_with_snowflake_id('geoserver_layers', layer_params)
+            layer_id = insert_with_snowflake_id('geoserver_layers', layer_params)
+            capabilities_cache.invalidate()
+            return layer_id
             
         except Exception as e:
             print(f"创建图层失败: {str(e)}")
@@ -484,6 +487,7 @@ class LayerService:
             """
             
             execute_query(query, params)
+            capabilities_cache.invalidate()
             
         except Exception as e:
             print(f"更新图层失败: {str(e)}")
@@ -499,6 +503,7 @@ class LayerService:
             
             # 删除图层（级联删除会处理相关的要素类型/覆盖范围和存储仓库）
             execute_query("DELETE FROM geoserver_layers WHERE id = %s", (layer_id,), fetch=False)
+            capabilities_cache.invalidate()
             
             # 如果有关联文件，更新文件状态
             if layer.get('file_id'):
@@ -528,6 +533,16 @@ class LayerService:
                 'opaque': layer.get('opaque', False)
             }
             
+            # 数据库中没有范围时从缓存的WMS GetCapabilities文档中按图层名查找
+            if not capabilities['bbox'] and capabilities['workspace']:
+                try:
+                    capability_layer = capabilities_cache.get_layer(f"{capabilities['workspace']}:{layer['name']}")
+                    if capability_layer:
+                        capabilities['bbox'] = capability_layer['bbox']
+                        capabilities['title'] = capabilities['title'] or capability_layer['title']
+                except Exception as e:
+                    print(f"⚠️ 从GetCapabilities获取图层范围失败: {str(e)}")
+            
             # 根据服务类型添加特定信息
             if service_type.upper() == 'WMS':
                 capabilities['formats'] = ['image/png', 'image/jpeg', 'image/gif']
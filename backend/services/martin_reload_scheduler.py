@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Martin 重启调度
+
+Martin 只在启动时发现 PostGIS 表，发布/取消发布后需要重启。原来每个发布流程各自调用
+refresh_tables()，连续上传N个文件会让瓦片服务中断N次。这里把重启请求合并：
+- 请求进入当前批次，最后一次请求后静默 debounce_seconds 秒（或第一次请求后满
+  max_delay_seconds 秒）时执行一次重启，整批请求共享这一次重启的结果
+- 重启执行期间到达的请求进入下一批
+- 重启后轮询HTTP就绪探针（/health），就绪即返回，并检查 /catalog 是否包含本批新发布的数据源
+
+前端和已保存的瓦片URL都固定指向 MARTIN_CONFIG['port']，没有可切换流量的前置代理，
+因此仍是同端口停止后再启动；停止前完成配置准备，停止后按端口释放、就绪探针轮询，
+不再固定等待。
+
+合并只在本进程内进行：多个应用进程各自维护批次，同一时间段的发布仍可能各自触发一次重启。
+各进程的重启通过数据库事务级咨询锁（pg_advisory_xact_lock）串行执行，不会同时停止/启动
+同一个Martin端口。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from config import MARTIN_RELOAD_CONFIG
+
+# 跨进程重启锁的名称（hashtext 后作为咨询锁的键）
+RELOAD_LOCK_NAME = 'martin_reload'
+
+
+@contextmanager
+def reload_lock():
+    """跨进程的Martin重启锁，等待其他进程的重启完成后再进入
+
+    使用事务级咨询锁，事务结束时自动释放，连接可以直接归还连接池；
+    数据库不可用时不加锁继续执行
+    """
+    from models.db import get_connection
+
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (RELOAD_LOCK_NAME,))
+    except Exception as e:
+        print(f"⚠️ 获取Martin重启锁失败，不加锁继续: {str(e)}")
+        if conn is not None:
+            conn.close()
+        conn = None
+    try:
+        yield
+    finally:
+        if conn is not None:
+            # 归还连接池时回滚事务，同时释放咨询锁
+            conn.close()
+
+
+class ReloadTicket:
+    """一次重启请求的结果，同一批次的请求共享"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.success = None
+
+    def _resolve(self, success):
+        self.success = success
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """等待本批次重启完成，返回是否成功（超时返回None）"""
+        if not self._event.wait(timeout):
+            return None
+        return self.success
+
+
+class MartinReloadScheduler:
+    """合并 Martin 重启请求的后台调度器"""
+
+    def __init__(self, martin_service=None, debounce_seconds=None, max_delay_seconds=None):
+        self._martin_service = martin_service
+        self.debounce_seconds = MARTIN_RELOAD_CONFIG['debounce_seconds'] if debounce_seconds is None else debounce_seconds
+        self.max_delay_seconds = MARTIN_RELOAD_CONFIG['max_delay_seconds'] if max_delay_seconds is None else max_delay_seconds
+        self._condition = threading.Condition()
+        self._ticket = None
+        self._sources = set()
+        self._reasons = []
+        self._first_request_at = None
+        self._last_request_at = None
+        self._thread = None
+        self.reload_count = 0
+
+    @property
+    def martin_service(self):
+        if self._martin_service is None:
+            from services.martin_service import martin_service
+            self._martin_service = martin_service
+        return self._martin_service
+
+    def request_reload(self, source_id=None, reason=None):
+        """请求重启 Martin
+
+        Args:
+            source_id: 新发布的数据源ID（发布时传入，取消发布时为None）
+            reason: 日志中显示的原因
+
+        Returns:
+            ReloadTicket，可调用 wait() 等待本批次重启完成
+        """
+        with self._condition:
+            now = time.time()
+            if self._ticket is None:
+                self._ticket = ReloadTicket()
+                self._first_request_at = now
+            self._last_request_at = now
+            if source_id:
+                self._sources.add(source_id)
+            if reason:
+                self._reasons.append(reason)
+            ticket = self._ticket
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='martin-reload', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return ticket
+
+    def reload_and_wait(self, source_id=None, reason=None, timeout=None):
+        """请求重启并等待完成（发布流程需要确认新数据源已可用）"""
+        timeout = MARTIN_RELOAD_CONFIG['publish_wait_seconds'] if timeout is None else timeout
+        success = self.request_reload(source_id, reason).wait(timeout)
+        if success is None:
+            print(f"⚠️ 等待Martin重启超时（{timeout}秒），重启仍在后台进行")
+            return False
+        return success
+
+    def _due_at(self):
+        return min(self._last_request_at + self.debounce_seconds,
+                   self._first_request_at + self.max_delay_seconds)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # 没有待处理请求时线程退出，下次请求时重新启动
+                if self._ticket is None:
+                    self._thread = None
+                    return
+                remaining = self._due_at() - time.time()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+
+                # 取出当前批次，之后到达的请求进入下一批
+                ticket, sources, reasons = self._ticket, sorted(self._sources), self._reasons
+                self._ticket = None
+                self._sources = set()
+                self._reasons = []
+
+            print(f"♻️ 合并 {max(len(reasons), 1)} 个Martin重启请求: {', '.join(reasons) or '未注明原因'}")
+            started = time.time()
+            try:
+                with reload_lock():
+                    success = self.martin_service.refresh_tables(sources=sources or None)
+            except Exception as e:
+                print(f"❌ Martin重启失败: {str(e)}")
+                success = False
+            self.reload_count += 1
+            print(f"{'✅' if success else '❌'} Martin重启{'完成' if success else '失败'}，"
+                  f"耗时 {time.time() - started:.1f} 秒")
+            ticket._resolve(success)
+
+
+martin_reload_scheduler = MartinReloadScheduler()
@@ -12,7 +12,7 @@ import time
 import socket
 from typing import Dict, List, Optional, Tuple
 import psycopg2
-from config import MARTIN_CONFIG, DB_CONFIG
+from config import MARTIN_CONFIG, MARTIN_RELOAD_CONFIG, DB_CONFIG
 
 logger = logging.getLogger(__name__)
 
@@ -78,9 +78,9 @@ class MartinService:
         """获取 PostGIS 数据库中的空间表"""
         tables = []
         try:
-            # 创建数据库连接，排除 schema 参数
-            db_params = {k: v for k, v in self.db_config.items() if k != 'schema'}
-            conn = psycopg2.connect(**db_params)
+            # 从连接池获取数据库连接
+            from models.db import get_connection
+            conn = get_connection()
             cursor = conn.cursor()
             
             # 查询包含几何列的表
@@ -202,8 +202,12 @@ class MartinService:
                 lines.append(f"{prefix}{key}: {value}")
         return "\n".join(lines)
     
-    def start_service(self) -> bool:
-        """启动 Martin 服务"""
+    def start_service(self, sources: Optional[List[str]] = None) -> bool:
+        """启动 Martin 服务
+        
+        Args:
+            sources: 新发布的数据源ID，就绪后检查是否已出现在 /catalog 中
+        """
         if not self.is_enabled():
             logger.info("Martin 服务未启用")
             return False
@@ -276,81 +280,26 @@ class MartinService:
                     stdin=subprocess.DEVNULL
                 )
             
-            # 等待服务启动 - 增加初始等待时间
+            # 等待服务启动：轮询HTTP就绪探针，就绪后立即返回
             logger.info("等待Martin服务启动...")
+            if self.wait_until_ready(sources=sources):
+                logger.info("✅ Martin服务完全就绪并可访问")
+                return True
             
-            # 给Martin进程一点时间来初始化（重要：避免立即检查）
-            time.sleep(1)
+            exit_code = self.process.poll()
+            if exit_code is not None:
+                logger.error(f"Martin进程启动后立即退出，退出码: {exit_code}")
+                self._log_stderr_output()
+                return False
             
-            max_retries = 5  # 增加重试次数
-            retry_interval = 2
             martin_port = self.config.get('port', 3000)
-            
-            for i in range(max_retries):
-                # 检查进程是否已退出
-                if self.process.poll() is not None:
-                    exit_code = self.process.poll()
-                    logger.error(f"Martin进程启动后立即退出，退出码: {exit_code}")
-                    
-                    # 尝试读取日志文件获取错误信息
-                    if os.name == 'nt':
-                        try:
-                            log_dir = os.path.join(os.path.dirname(self.config_file_path), 'logs')
-                            stderr_log = os.path.join(log_dir, 'martin_stderr.log')
-                            if os.path.exists(stderr_log):
-                                with open(stderr_log, 'r', encoding='utf-8') as f:
-                                    stderr_content = f.read()
-                                    if stderr_content.strip():
-                                        logger.error(f"错误输出: {stderr_content}")
-                        except Exception as e:
-                            logger.debug(f"读取错误日志失败: {e}")
-                    
-                    return False
-                
-                # 首先检查端口是否被占用（这是启动成功的主要指标）
-                if self.check_port_in_use(martin_port):
-                    logger.info(f"✅ 端口{martin_port}已被占用，Martin服务启动成功 (尝试 {i+1}/{max_retries})")
-                    
-                    # 进一步验证Martin服务的可访问性
-                    if self.is_running():
-                        logger.info(f"✅ Martin服务完全就绪并可访问")
-                        return True
-                    else:
-                        logger.info(f"⚠️ 端口已占用但服务尚未完全就绪，继续等待...")
-                        # 端口占用了，说明Martin在启动过程中，继续等待
-                        time.sleep(retry_interval)
-                        continue
-                
-                logger.info(f"端口{martin_port}尚未被占用，Martin服务正在启动... ({i+1}/{max_retries})")
-                time.sleep(retry_interval)
-            
-            # 最后一次检查端口占用情况
             if self.check_port_in_use(martin_port):
-                logger.info("✅ Martin服务启动成功（端口已被占用）")
-                
-                # 尝试最后一次验证服务可访问性
-                if self.is_running():
-                    logger.info("✅ Martin服务完全就绪")
-                else:
-                    logger.warning("⚠️ Martin服务端口已占用但HTTP访问可能需要更多时间")
+                logger.warning("⚠️ Martin服务端口已占用但就绪探针未通过，可能需要更多时间")
                 return True
-            else:
-                logger.error(f"❌ 端口{martin_port}未被占用，Martin服务启动失败")
-                
-                # 尝试读取日志文件获取错误信息
-                if os.name == 'nt':
-                    try:
-                        log_dir = os.path.join(os.path.dirname(self.config_file_path), 'logs')
-                        stderr_log = os.path.join(log_dir, 'martin_stderr.log')
-                        if os.path.exists(stderr_log):
-                            with open(stderr_log, 'r', encoding='utf-8') as f:
-                                stderr_content = f.read()
-                                if stderr_content.strip():
-                                    logger.error(f"错误输出: {stderr_content}")
-                    except Exception as e:
-                        logger.debug(f"读取错误日志失败: {e}")
-                
-                return False
+            
+            logger.error(f"❌ 端口{martin_port}未被占用，Martin服务启动失败")
+            self._log_stderr_output()
+            return False
                 
         except Exception as e:
             logger.error(f"启动Martin失败: {str(e)}")
@@ -358,6 +307,82 @@ class MartinService:
             logger.error(traceback.format_exc())
             return False
     
+    def _log_stderr_output(self) -> None:
+        """输出Martin错误日志（Windows启动方式下输出被重定向到日志文件）"""
+        if os.name != 'nt':
+            return
+        try:
+            log_dir = os.path.join(os.path.dirname(self.config_file_path), 'logs')
+            stderr_log = os.path.join(log_dir, 'martin_stderr.log')
+            if os.path.exists(stderr_log):
+                with open(stderr_log, 'r', encoding='utf-8') as f:
+                    stderr_content = f.read()
+                    if stderr_content.strip():
+                        logger.error(f"错误输出: {stderr_content}")
+        except Exception as e:
+            logger.debug(f"读取错误日志失败: {e}")
+    
+    def _catalog_source_ids(self, catalog) -> set:
+        """Martin目录中的数据源ID（兼容新版 {"tiles": {...}} 和旧版列表格式）"""
+        if isinstance(catalog, dict):
+            return set((catalog.get('tiles') or {}).keys())
+        if isinstance(catalog, list):
+            return {item.get('id') for item in catalog if isinstance(item, dict)}
+        return set()
+    
+    def _log_missing_sources(self, sources: List[str]) -> None:
+        """检查新发布的数据源是否已出现在目录中（source_id_format 不同时按表名匹配）"""
+        try:
+            response = requests.get(f"{self.base_url}/catalog", timeout=5)
+            if response.status_code != 200:
+                return
+            available = self._catalog_source_ids(response.json())
+            missing = [source for source in sources
+                       if source not in available and source.split('.')[-1] not in available]
+            if missing:
+                logger.warning(f"⚠️ Martin已就绪，但目录中没有这些数据源（检查auto_publish的id_regex配置）: {missing}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.debug(f"获取Martin目录失败: {e}")
+    
+    def wait_until_ready(self, sources: Optional[List[str]] = None, timeout: Optional[float] = None) -> bool:
+        """轮询HTTP就绪探针，直到 /health 返回200
+        
+        Args:
+            sources: 新发布的数据源ID，就绪后检查是否已出现在 /catalog 中
+            timeout: 最长等待时间，默认 MARTIN_RELOAD_CONFIG['ready_timeout']
+        """
+        timeout = MARTIN_RELOAD_CONFIG['ready_timeout'] if timeout is None else timeout
+        interval = MARTIN_RELOAD_CONFIG['probe_interval']
+        deadline = time.time() + timeout
+        
+        while time.time() < deadline:
+            # 本进程启动的Martin已退出时不再等待
+            if self.process is not None and self.process.poll() is not None:
+                return False
+            try:
+                response = requests.get(f"{self.base_url}/health", timeout=2)
+                if response.status_code == 200:
+                    if sources:
+                        self._log_missing_sources(sources)
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(interval)
+        
+        return False
+    
+    def wait_port_released(self, timeout: Optional[float] = None) -> bool:
+        """停止服务后等待端口释放，代替固定等待"""
+        timeout = MARTIN_RELOAD_CONFIG['ready_timeout'] if timeout is None else timeout
+        martin_port = self.config.get('port', 3000)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.check_port_in_use(martin_port):
+                return True
+            time.sleep(MARTIN_RELOAD_CONFIG['probe_interval'])
+        logger.warning(f"⚠️ 端口{martin_port}在{timeout}秒内未释放")
+        return False
+    
     def _safe_decode(self, data: bytes) -> str:
         """安全地解码字节数据"""
         if not data:
@@ -777,67 +802,59 @@ class MartinService:
             logger.error(f"获取Martin版本失败: {e}")
         return "未知版本"
     
-    def refresh_tables(self) -> bool:
-        """重启Martin服务 - 更智能地处理重启过程"""
+    def refresh_tables(self, sources: Optional[List[str]] = None) -> bool:
+        """重启Martin服务，使新建/删除的表生效
+        
+        发布流程应通过 martin_reload_scheduler 合并重启请求，这里执行一次实际的重启。
+        
+        Args:
+            sources: 本次重启要发布的数据源ID（如 public.geojson_xxx），就绪后检查目录
+        """
         try:
             logger.info("=== 重启Martin服务 ===")
             
-            # 1. 停止当前服务
-            logger.info("正在停止当前Martin服务...")
-            self.stop_service()
-            
-            # 2. 等待一下让系统清理资源
-            time.sleep(2)
-            
-            # 3. 检查Martin可执行文件
+            # 1. 先完成检查和配置准备，缩短服务中断时间
             if not os.path.exists(self.martin_executable):
                 logger.error(f"❌ Martin可执行文件不存在: {self.martin_executable}")
                 return False
                 
-            # 4. 确保配置文件存在
             if not os.path.exists(self.config_file_path):
                 logger.info("配置文件不存在，尝试生成...")
                 if not self.write_config_file():
                     logger.error("❌ 无法生成配置文件")
                     return False
             
-            # 5. 尝试直接启动服务
+            # 2. 停止当前服务并等待端口释放
+            logger.info("正在停止当前Martin服务...")
+            self.stop_service()
+            self.wait_port_released()
+            
+            # 3. 尝试直接启动服务
             logger.info("尝试直接启动Martin服务...")
-            if self.start_service():
+            if self.start_service(sources=sources):
                 logger.info("✅ Martin服务直接启动成功")
                 return True
                 
-            # 6. 如果直接启动失败，尝试使用bat文件启动
+            # 4. 如果直接启动失败，尝试使用bat文件启动
             logger.info("直接启动失败，尝试使用bat文件启动...")
+            # bat启动的Martin不是本进程的子进程：清除直接启动失败的进程，
+            # 否则就绪探针看到该进程已退出会立即返回，不再等待bat启动的服务
+            if self.process is not None:
+                if self.process.poll() is None:
+                    self.stop_service()
+                    self.wait_port_released()
+                self.process = None
             if self.start_service_with_bat(background=True):
-                # 等待服务启动并验证（增加验证时间和次数）
                 logger.info("等待bat启动的Martin服务...")
-                martin_port = self.config.get('port', 3000)
-                max_wait_time = 15  # 最多等待15秒
-                check_interval = 1  # 每秒检查一次
-                
-                for i in range(max_wait_time):
-                    # 检查端口是否被占用
-                    if self.check_port_in_use(martin_port):
-                        logger.info(f"✅ 端口{martin_port}已被占用，Martin服务通过bat启动成功")
-                        
-                        # 进一步验证HTTP访问
-                        if self.is_running():
-                            logger.info("✅ Martin服务完全就绪并可访问")
-                        else:
-                            logger.info("⚠️ Martin服务端口已占用，HTTP服务正在启动中")
-                        return True
-                    
-                    logger.info(f"等待端口{martin_port}被占用... ({i+1}/{max_wait_time})")
-                    time.sleep(check_interval)
+                if self.wait_until_ready(sources=sources):
+                    logger.info("✅ Martin服务通过bat启动成功并可访问")
+                    return True
                 
-                # 最后检查一次
-                if self.check_port_in_use(martin_port):
+                if self.check_port_in_use(self.config.get('port', 3000)):
                     logger.info("✅ Martin服务通过bat启动成功（端口已被占用）")
-                    return True
                 else:
                     logger.warning("⚠️ bat命令执行成功但Martin服务可能需要更多时间启动")
-                    return True  # bat命令执行成功就算成功
+                return True  # bat命令执行成功就算成功
             
             logger.error("❌ 所有启动方法均失败")
             return False
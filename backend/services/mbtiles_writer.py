@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+MBTiles 写入工具
+
+按批次在单个事务中写入瓦片，供目录打包和内存流水线两种模式共用。
+写入期间使用WAL模式，渲染进程可以同时以只读方式读取已提交的瓦片（金字塔模式读取子瓦片）。
+
+采用标准的去重结构：map 记录瓦片坐标到 tile_id 的映射，images 按内容哈希只存一份数据，
+tiles 为两者连接的视图，读取方式与普通MBTiles相同。
+
+断点续传：tiling_checkpoint 表记录已完成的渲染单元，与其瓦片在同一事务中提交，
+进程中断后以 resume=True 重新打开即可跳过已完成的单元；close() 时删除该表。
+有瓦片渲染失败的单元不记录完成，续传时整体重新渲染。
+
+瓦片格式按文件头识别并记录在 tile_formats 元数据中；close() 时把 format 元数据更新为
+实际格式。Martin 按 format 返回所有瓦片的 Content-Type，出现多种格式（如续传了编码参数
+不同的旧文件）时无法正确提供，close() 抛出异常而不是交付元数据错误的文件。
+"""
+
+import hashlib
+import os
+import sqlite3
+
+from utils.tile_encoding import sniff_tile_format
+
+# 每个事务写入的瓦片数
+DEFAULT_BATCH_SIZE = 1000
+
+
+def remove_mbtiles(mbtiles_path):
+    """删除MBTiles文件及其WAL附属文件"""
+    for path in (mbtiles_path, f'{mbtiles_path}-wal', f'{mbtiles_path}-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class MBTilesWriter:
+    """批量写入MBTiles文件
+
+    写入过程中关闭同步以提高吞吐，close() 时合并WAL并切回普通日志模式，
+    保证交付的是单个自包含的MBTiles文件。
+    瓦片坐标使用XYZ方案传入，写入时转换为MBTiles要求的TMS行号。
+    """
+
+    def __init__(self, mbtiles_path, metadata, batch_size=DEFAULT_BATCH_SIZE, empty_tile=None, resume=False):
+        """
+        Args:
+            empty_tile: 完全透明瓦片的编码数据；add_tile 传入空字节串时使用它，为None时忽略空瓦片
+            resume: 文件已存在时在其基础上继续写入，否则重新创建
+        """
+        self.mbtiles_path = mbtiles_path
+        self.batch_size = batch_size
+        self.empty_tile = empty_tile
+        self.tile_count = 0
+        self._pending = []
+        self._pending_images = {}
+        self._pending_units = []
+        self.formats = set()
+
+        self.resumed = resume and os.path.exists(mbtiles_path)
+        if not self.resumed:
+            remove_mbtiles(mbtiles_path)
+
+        self.conn = sqlite3.connect(mbtiles_path)
+        # WAL + NORMAL：进程崩溃不会丢失已提交的事务
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+
+        if self.resumed:
+            self.tile_count = self.conn.execute('SELECT COUNT(*) FROM map').fetchone()[0]
+            row = self.conn.execute("SELECT value FROM metadata WHERE name = 'tile_formats'").fetchone()
+            if row and row[0]:
+                self.formats = set(row[0].split(','))
+            return
+
+        cursor = self.conn.cursor()
+        cursor.execute('CREATE TABLE metadata (name text, value text)')
+        cursor.execute('''
+            CREATE TABLE map (zoom_level integer, tile_column integer,
+                              tile_row integer, tile_id text)
+        ''')
+        # 索引在建表时创建，渲染过程中即可按坐标查询瓦片
+        cursor.execute('''
+            CREATE UNIQUE INDEX map_index on map
+            (zoom_level, tile_column, tile_row)
+        ''')
+        cursor.execute('CREATE TABLE images (tile_data blob, tile_id text)')
+        cursor.execute('CREATE UNIQUE INDEX images_id on images (tile_id)')
+        cursor.execute('''
+            CREATE VIEW tiles AS
+            SELECT map.zoom_level AS zoom_level,
+                   map.tile_column AS tile_column,
+                   map.tile_row AS tile_row,
+                   images.tile_data AS tile_data
+            FROM map JOIN images ON images.tile_id = map.tile_id
+        ''')
+        cursor.execute('''
+            CREATE TABLE tiling_checkpoint (zoom_level integer, x_start integer, x_end integer,
+                                            y_start integer, y_end integer)
+        ''')
+        cursor.executemany('INSERT INTO metadata VALUES (?, ?)', list(metadata.items()))
+        self.conn.commit()
+
+    def add_tile(self, zoom, tile_x, tile_y, tile_data):
+        """添加一个XYZ瓦片，tile_data 为空字节串表示完全透明瓦片"""
+        if not tile_data:
+            if self.empty_tile is None:
+                return
+            tile_data = self.empty_tile
+        tile_id = hashlib.md5(tile_data).hexdigest()
+        # 批次内去重；跨批次的重复内容由 images_id 唯一索引忽略
+        self._pending_images[tile_id] = tile_data
+        tms_y = (2 ** zoom - 1) - tile_y
+        self._pending.append((zoom, tile_x, tms_y, tile_id))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def add_tiles(self, tiles):
+        """添加多个 (zoom, x, y, data) XYZ瓦片"""
+        for zoom, tile_x, tile_y, tile_data in tiles:
+            self.add_tile(zoom, tile_x, tile_y, tile_data)
+
+    def mark_completed(self, unit):
+        """记录一个已完成的渲染单元 (zoom, x_start, x_end, y_start, y_end)
+
+        在下一次 flush 时与该单元的瓦片一起提交
+        """
+        self._pending_units.append(tuple(unit))
+
+    def completed_units(self):
+        """已提交的渲染单元集合"""
+        rows = self.conn.execute(
+            'SELECT zoom_level, x_start, x_end, y_start, y_end FROM tiling_checkpoint'
+        ).fetchall()
+        return set(rows)
+
+    def flush(self):
+        """在一个事务中写入缓冲的瓦片和渲染单元记录"""
+        if not self._pending and not self._pending_units:
+            return
+        formats = self.formats | {sniff_tile_format(data) for data in self._pending_images.values()}
+        formats.discard(None)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)',
+                [(data, tile_id) for tile_id, data in self._pending_images.items()]
+            )
+            if formats != self.formats:
+                self._set_metadata('tile_formats', ','.join(sorted(formats)))
+            # tile_count 只统计新坐标：先插入不存在的坐标，再覆盖已存在的坐标
+            # （续传时未记录完成的单元会重新渲染，可能覆盖已写入的瓦片）
+            changes_before = self.conn.total_changes
+            self.conn.executemany('INSERT OR IGNORE INTO map VALUES (?, ?, ?, ?)', self._pending)
+            inserted = self.conn.total_changes - changes_before
+            if inserted < len(self._pending):
+                self.conn.executemany(
+                    'UPDATE map SET tile_id = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                    [(tile_id, zoom, column, row) for zoom, column, row, tile_id in self._pending]
+                )
+            self.conn.executemany('INSERT INTO tiling_checkpoint VALUES (?, ?, ?, ?, ?)', self._pending_units)
+        self.tile_count += inserted
+        self.formats = formats
+        self._pending = []
+        self._pending_images = {}
+        self._pending_units = []
+
+    def _set_metadata(self, name, value):
+        self.conn.execute('DELETE FROM metadata WHERE name = ?', (name,))
+        self.conn.execute('INSERT INTO metadata VALUES (?, ?)', (name, value))
+
+    def close(self):
+        """写入剩余瓦片、合并WAL并关闭"""
+        if self.conn is None:
+            return
+        try:
+            self.flush()
+            with self.conn:
+                self.conn.execute('DROP TABLE IF EXISTS tiling_checkpoint')
+                if len(self.formats) > 1:
+                    raise Exception(f"MBTiles包含多种瓦片格式（{', '.join(sorted(self.formats))}），"
+                                    f"format 元数据无法与所有瓦片一致")
+                if self.formats:
+                    self._set_metadata('format', next(iter(self.formats)))
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self.conn.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    def abort(self):
+        """中止写入：提交已完成单元的瓦片（供续传使用）后关闭连接"""
+        if self.conn is not None:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ 中止时写入MBTiles失败: {str(e)}")
+            self.conn.close()
+            self.conn = None
+        self._pending = []
+        self._pending_images = {}
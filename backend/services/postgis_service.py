@@ -12,10 +12,14 @@ from psycopg2 import sql
 from psycopg2.extras import Json, RealDictCursor
 import time
 import uuid
+import io
 import tempfile
 import warnings
 
-from config import DB_CONFIG
+from config import DB_CONFIG, POSTGIS_CONFIG
+from utils.wkb import geojson_to_ewkb_hex
+from utils.geojson_stream import open_geojson, iter_features
+from services.geojson_analyzer import analyze_geojson, extract_crs
 
 
 class PostGISService:
@@ -81,12 +85,11 @@ class PostGISService:
         return engine
     
     def get_connection(self):
-        """获取数据库连接"""
-        connection_uri = f"postgresql://{self.db_config['user']}:{self.db_config['password']}@{self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}"
-        conn = psycopg2.connect(connection_uri, client_encoding='utf8')
-        return conn
+        """获取数据库连接（从共享连接池借出，close() 时归还）"""
+        from models.db import get_connection
+        return get_connection()
     
-    def store_geojson(self, geojson_path, file_id):
+    def store_geojson(self, geojson_path, file_id, analysis=None):
         """将GeoJSON文件存储到PostGIS数据库
         
         优先尝试 geopandas 方法，失败时回退到手动实现
@@ -94,6 +97,7 @@ class PostGISService:
         Args:
             geojson_path: GeoJSON文件路径
             file_id: 文件ID
+            analysis: 调用方已得到的 GeoJSONAnalysis，提供时手动实现不再重复分析
             
         Returns:
             表名和特性信息的字典
@@ -112,9 +116,9 @@ class PostGISService:
             except Exception as e:
                 print(f"⚠️ geopandas方法失败，回退到手动实现: {e}")
                 # 回退到手动实现
-                return self._store_geojson_manual(geojson_path, file_id)
+                return self._store_geojson_manual(geojson_path, file_id, analysis)
         else:
-            return self._store_geojson_manual(geojson_path, file_id)
+            return self._store_geojson_manual(geojson_path, file_id, analysis)
     
     def _store_geojson_with_geopandas(self, geojson_path, file_id):
         """使用geopandas存储GeoJSON"""
@@ -124,9 +128,8 @@ class PostGISService:
         
         print("📖 使用 geopandas 读取 GeoJSON 文件...")
         
-        # 首先读取GeoJSON文件以获取CRS信息
-        with open(geojson_path, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
+        # 只解析features之前的顶层成员以获取CRS信息
+        geojson_data = open_geojson(geojson_path)
         
         # 从GeoJSON中提取CRS信息
         original_srid, original_crs = self._extract_crs_from_geojson(geojson_data)
@@ -191,16 +194,18 @@ class PostGISService:
         
         return result
     
-    def _store_geojson_manual(self, geojson_path, file_id):
+    def _store_geojson_manual(self, geojson_path, file_id, analysis=None):
         """使用手动实现存储GeoJSON"""
         print("📖 使用手动方法读取 GeoJSON 文件...")
         
-        # 1. 读取GeoJSON文件
-        with open(geojson_path, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
+        # 1. 以增量方式打开GeoJSON文件（不一次性加载整个文件）
+        geojson_data = open_geojson(geojson_path)
         
-        # 2. 分析GeoJSON特性
-        feature_info = self._analyze_geojson(geojson_data)
+        # 2. 分析GeoJSON特性（复用调用方的分析结果）
+        if analysis is not None:
+            feature_info = analysis.to_feature_info()
+        else:
+            feature_info = self._analyze_geojson(geojson_data)
         print(f"GeoJSON分析结果: {feature_info}")
         
         # 🔧 新方案：无论是否为混合几何类型，都存储到单一表中
@@ -209,11 +214,8 @@ class PostGISService:
         print(f"   - 几何类型: {feature_info['geometry_types']}")
         print(f"   - 是否混合: {'是' if len(feature_info['geometry_types']) > 1 else '否'}")
         
-        # 为手动实现添加几何类型信息到每个要素
-        geojson_data_with_type = self._add_geom_type_to_features(geojson_data)
-        
-        # 创建表并导入数据（包含几何类型列）
-        self._create_and_import_data_with_geom_type(table_name, geojson_data_with_type, feature_info)
+        # 创建表并导入数据（包含几何类型列，导入时按要素填充geom_type）
+        self._create_and_import_data_with_geom_type(table_name, geojson_data, feature_info)
         
         result = {
             "success": True,
@@ -558,155 +560,26 @@ class PostGISService:
         """从GeoJSON数据中提取CRS信息
         
         Args:
-            geojson_data: GeoJSON数据字典
+            geojson_data: GeoJSON数据字典或流式文档
             
         Returns:
             tuple: (srid, crs_string) 其中srid是数字，crs_string是字符串格式
         """
-        # 默认值
-        default_srid = 4326
-        default_crs = 'EPSG:4326'
-        
-        # 检查是否有crs字段
-        if 'crs' not in geojson_data:
-            print("⚠️ GeoJSON文件中没有CRS信息，使用默认WGS84 (EPSG:4326)")
-            return default_srid, default_crs
-        
-        crs_info = geojson_data['crs']
-        
-        # 处理不同的CRS格式
-        if isinstance(crs_info, dict):
-            if crs_info.get('type') == 'name':
-                # 处理命名CRS格式: {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::4547"}}
-                properties = crs_info.get('properties', {})
-                name = properties.get('name', '')
-                
-                if 'EPSG::' in name:
-                    # 提取EPSG代码
-                    try:
-                        epsg_code = name.split('EPSG::')[-1]
-                        srid = int(epsg_code)
-                        crs_string = f'EPSG:{srid}'
-                        print(f"✅ 从GeoJSON中解析到CRS: {crs_string}")
-                        return srid, crs_string
-                    except (ValueError, IndexError) as e:
-                        print(f"⚠️ 解析EPSG代码失败: {name}, 错误: {e}")
-                        return default_srid, default_crs
-                
-                elif 'EPSG:' in name:
-                    # 处理EPSG:4547格式
-                    try:
-                        epsg_code = name.split('EPSG:')[-1]
-                        srid = int(epsg_code)
-                        crs_string = f'EPSG:{srid}'
-                        print(f"✅ 从GeoJSON中解析到CRS: {crs_string}")
-                        return srid, crs_string
-                    except (ValueError, IndexError) as e:
-                        print(f"⚠️ 解析EPSG代码失败: {name}, 错误: {e}")
-                        return default_srid, default_crs
-                
-                else:
-                    print(f"⚠️ 不支持的CRS格式: {name}")
-                    return default_srid, default_crs
-            
-            elif crs_info.get('type') == 'EPSG':
-                # 处理EPSG格式: {"type": "EPSG", "properties": {"code": 4547}}
-                properties = crs_info.get('properties', {})
-                code = properties.get('code')
-                if code:
-                    try:
-                        srid = int(code)
-                        crs_string = f'EPSG:{srid}'
-                        print(f"✅ 从GeoJSON中解析到CRS: {crs_string}")
-                        return srid, crs_string
-                    except ValueError as e:
-                        print(f"⚠️ 解析EPSG代码失败: {code}, 错误: {e}")
-                        return default_srid, default_crs
-            
-            else:
-                print(f"⚠️ 不支持的CRS类型: {crs_info.get('type')}")
-                return default_srid, default_crs
-        
-        else:
-            print(f"⚠️ CRS信息格式不正确: {crs_info}")
-            return default_srid, default_crs
+        srid, crs_string = extract_crs(geojson_data)
+        print(f"✅ 使用坐标系: {crs_string}")
+        return srid, crs_string
 
     def _analyze_geojson(self, geojson_data):
         """分析GeoJSON数据，提取特性信息"""
-        # 从GeoJSON中提取CRS信息
-        srid, crs_string = self._extract_crs_from_geojson(geojson_data)
-        
-        feature_info = {
-            "geometry_type": None,
-            "geometry_types": set(),  # 存储所有发现的几何类型
-            "properties": {},
-            "feature_count": 0,
-            "srid": srid,  # 使用从GeoJSON中解析的SRID
-            "crs": crs_string  # 添加CRS字符串信息
-        }
-        
-        # 处理FeatureCollection
-        if geojson_data.get('type') == 'FeatureCollection':
-            features = geojson_data.get('features', [])
-            feature_info['feature_count'] = len(features)
-            
-            # 分析所有要素的几何类型
-            for feature in features:
-                if 'geometry' in feature and feature['geometry'] and 'type' in feature['geometry']:
-                    geom_type = feature['geometry']['type']
-                    feature_info['geometry_types'].add(geom_type)
-                
-                # 分析属性（使用第一个有属性的要素）
-                if 'properties' in feature and feature['properties'] and not feature_info['properties']:
-                    for key, value in feature['properties'].items():
-                        if value is not None:
-                            if isinstance(value, int):
-                                feature_info['properties'][key] = 'integer'
-                            elif isinstance(value, float):
-                                feature_info['properties'][key] = 'double precision'
-                            elif isinstance(value, bool):
-                                feature_info['properties'][key] = 'boolean'
-                            else:
-                                feature_info['properties'][key] = 'text'
-            
-            # 确定主要几何类型
-            if len(feature_info['geometry_types']) == 1:
-                feature_info['geometry_type'] = list(feature_info['geometry_types'])[0]
-            elif len(feature_info['geometry_types']) > 1:
-                # 混合几何类型，使用通用类型
-                print(f"⚠️ 检测到混合几何类型: {feature_info['geometry_types']}")
-                feature_info['geometry_type'] = 'Geometry'  # 使用通用几何类型
-            else:
-                print("⚠️ 未检测到有效的几何类型")
-                feature_info['geometry_type'] = 'Geometry'  # 默认使用通用几何类型
+        feature_info = analyze_geojson(geojson_data).to_feature_info()
         
-        # 处理单个Feature
-        elif geojson_data.get('type') == 'Feature':
-            feature_info['feature_count'] = 1
-            
-            if 'geometry' in geojson_data and geojson_data['geometry'] and 'type' in geojson_data['geometry']:
-                geom_type = geojson_data['geometry']['type']
-                feature_info['geometry_type'] = geom_type
-                feature_info['geometry_types'].add(geom_type)
-            
-            # 分析属性
-            if 'properties' in geojson_data and geojson_data['properties']:
-                for key, value in geojson_data['properties'].items():
-                    if value is not None:
-                        if isinstance(value, int):
-                            feature_info['properties'][key] = 'integer'
-                        elif isinstance(value, float):
-                            feature_info['properties'][key] = 'double precision'
-                        elif isinstance(value, bool):
-                            feature_info['properties'][key] = 'boolean'
-                        else:
-                            feature_info['properties'][key] = 'text'
-        
-        # 转换为列表以便序列化
-        feature_info['geometry_types'] = list(feature_info['geometry_types'])
+        if len(feature_info['geometry_types']) > 1:
+            print(f"⚠️ 检测到混合几何类型: {feature_info['geometry_types']}")
+        elif not feature_info['geometry_types']:
+            print("⚠️ 未检测到有效的几何类型")
         
         print(f"📊 GeoJSON分析完成:")
-        print(f"   - 坐标系: {crs_string} (SRID: {srid})")
+        print(f"   - 坐标系: {feature_info['crs']} (SRID: {feature_info['srid']})")
         print(f"   - 要素数量: {feature_info['feature_count']}")
         print(f"   - 几何类型: {feature_info['geometry_types']}")
         
@@ -855,7 +728,245 @@ class PostGISService:
         return create_table_sql
     
     def _import_geojson_data(self, table_name, geojson_data, feature_info, conn=None):
-        """导入GeoJSON数据"""
+        """导入GeoJSON数据
+        
+        默认使用COPY批量导入（POSTGIS_CONFIG['import_method'] = 'copy'），
+        设置为 'insert' 时使用逐要素INSERT
+        """
+        if POSTGIS_CONFIG.get('import_method', 'copy') == 'copy':
+            return self._copy_import_features(
+                table_name, iter_features(geojson_data), feature_info, conn
+            )
+        return self._insert_import_geojson_data(table_name, geojson_data, feature_info, conn)
+    
+    def _copy_import_features(self, table_name, features, feature_info, conn=None):
+        """使用COPY将要素流式导入临时表，再集合式写入目标表
+        
+        几何对象在Python端编码为十六进制EWKB，属性按目标列类型校验；
+        无法导入的要素写入 {table_name}_rejects 表而不是中断导入。
+        Python端校验之外仍被服务端拒绝的批次会回滚到保存点后逐行重试，
+        被拒绝的行同样写入拒绝表。拒绝表跨导入保留，同一次导入的记录
+        rejected_at 相同（事务开始时间）。
+        
+        Args:
+            table_name: 目标表名（需已创建）
+            features: 要素可迭代对象
+            feature_info: _analyze_geojson 的分析结果
+            conn: 可选的数据库连接
+            
+        Returns:
+            导入统计信息字典
+        """
+        from models.db import format_copy_value
+        
+        close_conn = False
+        if conn is None:
+            conn = self.get_connection()
+            close_conn = True
+        
+        batch_size = POSTGIS_CONFIG.get('copy_batch_size', 5000)
+        staging_table = f"{table_name}_staging"
+        reject_table = f"{table_name}_rejects"
+        srid = feature_info['srid']
+        property_types = feature_info['properties']
+        target_geometry_type = (feature_info.get('geometry_type') or 'Geometry').upper()
+        start_time = time.time()
+        
+        try:
+            cursor = conn.cursor()
+            
+            # 1. 读取目标表列（排除自增主键），创建同结构的临时表
+            cursor.execute(sql.SQL("SELECT * FROM {} LIMIT 0").format(sql.Identifier(table_name)))
+            columns = [desc[0] for desc in cursor.description if desc[0] != 'id']
+            column_list = sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+            
+            cursor.execute(sql.SQL(
+                "CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+            ).format(sql.Identifier(staging_table), column_list, sql.Identifier(table_name)))
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN feature_index BIGINT").format(
+                sql.Identifier(staging_table)
+            ))
+            
+            # 2. 拒绝要素表（保留之前导入的记录）
+            cursor.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    feature_index BIGINT,
+                    reason TEXT,
+                    feature TEXT,
+                    rejected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """).format(sql.Identifier(reject_table)))
+            
+            copy_staging_sql = sql.SQL("COPY {} ({}, feature_index) FROM STDIN").format(
+                sql.Identifier(staging_table), column_list
+            )
+            copy_reject_sql = sql.SQL("COPY {} (feature_index, reason, feature) FROM STDIN").format(
+                sql.Identifier(reject_table)
+            )
+            
+            reject_buffer = io.StringIO()
+            batch = []  # (要素序号, COPY行, 要素)
+            success_count = 0
+            error_count = 0
+            
+            def reject(index, reason, feature):
+                nonlocal error_count
+                error_count += 1
+                try:
+                    feature_text = json.dumps(feature, ensure_ascii=False)
+                except Exception:
+                    feature_text = str(feature)
+                reject_buffer.write('\t'.join(
+                    format_copy_value(v) for v in (index, reason, feature_text)
+                ))
+                reject_buffer.write('\n')
+            
+            def copy_lines(lines):
+                cursor.copy_expert(copy_staging_sql, io.StringIO(''.join(lines)))
+            
+            def flush():
+                nonlocal success_count
+                if batch:
+                    cursor.execute("SAVEPOINT copy_batch")
+                    try:
+                        copy_lines(line for _, line, _ in batch)
+                        success_count += len(batch)
+                    except psycopg2.Error as e:
+                        # 服务端拒绝了批次中的某一行（类型转换、约束等），逐行重试定位
+                        cursor.execute("ROLLBACK TO SAVEPOINT copy_batch")
+                        print(f"⚠️ 批量COPY失败，逐行重试 {len(batch)} 个要素: {str(e).strip()}")
+                        for index, line, feature in batch:
+                            cursor.execute("SAVEPOINT copy_row")
+                            try:
+                                copy_lines([line])
+                                success_count += 1
+                            except psycopg2.Error as row_error:
+                                cursor.execute("ROLLBACK TO SAVEPOINT copy_row")
+                                reject(index, str(row_error).strip(), feature)
+                            cursor.execute("RELEASE SAVEPOINT copy_row")
+                    cursor.execute("RELEASE SAVEPOINT copy_batch")
+                    batch.clear()
+                
+                if reject_buffer.tell():
+                    reject_buffer.seek(0)
+                    cursor.copy_expert(copy_reject_sql, reject_buffer)
+                    reject_buffer.seek(0)
+                    reject_buffer.truncate()
+            
+            # 3. 流式编码要素并分批COPY
+            pending = 0
+            for index, feature in enumerate(features):
+                try:
+                    row = self._feature_to_copy_row(
+                        feature, columns, property_types, srid, target_geometry_type
+                    )
+                    line = '\t'.join(format_copy_value(v) for v in row) + f"\t{index}\n"
+                    batch.append((index, line, feature))
+                except Exception as e:
+                    reject(index, str(e), feature)
+                
+                pending += 1
+                if pending >= batch_size:
+                    flush()
+                    pending = 0
+                    print(f"已处理 {index + 1} 个要素...")
+            flush()
+            
+            # 4. 集合式写入目标表，保持原始要素顺序
+            cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} ORDER BY feature_index").format(
+                sql.Identifier(table_name), column_list, column_list, sql.Identifier(staging_table)
+            ))
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(staging_table)))
+            
+            conn.commit()
+            
+            elapsed = time.time() - start_time
+            features_per_second = success_count / elapsed if elapsed > 0 else float(success_count)
+            print(f"✅ 数据导入完成（COPY）")
+            print(f"   - 成功导入: {success_count} 个要素")
+            print(f"   - 耗时: {elapsed:.2f} 秒 ({features_per_second:.0f} 要素/秒)")
+            if error_count > 0:
+                print(f"   - 失败跳过: {error_count} 个要素，详见表 {reject_table}")
+            
+            if success_count == 0:
+                raise Exception("没有成功导入任何要素")
+            
+            return {
+                'success_count': success_count,
+                'error_count': error_count,
+                'reject_table': reject_table if error_count else None,
+                'elapsed': elapsed,
+                'features_per_second': features_per_second
+            }
+            
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            print(f"❌ 导入数据失败: {str(e)}")
+            raise
+        finally:
+            if close_conn and conn:
+                conn.close()
+    
+    def _feature_to_copy_row(self, feature, columns, property_types, srid, target_geometry_type):
+        """将要素转换为与目标列对应的COPY行，无法导入时抛出异常"""
+        if not isinstance(feature, dict) or 'properties' not in feature or 'geometry' not in feature:
+            raise ValueError("无效要素：缺少properties或geometry")
+        
+        geometry = feature['geometry']
+        if not geometry or geometry.get('type') is None:
+            raise ValueError("无效要素：几何对象为空")
+        
+        geom_type = geometry['type']
+        if target_geometry_type != 'GEOMETRY' and geom_type.upper() != target_geometry_type:
+            raise ValueError(f"几何类型 {geom_type} 与目标列类型 {target_geometry_type} 不一致")
+        
+        properties = feature['properties'] or {}
+        row = []
+        for column in columns:
+            if column == 'geom':
+                row.append(geojson_to_ewkb_hex(geometry, srid))
+            elif column == 'geom_type':
+                row.append(geom_type)
+            elif column in property_types:
+                row.append(self._coerce_property_value(properties.get(column), property_types[column]))
+            else:
+                row.append(None)
+        return row
+    
+    def _coerce_property_value(self, value, column_type):
+        """按目标列类型校验并转换属性值"""
+        if value is None:
+            return None
+        
+        column_type = column_type.lower()
+        if column_type in ('integer', 'bigint'):
+            if isinstance(value, float):
+                value = round(value)
+            value = int(value)
+            if column_type == 'integer' and not -2147483648 <= value <= 2147483647:
+                raise ValueError(f"属性值 {value} 超出integer范围")
+            return value
+        if column_type == 'double precision':
+            return float(value)
+        if column_type == 'boolean':
+            if isinstance(value, bool):
+                return value
+            text = str(value).strip().lower()
+            if text in ('true', 't', '1', 'yes', 'y'):
+                return True
+            if text in ('false', 'f', '0', 'no', 'n'):
+                return False
+            raise ValueError(f"属性值 {value} 不是有效的boolean")
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        if isinstance(value, str) and '\x00' in value:
+            # PostgreSQL 文本类型不能包含NUL字符
+            raise ValueError("属性值包含NUL字符")
+        return value
+    
+    def _insert_import_geojson_data(self, table_name, geojson_data, feature_info, conn=None):
+        """导入GeoJSON数据（逐要素INSERT）"""
         close_conn = False
         if conn is None:
             conn = self.get_connection()
@@ -870,9 +981,7 @@ class PostGISService:
             
             # 处理FeatureCollection
             if geojson_data.get('type') == 'FeatureCollection':
-                features = geojson_data.get('features', [])
-                
-                for i, feature in enumerate(features):
+                for i, feature in enumerate(iter_features(geojson_data)):
                     try:
                         self._insert_feature(table_name, feature, feature_info, cursor)
                         success_count += 1
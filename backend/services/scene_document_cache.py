@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+场景文档缓存
+
+打开场景时返回的 {scene, layers} JSON 按场景ID缓存在进程内（已序列化的字节和ETag）：
+- scenes.doc_version 为场景版本号，场景和场景图层的每次修改都会递增（SceneService.bump_scene_version）
+- 本进程内的修改立即使缓存失效；其他进程的缓存在 revalidate_seconds 秒后
+  用一次主键查询核对版本号，版本未变则继续使用
+- 图层引用的服务、文件在场景之外被修改时不会递增版本号，缓存最多保留 max_age_seconds 秒
+- ETag 为文档内容的摘要（强ETag），客户端带 If-None-Match 时可直接返回304
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from config import SCENE_CACHE_CONFIG
+from models.db import execute_query
+
+
+class SceneDocument:
+    """一个已序列化的场景文档"""
+
+    __slots__ = ('scene_id', 'version', 'body', 'etag', 'built_at', 'checked_at')
+
+    def __init__(self, scene_id, version, body):
+        self.scene_id = scene_id
+        self.version = version
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.built_at = self.checked_at = time.time()
+
+
+class SceneDocumentCache:
+    """按场景ID缓存场景文档"""
+
+    def __init__(self, revalidate_seconds=None, max_age_seconds=None, max_scenes=None):
+        self.revalidate_seconds = SCENE_CACHE_CONFIG['revalidate_seconds'] if revalidate_seconds is None else revalidate_seconds
+        self.max_age_seconds = SCENE_CACHE_CONFIG['max_age_seconds'] if max_age_seconds is None else max_age_seconds
+        self.max_scenes = SCENE_CACHE_CONFIG['max_scenes'] if max_scenes is None else max_scenes
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current_version(scene_id):
+        """数据库中的场景版本号，场景不存在时返回None"""
+        result = execute_query("SELECT doc_version FROM scenes WHERE id = %s", (scene_id,))
+        return result[0]['doc_version'] if result else None
+
+    def get(self, scene_id, builder):
+        """获取场景文档，缓存不可用时调用 builder(scene_id) 生成
+
+        Args:
+            scene_id: 场景ID
+            builder: 返回序列化后的文档字节，场景不存在时返回None
+
+        Returns:
+            SceneDocument，场景不存在时返回None
+        """
+        now = time.time()
+        with self._lock:
+            document = self._documents.get(scene_id)
+            if document is not None:
+                self._documents.move_to_end(scene_id)
+
+        if document is not None and now - document.built_at < self.max_age_seconds:
+            if now - document.checked_at < self.revalidate_seconds:
+                return document
+            # 核对版本号（其他进程可能修改了场景）
+            if self.current_version(scene_id) == document.version:
+                document.checked_at = now
+                return document
+
+        # 先读版本号再生成文档：生成期间发生的修改会让版本号变大，下次核对时重新生成
+        version = self.current_version(scene_id)
+        if version is None:
+            self.invalidate(scene_id)
+            return None
+        body = builder(scene_id)
+        if body is None:
+            self.invalidate(scene_id)
+            return None
+
+        document = SceneDocument(scene_id, version, body)
+        with self._lock:
+            self._documents[scene_id] = document
+            self._documents.move_to_end(scene_id)
+            while len(self._documents) > self.max_scenes:
+                self._documents.popitem(last=False)
+        return document
+
+    def invalidate(self, scene_id):
+        with self._lock:
+            self._documents.pop(scene_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+scene_document_cache = SceneDocumentCache()
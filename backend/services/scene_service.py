@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from models.db import execute_query, insert_with_snowflake_id
+from services.scene_document_cache import scene_document_cache
 import json
 
 class SceneService:
@@ -16,7 +17,9 @@ class SceneService:
         Returns:
             场景ID
         """
-        return insert_with_snowflake_id('scenes', scene_data)
+        scene_id = insert_with_snowflake_id('scenes', scene_data)
+        scene_document_cache.invalidate(scene_id)
+        return scene_id
     
     def update_scene(self, scene_id, scene_data):
         """更新场景
@@ -33,7 +36,8 @@ class SceneService:
         SET name = %(name)s,
             description = %(description)s,
             is_public = %(is_public)s,
-            updated_at = CURRENT_TIMESTAMP
+            updated_at = CURRENT_TIMESTAMP,
+            doc_version = doc_version + 1
         WHERE id = %(scene_id)s
         """
         
@@ -45,6 +49,7 @@ class SceneService:
         }
         
         execute_query(sql, params)
+        scene_document_cache.invalidate(scene_id)
         return True
     
     def delete_scene(self, scene_id):
@@ -63,9 +68,37 @@ class SceneService:
         # 删除场景
         sql = "DELETE FROM scenes WHERE id = %(scene_id)s"
         execute_query(sql, {'scene_id': scene_id})
+        scene_document_cache.invalidate(scene_id)
         
         return True
     
+    def bump_scene_version(self, scene_id):
+        """递增场景文档版本号，使所有进程缓存的场景文档失效
+        
+        场景图层的每次修改（包括路由中直接执行的SQL）之后都要调用。
+        """
+        execute_query("UPDATE scenes SET doc_version = doc_version + 1 WHERE id = %s", (scene_id,), fetch=False)
+        scene_document_cache.invalidate(scene_id)
+    
+    def get_scene_document(self, scene_id, serialize):
+        """获取场景文档（场景信息和图层列表），优先使用缓存
+        
+        Args:
+            scene_id: 场景ID
+            serialize: 把 {'scene': ..., 'layers': ...} 序列化为JSON字符串的函数
+            
+        Returns:
+            SceneDocument（body 为JSON字节，etag 为内容摘要），场景不存在时返回None
+        """
+        def build(scene_id):
+            scene = self.get_scene_by_id(scene_id)
+            if not scene:
+                return None
+            layers = self.get_layers_by_scene(scene_id)
+            return serialize({'scene': scene, 'layers': layers}).encode('utf-8')
+        
+        return scene_document_cache.get(scene_id, build)
+    
     def get_scenes(self, user_id=None, public_only=False):
         """获取场景列表
         
@@ -243,7 +276,9 @@ class SceneService:
         }
         
         # 使用雪花算法生成ID并插入
-        return insert_with_snowflake_id('scene_layers', layer_insert_data)
+        scene_layer_id = insert_with_snowflake_id('scene_layers', layer_insert_data)
+        self.bump_scene_version(layer_data.get('scene_id'))
+        return scene_layer_id
     
     def update_scene_layer(self, scene_id, layer_id, layer_data):
         """更新场景图层
@@ -293,6 +328,7 @@ class SceneService:
         """
         
         execute_query(sql, params)
+        self.bump_scene_version(scene_id)
         return True
     
     def delete_layer(self, layer_id):
@@ -304,21 +340,27 @@ class SceneService:
         Returns:
             True 如果删除成功
         """
-        sql = "DELETE FROM scene_layers WHERE layer_id = %(layer_id)s"
-        execute_query(sql, {'layer_id': layer_id})
+        sql = "DELETE FROM scene_layers WHERE layer_id = %(layer_id)s RETURNING scene_id"
+        deleted = execute_query(sql, {'layer_id': layer_id})
+        for scene_id in {row['scene_id'] for row in deleted}:
+            self.bump_scene_version(scene_id)
         return True
     
     def get_layers_by_scene(self, scene_id):
         """获取场景的图层列表
         
+        场景图层及其Martin服务、GeoServer图层、文件信息在一条SQL中关联查出，
+        查询次数不随图层数量增加。
+        
         Args:
             scene_id: 场景ID
             
         Returns:
             图层列表
         """
-        # 首先获取场景图层基本信息
-        base_sql = """
+        # martin_service_type 为 geojson/shp/dxf 时只匹配同类型的服务，其他情况按ID匹配；
+        # Martin服务关联的文件按原始文件名匹配（取一条）
+        sql = """
         SELECT 
             sl.id as scene_layer_id,
             sl.layer_id,
@@ -331,276 +373,196 @@ class SceneService:
             sl.custom_style as style_config,
             sl.queryable,
             sl.selectable,
-            sl.created_at
+            sl.created_at,
+            ms.id as ms_id,
+            ms.vector_type as ms_service_type,
+            ms.file_id as ms_martin_file_id,
+            ms.original_filename as ms_original_filename,
+            ms.table_name as ms_table_name,
+            ms.mvt_url as ms_mvt_url,
+            ms.tilejson_url as ms_tilejson_url,
+            ms.service_url as ms_service_url,
+            ms.style as ms_style,
+            CASE WHEN sl.martin_service_type = 'dxf' THEN ms.vector_info END as ms_vector_info,
+            mf.id as ms_file_id,
+            mf.file_type as ms_file_type,
+            mf.discipline as ms_discipline,
+            gl.id as gl_id,
+            CONCAT(gw.name, ':', gl.name) as gl_geoserver_layer,
+            gl.name as gl_layer_name_only,
+            gl.title as gl_title,
+            gl.abstract as gl_abstract,
+            gl.enabled as gl_enabled,
+            gl.wms_url as gl_wms_url,
+            gl.wfs_url as gl_wfs_url,
+            gl.wcs_url as gl_wcs_url,
+            gw.name as gl_workspace_name,
+            gf.file_name as gl_layer_name,
+            gf.file_type as gl_file_type,
+            gf.discipline as gl_discipline
         FROM scene_layers sl
+        LEFT JOIN vector_martin_services ms
+            ON sl.martin_service_id IS NOT NULL
+            AND ms.id = sl.martin_service_id
+            AND ms.status = 'active'
+            AND (sl.martin_service_type IS NULL
+                 OR sl.martin_service_type NOT IN ('geojson', 'shp', 'dxf')
+                 OR ms.vector_type = sl.martin_service_type)
+        LEFT JOIN LATERAL (
+            SELECT f.id, f.file_type, f.discipline
+            FROM files f
+            WHERE f.file_name = ms.original_filename
+            LIMIT 1
+        ) mf ON TRUE
+        LEFT JOIN geoserver_layers gl
+            ON sl.martin_service_id IS NULL AND gl.id = sl.layer_id
+        LEFT JOIN geoserver_workspaces gw ON gl.workspace_id = gw.id
+        LEFT JOIN files gf ON gl.file_id = gf.id
         WHERE sl.scene_id = %(scene_id)s
         ORDER BY sl.layer_order ASC
         """
         
-        scene_layers = execute_query(base_sql, {'scene_id': scene_id})
+        rows = execute_query(sql, {'scene_id': scene_id})
         
-        # 处理每个图层，根据martin_service_id判断是Martin服务还是GeoServer服务
-        result = []
+        return [self._build_scene_layer(row) for row in rows]
+    
+    @staticmethod
+    def _parse_json(value, description):
+        """解析JSON字段（已是dict时直接返回），失败返回空字典"""
+        if not value:
+            return {}
+        if not isinstance(value, str):
+            return value
+        try:
+            return json.loads(value)
+        except (json.JSONDecodeError, TypeError) as e:
+            print(f"解析{description}失败: {str(e)}")
+            return {}
+    
+    def _build_scene_layer(self, row):
+        """把关联查询的一行转换为图层信息"""
+        layer_id = row['layer_id']
+        martin_service_id = row['martin_service_id']
         
-        for layer in scene_layers:
-            layer_id = layer['layer_id']
-            martin_service_id = layer['martin_service_id']
-            
-            # 处理基本字段
-            if 'visibility' in layer:
-                layer['visibility'] = bool(layer['visibility'])
-            
-            # 处理不透明度字段
-            if 'opacity' in layer:
-                if layer['opacity'] is None or layer['opacity'] == 0:
-                    layer['opacity'] = 1.0  # 默认100%不透明度
-                else:
-                    layer['opacity'] = float(layer['opacity'])
-            else:
-                layer['opacity'] = 1.0
-            
-            if layer.get('style_config'):
-                try:
-                    if isinstance(layer['style_config'], str):
-                        layer['style_config'] = json.loads(layer['style_config'])
-                except (json.JSONDecodeError, TypeError):
-                    layer['style_config'] = {}
-            else:
-                layer['style_config'] = {}
-            
-            # 判断是否为Martin服务
-            if martin_service_id:
-                martin_service_type = layer.get('martin_service_type')
-                martin_result = None
+        layer = {key: value for key, value in row.items()
+                 if not key.startswith('ms_') and not key.startswith('gl_')}
+        
+        # 处理基本字段
+        layer['visibility'] = bool(layer['visibility'])
+        
+        # 处理不透明度字段
+        if layer['opacity'] is None or layer['opacity'] == 0:
+            layer['opacity'] = 1.0  # 默认100%不透明度
+        else:
+            layer['opacity'] = float(layer['opacity'])
+        
+        layer['style_config'] = self._parse_json(layer.get('style_config'), '图层样式配置')
+        
+        # 判断是否为Martin服务
+        if martin_service_id:
+            if row['ms_id'] is not None:
+                # 解析Martin服务的样式配置
+                martin_style_config = self._parse_json(row['ms_style'], 'Martin服务样式配置')
                 
-                # 根据服务类型查询对应的表
-                if martin_service_type == 'geojson':
-                    martin_sql = """
-                    SELECT 
-                        'geojson' as service_type,
-                        ms.id,
-                        ms.file_id as martin_file_id,
-                        ms.original_filename,
-                        ms.table_name,
-                        ms.mvt_url,
-                        ms.tilejson_url,
-                        ms.service_url,
-                        ms.style,
-                        ms.vector_info,
-                        ms.status,
-                        f.id as file_id,
-                        f.file_type,
-                        f.discipline
-                    FROM vector_martin_services ms
-                    LEFT JOIN files f ON ms.original_filename = f.file_name
-                    WHERE ms.id = %(martin_service_id)s AND ms.status = 'active' AND ms.vector_type = 'geojson'
-                    """
-                    martin_result = execute_query(martin_sql, {'martin_service_id': martin_service_id})
-                elif martin_service_type == 'shp':
-                    martin_sql = """
-                    SELECT 
-                        'shp' as service_type,
-                        ms.id,
-                        ms.file_id as martin_file_id,
-                        ms.original_filename,
-                        ms.table_name,
-                        ms.mvt_url,
-                        ms.tilejson_url,
-                        ms.service_url,
-                        ms.style,
-                        ms.vector_info,
-                        ms.status,
-                        f.id as file_id,
-                        f.file_type,
-                        f.discipline
-                    FROM vector_martin_services ms
-                    LEFT JOIN files f ON ms.original_filename = f.file_name
-                    WHERE ms.id = %(martin_service_id)s AND ms.status = 'active' AND ms.vector_type = 'shp'
-                    """
-                    martin_result = execute_query(martin_sql, {'martin_service_id': martin_service_id})
-                elif martin_service_type == 'dxf':
-                    martin_sql = """
-                    SELECT 
-                        'dxf' as service_type,
-                        ms.id,
-                        ms.file_id as martin_file_id,
-                        ms.original_filename,
-                        ms.table_name,
-                        ms.mvt_url,
-                        ms.tilejson_url,
-                        ms.service_url,
-                        ms.style,
-                        ms.vector_info,
-                        ms.status,
-                        f.id as file_id,
-                        f.file_type,
-                        f.discipline
-                    FROM vector_martin_services ms
-                    LEFT JOIN files f ON ms.original_filename = f.file_name
-                    WHERE ms.id = %(martin_service_id)s AND ms.status = 'active' AND ms.vector_type = 'dxf'
-                    """
-                    martin_result = execute_query(martin_sql, {'martin_service_id': martin_service_id})
-                else:
-                    # 如果没有服务类型信息，查询统一表，根据ID获取
-                    martin_sql = """
-                    SELECT 
-                        ms.vector_type as service_type,
-                        ms.id,
-                        ms.file_id as martin_file_id,
-                        ms.original_filename,
-                        ms.table_name,
-                        ms.mvt_url,
-                        ms.tilejson_url,
-                        ms.service_url,
-                        ms.style,
-                        ms.status,
-                        f.id as file_id,
-                        f.file_type,
-                        f.discipline
-                    FROM vector_martin_services ms
-                    LEFT JOIN files f ON ms.original_filename = f.file_name
-                    WHERE ms.id = %(martin_service_id)s AND ms.status = 'active'
-                    """
-                    martin_result = execute_query(martin_sql, {'martin_service_id': martin_service_id})
+                # 对于DXF类型，尝试从vector_info中读取样式配置
+                if row['ms_vector_info']:
+                    vector_info = self._parse_json(row['ms_vector_info'], 'DXF Martin服务vector_info')
+                    dxf_style_config = vector_info.get('style_config', {})
+                    if dxf_style_config:
+                        martin_style_config = dxf_style_config
                 
-                if martin_result:
-                    martin_info = martin_result[0]
-                    
-                    # 解析Martin服务的样式配置
-                    martin_style_config = {}
-                    if martin_info.get('style'):
-                        try:
-                            if isinstance(martin_info['style'], str):
-                                martin_style_config = json.loads(martin_info['style'])
-                            else:
-                                martin_style_config = martin_info['style']
-                        except (json.JSONDecodeError, TypeError) as e:
-                            print(f"解析Martin服务样式配置失败: {str(e)}")
-                            martin_style_config = {}
-                    
-                    # 对于DXF类型，尝试从vector_info中读取样式配置
-                    if martin_info.get('service_type') == 'dxf' and martin_info.get('vector_info'):
-                        try:
-                            vector_info = json.loads(martin_info['vector_info']) if isinstance(martin_info['vector_info'], str) else martin_info['vector_info']
-                            dxf_style_config = vector_info.get('style_config', {})
-                            if dxf_style_config:
-                                martin_style_config = dxf_style_config
-                                print(f"从vector_info读取DXF样式配置: {martin_style_config}")
-                        except (json.JSONDecodeError, TypeError) as e:
-                            print(f"解析DXF Martin服务vector_info失败: {str(e)}")
-                    
-                    # 构建Martin图层信息
-                    layer.update({
-                        'id': layer_id,  # 保持原有ID
-                        'layer_name': martin_info['original_filename'],
-                        'layer_name_only': martin_info['original_filename'],
-                        'title': martin_info['original_filename'],
-                        'abstract': f"Martin MVT瓦片服务 - {martin_info['original_filename']}",
-                        'enabled': True,
-                        'file_type': martin_info['file_type'],
-                        'discipline': martin_info['discipline'],
-                        'workspace_name': 'martin',
-                        'geoserver_layer': None,
-                        'wms_url': None,
-                        'wfs_url': None,
-                        'wcs_url': None,
-                        # Martin服务特有字段
-                        'service_type': 'martin',  # 统一设置为martin，不使用具体的子类型
-                        'martin_service_subtype': martin_info['service_type'],  # 子类型单独存储
-                        'martin_service_id': martin_service_id,
-                        'martin_file_id': martin_info['martin_file_id'],
-                        'martin_table_name': martin_info['table_name'],
-                        'service_url': martin_info['service_url'],
-                        'mvt_url': martin_info['mvt_url'],
-                        'tilejson_url': martin_info['tilejson_url'],
-                        'file_id': martin_info['file_id'],
-                        # 样式配置
-                        'style_config': martin_style_config
-                    })
-                else:
-                    # Martin服务不存在
-                    layer.update({
-                        'id': layer_id,
-                        'layer_name': f'Martin服务不存在 (ID: {martin_service_id})',
-                        'layer_name_only': 'Martin服务不存在',
-                        'title': 'Martin服务不存在',
-                        'abstract': 'Martin服务已被删除',
-                        'enabled': False,
-                        'file_type': 'unknown',
-                        'discipline': 'unknown',
-                        'workspace_name': 'martin',
-                        'service_type': 'martin',
-                        'martin_service_subtype': 'unknown',
-                        'martin_service_id': martin_service_id,
-                        'geoserver_layer': None,
-                        'wms_url': None,
-                        'wfs_url': None,
-                        'wcs_url': None
-                    })
-            
+                # 构建Martin图层信息
+                layer.update({
+                    'id': layer_id,  # 保持原有ID
+                    'layer_name': row['ms_original_filename'],
+                    'layer_name_only': row['ms_original_filename'],
+                    'title': row['ms_original_filename'],
+                    'abstract': f"Martin MVT瓦片服务 - {row['ms_original_filename']}",
+                    'enabled': True,
+                    'file_type': row['ms_file_type'],
+                    'discipline': row['ms_discipline'],
+                    'workspace_name': 'martin',
+                    'geoserver_layer': None,
+                    'wms_url': None,
+                    'wfs_url': None,
+                    'wcs_url': None,
+                    # Martin服务特有字段
+                    'service_type': 'martin',  # 统一设置为martin，不使用具体的子类型
+                    'martin_service_subtype': row['ms_service_type'],  # 子类型单独存储
+                    'martin_service_id': martin_service_id,
+                    'martin_file_id': row['ms_martin_file_id'],
+                    'martin_table_name': row['ms_table_name'],
+                    'service_url': row['ms_service_url'],
+                    'mvt_url': row['ms_mvt_url'],
+                    'tilejson_url': row['ms_tilejson_url'],
+                    'file_id': row['ms_file_id'],
+                    # 样式配置
+                    'style_config': martin_style_config
+                })
             else:
-                # GeoServer服务处理（原有逻辑）
-                geoserver_sql = """
-                SELECT 
-                    gl.id,
-                    CONCAT(gw.name, ':', gl.name) as geoserver_layer,
-                    gl.name as layer_name_only,
-                    gl.title,
-                    gl.abstract,
-                    gl.enabled,
-                    gl.wms_url,
-                    gl.wfs_url,
-                    gl.wcs_url,
-                    gw.name as workspace_name,
-                    f.file_name as layer_name,
-                    f.file_type,
-                    f.discipline
-                FROM geoserver_layers gl
-                LEFT JOIN geoserver_workspaces gw ON gl.workspace_id = gw.id
-                LEFT JOIN files f ON gl.file_id = f.id
-                WHERE gl.id = %(layer_id)s
-                """
-                
-                geoserver_result = execute_query(geoserver_sql, {'layer_id': layer_id})
-                
-                if geoserver_result:
-                    geoserver_info = geoserver_result[0]
-                    layer.update(geoserver_info)
-                    layer['service_type'] = 'geoserver'
-                else:
-                    # GeoServer图层不存在
-                    layer.update({
-                        'id': layer_id,
-                        'layer_name': f'GeoServer图层不存在 (ID: {layer_id})',
-                        'layer_name_only': 'GeoServer图层不存在',
-                        'title': 'GeoServer图层不存在',
-                        'abstract': 'GeoServer图层已被删除',
-                        'enabled': False,
-                        'file_type': 'unknown',
-                        'discipline': 'unknown',
-                        'workspace_name': 'unknown',
-                        'service_type': 'geoserver',
-                        'geoserver_layer': None,
-                        'wms_url': None,
-                        'wfs_url': None,
-                        'wcs_url': None
-                    })
-            
-            # 🔥 关键修复：将所有ID字段转换为字符串，避免JavaScript大整数精度丢失
-            if layer.get('scene_layer_id'):
-                layer['scene_layer_id'] = str(layer['scene_layer_id'])
-            if layer.get('layer_id'):
-                layer['layer_id'] = str(layer['layer_id'])
-            if layer.get('martin_service_id'):
-                layer['martin_service_id'] = str(layer['martin_service_id'])
-            if layer.get('file_id'):
-                layer['file_id'] = str(layer['file_id'])
-            if layer.get('id'):
-                layer['id'] = str(layer['id'])
-            
-            result.append(layer)
+                # Martin服务不存在
+                layer.update({
+                    'id': layer_id,
+                    'layer_name': f'Martin服务不存在 (ID: {martin_service_id})',
+                    'layer_name_only': 'Martin服务不存在',
+                    'title': 'Martin服务不存在',
+                    'abstract': 'Martin服务已被删除',
+                    'enabled': False,
+                    'file_type': 'unknown',
+                    'discipline': 'unknown',
+                    'workspace_name': 'martin',
+                    'service_type': 'martin',
+                    'martin_service_subtype': 'unknown',
+                    'martin_service_id': martin_service_id,
+                    'geoserver_layer': None,
+                    'wms_url': None,
+                    'wfs_url': None,
+                    'wcs_url': None
+                })
+        
+        elif row['gl_id'] is not None:
+            # GeoServer服务
+            layer.update({
+                'id': row['gl_id'],
+                'geoserver_layer': row['gl_geoserver_layer'],
+                'layer_name_only': row['gl_layer_name_only'],
+                'title': row['gl_title'],
+                'abstract': row['gl_abstract'],
+                'enabled': row['gl_enabled'],
+                'wms_url': row['gl_wms_url'],
+                'wfs_url': row['gl_wfs_url'],
+                'wcs_url': row['gl_wcs_url'],
+                'workspace_name': row['gl_workspace_name'],
+                'layer_name': row['gl_layer_name'],
+                'file_type': row['gl_file_type'],
+                'discipline': row['gl_discipline'],
+                'service_type': 'geoserver'
+            })
+        else:
+            # GeoServer图层不存在
+            layer.update({
+                'id': layer_id,
+                'layer_name': f'GeoServer图层不存在 (ID: {layer_id})',
+                'layer_name_only': 'GeoServer图层不存在',
+                'title': 'GeoServer图层不存在',
+                'abstract': 'GeoServer图层已被删除',
+                'enabled': False,
+                'file_type': 'unknown',
+                'discipline': 'unknown',
+                'workspace_name': 'unknown',
+                'service_type': 'geoserver',
+                'geoserver_layer': None,
+                'wms_url': None,
+                'wfs_url': None,
+                'wcs_url': None
+            })
+        
+        # 🔥 关键修复：将所有ID字段转换为字符串，避免JavaScript大整数精度丢失
+        for key in ('scene_layer_id', 'layer_id', 'martin_service_id', 'file_id', 'id'):
+            if layer.get(key):
+                layer[key] = str(layer[key])
         
-        return result
+        return layer
     
     def reorder_layers(self, scene_id, layer_order_map):
         """重新排序场景图层
@@ -635,4 +597,5 @@ class SceneService:
             print(f"更新图层顺序: scene_id={scene_id}, layer_id={layer_id_int}, order={order}")
             execute_query(sql, params)
         
+        self.bump_scene_version(scene_id)
         return True
\ No newline at end of file
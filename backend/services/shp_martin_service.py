@@ -21,6 +21,7 @@ from config import FILE_STORAGE, DB_CONFIG
 from models.db import execute_query, insert_with_snowflake_id
 from services.postgis_service import PostGISService
 from services.martin_service import MartinService
+from services.martin_reload_scheduler import martin_reload_scheduler
 
 
 class ShpMartinService:
@@ -389,8 +390,8 @@ class ShpMartinService:
             
             # 4. 刷新Martin配置
             try:
-                self.martin_service.refresh_tables()
-                print(f"✅ Martin配置已刷新")
+                martin_reload_scheduler.request_reload(reason="取消发布SHP服务")
+                print(f"✅ 已请求重启Martin服务（合并后在后台执行）")
             except Exception as e:
                 print(f"⚠️ 刷新Martin配置失败: {e}")
             
@@ -784,12 +785,12 @@ class ShpMartinService:
                     "message": "Martin服务未启用"
                 }
             
-            # 刷新Martin配置和服务
-            success = self.martin_service.refresh_tables()
+            # 请求重启Martin（与同一时间窗口内的其他发布合并为一次），等待新数据源可用
+            source_id = f"public.{table_name}"
+            success = martin_reload_scheduler.reload_and_wait(source_id, reason=f"发布SHP {table_name}")
             
             if success:
                 # 获取MVT URL
-                source_id = f"public.{table_name}"
                 mvt_url = self.martin_service.get_mvt_url(source_id)
                 tilejson_url = f"{self.martin_service.base_url}/{source_id}"
                 
@@ -7,9 +7,11 @@ TIF Martin Service - Simplified Version
 
 import os
 import json
+import hashlib
 import uuid
 import tempfile
 import shutil
+import socket
 import subprocess
 import sqlite3
 import threading
@@ -17,16 +19,13 @@ import time
 from pathlib import Path
 from models.db import execute_query, insert_with_snowflake_id
 from config import DB_CONFIG, MARTIN_CONFIG, FILE_STORAGE
+from services.tif_tiling_engine import TileRenderEngine, empty_tile_bytes, resolve_worker_count
+from services.mbtiles_writer import MBTilesWriter, remove_mbtiles
+from services.tif_zoom_planner import plan_tif_tiling, mercator_bounds, tile_range, lonlat_bounds
+from utils.tile_encoding import resolve_tile_encoding, MBTILES_FORMATS
+from config import TIF_TILING_CONFIG
 import logging
 
-# 尝试导入PIL用于透明度处理
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-    print("⚠️ PIL库未安装，将无法处理透明背景。如需此功能请安装: pip install Pillow")
-
 logger = logging.getLogger(__name__)
 
 class TifMartinService:
@@ -37,13 +36,22 @@ class TifMartinService:
         self.upload_folder = FILE_STORAGE['upload_folder']
         self.mbtiles_folder = os.path.join(self.upload_folder, 'mbtiles')
         self.temp_folder = FILE_STORAGE.get('temp_folder', 'temp')
+        # 转换任务的断点文件和未完成的MBTiles（不放在mbtiles目录，避免被Martin加载）
+        self.jobs_folder = os.path.join(self.upload_folder, 'tif_jobs')
         
         # 确保目录存在
         os.makedirs(self.mbtiles_folder, exist_ok=True)
         os.makedirs(self.temp_folder, exist_ok=True)
+        os.makedirs(self.jobs_folder, exist_ok=True)
         
         # 进度跟踪
         self.progress_data = {}
+        # 进度回调（task_id -> callable(进度字典)），由后台任务队列同步进度到任务记录
+        self.progress_hooks = {}
+        # 本进程中正在执行内存流水线转换的文件ID，以及断点描述中记录的执行者标识
+        self._active_jobs = set()
+        self._active_jobs_lock = threading.Lock()
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
         
         print("✅ TIF Martin服务初始化完成")
     
@@ -91,6 +99,10 @@ class TifMartinService:
         # 打印到控制台（包含表情符号的消息）
         if message:
             print(message)
+        
+        hook = self.progress_hooks.get(task_id)
+        if hook is not None:
+            hook(self.progress_data[task_id])
     
     def get_file_coordinate_system(self, file_id):
         """从数据库获取文件的坐标系信息"""
@@ -104,9 +116,31 @@ class TifMartinService:
             print(f"⚠️ 获取坐标系信息失败: {str(e)}")
             return 'EPSG:4326'
     
-    def tif_to_mbtiles_and_publish(self, file_id, file_path, original_filename, user_id=None, max_zoom=18, min_zoom=2, task_id=None):
-        """将TIF文件转换为MBTiles并发布为Martin服务"""
+    def tif_to_mbtiles_and_publish(self, file_id, file_path, original_filename, user_id=None, max_zoom=18, min_zoom=2, task_id=None,
+                                   workers=None, gdal_cachemax=None, pipeline=None, tolerance=None, nodata=None, pyramid=None,
+                                   resume=False, tile_format=None, quality=None, clamp_zoom=None):
+        """将TIF文件转换为MBTiles并发布为Martin服务
+        
+        Args:
+            workers: 瓦片渲染进程数，None 使用 TIF_TILING_CONFIG 配置
+            gdal_cachemax: 每个渲染进程的 GDAL_CACHEMAX（MB）
+            pipeline: memory（内存渲染直接写入MBTiles）或 directory（先生成瓦片目录再打包）
+            tolerance: 透明掩膜容差，像素各颜色波段与nodata之差都不超过该值时设为透明
+            nodata: 源波段未登记nodata时使用的nodata值
+            pyramid: 金字塔模式，只从源数据渲染最大级别，低级别由子瓦片合成
+            resume: 从该文件上一次未完成的转换断点继续（仅内存流水线）
+            tile_format: 瓦片编码 png / jpeg / webp / auto（auto 全部为webp，完全不透明瓦片有损压缩）
+            quality: jpeg / webp 压缩质量
+            clamp_zoom: max_zoom 超过源数据原始分辨率对应的级别时是否截断，None 使用配置
+        """
         temp_dir = None
+        job = None
+        active_job_id = None
+        pipeline = pipeline or TIF_TILING_CONFIG.get('pipeline', 'memory')
+        if resume and pipeline != 'memory':
+            print("⚠️ 断点续传只支持内存流水线，已切换为 memory")
+            pipeline = 'memory'
+        encoding = resolve_tile_encoding(tile_format, quality, TIF_TILING_CONFIG)
         
         # 如果没有提供task_id，生成一个新的
         if task_id is None:
@@ -155,50 +189,133 @@ class TifMartinService:
                 current_step='init'
             )
             
-            # 生成输出路径
-            file_uuid = uuid.uuid4().hex
-            mbtiles_filename = f"{file_uuid}.mbtiles"
-            mbtiles_path = os.path.join(self.mbtiles_folder, mbtiles_filename)
-            
-            # 创建临时工作目录
-            temp_dir = tempfile.mkdtemp(prefix='tif_conversion_')
-            tiles_dir = os.path.join(temp_dir, 'tiles')
-            
-            self._update_progress_with_log(task_id, 
-                progress=8, 
-                message=f"📁 临时目录: {temp_dir}", 
-                current_step='init'
-            )
-            
+            # 按源数据分辨率校正缩放级别，避免超出原始分辨率的过度切片
+            zoom_plan = plan_tif_tiling(file_path, min_zoom, max_zoom, clamp=clamp_zoom, sample_tiles=0)
+            for warning in zoom_plan.warnings:
+                self._update_progress_with_log(task_id, message=f"⚠️ {warning}", current_step='init')
+            min_zoom, max_zoom = zoom_plan.min_zoom, zoom_plan.max_zoom
             self._update_progress_with_log(task_id, 
-                progress=10, 
-                message=f"📁 瓦片目录: {tiles_dir}", 
-                status='processing',
-                current_step='tiles_generation'
+                progress=7, 
+                message=f"🔍 原始分辨率 {zoom_plan.pixel_size:.3f} 米，对应最大级别 {zoom_plan.native_max_zoom}，切片级别: {min_zoom}-{max_zoom}", 
+                current_step='init',
+                min_zoom=min_zoom,
+                max_zoom=max_zoom,
+                native_max_zoom=zoom_plan.native_max_zoom
             )
             
-            # 第一步：使用gdal2tiles.py生成瓦片
-            if not self._generate_tiles_with_gdal2tiles(file_path, tiles_dir, min_zoom, max_zoom, coordinate_system, task_id):
-                return {
-                    'success': False,
-                    'error': '瓦片生成失败',
-                    'task_id': task_id
-                }
-            
-            # 更新进度
-            self.progress_data[task_id].update({
-                'progress': 80,
-                'message': '瓦片生成完成，开始打包MBTiles...',
-                'current_step': 'mbtiles_packing'
-            })
+            tiling_params = {
+                'min_zoom': min_zoom,
+                'max_zoom': max_zoom,
+                'tolerance': tolerance,
+                'nodata': nodata,
+                'pyramid': pyramid,
+                'tile_format': encoding.format,
+                'mbtiles_format': encoding.mbtiles_format,
+                'quality': encoding.quality
+            }
             
-            # 第二步：将瓦片打包为MBTiles
-            if not self._pack_tiles_to_mbtiles(tiles_dir, mbtiles_path, min_zoom, max_zoom, task_id):
-                return {
-                    'success': False,
-                    'error': 'MBTiles打包失败',
-                    'task_id': task_id
-                }
+            # 相同内容的TIF已按相同参数切片过时，直接复用其MBTiles
+            content_hash = None
+            reused_from = None
+            if TIF_TILING_CONFIG.get('reuse_duplicate_mbtiles', True) and not resume:
+                content_hash = self._get_content_hash(file_id)
+                if content_hash:
+                    mbtiles_filename = f"{uuid.uuid4().hex}.mbtiles"
+                    mbtiles_path = os.path.join(self.mbtiles_folder, mbtiles_filename)
+                    reused_from = self._reuse_mbtiles_artifact(content_hash, tiling_params, mbtiles_path)
+            
+            if reused_from:
+                self._update_progress_with_log(task_id, 
+                    progress=80, 
+                    message=f"♻️ 相同内容已按相同参数切片，复用 {os.path.basename(reused_from)}", 
+                    status='processing',
+                    current_step='tiles_generation',
+                    reused=True
+                )
+            elif pipeline == 'memory':
+                # 内存流水线：瓦片在内存中渲染并直接写入MBTiles，无中间瓦片目录；
+                # 渲染期间写入 tif_jobs 下的工作文件并记录断点，完成后再移动到mbtiles目录
+                job = self._prepare_tiling_job(file_id, file_path, resume, tiling_params,
+                                               resolve_worker_count(workers))
+                active_job_id = str(file_id)
+                mbtiles_filename = job['mbtiles_filename']
+                mbtiles_path = os.path.join(self.mbtiles_folder, mbtiles_filename)
+                
+                self._update_progress_with_log(task_id, 
+                    progress=10, 
+                    message=(f"⏩ 从断点继续转换: {mbtiles_filename}" if job['resumed']
+                             else f"🧠 内存流水线：瓦片直接写入 {mbtiles_filename}"), 
+                    status='processing',
+                    current_step='tiles_generation',
+                    resumed=job['resumed']
+                )
+                
+                if not self._generate_tiles_with_gdal2tiles(file_path, None, min_zoom, max_zoom, coordinate_system, task_id,
+                                                            workers=workers, gdal_cachemax=gdal_cachemax,
+                                                            tolerance=tolerance, nodata=nodata, pyramid=pyramid,
+                                                            mbtiles_path=job['work_path'], resume=job['resumed'],
+                                                            plan_workers=job['plan_workers'], encoding=encoding):
+                    # 保留工作文件和断点，便于下次续传
+                    self._save_job_manifest(file_id, dict(job, status='failed'))
+                    return {
+                        'success': False,
+                        'error': '瓦片生成失败',
+                        'task_id': task_id,
+                        'resumable': True
+                    }
+                
+                os.replace(job['work_path'], mbtiles_path)
+                self._remove_job_manifest(file_id)
+                job = None
+            else:
+                # 生成输出路径
+                file_uuid = uuid.uuid4().hex
+                mbtiles_filename = f"{file_uuid}.mbtiles"
+                mbtiles_path = os.path.join(self.mbtiles_folder, mbtiles_filename)
+                
+                # 创建临时工作目录
+                temp_dir = tempfile.mkdtemp(prefix='tif_conversion_')
+                tiles_dir = os.path.join(temp_dir, 'tiles')
+                
+                self._update_progress_with_log(task_id, 
+                    progress=8, 
+                    message=f"📁 临时目录: {temp_dir}", 
+                    current_step='init'
+                )
+                
+                self._update_progress_with_log(task_id, 
+                    progress=10, 
+                    message=f"📁 瓦片目录: {tiles_dir}", 
+                    status='processing',
+                    current_step='tiles_generation'
+                )
+                
+                # 第一步：使用gdal2tiles.py生成瓦片
+                if not self._generate_tiles_with_gdal2tiles(file_path, tiles_dir, min_zoom, max_zoom, coordinate_system, task_id,
+                                                            workers=workers, gdal_cachemax=gdal_cachemax,
+                                                            tolerance=tolerance, nodata=nodata, pyramid=pyramid,
+                                                            encoding=encoding):
+                    return {
+                        'success': False,
+                        'error': '瓦片生成失败',
+                        'task_id': task_id
+                    }
+                
+                # 更新进度
+                self.progress_data[task_id].update({
+                    'progress': 80,
+                    'message': '瓦片生成完成，开始打包MBTiles...',
+                    'current_step': 'mbtiles_packing'
+                })
+                
+                # 第二步：将瓦片打包为MBTiles
+                if not self._pack_tiles_to_mbtiles(tiles_dir, mbtiles_path, min_zoom, max_zoom, task_id,
+                                                   encoding=encoding):
+                    return {
+                        'success': False,
+                        'error': 'MBTiles打包失败',
+                        'task_id': task_id
+                    }
             
             # 更新进度
             self.progress_data[task_id].update({
@@ -222,6 +339,9 @@ class TifMartinService:
                     os.remove(mbtiles_path)
                 return publish_result
             
+            if content_hash and not reused_from:
+                self._record_mbtiles_artifact(content_hash, tiling_params, mbtiles_path)
+            
             # 完成
             self.progress_data[task_id].update({
                 'status': 'completed',
@@ -239,12 +359,24 @@ class TifMartinService:
                 'mbtiles_path': mbtiles_path,
                 'mbtiles_filename': mbtiles_filename,
                 'coordinate_system': coordinate_system,
+                'min_zoom': min_zoom,
+                'max_zoom': max_zoom,
+                'native_max_zoom': zoom_plan.native_max_zoom,
+                'zoom_clamped': zoom_plan.clamped,
+                'reused': bool(reused_from),
                 'martin_service': publish_result
             }
             
         except Exception as e:
             print(f"❌ TIF转MBTiles并发布失败: {str(e)}")
             
+            # 渲染中断时保留工作文件和断点，便于下次续传
+            if job is not None:
+                try:
+                    self._save_job_manifest(file_id, dict(job, status='failed'))
+                except Exception:
+                    pass
+            
             # 更新进度为错误状态
             if task_id in self.progress_data:
                 self.progress_data[task_id].update({
@@ -266,6 +398,9 @@ class TifMartinService:
                 'task_id': task_id
             }
         finally:
+            if active_job_id is not None:
+                with self._active_jobs_lock:
+                    self._active_jobs.discard(active_job_id)
             # 清理临时目录
             if temp_dir and os.path.exists(temp_dir):
                 try:
@@ -274,11 +409,18 @@ class TifMartinService:
                 except Exception as e:
                     print(f"⚠️ 清理临时目录失败: {e}")
     
-    def _generate_tiles_with_gdal2tiles(self, tif_path, tiles_dir, min_zoom, max_zoom, coordinate_system, task_id):
-        """使用GDAL Python API生成瓦片"""
+    def _generate_tiles_with_gdal2tiles(self, tif_path, tiles_dir, min_zoom, max_zoom, coordinate_system, task_id,
+                                         workers=None, gdal_cachemax=None, tolerance=None, nodata=None,
+                                         pyramid=None, mbtiles_path=None, resume=False, plan_workers=None,
+                                         encoding=None):
+        """使用GDAL Python API生成瓦片（按缩放级别和列区间分区，进程池并行渲染）
+        
+        提供 mbtiles_path 时在内存中渲染并直接写入该MBTiles文件，否则写入 tiles_dir 目录；
+        resume 为True时在已有的MBTiles上继续，跳过断点表中已完成的分区；
+        encoding 为瓦片编码参数（TileEncoding），None 使用配置默认值
+        """
         try:
-            from osgeo import gdal, osr
-            import math
+            from osgeo import gdal
             
             self._update_progress_with_log(task_id, 
                 progress=12, 
@@ -286,49 +428,13 @@ class TifMartinService:
                 current_step='tiles_generation'
             )
             
-            # 设置GDAL配置
-            gdal.SetConfigOption('GDAL_CACHEMAX', '500')
-            
             # 打开源数据集
             src_ds = gdal.Open(tif_path, gdal.GA_ReadOnly)
             if src_ds is None:
                 raise Exception(f"无法打开TIF文件: {tif_path}")
             
-            # 获取源数据集信息
-            src_srs = osr.SpatialReference()
-            src_srs.ImportFromWkt(src_ds.GetProjection())
-            
-            # 目标坐标系 (Web Mercator)
-            dst_srs = osr.SpatialReference()
-            dst_srs.ImportFromEPSG(3857)
-            
-            # 创建坐标转换
-            transform = osr.CoordinateTransformation(src_srs, dst_srs)
-            
-            # 获取源数据集的地理范围
-            gt = src_ds.GetGeoTransform()
-            width = src_ds.RasterXSize
-            height = src_ds.RasterYSize
-            
-            # 计算四个角点的坐标
-            corners = [
-                (gt[0], gt[3]),  # 左上
-                (gt[0] + width * gt[1], gt[3]),  # 右上
-                (gt[0], gt[3] + height * gt[5]),  # 左下
-                (gt[0] + width * gt[1], gt[3] + height * gt[5])  # 右下
-            ]
-            
-            # 转换到Web Mercator
-            transformed_corners = []
-            for x, y in corners:
-                point = transform.TransformPoint(x, y)
-                transformed_corners.append((point[0], point[1]))
-            
-            # 计算边界框
-            min_x = min(corner[0] for corner in transformed_corners)
-            max_x = max(corner[0] for corner in transformed_corners)
-            min_y = min(corner[1] for corner in transformed_corners)
-            max_y = max(corner[1] for corner in transformed_corners)
+            # 源数据范围转换到 Web Mercator
+            min_x, max_x, min_y, max_y = mercator_bounds(src_ds)
             
             self._update_progress_with_log(task_id, 
                 progress=15, 
@@ -336,69 +442,89 @@ class TifMartinService:
                 current_step='tiles_generation'
             )
             
-            # 启动进度监控线程
-            progress_thread = threading.Thread(
-                target=self._monitor_tiles_progress,
-                args=(tiles_dir, task_id, min_zoom, max_zoom)
-            )
-            progress_thread.daemon = True
-            progress_thread.start()
-            
-            # 生成瓦片
-            total_tiles = 0
-            processed_tiles = 0
+            # 关闭主进程的数据集，渲染进程各自打开
+            src_ds = None
             
-            # 计算总瓦片数
-            for zoom in range(min_zoom, max_zoom + 1):
-                tile_min_x, tile_max_x, tile_min_y, tile_max_y = self._get_tile_bounds(min_x, max_x, min_y, max_y, zoom)
-                total_tiles += (tile_max_x - tile_min_x + 1) * (tile_max_y - tile_min_y + 1)
+            # 划分渲染分区
+            tile_ranges = {
+                zoom: self._get_tile_bounds(min_x, max_x, min_y, max_y, zoom)
+                for zoom in range(min_zoom, max_zoom + 1)
+            }
+            engine = TileRenderEngine(tif_path, workers=workers, gdal_cachemax=gdal_cachemax,
+                                      tolerance=tolerance, nodata=nodata, pyramid=pyramid,
+                                      plan_workers=plan_workers, encoding=encoding)
+            # 构建有效数据footprint索引，跳过不含数据的分区和瓦片
+            engine.build_footprint(tile_ranges)
+            stages = engine.plan(tile_ranges)
+            partition_count = sum(len(partitions) for partitions, _ in stages)
+            total_tiles = sum(p.tile_count for partitions, _ in stages for p in partitions)
+            mode_text = "金字塔模式" if engine.pyramid else "逐级重投影"
+            mode_text += f"，{engine.encoding.format} 编码"
             
             self._update_progress_with_log(task_id, 
                 progress=18, 
-                message=f"📊 预计生成 {total_tiles} 个瓦片", 
-                current_step='tiles_generation'
+                message=f"📊 预计生成 {total_tiles} 个瓦片，使用 {engine.workers} 个渲染进程，{partition_count} 个分区（{mode_text}）", 
+                current_step='tiles_generation',
+                tiles_total=total_tiles,
+                workers=engine.workers
             )
             
-            # 为每个缩放级别生成瓦片
-            for zoom in range(min_zoom, max_zoom + 1):
-                zoom_dir = os.path.join(tiles_dir, str(zoom))
-                os.makedirs(zoom_dir, exist_ok=True)
-                
-                # 计算该缩放级别的瓦片范围
-                tile_min_x, tile_max_x, tile_min_y, tile_max_y = self._get_tile_bounds(min_x, max_x, min_y, max_y, zoom)
-                
-                self._update_progress_with_log(task_id, 
-                    message=f"🔧 生成缩放级别 {zoom} 的瓦片 ({tile_min_x}-{tile_max_x}, {tile_min_y}-{tile_max_y})", 
-                    current_step='tiles_generation'
+            last_touch = [time.time()]
+            
+            def on_progress(processed, generated, total):
+                # 定期更新工作文件的修改时间，其他进程据此判断转换仍在执行
+                if mbtiles_path and time.time() - last_touch[0] >= 30:
+                    last_touch[0] = time.time()
+                    try:
+                        os.utime(mbtiles_path, None)
+                    except OSError:
+                        pass
+                # 汇总各进程完成的分区，映射到 18% - 75%
+                progress = 18 + int((processed / total) * 57) if total else 75
+                self.progress_data[task_id].update({
+                    'progress': min(progress, 75),
+                    'message': f'正在生成瓦片... ({processed}/{total})',
+                    'tiles_count': generated,
+                    'tiles_processed': processed
+                })
+                hook = self.progress_hooks.get(task_id)
+                if hook is not None:
+                    hook(self.progress_data[task_id])
+            
+            if mbtiles_path:
+                empty_tile = empty_tile_bytes(engine.encoding) if TIF_TILING_CONFIG.get('store_empty_tiles', True) else None
+                writer = MBTilesWriter(
+                    mbtiles_path,
+                    self._build_mbtiles_metadata(min_zoom, max_zoom, engine.encoding.mbtiles_format,
+                                                 bounds=lonlat_bounds(min_x, max_x, min_y, max_y)),
+                    batch_size=TIF_TILING_CONFIG.get('mbtiles_batch_size', 1000),
+                    empty_tile=empty_tile,
+                    resume=resume
                 )
-                
-                for tile_x in range(tile_min_x, tile_max_x + 1):
-                    x_dir = os.path.join(zoom_dir, str(tile_x))
-                    os.makedirs(x_dir, exist_ok=True)
-                    
-                    for tile_y in range(tile_min_y, tile_max_y + 1):
-                        try:
-                            # 生成单个瓦片
-                            tile_path = os.path.join(x_dir, f"{tile_y}.png")
-                            if self._generate_single_tile(src_ds, tile_path, zoom, tile_x, tile_y, transform):
-                                processed_tiles += 1
-                            
-                            # 更新进度
-                            if processed_tiles % 50 == 0:
-                                progress = 10 + int((processed_tiles / total_tiles) * 65)
-                                self.progress_data[task_id].update({
-                                    'progress': min(progress, 75),
-                                    'message': f'正在生成瓦片... ({processed_tiles}/{total_tiles})',
-                                    'tiles_count': processed_tiles
-                                })
-                        except Exception as e:
-                            print(f"⚠️ 生成瓦片 {zoom}/{tile_x}/{tile_y} 失败: {str(e)}")
-                            continue
-            
-            # 关闭数据集
-            src_ds = None
+                try:
+                    stats = engine.render(tile_ranges, writer=writer, progress_callback=on_progress)
+                    if stats['failed']:
+                        # 保留断点表（有失败瓦片的分区未记为完成），续传时只重新渲染这些分区
+                        writer.abort()
+                    else:
+                        writer.close()
+                except BaseException:
+                    writer.abort()
+                    raise
+            else:
+                stats = engine.render(tile_ranges, tiles_dir=tiles_dir, progress_callback=on_progress)
             
-            print(f"✅ 瓦片生成完成，共生成 {processed_tiles} 个瓦片")
+            if stats['skipped']:
+                print(f"⏭️ footprint索引跳过了 {stats['skipped']} 个无数据瓦片")
+            if stats['failed']:
+                # 缺少瓦片的结果不发布
+                print(f"❌ {stats['failed']} 个瓦片生成失败，本次转换不发布")
+                self.progress_data[task_id].update({
+                    'status': 'error',
+                    'message': f"{stats['failed']} 个瓦片生成失败"
+                })
+                return False
+            print(f"✅ 瓦片生成完成，共生成 {stats['generated']} 个瓦片")
             return True
             
         except Exception as e:
@@ -409,208 +535,191 @@ class TifMartinService:
             })
             return False
     
-    def _get_tile_bounds(self, min_x, max_x, min_y, max_y, zoom):
-        """计算指定缩放级别的瓦片边界"""
-        import math
-        # Web Mercator 范围
-        EARTH_RADIUS = 6378137
-        EARTH_CIRCUMFERENCE = 2 * math.pi * EARTH_RADIUS
-        
-        # 瓦片大小 (Web Mercator)
-        tile_size = EARTH_CIRCUMFERENCE / (2 ** zoom)
-        
-        # 计算瓦片索引
-        tile_min_x = max(0, int((min_x + EARTH_CIRCUMFERENCE/2) / tile_size))
-        tile_max_x = min(2**zoom - 1, int((max_x + EARTH_CIRCUMFERENCE/2) / tile_size))
-        tile_min_y = max(0, int((EARTH_CIRCUMFERENCE/2 - max_y) / tile_size))
-        tile_max_y = min(2**zoom - 1, int((EARTH_CIRCUMFERENCE/2 - min_y) / tile_size))
-        
-        return tile_min_x, tile_max_x, tile_min_y, tile_max_y
+    def _job_manifest_path(self, file_id):
+        return os.path.join(self.jobs_folder, f"{file_id}.json")
     
-    def _generate_single_tile(self, src_ds, tile_path, zoom, tile_x, tile_y, transform):
-        """生成单个瓦片"""
+    def _load_job_manifest(self, file_id):
+        path = self._job_manifest_path(file_id)
+        if not os.path.exists(path):
+            return None
         try:
-            from osgeo import gdal
-            import math
-            
-            # Web Mercator 参数
-            EARTH_RADIUS = 6378137
-            EARTH_CIRCUMFERENCE = 2 * math.pi * EARTH_RADIUS
-            TILE_SIZE = 256
-            
-            # 计算瓦片的地理范围
-            tile_size_meters = EARTH_CIRCUMFERENCE / (2 ** zoom)
-            
-            min_x = -EARTH_CIRCUMFERENCE/2 + tile_x * tile_size_meters
-            max_x = -EARTH_CIRCUMFERENCE/2 + (tile_x + 1) * tile_size_meters
-            max_y = EARTH_CIRCUMFERENCE/2 - tile_y * tile_size_meters
-            min_y = EARTH_CIRCUMFERENCE/2 - (tile_y + 1) * tile_size_meters
-            
-            # 使用gdalwarp进行重投影和裁剪
-            warp_options = gdal.WarpOptions(
-                format='PNG',
-                outputBounds=[min_x, min_y, max_x, max_y],
-                width=TILE_SIZE,
-                height=TILE_SIZE,
-                dstSRS='EPSG:3857',
-                resampleAlg=gdal.GRA_Bilinear,
-                srcNodata=0,  # 设置源数据的nodata值为0（黑色）
-                dstNodata=0,  # 设置目标数据的nodata值为0
-                creationOptions=['WORLDFILE=NO']
-            )
-            
-            # 执行重投影
-            result_ds = gdal.Warp(tile_path, src_ds, options=warp_options)
-            
-            if result_ds is None:
-                return False
-            
-            # 关闭数据集
-            result_ds = None
-            
-            # 检查文件是否生成
-            if not os.path.exists(tile_path) or os.path.getsize(tile_path) == 0:
-                if os.path.exists(tile_path):
-                    os.remove(tile_path)
-                return False
-            
-            # 处理透明度，将纯黑色设置为透明
-            success, transparent_pixels = self._make_black_transparent(tile_path, tolerance=5)
-            
-            # 记录透明度处理结果（仅当有透明像素时）
-            if success and transparent_pixels > 0:
-                print(f"🎨 瓦片透明度处理完成，设置了 {transparent_pixels} 个黑色像素为透明")
-            
-            # 检查最终文件是否有效
-            if os.path.exists(tile_path) and os.path.getsize(tile_path) > 0:
-                return True
-            else:
-                # 删除无效文件
-                if os.path.exists(tile_path):
-                    os.remove(tile_path)
-                return False
-                
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
         except Exception as e:
-            print(f"⚠️ 生成瓦片失败 {zoom}/{tile_x}/{tile_y}: {str(e)}")
+            print(f"⚠️ 读取转换断点失败: {str(e)}")
+            return None
+    
+    def _save_job_manifest(self, file_id, job):
+        """写入断点描述文件（先写临时文件再替换，保证文件完整）"""
+        job = dict(job, updated_at=time.time())
+        path = self._job_manifest_path(file_id)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    
+    def _remove_job_manifest(self, file_id):
+        path = self._job_manifest_path(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+    
+    def _job_is_running(self, file_id, job):
+        """断点描述对应的转换是否仍在执行（调用方持有 _active_jobs_lock）
+        
+        本进程记录的任务按进程内登记判断；其他进程的任务在渲染期间会持续更新工作文件，
+        工作文件超过 job_stale_seconds 秒未更新时视为该进程已退出
+        """
+        if job.get('status') != 'running':
             return False
+        if job.get('owner') == self._owner:
+            return str(file_id) in self._active_jobs
+        work_path = job.get('work_path', '')
+        paths = [self._job_manifest_path(file_id), work_path, f'{work_path}-wal']
+        last_update = max((os.path.getmtime(path) for path in paths if path and os.path.exists(path)), default=0)
+        return time.time() - last_update < TIF_TILING_CONFIG.get('job_stale_seconds', 180)
     
-    def _monitor_tiles_progress(self, tiles_dir, task_id, min_zoom, max_zoom):
-        """监控瓦片生成进度"""
+    def _prepare_tiling_job(self, file_id, file_path, resume, params, plan_workers):
+        """准备转换任务：续传时复用上次的工作文件，否则新建
+        
+        同一文件的上一次转换仍在执行时拒绝新的转换，避免删除或同时写入其工作文件
+        
+        Returns:
+            dict: mbtiles_filename / work_path / params / plan_workers / resumed 等
+        """
+        source_stat = os.stat(file_path)
+        params = dict(params, source_size=source_stat.st_size, source_mtime=int(source_stat.st_mtime))
+        with self._active_jobs_lock:
+            previous = self._load_job_manifest(file_id)
+            if previous and self._job_is_running(file_id, previous):
+                raise Exception("该文件正在转换中，请等待当前转换完成后再试")
+            self._active_jobs.add(str(file_id))
         try:
-            # 估算总瓦片数
-            total_tiles_estimate = sum(4 ** zoom for zoom in range(min_zoom, min(max_zoom + 1, 10)))
-            
-            while True:
-                if task_id not in self.progress_data:
-                    break
-                
-                if self.progress_data[task_id]['status'] in ['completed', 'error']:
-                    break
-                
-                # 统计已生成的瓦片数
-                current_tiles = 0
-                if os.path.exists(tiles_dir):
-                    for root, dirs, files in os.walk(tiles_dir):
-                        current_tiles += len([f for f in files if f.endswith('.png')])
-                
-                # 计算进度 (10% - 75%)
-                if total_tiles_estimate > 0:
-                    progress = 10 + int((current_tiles / total_tiles_estimate) * 65)
-                    progress = min(progress, 75)
-                else:
-                    progress = 10
-                
-                # 更新进度
-                self.progress_data[task_id].update({
-                    'progress': progress,
-                    'message': f'正在生成瓦片... ({current_tiles} 个瓦片)',
-                    'tiles_count': current_tiles
-                })
-                
-                time.sleep(2)  # 每2秒更新一次
-                
+            return self._create_tiling_job(file_id, file_path, resume, params, plan_workers, previous)
+        except BaseException:
+            with self._active_jobs_lock:
+                self._active_jobs.discard(str(file_id))
+            raise
+    
+    def _create_tiling_job(self, file_id, file_path, resume, params, plan_workers, previous):
+        """续用上一次的工作文件或新建转换任务，写入断点描述"""
+        if previous and resume:
+            if previous.get('params') == params and os.path.exists(previous.get('work_path', '')):
+                job = dict(previous, resumed=True, status='running', owner=self._owner)
+                self._save_job_manifest(file_id, job)
+                return job
+            print("⚠️ 转换参数或源文件已变化，无法续传，将重新开始")
+        
+        # 不续传时清理上一次遗留的工作文件
+        if previous and previous.get('work_path'):
+            try:
+                remove_mbtiles(previous['work_path'])
+            except Exception as e:
+                print(f"⚠️ 清理遗留工作文件失败: {str(e)}")
+        
+        file_uuid = uuid.uuid4().hex
+        job = {
+            'file_id': str(file_id),
+            'file_path': file_path,
+            'mbtiles_filename': f"{file_uuid}.mbtiles",
+            'work_path': os.path.join(self.jobs_folder, f"{file_uuid}.mbtiles.part"),
+            'params': params,
+            'plan_workers': plan_workers,
+            'status': 'running',
+            'owner': self._owner,
+            'resumed': False
+        }
+        self._save_job_manifest(file_id, job)
+        return job
+    
+    def _get_content_hash(self, file_id):
+        """文件内容摘要（上传时计算），旧数据没有摘要时返回None"""
+        try:
+            result = execute_query("SELECT content_hash FROM files WHERE id = %s", (file_id,))
         except Exception as e:
-            print(f"⚠️ 进度监控异常: {str(e)}")
+            print(f"⚠️ 获取文件内容摘要失败: {str(e)}")
+            return None
+        return result[0].get('content_hash') if result else None
+    
+    def _mbtiles_artifact_key(self, params):
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"mbtiles:{digest[:16]}"
     
-    def _make_black_transparent(self, tile_path, tolerance=5):
-        """将PNG瓦片中的纯黑色设置为透明
+    def _reuse_mbtiles_artifact(self, content_hash, params, mbtiles_path):
+        """把已有的同内容同参数MBTiles链接（不支持硬链接时复制）到 mbtiles_path
         
-        Args:
-            tile_path: 瓦片文件路径
-            tolerance: 黑色容差值，默认为5
+        各自的文件名独立发布和删除，硬链接保证删除其中一个不影响另一个。
         
         Returns:
-            tuple: (处理是否成功, 透明像素数量)
+            str: 复用的源MBTiles路径，没有可复用的产物时返回None
         """
-        if not PIL_AVAILABLE:
-            return False, 0
-            
         try:
-            # 打开生成的PNG图像
-            img = Image.open(tile_path).convert("RGBA")
-            
-            # 获取图像数据
-            data = img.getdata()
-            
-            # 统计处理的像素数
-            transparent_pixels = 0
-            
-            # 创建新的图像数据，将黑色像素设置为透明
-            new_data = []
-            for item in data:
-                # 检查是否为纯黑色 (RGB值都小于等于容差值)
-                if item[0] <= tolerance and item[1] <= tolerance and item[2] <= tolerance:
-                    # 设置为透明
-                    new_data.append((0, 0, 0, 0))
-                    transparent_pixels += 1
-                else:
-                    # 保持原有的颜色和透明度
-                    new_data.append(item)
-            
-            # 更新图像数据
-            img.putdata(new_data)
-            
-            # 保存处理后的图像
-            img.save(tile_path, "PNG", optimize=True)
-            
-            # 返回处理结果
-            return True, transparent_pixels
-            
+            result = execute_query(
+                "SELECT artifact_path FROM file_blob_artifacts WHERE content_hash = %s AND artifact_key = %s",
+                (content_hash, self._mbtiles_artifact_key(params))
+            )
         except Exception as e:
-            print(f"⚠️ 透明度处理失败: {str(e)}")
-            return False, 0
+            print(f"⚠️ 查询可复用的MBTiles失败: {str(e)}")
+            return None
+        if not result or not os.path.exists(result[0]['artifact_path']):
+            return None
+        
+        source_path = result[0]['artifact_path']
+        try:
+            os.link(source_path, mbtiles_path)
+        except OSError:
+            shutil.copy2(source_path, mbtiles_path)
+        return source_path
     
-    def _pack_tiles_to_mbtiles(self, tiles_dir, mbtiles_path, min_zoom, max_zoom, task_id):
+    def _record_mbtiles_artifact(self, content_hash, params, mbtiles_path):
+        """登记切片结果，供相同内容的TIF复用"""
+        try:
+            execute_query("""
+                INSERT INTO file_blob_artifacts (content_hash, artifact_key, artifact_path, params)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (content_hash, artifact_key)
+                DO UPDATE SET artifact_path = EXCLUDED.artifact_path, params = EXCLUDED.params,
+                              created_at = CURRENT_TIMESTAMP
+            """, (content_hash, self._mbtiles_artifact_key(params), mbtiles_path, json.dumps(params)), fetch=False)
+        except Exception as e:
+            print(f"⚠️ 登记MBTiles复用记录失败: {str(e)}")
+    
+    def _get_tile_bounds(self, min_x, max_x, min_y, max_y, zoom):
+        """计算指定缩放级别的瓦片边界"""
+        return tile_range(min_x, max_x, min_y, max_y, zoom)
+    
+    def _build_mbtiles_metadata(self, min_zoom, max_zoom, tile_format='png', bounds=None):
+        """MBTiles元数据（format 为 png / jpg / webp，写入完成后按实际瓦片格式校正）
+
+        bounds 为经纬度 (west, south, east, north)，图层范围直接从该元数据读取
+        """
+        metadata = {
+            'name': 'Generated from TIF',
+            'type': 'overlay',
+            'version': '1.0',
+            'description': 'Tiles generated from TIF file',
+            'format': tile_format,
+            'minzoom': str(min_zoom),
+            'maxzoom': str(max_zoom)
+        }
+        if bounds:
+            metadata['bounds'] = ','.join(f'{value:.6f}' for value in bounds)
+        return metadata
+    
+    def _pack_tiles_to_mbtiles(self, tiles_dir, mbtiles_path, min_zoom, max_zoom, task_id, encoding=None):
         """将瓦片目录打包为MBTiles文件"""
+        writer = None
         try:
             print("📦 打包瓦片为MBTiles格式...")
             
-            # 创建MBTiles数据库
-            conn = sqlite3.connect(mbtiles_path)
-            cursor = conn.cursor()
-            
-            # 创建表结构
-            cursor.execute('''
-                CREATE TABLE metadata (name text, value text);
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE tiles (zoom_level integer, tile_column integer, 
-                                  tile_row integer, tile_data blob);
-            ''')
-            
-            # 插入元数据
-            metadata = [
-                ('name', 'Generated from TIF'),
-                ('type', 'overlay'),
-                ('version', '1.0'),
-                ('description', 'Tiles generated from TIF file'),
-                ('format', 'png'),
-                ('minzoom', str(min_zoom)),
-                ('maxzoom', str(max_zoom))
-            ]
-            
-            cursor.executemany('INSERT INTO metadata VALUES (?, ?)', metadata)
+            tile_format = encoding.mbtiles_format if encoding else 'png'
+            extensions = tuple(f'.{extension}' for extension in MBTILES_FORMATS.values())
+            writer = MBTilesWriter(
+                mbtiles_path,
+                self._build_mbtiles_metadata(min_zoom, max_zoom, tile_format),
+                batch_size=TIF_TILING_CONFIG.get('mbtiles_batch_size', 1000)
+            )
             
             # 插入瓦片数据
             tile_count = 0
@@ -618,7 +727,7 @@ class TifMartinService:
             
             for root, dirs, files in os.walk(tiles_dir):
                 for file in files:
-                    if not file.endswith('.png'):
+                    if not file.endswith(extensions):
                         continue
                     
                     # 解析路径获取z/x/y
@@ -629,20 +738,14 @@ class TifMartinService:
                         try:
                             zoom = int(path_parts[0])
                             x = int(path_parts[1])
-                            y = int(file.replace('.png', ''))
-                            
-                            # TMS y坐标转换
-                            tms_y = (2 ** zoom - 1) - y
+                            y = int(os.path.splitext(file)[0])
                             
                             # 读取瓦片数据
                             tile_path = os.path.join(root, file)
                             with open(tile_path, 'rb') as f:
                                 tile_data = f.read()
                             
-                            cursor.execute(
-                                'INSERT INTO tiles VALUES (?, ?, ?, ?)',
-                                (zoom, x, tms_y, tile_data)
-                            )
+                            writer.add_tile(zoom, x, y, tile_data)
                             tile_count += 1
                             
                             # 更新进度
@@ -656,20 +759,15 @@ class TifMartinService:
                         except (ValueError, IndexError):
                             continue
             
-            # 创建索引
-            cursor.execute('''
-                CREATE UNIQUE INDEX tile_index on tiles 
-                (zoom_level, tile_column, tile_row);
-            ''')
-            
-            conn.commit()
-            conn.close()
+            writer.close()
             
             print(f"✅ MBTiles打包完成，包含 {tile_count} 个瓦片")
             return True
             
         except Exception as e:
             print(f"❌ MBTiles打包失败: {str(e)}")
+            if writer is not None:
+                writer.abort()
             self.progress_data[task_id].update({
                 'status': 'error',
                 'message': f'MBTiles打包失败: {str(e)}'
@@ -0,0 +1,578 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+TIF瓦片并行渲染引擎
+
+把 (zoom, x列区间) 划分为若干分区交给进程池渲染：
+- 每个工作进程在初始化时打开自己的GDAL数据集句柄，并设置 GDAL_CACHEMAX
+- 分区渲染完成后把瓦片计数返回主进程，由主进程汇总进度
+- 进程数为1时在当前进程内串行执行，行为与原来的逐瓦片渲染一致
+
+两种输出方式：
+- render_to_directory: 逐瓦片写文件到 z/x/y 目录
+- render_to_mbtiles: 编码结果回传主进程后批量写入MBTiles，不产生中间瓦片目录
+
+两种方式都先重投影到内存数据集，在数组上计算透明/nodata掩膜（utils.raster_mask），
+再按 utils.tile_encoding 的编码参数（png/jpeg/webp/auto）只编码一次。
+
+金字塔模式（pyramid=True）只有最大缩放级别从源数据重投影，
+较低级别逐级由4个子瓦片拼接后2倍降采样得到，总耗时约与最大级别瓦片数成正比。
+
+footprint索引（services.tile_footprint）在重投影前跳过与有效数据不相交的瓦片；
+落在范围内但完全透明的瓦片以 EMPTY_TILE 回传，由MBTilesWriter去重后只存一份。
+"""
+
+import math
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import numpy as np
+
+from config import TIF_TILING_CONFIG
+from utils.raster_mask import resolve_mask_spec, mask_to_rgba, to_rgba
+from utils.tile_encoding import TileEncoding, encode_array, sniff_tile_format, MBTILES_FORMATS
+
+# Web Mercator 参数
+EARTH_RADIUS = 6378137
+EARTH_CIRCUMFERENCE = 2 * math.pi * EARTH_RADIUS
+TILE_SIZE = 256
+
+# 完全透明瓦片的标记（写入MBTiles时替换为共享的空白瓦片）
+EMPTY_TILE = b''
+
+# 未指定编码参数时使用PNG
+DEFAULT_ENCODING = TileEncoding()
+
+
+@dataclass(frozen=True)
+class TilePartition:
+    """一个渲染分区：某个缩放级别下连续的若干列瓦片"""
+    zoom: int
+    x_start: int
+    x_end: int
+    y_start: int
+    y_end: int
+
+    @property
+    def tile_count(self):
+        return (self.x_end - self.x_start + 1) * (self.y_end - self.y_start + 1)
+
+
+def resolve_worker_count(workers=None):
+    """确定渲染进程数，0 或 None 表示使用CPU核数"""
+    if workers is None:
+        workers = TIF_TILING_CONFIG.get('workers', 0)
+    if not workers or workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(int(workers), TIF_TILING_CONFIG.get('max_workers', 64)))
+
+
+def tile_bounds_3857(zoom, tile_x, tile_y):
+    """XYZ瓦片在 Web Mercator 下的范围 [min_x, min_y, max_x, max_y]"""
+    tile_size_meters = EARTH_CIRCUMFERENCE / (2 ** zoom)
+    min_x = -EARTH_CIRCUMFERENCE / 2 + tile_x * tile_size_meters
+    max_x = -EARTH_CIRCUMFERENCE / 2 + (tile_x + 1) * tile_size_meters
+    max_y = EARTH_CIRCUMFERENCE / 2 - tile_y * tile_size_meters
+    min_y = EARTH_CIRCUMFERENCE / 2 - (tile_y + 1) * tile_size_meters
+    return [min_x, min_y, max_x, max_y]
+
+
+def plan_partitions(tile_ranges, workers, partitions_per_worker=None, max_partition_tiles=None):
+    """把各缩放级别的瓦片范围划分为渲染分区
+
+    Args:
+        tile_ranges: {zoom: (tile_min_x, tile_max_x, tile_min_y, tile_max_y)}
+        workers: 渲染进程数
+        partitions_per_worker: 每个进程平均分到的分区数
+        max_partition_tiles: 单个分区最多瓦片数，单列超过时按行再切分
+
+    Returns:
+        list[TilePartition]，按缩放级别从低到高排列
+    """
+    if partitions_per_worker is None:
+        partitions_per_worker = TIF_TILING_CONFIG.get('partitions_per_worker', 8)
+    if max_partition_tiles is None:
+        max_partition_tiles = TIF_TILING_CONFIG.get('max_partition_tiles', 1024)
+
+    total_tiles = sum(
+        (x1 - x0 + 1) * (y1 - y0 + 1) for x0, x1, y0, y1 in tile_ranges.values()
+    )
+    # 每个分区的目标瓦片数，保证分区数大致为 进程数 × partitions_per_worker
+    target_tiles = max(1, total_tiles // max(1, workers * partitions_per_worker))
+    target_tiles = min(target_tiles, max(1, max_partition_tiles))
+
+    partitions = []
+    for zoom in sorted(tile_ranges):
+        x0, x1, y0, y1 = tile_ranges[zoom]
+        rows = y1 - y0 + 1
+        if rows > target_tiles:
+            # 单列瓦片已超过目标大小：每个分区一列，按行切分
+            for x in range(x0, x1 + 1):
+                for y_start in range(y0, y1 + 1, target_tiles):
+                    y_end = min(y_start + target_tiles - 1, y1)
+                    partitions.append(TilePartition(zoom, x, x, y_start, y_end))
+            continue
+        columns_per_partition = max(1, target_tiles // rows)
+        for x_start in range(x0, x1 + 1, columns_per_partition):
+            x_end = min(x_start + columns_per_partition - 1, x1)
+            partitions.append(TilePartition(zoom, x_start, x_end, y0, y1))
+    return partitions
+
+
+def warp_tile_array(src_ds, zoom, tile_x, tile_y, warp_nodata=None):
+    """重投影单个瓦片到内存数据集，返回 (bands, height, width) 数组
+
+    Args:
+        warp_nodata: 按波段的nodata字符串，用作 srcNodata/dstNodata；None 时使用源数据集自身设置
+    """
+    from osgeo import gdal
+
+    nodata_options = {}
+    if warp_nodata is not None:
+        nodata_options = {'srcNodata': warp_nodata, 'dstNodata': warp_nodata}
+
+    warp_options = gdal.WarpOptions(
+        format='MEM',
+        outputBounds=tile_bounds_3857(zoom, tile_x, tile_y),
+        width=TILE_SIZE,
+        height=TILE_SIZE,
+        dstSRS='EPSG:3857',
+        resampleAlg=gdal.GRA_Bilinear,
+        **nodata_options
+    )
+    mem_ds = gdal.Warp('', src_ds, options=warp_options)
+    if mem_ds is None:
+        return None
+    array = mem_ds.ReadAsArray()
+    mem_ds = None
+    if array is None:
+        return None
+    if array.ndim == 2:
+        array = array[np.newaxis, :, :]
+    return array
+
+
+def render_tile_bytes(src_ds, zoom, tile_x, tile_y, mask_spec, encoding=None):
+    """在内存中渲染单个瓦片并编码
+
+    Returns:
+        编码后的瓦片；完全透明时返回 EMPTY_TILE；重投影失败时返回None
+    """
+    bands = warp_tile_array(src_ds, zoom, tile_x, tile_y, mask_spec.warp_nodata())
+    if bands is None:
+        return None
+    rgba, transparent = mask_to_rgba(bands, mask_spec)
+    if transparent == rgba.shape[0] * rgba.shape[1]:
+        return EMPTY_TILE
+    return (encoding or DEFAULT_ENCODING).encode(rgba)
+
+
+def empty_tile_bytes(encoding=None):
+    """编码一个完全透明的瓦片；编码格式不支持透明（jpeg）时返回None"""
+    encoding = encoding or DEFAULT_ENCODING
+    if not encoding.supports_alpha:
+        return None
+    return encode_array(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8), encoding.tile_format,
+                        encoding.quality, lossless=encoding.format == 'auto')
+
+
+def decode_tile(tile_data):
+    """把编码后的瓦片解码为 (高, 宽, 4) 的RGBA数组"""
+    from osgeo import gdal
+
+    path = f'/vsimem/decode_{os.getpid()}_{id(tile_data)}'
+    gdal.FileFromMemBuffer(path, tile_data)
+    try:
+        ds = gdal.Open(path)
+        if ds is None:
+            return None
+        bands = ds.ReadAsArray()
+        ds = None
+    finally:
+        gdal.Unlink(path)
+    if bands.ndim == 2:
+        bands = bands[np.newaxis, :, :]
+    alpha_band = 3 if bands.shape[0] == 4 else (1 if bands.shape[0] == 2 else None)
+    return to_rgba(bands, alpha_band)
+
+
+def downsample_2x(canvas):
+    """以alpha为权重把 (2H, 2W, 4) 的RGBA画布按2x2块平均为 (H, W, 4)"""
+    height, width = canvas.shape[0] // 2, canvas.shape[1] // 2
+    blocks = canvas.astype(np.float32).reshape(height, 2, width, 2, 4)
+    alpha = blocks[..., 3]
+    weight = alpha.sum(axis=(1, 3))
+    color = (blocks[..., :3] * alpha[..., np.newaxis]).sum(axis=(1, 3))
+
+    result = np.zeros((height, width, 4), dtype=np.uint8)
+    valid = weight > 0
+    result[..., :3][valid] = np.clip(np.rint(color[valid] / weight[valid][:, np.newaxis]), 0, 255)
+    result[..., 3] = np.clip(np.rint(weight / 4), 0, 255)
+    return result
+
+
+def compose_tile_bytes(children, encoding=None):
+    """由子瓦片拼接并降采样得到父瓦片
+
+    Args:
+        children: {(dx, dy): tile_data}，dx/dy 为子瓦片在父瓦片中的列/行偏移（0或1）
+
+    Returns:
+        编码后的瓦片；没有子瓦片时返回None，合成结果完全透明时返回 EMPTY_TILE
+    """
+    canvas = np.zeros((TILE_SIZE * 2, TILE_SIZE * 2, 4), dtype=np.uint8)
+    placed = False
+    for (dx, dy), tile_data in children.items():
+        rgba = decode_tile(tile_data)
+        if rgba is None or rgba.shape[:2] != (TILE_SIZE, TILE_SIZE):
+            continue
+        canvas[dy * TILE_SIZE:(dy + 1) * TILE_SIZE, dx * TILE_SIZE:(dx + 1) * TILE_SIZE] = rgba
+        placed = True
+    if not placed:
+        return None
+    rgba = downsample_2x(canvas)
+    if not rgba[..., 3].any():
+        return EMPTY_TILE
+    return (encoding or DEFAULT_ENCODING).encode(rgba)
+
+
+def write_tile_file(tiles_dir, zoom, tile_x, tile_y, tile_data):
+    """写入 tiles_dir/z/x/y.<ext>，扩展名按瓦片实际格式确定"""
+    x_dir = os.path.join(tiles_dir, str(zoom), str(tile_x))
+    os.makedirs(x_dir, exist_ok=True)
+    extension = sniff_tile_format(tile_data) or 'png'
+    with open(os.path.join(x_dir, f"{tile_y}.{extension}"), 'wb') as f:
+        f.write(tile_data)
+
+
+def find_tile_file(tiles_dir, zoom, tile_x, tile_y):
+    """查找目录模式下的瓦片文件，不存在时返回None"""
+    for extension in MBTILES_FORMATS.values():
+        path = os.path.join(tiles_dir, str(zoom), str(tile_x), f"{tile_y}.{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# ---------------------------------------------------------------------------
+# 工作进程
+# ---------------------------------------------------------------------------
+
+# 每个工作进程独立持有的状态（GDAL数据集句柄等）
+_worker_state = {}
+# 串行模式在当前进程内使用 _worker_state，同一进程同时只允许一个串行渲染
+_serial_lock = threading.Lock()
+
+
+def _init_worker(tif_path, gdal_cachemax, tolerance, nodata, use_source_nodata, footprint=None, encoding=None,
+                 configure_gdal=True):
+    """工作进程初始化：设置GDAL缓存、打开源数据集并读取各波段nodata
+
+    configure_gdal=False 用于在当前（Web）进程中串行渲染，不修改进程级的GDAL配置
+    """
+    from osgeo import gdal
+
+    if configure_gdal:
+        gdal.SetConfigOption('GDAL_CACHEMAX', str(gdal_cachemax))
+    src_ds = gdal.Open(tif_path, gdal.GA_ReadOnly)
+    if src_ds is None:
+        raise Exception(f"无法打开TIF文件: {tif_path}")
+    _worker_state['src_ds'] = src_ds
+    _worker_state['mask_spec'] = resolve_mask_spec(
+        src_ds, nodata=nodata, tolerance=tolerance, use_source_nodata=use_source_nodata
+    )
+    _worker_state['footprint'] = footprint
+    _worker_state['encoding'] = encoding or DEFAULT_ENCODING
+
+
+def _release_worker():
+    conn = _worker_state.get('mbtiles_conn')
+    if conn is not None:
+        conn.close()
+    _worker_state.clear()
+
+
+def _mbtiles_reader(mbtiles_path):
+    """工作进程内复用的只读MBTiles连接"""
+    conn = _worker_state.get('mbtiles_conn')
+    if conn is None:
+        conn = sqlite3.connect(f'file:{mbtiles_path}?mode=ro', uri=True)
+        _worker_state['mbtiles_conn'] = conn
+    return conn
+
+
+def _read_children(zoom, tile_x, tile_y, tiles_dir, mbtiles_path):
+    """读取 (zoom, x, y) 的4个子瓦片"""
+    child_zoom = zoom + 1
+    children = {}
+    if tiles_dir:
+        for dx in (0, 1):
+            for dy in (0, 1):
+                path = find_tile_file(tiles_dir, child_zoom, tile_x * 2 + dx, tile_y * 2 + dy)
+                if path:
+                    with open(path, 'rb') as f:
+                        children[(dx, dy)] = f.read()
+        return children
+
+    # MBTiles 使用TMS行号
+    tms_top = (2 ** child_zoom - 1) - tile_y * 2
+    rows = (tms_top, tms_top - 1)
+    cursor = _mbtiles_reader(mbtiles_path).execute(
+        'SELECT tile_column, tile_row, tile_data FROM tiles '
+        'WHERE zoom_level = ? AND tile_column IN (?, ?) AND tile_row IN (?, ?)',
+        (child_zoom, tile_x * 2, tile_x * 2 + 1, rows[0], rows[1])
+    )
+    for column, row, tile_data in cursor:
+        children[(column - tile_x * 2, tms_top - row)] = tile_data
+    return children
+
+
+def _render_partition(partition, tiles_dir=None, mbtiles_path=None, from_children=False):
+    """渲染一个分区
+
+    Args:
+        tiles_dir: 目录模式下直接写入 tiles_dir/z/x/y.<ext>；为None时返回编码结果
+        mbtiles_path: 金字塔模式下读取子瓦片的MBTiles（内存流水线）
+        from_children: 是否由子瓦片合成（金字塔模式的低级别）
+
+    Returns:
+        tuple: (partition, [(zoom, x, y, tile_data)], 生成的瓦片数, 失败的瓦片数, 跳过的瓦片数)
+        完全透明的瓦片以 EMPTY_TILE 出现在列表中（目录模式下不写文件）
+    """
+    src_ds = _worker_state['src_ds']
+    mask_spec = _worker_state['mask_spec']
+    footprint = _worker_state.get('footprint')
+    encoding = _worker_state.get('encoding')
+    zoom = partition.zoom
+
+    tiles = []
+    generated = 0
+    failed = 0
+    skipped = 0
+    for tile_x in range(partition.x_start, partition.x_end + 1):
+        for tile_y in range(partition.y_start, partition.y_end + 1):
+            if footprint is not None and not footprint.intersects(zoom, tile_x, tile_y):
+                skipped += 1
+                continue
+            try:
+                if from_children:
+                    children = _read_children(zoom, tile_x, tile_y, tiles_dir, mbtiles_path)
+                    tile_data = compose_tile_bytes(children, encoding) if children else None
+                else:
+                    tile_data = render_tile_bytes(src_ds, zoom, tile_x, tile_y, mask_spec, encoding)
+                if tile_data is None:
+                    continue
+                if tiles_dir:
+                    if tile_data:
+                        write_tile_file(tiles_dir, zoom, tile_x, tile_y, tile_data)
+                        generated += 1
+                else:
+                    tiles.append((zoom, tile_x, tile_y, tile_data))
+                    generated += 1
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ 生成瓦片 {zoom}/{tile_x}/{tile_y} 失败: {str(e)}")
+    return partition, tiles, generated, failed, skipped
+
+
+# ---------------------------------------------------------------------------
+# 主进程
+# ---------------------------------------------------------------------------
+
+def _unit_key(partition):
+    """分区在断点表中的标识"""
+    return (partition.zoom, partition.x_start, partition.x_end, partition.y_start, partition.y_end)
+
+
+class TileRenderEngine:
+    """进程池瓦片渲染引擎"""
+
+    def __init__(self, tif_path, workers=None, gdal_cachemax=None, tolerance=None, nodata=None,
+                 use_source_nodata=None, pyramid=None, footprint=None, plan_workers=None, encoding=None):
+        """
+        Args:
+            tolerance: 与nodata比较的容差
+            nodata: 源波段未设置nodata时使用的nodata值
+            use_source_nodata: 是否优先使用源数据集各波段登记的nodata
+            pyramid: 是否只从源数据渲染最大级别，低级别由子瓦片合成
+            footprint: 是否构建有效数据footprint索引以跳过空瓦片
+            plan_workers: 划分分区时使用的进程数；续传时沿用首次运行的值以保证分区一致
+            encoding: 瓦片编码参数 TileEncoding，None 使用PNG
+        """
+        self.tif_path = tif_path
+        self.workers = resolve_worker_count(workers)
+        self.gdal_cachemax = gdal_cachemax or TIF_TILING_CONFIG.get('gdal_cachemax', 512)
+        if tolerance is None:
+            tolerance = TIF_TILING_CONFIG.get('transparent_tolerance', 5)
+        if nodata is None:
+            nodata = TIF_TILING_CONFIG.get('nodata', 0)
+        if use_source_nodata is None:
+            use_source_nodata = TIF_TILING_CONFIG.get('use_source_nodata', True)
+        if pyramid is None:
+            pyramid = TIF_TILING_CONFIG.get('pyramid', True)
+        if footprint is None:
+            footprint = TIF_TILING_CONFIG.get('footprint', True)
+        self.tolerance = tolerance
+        self.nodata = nodata
+        self.use_source_nodata = use_source_nodata
+        self.pyramid = pyramid
+        self.use_footprint = footprint
+        self.plan_workers = plan_workers or self.workers
+        self.encoding = encoding or DEFAULT_ENCODING
+        self.footprint = None
+        self._footprint_ready = False
+
+    def _initargs(self):
+        return (self.tif_path, self.gdal_cachemax, self.tolerance, self.nodata, self.use_source_nodata,
+                self.footprint, self.encoding)
+
+    def build_footprint(self, tile_ranges):
+        """构建有效数据footprint索引，失败时不跳过任何瓦片"""
+        self._footprint_ready = True
+        if not self.use_footprint or not tile_ranges:
+            return None
+        from osgeo import gdal
+        from services.tile_footprint import build_tile_footprint
+
+        try:
+            src_ds = gdal.Open(self.tif_path, gdal.GA_ReadOnly)
+            if src_ds is None:
+                raise Exception(f"无法打开TIF文件: {self.tif_path}")
+            mask_spec = resolve_mask_spec(src_ds, nodata=self.nodata, tolerance=self.tolerance,
+                                          use_source_nodata=self.use_source_nodata)
+            max_zoom = max(tile_ranges)
+            self.footprint = build_tile_footprint(
+                src_ds, max_zoom, tile_ranges[max_zoom], mask_spec.warp_nodata(),
+                cells_per_tile=TIF_TILING_CONFIG.get('footprint_cells_per_tile', 4),
+                max_cells=TIF_TILING_CONFIG.get('footprint_max_cells', 2048)
+            )
+            src_ds = None
+            print(f"🗺️ footprint索引已构建: 级别 {self.footprint.zoom}, "
+                  f"{self.footprint.width}x{self.footprint.height} 单元, 有效 {self.footprint.valid_cells} 个")
+        except Exception as e:
+            print(f"⚠️ footprint索引构建失败，将渲染完整范围: {str(e)}")
+            self.footprint = None
+        return self.footprint
+
+    def _filter(self, partitions):
+        if self.footprint is None:
+            return partitions
+        return [
+            p for p in partitions
+            if self.footprint.intersects(p.zoom, p.x_start, p.y_start, p.x_end, p.y_end)
+        ]
+
+    def plan(self, tile_ranges):
+        """划分渲染阶段（已构建footprint时去掉不含有效数据的分区）
+
+        Returns:
+            list of (partitions, from_children)。非金字塔模式只有一个阶段；
+            金字塔模式先渲染最大级别，再从高到低逐级合成
+        """
+        if not self.pyramid or len(tile_ranges) <= 1:
+            return [(self._filter(plan_partitions(tile_ranges, self.plan_workers)), False)]
+
+        zooms = sorted(tile_ranges, reverse=True)
+        stages = [(self._filter(plan_partitions({zooms[0]: tile_ranges[zooms[0]]}, self.plan_workers)), False)]
+        for zoom in zooms[1:]:
+            stages.append((self._filter(plan_partitions({zoom: tile_ranges[zoom]}, self.plan_workers)), True))
+        return stages
+
+    def _run(self, partitions, task, task_args, handle_result):
+        """在进程池（或当前进程）中执行分区任务，按完成顺序处理结果"""
+        if self.workers == 1 or len(partitions) <= 1:
+            # 串行模式：在当前进程内打开数据集，不修改GDAL_CACHEMAX等进程级配置
+            with _serial_lock:
+                _init_worker(*self._initargs(), configure_gdal=False)
+                try:
+                    for partition in partitions:
+                        handle_result(task(partition, *task_args))
+                finally:
+                    _release_worker()
+            return
+
+        start_method = TIF_TILING_CONFIG.get('start_method')
+        mp_context = multiprocessing.get_context(start_method) if start_method else None
+        max_workers = min(self.workers, len(partitions))
+
+        print(f"🚀 启动 {max_workers} 个渲染进程，共 {len(partitions)} 个分区，"
+              f"GDAL_CACHEMAX={self.gdal_cachemax}MB")
+
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                                 initializer=_init_worker, initargs=self._initargs()) as pool:
+            futures = [pool.submit(task, p, *task_args) for p in partitions]
+            try:
+                for future in as_completed(futures):
+                    handle_result(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def render(self, tile_ranges, tiles_dir=None, writer=None, progress_callback=None):
+        """按阶段渲染全部瓦片
+
+        Args:
+            tile_ranges: {zoom: (tile_min_x, tile_max_x, tile_min_y, tile_max_y)}
+            tiles_dir: 目录模式的瓦片输出目录
+            writer: 内存流水线的 MBTilesWriter（与 tiles_dir 二选一）；
+                    每个分区完成后记录到写入器的断点表，续传时跳过已完成的分区
+                    （有失败瓦片的分区不记录，续传时重新渲染）
+            progress_callback: 每完成一个分区调用 callback(processed, generated, total)
+
+        Returns:
+            dict: generated / failed / skipped / resumed / processed / total / workers
+        """
+        if not self._footprint_ready:
+            self.build_footprint(tile_ranges)
+        stages = self.plan(tile_ranges)
+        total = sum(p.tile_count for partitions, _ in stages for p in partitions)
+        stats = {'generated': 0, 'failed': 0, 'skipped': 0, 'resumed': 0, 'processed': 0, 'total': total,
+                 'workers': self.workers}
+
+        completed = writer.completed_units() if writer is not None else set()
+        if completed:
+            remaining_stages = []
+            for partitions, from_children in stages:
+                remaining = [p for p in partitions if _unit_key(p) not in completed]
+                stats['resumed'] += sum(p.tile_count for p in partitions if _unit_key(p) in completed)
+                remaining_stages.append((remaining, from_children))
+            stages = remaining_stages
+            stats['processed'] = stats['resumed']
+            print(f"⏩ 从断点继续：跳过 {len(completed)} 个已完成分区（{stats['resumed']} 个瓦片）")
+            if progress_callback:
+                progress_callback(stats['processed'], 0, total)
+
+        def collect(result):
+            partition, tiles, generated, failed, skipped = result
+            if writer is not None:
+                writer.add_tiles(tiles)
+                # 有瓦片渲染失败的分区不记为完成，续传时重新渲染以重试失败的瓦片
+                if not failed:
+                    writer.mark_completed(_unit_key(partition))
+            stats['processed'] += partition.tile_count
+            stats['generated'] += generated
+            stats['failed'] += failed
+            stats['skipped'] += skipped
+            if progress_callback:
+                progress_callback(stats['processed'], stats['generated'], total)
+
+        if tiles_dir:
+            os.makedirs(tiles_dir, exist_ok=True)
+        mbtiles_path = writer.mbtiles_path if writer is not None else None
+
+        for partitions, from_children in stages:
+            if not partitions:
+                continue
+            if from_children:
+                print(f"🔺 由子瓦片合成缩放级别 {partitions[0].zoom}")
+            self._run(partitions, _render_partition, (tiles_dir, mbtiles_path, from_children), collect)
+            if writer is not None:
+                # 下一阶段的工作进程需要读取本阶段写入的瓦片
+                writer.flush()
+
+        return stats
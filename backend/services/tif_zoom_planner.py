@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+TIF切片缩放级别规划与工作量估算
+
+- 由源数据重投影到 EPSG:3857 后的像元大小推算原始分辨率对应的最大缩放级别，
+  请求的 max_zoom 超过该级别时截断（或仅给出提示），避免每多一级工作量翻4倍的过度切片
+- 估算各缩放级别的瓦片数、输出字节数和耗时：在最大级别范围内均匀抽样渲染少量瓦片，
+  以实测的单瓦片耗时、编码大小和有数据比例外推
+"""
+
+import math
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List
+
+from config import TIF_TILING_CONFIG
+from services.tif_tiling_engine import (
+    EARTH_CIRCUMFERENCE, TILE_SIZE, render_tile_bytes, resolve_worker_count
+)
+from utils.raster_mask import resolve_mask_spec
+from utils.tile_encoding import resolve_tile_encoding
+
+# 抽样失败（全部为空瓦片等）时使用的单瓦片经验值
+DEFAULT_TILE_BYTES = {'png': 60000, 'jpg': 18000, 'webp': 12000}
+DEFAULT_SECONDS_PER_TILE = 0.05
+
+
+@dataclass
+class ZoomLevelEstimate:
+    """单个缩放级别的估算"""
+    zoom: int
+    tiles: int  # 外接矩形内的瓦片数
+    data_tiles: int  # 估计含有数据的瓦片数
+    bytes: int
+    seconds: float
+    resolution: float  # 该级别的像元大小（米）
+
+
+@dataclass
+class TilingPlan:
+    """切片规划结果"""
+    min_zoom: int
+    max_zoom: int
+    requested_max_zoom: int
+    native_max_zoom: int
+    pixel_size: float  # 源数据在 EPSG:3857 下的像元大小（米）
+    bounds: List[float]  # EPSG:3857 范围 [min_x, min_y, max_x, max_y]
+    clamped: bool = False
+    workers: int = 1
+    tile_format: str = 'png'
+    sampled_tiles: int = 0
+    coverage: float = 1.0  # 抽样得到的有数据瓦片比例
+    levels: List[ZoomLevelEstimate] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def total_tiles(self):
+        return sum(level.data_tiles for level in self.levels)
+
+    @property
+    def total_bytes(self):
+        return sum(level.bytes for level in self.levels)
+
+    @property
+    def estimated_seconds(self):
+        return sum(level.seconds for level in self.levels)
+
+    def to_dict(self):
+        result = asdict(self)
+        result.update({
+            'total_tiles': self.total_tiles,
+            'total_bytes': self.total_bytes,
+            'estimated_seconds': round(self.estimated_seconds, 1),
+        })
+        return result
+
+
+def zoom_resolution(zoom):
+    """缩放级别对应的像元大小（米/像素）"""
+    return EARTH_CIRCUMFERENCE / (TILE_SIZE * 2 ** zoom)
+
+
+def native_zoom_for_pixel_size(pixel_size, max_zoom=25):
+    """能完整表达源分辨率的最小缩放级别（该级别像元不大于源像元）"""
+    if not pixel_size or pixel_size <= 0:
+        return max_zoom
+    zoom = math.ceil(math.log2(EARTH_CIRCUMFERENCE / (TILE_SIZE * pixel_size)) - 1e-6)
+    return max(0, min(max_zoom, zoom))
+
+
+def mercator_bounds(src_ds):
+    """源数据四个角点转换到 EPSG:3857 后的范围 (min_x, max_x, min_y, max_y)"""
+    from osgeo import osr
+
+    src_srs = osr.SpatialReference()
+    src_srs.ImportFromWkt(src_ds.GetProjection())
+    dst_srs = osr.SpatialReference()
+    dst_srs.ImportFromEPSG(3857)
+    transform = osr.CoordinateTransformation(src_srs, dst_srs)
+
+    gt = src_ds.GetGeoTransform()
+    width = src_ds.RasterXSize
+    height = src_ds.RasterYSize
+    corners = [
+        (gt[0], gt[3]),  # 左上
+        (gt[0] + width * gt[1], gt[3]),  # 右上
+        (gt[0], gt[3] + height * gt[5]),  # 左下
+        (gt[0] + width * gt[1], gt[3] + height * gt[5])  # 右下
+    ]
+    points = [transform.TransformPoint(x, y) for x, y in corners]
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+def mercator_pixel_size(src_ds):
+    """源数据重投影到 EPSG:3857 后的像元大小（米），取 GDAL 建议的输出分辨率"""
+    from osgeo import gdal, osr
+
+    dst_srs = osr.SpatialReference()
+    dst_srs.ImportFromEPSG(3857)
+    vrt_ds = gdal.AutoCreateWarpedVRT(src_ds, None, dst_srs.ExportToWkt(), gdal.GRA_NearestNeighbour)
+    if vrt_ds is None:
+        raise Exception("无法计算重投影后的分辨率")
+    gt = vrt_ds.GetGeoTransform()
+    vrt_ds = None
+    return min(abs(gt[1]), abs(gt[5]))
+
+
+def lonlat_bounds(min_x, max_x, min_y, max_y):
+    """EPSG:3857 范围转换为经纬度 (west, south, east, north)，用于 MBTiles 的 bounds 元数据"""
+    half = EARTH_CIRCUMFERENCE / 2
+
+    def lon(x):
+        return max(-180.0, min(180.0, x / half * 180.0))
+
+    def lat(y):
+        y = max(-half, min(half, y))
+        return math.degrees(2 * math.atan(math.exp(y / half * math.pi)) - math.pi / 2)
+
+    return lon(min_x), lat(min_y), lon(max_x), lat(max_y)
+
+
+def tile_range(min_x, max_x, min_y, max_y, zoom):
+    """指定缩放级别下覆盖范围的瓦片索引 (x0, x1, y0, y1)"""
+    tile_size = EARTH_CIRCUMFERENCE / (2 ** zoom)
+    half = EARTH_CIRCUMFERENCE / 2
+    return (
+        max(0, int((min_x + half) / tile_size)),
+        min(2 ** zoom - 1, int((max_x + half) / tile_size)),
+        max(0, int((half - max_y) / tile_size)),
+        min(2 ** zoom - 1, int((half - min_y) / tile_size)),
+    )
+
+
+def _sample_positions(x0, x1, y0, y1, count):
+    """在瓦片范围内均匀取 count 个左右的瓦片位置"""
+    columns = x1 - x0 + 1
+    rows = y1 - y0 + 1
+    if columns * rows <= count:
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    side = max(1, int(math.sqrt(count)))
+    xs = sorted({x0 + int((i + 0.5) * columns / side) for i in range(side)})
+    ys = sorted({y0 + int((i + 0.5) * rows / side) for i in range(side)})
+    return [(x, y) for x in xs for y in ys]
+
+
+def _sample_tiles(src_ds, zoom, ranges, mask_spec, encoding, count):
+    """抽样渲染最大级别的瓦片
+
+    Returns:
+        tuple: (抽样数, 有数据瓦片数, 有数据瓦片平均字节数, 平均每瓦片耗时秒数)
+    """
+    positions = _sample_positions(*ranges, count)
+    data_tiles = 0
+    data_bytes = 0
+    started = time.time()
+    for tile_x, tile_y in positions:
+        tile_data = render_tile_bytes(src_ds, zoom, tile_x, tile_y, mask_spec, encoding)
+        if tile_data:
+            data_tiles += 1
+            data_bytes += len(tile_data)
+    elapsed = time.time() - started
+    sampled = len(positions)
+    average_bytes = data_bytes / data_tiles if data_tiles else None
+    seconds_per_tile = elapsed / sampled if sampled else None
+    return sampled, data_tiles, average_bytes, seconds_per_tile
+
+
+def plan_tif_tiling(tif_path, min_zoom, max_zoom, tile_format=None, quality=None, workers=None,
+                    pyramid=None, tolerance=None, nodata=None, clamp=None, sample_tiles=None):
+    """规划TIF切片的缩放级别并估算工作量
+
+    Args:
+        clamp: 请求的 max_zoom 超过原始分辨率时是否截断，None 使用配置 clamp_to_native_zoom
+        sample_tiles: 抽样渲染的瓦片数，0 表示不抽样（使用经验值）
+
+    Returns:
+        TilingPlan
+    """
+    from osgeo import gdal
+
+    if clamp is None:
+        clamp = TIF_TILING_CONFIG.get('clamp_to_native_zoom', True)
+    if sample_tiles is None:
+        sample_tiles = TIF_TILING_CONFIG.get('estimate_sample_tiles', 16)
+    if pyramid is None:
+        pyramid = TIF_TILING_CONFIG.get('pyramid', True)
+    if tolerance is None:
+        tolerance = TIF_TILING_CONFIG.get('transparent_tolerance', 5)
+    if nodata is None:
+        nodata = TIF_TILING_CONFIG.get('nodata', 0)
+    encoding = resolve_tile_encoding(tile_format, quality, TIF_TILING_CONFIG)
+    workers = resolve_worker_count(workers)
+
+    src_ds = gdal.Open(tif_path, gdal.GA_ReadOnly)
+    if src_ds is None:
+        raise Exception(f"无法打开TIF文件: {tif_path}")
+    try:
+        pixel_size = mercator_pixel_size(src_ds)
+        native_zoom = native_zoom_for_pixel_size(pixel_size)
+        min_x, max_x, min_y, max_y = mercator_bounds(src_ds)
+
+        plan = TilingPlan(
+            min_zoom=min_zoom,
+            max_zoom=max_zoom,
+            requested_max_zoom=max_zoom,
+            native_max_zoom=native_zoom,
+            pixel_size=pixel_size,
+            bounds=[min_x, min_y, max_x, max_y],
+            workers=workers,
+            tile_format=encoding.format,
+        )
+        if max_zoom > native_zoom:
+            if clamp:
+                plan.max_zoom = native_zoom
+                plan.clamped = True
+                plan.warnings.append(
+                    f"请求的最大级别 {max_zoom} 超过原始分辨率对应的级别 {native_zoom}，已截断为 {native_zoom}"
+                )
+            else:
+                plan.warnings.append(
+                    f"请求的最大级别 {max_zoom} 超过原始分辨率对应的级别 {native_zoom}，"
+                    f"高于 {native_zoom} 的级别只是对源数据的放大"
+                )
+        if plan.min_zoom > plan.max_zoom:
+            plan.min_zoom = plan.max_zoom
+            plan.warnings.append(f"最小级别已调整为 {plan.max_zoom}")
+
+        top_range = tile_range(min_x, max_x, min_y, max_y, plan.max_zoom)
+        coverage = 1.0
+        tile_bytes = DEFAULT_TILE_BYTES.get(encoding.mbtiles_format, DEFAULT_TILE_BYTES['png'])
+        seconds_per_tile = DEFAULT_SECONDS_PER_TILE
+        if sample_tiles:
+            mask_spec = resolve_mask_spec(src_ds, nodata=nodata, tolerance=tolerance,
+                                          use_source_nodata=TIF_TILING_CONFIG.get('use_source_nodata', True))
+            sampled, data_tiles, average_bytes, sample_seconds = _sample_tiles(
+                src_ds, plan.max_zoom, top_range, mask_spec, encoding, sample_tiles)
+            plan.sampled_tiles = sampled
+            if sampled:
+                coverage = data_tiles / sampled
+                seconds_per_tile = sample_seconds
+            if average_bytes:
+                tile_bytes = average_bytes
+            if sampled and not data_tiles:
+                plan.warnings.append("抽样瓦片均不含数据，瓦片大小按经验值估算")
+        plan.coverage = round(coverage, 3)
+    finally:
+        src_ds = None
+
+    # 金字塔模式下低级别由子瓦片合成，耗时约为重投影的一小部分
+    compose_ratio = TIF_TILING_CONFIG.get('estimate_compose_ratio', 0.3)
+    for zoom in range(plan.min_zoom, plan.max_zoom + 1):
+        x0, x1, y0, y1 = tile_range(min_x, max_x, min_y, max_y, zoom)
+        tiles = (x1 - x0 + 1) * (y1 - y0 + 1)
+        data_tiles = int(math.ceil(tiles * coverage))
+        cost = seconds_per_tile * (compose_ratio if pyramid and zoom < plan.max_zoom else 1.0)
+        plan.levels.append(ZoomLevelEstimate(
+            zoom=zoom,
+            tiles=tiles,
+            data_tiles=data_tiles,
+            bytes=int(data_tiles * tile_bytes),
+            seconds=round(data_tiles * cost / workers, 2),
+            resolution=round(zoom_resolution(zoom), 4),
+        ))
+    return plan
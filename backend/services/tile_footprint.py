@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+栅格有效数据覆盖范围（footprint）索引
+
+把源数据一次性重投影成与瓦片网格对齐的低分辨率有效性掩膜（EPSG:3857），
+再建立积分图，任意缩放级别下判断一个瓦片（或瓦片矩形）是否与有效数据相交都是O(1)。
+用于在重投影之前跳过旋转、不规则栅格外接矩形中完全没有数据的瓦片。
+"""
+
+import math
+
+import numpy as np
+
+from services.tif_tiling_engine import tile_bounds_3857
+
+# 每个瓦片在掩膜中占用的单元数（每个方向）
+DEFAULT_CELLS_PER_TILE = 4
+# 掩膜单边最大单元数
+DEFAULT_MAX_CELLS = 2048
+
+
+class TileFootprint:
+    """与瓦片网格对齐的有效数据掩膜
+
+    掩膜建立在缩放级别 zoom 上，每个瓦片对应 cells_per_tile × cells_per_tile 个单元，
+    左上角单元对应瓦片 (origin_x, origin_y)。
+    """
+
+    def __init__(self, valid, zoom, origin_x, origin_y, cells_per_tile):
+        self.zoom = zoom
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.cells_per_tile = cells_per_tile
+        self.height, self.width = valid.shape
+        self.valid_cells = int(valid.sum())
+        # 积分图：integral[i, j] 为 valid[:i, :j] 中有效单元数
+        integral = np.zeros((self.height + 1, self.width + 1), dtype=np.int64)
+        integral[1:, 1:] = valid.cumsum(axis=0).cumsum(axis=1)
+        self.integral = integral
+
+    def _cell_span(self, start, end, zoom, origin, limit):
+        scale = self.cells_per_tile * (2.0 ** (self.zoom - zoom))
+        low = int(math.floor(start * scale)) - origin * self.cells_per_tile
+        high = int(math.ceil((end + 1) * scale)) - origin * self.cells_per_tile
+        return max(0, low), min(limit, high)
+
+    def intersects(self, zoom, x_start, y_start, x_end=None, y_end=None):
+        """瓦片矩形 [x_start, x_end] × [y_start, y_end] 是否包含有效数据"""
+        if x_end is None:
+            x_end = x_start
+        if y_end is None:
+            y_end = y_start
+        cx0, cx1 = self._cell_span(x_start, x_end, zoom, self.origin_x, self.width)
+        cy0, cy1 = self._cell_span(y_start, y_end, zoom, self.origin_y, self.height)
+        if cx0 >= cx1 or cy0 >= cy1:
+            return False
+        s = self.integral
+        return (s[cy1, cx1] - s[cy0, cx1] - s[cy1, cx0] + s[cy0, cx0]) > 0
+
+
+def _dilate(valid):
+    """向8邻域扩张一个单元，避免重采样误差导致边缘瓦片被跳过"""
+    grown = valid.copy()
+    grown[1:, :] |= valid[:-1, :]
+    grown[:-1, :] |= valid[1:, :]
+    result = grown.copy()
+    result[:, 1:] |= grown[:, :-1]
+    result[:, :-1] |= grown[:, 1:]
+    return result
+
+
+def build_tile_footprint(src_ds, max_zoom, max_zoom_range, warp_nodata=None,
+                         cells_per_tile=DEFAULT_CELLS_PER_TILE, max_cells=DEFAULT_MAX_CELLS):
+    """从源数据集构建footprint索引
+
+    Args:
+        src_ds: GDAL数据集
+        max_zoom: 最大缩放级别
+        max_zoom_range: 最大缩放级别下的瓦片范围 (x0, x1, y0, y1)
+        warp_nodata: 按波段的nodata字符串（BandMaskSpec.warp_nodata()）
+        cells_per_tile: 每个瓦片的掩膜单元数（每个方向）
+        max_cells: 掩膜单边最大单元数
+
+    Returns:
+        TileFootprint
+    """
+    from osgeo import gdal
+
+    x0, x1, y0, y1 = max_zoom_range
+    # 选择掩膜尺寸不超过 max_cells 的最高缩放级别
+    zoom = max_zoom
+    while zoom > 0:
+        shift = max_zoom - zoom
+        tiles_wide = (x1 >> shift) - (x0 >> shift) + 1
+        tiles_high = (y1 >> shift) - (y0 >> shift) + 1
+        if max(tiles_wide, tiles_high) * cells_per_tile <= max_cells:
+            break
+        zoom -= 1
+    shift = max_zoom - zoom
+    fx0, fx1, fy0, fy1 = x0 >> shift, x1 >> shift, y0 >> shift, y1 >> shift
+
+    min_x, min_y = tile_bounds_3857(zoom, fx0, fy1)[:2]
+    max_x, max_y = tile_bounds_3857(zoom, fx1, fy0)[2:]
+    width = (fx1 - fx0 + 1) * cells_per_tile
+    height = (fy1 - fy0 + 1) * cells_per_tile
+
+    nodata_options = {}
+    if warp_nodata is not None:
+        nodata_options['srcNodata'] = warp_nodata
+
+    # 目标alpha波段标记有效数据；平均重采样下只要有有效像素参与alpha即大于0
+    warp_options = gdal.WarpOptions(
+        format='MEM',
+        outputBounds=[min_x, min_y, max_x, max_y],
+        width=width,
+        height=height,
+        dstSRS='EPSG:3857',
+        resampleAlg=gdal.GRA_Average,
+        dstAlpha=True,
+        **nodata_options
+    )
+    mem_ds = gdal.Warp('', src_ds, options=warp_options)
+    if mem_ds is None:
+        raise Exception("footprint掩膜重投影失败")
+    alpha = mem_ds.GetRasterBand(mem_ds.RasterCount).ReadAsArray()
+    mem_ds = None
+
+    valid = _dilate(alpha > 0)
+    return TileFootprint(valid, zoom, fx0, fy0, cells_per_tile)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分片上传会话存储
+
+上传会话和已接收分片记录在本地SQLite中（与分片目标文件同目录），
+多个应用进程共享同一份状态，进程重启后上传可以继续：
+- 客户端通过状态接口获取已接收的分片区间，只补传缺失的分片
+- 会话在最后一次活动 FILE_STORAGE['chunk_cleanup_hours'] 小时后过期，
+  后台清理线程删除过期会话及其目标文件，以及没有会话记录的遗留目标文件
+- 执行完成步骤的进程崩溃时会话停留在完成中，超过 FILE_STORAGE['chunk_complete_timeout_seconds']
+  秒后允许新的完成请求接管，不必等到会话过期
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import FILE_STORAGE
+
+# 会话状态
+STATUS_UPLOADING = 'uploading'
+STATUS_COMPLETING = 'completing'
+
+# 清理线程的运行间隔（秒）
+REAP_INTERVAL = 600
+
+
+def compress_ranges(indexes):
+    """把有序的分片序号压缩为 [[起, 止], ...] 闭区间列表"""
+    ranges = []
+    for index in indexes:
+        if ranges and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def missing_ranges(received_ranges, total_chunks):
+    """由已接收区间求缺失区间"""
+    missing = []
+    expected = 0
+    for start, end in received_ranges:
+        if start > expected:
+            missing.append([expected, start - 1])
+        expected = end + 1
+    if expected < total_chunks:
+        missing.append([expected, total_chunks - 1])
+    return missing
+
+
+class UploadSessionStore:
+    """基于SQLite的分片上传会话存储"""
+
+    def __init__(self, staging_folder, cleanup_hours=None, complete_timeout=None):
+        self.staging_folder = staging_folder
+        os.makedirs(staging_folder, exist_ok=True)
+        self.db_path = os.path.join(staging_folder, 'sessions.db')
+        if cleanup_hours is None:
+            cleanup_hours = FILE_STORAGE.get('chunk_cleanup_hours', 24)
+        self.ttl_seconds = cleanup_hours * 3600
+        if complete_timeout is None:
+            complete_timeout = FILE_STORAGE.get('chunk_complete_timeout_seconds', 600)
+        self.complete_timeout = complete_timeout
+        self._local = threading.local()
+        self._reaper = None
+        self._stop_event = threading.Event()
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                upload_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                file_name TEXT NOT NULL,
+                total_chunks INTEGER NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                file_size INTEGER,
+                part_path TEXT NOT NULL,
+                metadata TEXT,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS upload_sessions_expires ON upload_sessions (expires_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                upload_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                checksum TEXT,
+                received_at REAL NOT NULL,
+                PRIMARY KEY (upload_id, chunk_index)
+            )
+        ''')
+
+    def part_path(self, upload_id):
+        return os.path.join(self.staging_folder, f'{upload_id}.part')
+
+    # ------------------------------------------------------------------
+    # 会话
+    # ------------------------------------------------------------------
+
+    def create(self, upload_id, file_name, total_chunks, chunk_size, file_size=None, metadata=None, user_id=None):
+        """创建会话；同一 upload_id 已存在时返回None"""
+        now = time.time()
+        try:
+            self._connect().execute('''
+                INSERT INTO upload_sessions (upload_id, user_id, file_name, total_chunks, chunk_size, file_size,
+                                             part_path, metadata, status, created_at, updated_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (upload_id, None if user_id is None else str(user_id), file_name, total_chunks, chunk_size,
+                  file_size, self.part_path(upload_id), json.dumps(metadata or {}, ensure_ascii=False),
+                  STATUS_UPLOADING, now, now, now + self.ttl_seconds))
+        except sqlite3.IntegrityError:
+            return None
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        """读取会话（含已接收分片），不存在或已过期时返回None"""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM upload_sessions WHERE upload_id = ?', (upload_id,)).fetchone()
+        if row is None or row['expires_at'] < time.time():
+            return None
+        session = dict(row)
+        session['metadata'] = json.loads(session['metadata'] or '{}')
+        chunks = conn.execute(
+            'SELECT chunk_index, size FROM upload_chunks WHERE upload_id = ? ORDER BY chunk_index', (upload_id,)
+        ).fetchall()
+        session['chunk_sizes'] = {chunk['chunk_index']: chunk['size'] for chunk in chunks}
+        session['received_chunks'] = set(session['chunk_sizes'])
+        return session
+
+    def record_chunk(self, upload_id, chunk_index, size, checksum=None):
+        """记录已写入的分片并顺延会话过期时间"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                INSERT OR REPLACE INTO upload_chunks (upload_id, chunk_index, size, checksum, received_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (upload_id, chunk_index, size, checksum, now))
+            conn.execute('UPDATE upload_sessions SET updated_at = ?, expires_at = ? WHERE upload_id = ?',
+                         (now, now + self.ttl_seconds, upload_id))
+            count = conn.execute('SELECT COUNT(*) FROM upload_chunks WHERE upload_id = ?',
+                                 (upload_id,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return count
+
+    def begin_complete(self, upload_id):
+        """把会话从上传中切换为完成中，保证只有一个请求执行完成步骤
+
+        已处于完成中、但超过 complete_timeout 秒没有更新的会话视为完成步骤所在进程已退出，
+        由本次请求接管
+        """
+        now = time.time()
+        cursor = self._connect().execute('''
+            UPDATE upload_sessions SET status = ?, updated_at = ?
+            WHERE upload_id = ? AND expires_at >= ?
+              AND (status = ? OR (status = ? AND updated_at < ?))
+        ''', (STATUS_COMPLETING, now, upload_id, now,
+              STATUS_UPLOADING, STATUS_COMPLETING, now - self.complete_timeout))
+        return cursor.rowcount == 1
+
+    def reset_complete(self, upload_id):
+        """完成步骤失败时恢复为上传中，允许客户端重试"""
+        self._connect().execute('UPDATE upload_sessions SET status = ?, updated_at = ? WHERE upload_id = ?',
+                                (STATUS_UPLOADING, time.time(), upload_id))
+
+    def delete(self, upload_id, remove_file=True):
+        """删除会话记录，remove_file 为True时同时删除目标文件"""
+        conn = self._connect()
+        row = conn.execute('SELECT part_path FROM upload_sessions WHERE upload_id = ?', (upload_id,)).fetchone()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+            conn.execute('DELETE FROM upload_sessions WHERE upload_id = ?', (upload_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if remove_file and row and os.path.exists(row['part_path']):
+            os.remove(row['part_path'])
+
+    def status(self, session):
+        """会话状态：已接收和缺失的分片区间，供客户端续传"""
+        received = compress_ranges(sorted(session['received_chunks']))
+        return {
+            'upload_id': session['upload_id'],
+            'file_name': session['file_name'],
+            'status': session['status'],
+            'total_chunks': session['total_chunks'],
+            'chunk_size': session['chunk_size'],
+            'file_size': session['file_size'],
+            'received_count': len(session['received_chunks']),
+            'received_bytes': sum(session['chunk_sizes'].values()),
+            'received_ranges': received,
+            'missing_ranges': missing_ranges(received, session['total_chunks']),
+            'expires_at': session['expires_at'],
+        }
+
+    # ------------------------------------------------------------------
+    # 过期清理
+    # ------------------------------------------------------------------
+
+    def reap(self):
+        """删除过期会话及其目标文件、没有会话记录的遗留目标文件
+
+        Returns:
+            int: 清理的会话和文件数
+        """
+        now = time.time()
+        conn = self._connect()
+        expired = conn.execute('SELECT upload_id FROM upload_sessions WHERE expires_at < ?', (now,)).fetchall()
+        removed = 0
+        for row in expired:
+            try:
+                self.delete(row['upload_id'])
+                removed += 1
+            except Exception as e:
+                print(f"⚠️ 清理过期上传会话失败 {row['upload_id']}: {str(e)}")
+
+        known = {row['part_path'] for row in conn.execute('SELECT part_path FROM upload_sessions')}
+        for name in os.listdir(self.staging_folder):
+            path = os.path.join(self.staging_folder, name)
+            if not name.endswith('.part') or path in known:
+                continue
+            try:
+                if os.path.getmtime(path) < now - self.ttl_seconds:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+
+        if removed:
+            print(f"🧹 已清理 {removed} 个过期的分片上传")
+        return removed
+
+    def start_reaper(self, interval=REAP_INTERVAL):
+        """启动后台清理线程（每个进程一个，重复清理是安全的）"""
+        if self._reaper is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.reap()
+                except Exception as e:
+                    print(f"⚠️ 清理分片上传失败: {str(e)}")
+                if self._stop_event.wait(interval):
+                    break
+
+        self._reaper = threading.Thread(target=run, name='upload-reaper', daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._stop_event.set()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_upload_session_store():
+    """获取分片上传会话存储（单例），首次使用时启动清理线程"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = UploadSessionStore(os.path.join(FILE_STORAGE['upload_folder'], '.chunked'))
+                store.start_reaper()
+                _store = store
+    return _store
@@ -10,6 +10,7 @@ import shutil
 import geopandas as gpd
 from pathlib import Path
 from models.db import execute_query, insert_with_snowflake_id
+from services.layer_extent_service import refresh_layer_extent
 from sqlalchemy import create_engine, text
 from config import DB_CONFIG, MARTIN_CONFIG
 
@@ -97,6 +98,7 @@ class VectorMartinService:
             }
             
             service_id = insert_with_snowflake_id('vector_martin_services', params)
+            refresh_layer_extent('martin', service_id)
             
             print(f"✅ GeoJSON Martin服务发布成功，服务ID: {service_id}")
             
@@ -241,6 +243,7 @@ class VectorMartinService:
             }
             
             service_id = insert_with_snowflake_id('vector_martin_services', params)
+            refresh_layer_extent('martin', service_id)
             
             print(f"✅ SHP Martin服务发布成功，服务ID: {service_id}")
             
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接导入 backend 下的模块（utils、services 等）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
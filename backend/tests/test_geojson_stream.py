@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""utils/geojson_stream.py 的流式读取测试"""
+
+import json
+
+import pytest
+
+from utils.geojson_stream import open_geojson
+
+FEATURES = [
+    {'type': 'Feature', 'properties': {'name': 'a "quoted" ] } [ {', 'path': 'C:\\data\\'},
+     'geometry': {'type': 'Point', 'coordinates': [1, 2]}},
+    {'type': 'Feature', 'properties': {'name': '中文'},
+     'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]}},
+]
+
+
+def _write(tmp_path, text):
+    path = tmp_path / 'data.geojson'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1024])
+def test_members_after_features_are_visible(tmp_path, chunk_size):
+    text = json.dumps({'features': FEATURES, 'type': 'FeatureCollection', 'name': 'after'}, ensure_ascii=False)
+    document = open_geojson(_write(tmp_path, text), chunk_size=chunk_size)
+
+    assert document.get('type') == 'FeatureCollection'
+    assert document.get('name') == 'after'
+    assert 'features' not in document
+    assert list(document.iter_features()) == FEATURES
+
+
+def test_members_before_features(tmp_path):
+    text = json.dumps({'type': 'FeatureCollection', 'crs': {'type': 'name'}, 'features': FEATURES})
+    document = open_geojson(_write(tmp_path, text), chunk_size=5)
+
+    assert document.type == 'FeatureCollection'
+    assert document['crs'] == {'type': 'name'}
+    assert list(document.iter_features()) == FEATURES
+
+
+def test_single_feature_document(tmp_path):
+    document = open_geojson(_write(tmp_path, json.dumps(FEATURES[0])))
+
+    assert document.type == 'Feature'
+    assert list(document.iter_features()) == [FEATURES[0]]
+
+
+def test_truncated_features_array(tmp_path):
+    text = json.dumps({'features': FEATURES, 'type': 'FeatureCollection'})[:40]
+    document = open_geojson(_write(tmp_path, text), chunk_size=8)
+
+    with pytest.raises(ValueError):
+        document.get('type')
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分片上传的目标文件读写工具
+
+分片不再单独保存再合并：初始化时预分配目标文件，每个分片到达时直接写入
+chunk_index * chunk_size 偏移处，边接收边计算校验和。多个分片可以并行写入各自的区间，
+全部到达后目标文件即为完整文件，只需重命名到最终位置。
+"""
+
+import errno
+import hashlib
+import os
+
+# 从请求流读取的块大小
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+SUPPORTED_CHECKSUMS = ('md5', 'sha1', 'sha256')
+
+
+class ChunkChecksumError(ValueError):
+    """分片校验和或大小与客户端声明的不一致"""
+    pass
+
+
+def create_part_file(path, file_size=None):
+    """创建（或保留已存在的）目标文件，已知总大小时预分配空间
+
+    预分配在空间不足时立即失败，而不是在上传到一半时才写满磁盘。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        return path
+    with open(path, 'wb') as f:
+        if file_size:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, file_size)
+                    return path
+                except OSError as e:
+                    # 部分文件系统不支持fallocate，退回稀疏文件；空间不足等错误直接抛出
+                    if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                        raise
+            f.truncate(file_size)
+    return path
+
+
+def parse_checksum(checksum, algorithm=None):
+    """解析 'sha256:<hex>' 或 (hex, algorithm) 形式的校验和
+
+    Returns:
+        tuple: (算法, 小写十六进制摘要)，未提供校验和时返回 (None, None)
+    """
+    if not checksum:
+        return None, None
+    if ':' in checksum:
+        algorithm, checksum = checksum.split(':', 1)
+    algorithm = (algorithm or 'sha256').lower()
+    if algorithm not in SUPPORTED_CHECKSUMS:
+        raise ChunkChecksumError(f"不支持的校验算法: {algorithm}")
+    return algorithm, checksum.strip().lower()
+
+
+def write_chunk_at(path, offset, stream, expected_size=None, checksum=None, algorithm=None,
+                   max_size=None, block_size=STREAM_BLOCK_SIZE):
+    """把请求流写入目标文件的 offset 处，同时计算校验和
+
+    Args:
+        stream: 可 read(n) 的分片数据流
+        expected_size: 分片应有的字节数，None 表示不校验
+        checksum: 客户端提供的校验和（'sha256:<hex>' 或十六进制摘要）
+        algorithm: checksum 为十六进制摘要时使用的算法
+        max_size: 分片最大字节数，超过时在写入越界数据前失败（避免覆盖相邻分片）
+
+    Returns:
+        tuple: (写入字节数, 十六进制摘要或None)
+    """
+    algorithm, expected_digest = parse_checksum(checksum, algorithm)
+    digest = hashlib.new(algorithm) if algorithm else None
+
+    written = 0
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            if max_size is not None and written + len(block) > max_size:
+                raise ChunkChecksumError(f"分片大小超过上限 {max_size} 字节")
+            if digest is not None:
+                digest.update(block)
+            f.write(block)
+            written += len(block)
+
+    if expected_size is not None and written != expected_size:
+        raise ChunkChecksumError(f"分片大小不一致: 期望 {expected_size} 字节，实际 {written} 字节")
+    hexdigest = digest.hexdigest() if digest is not None else None
+    if expected_digest and hexdigest != expected_digest:
+        raise ChunkChecksumError(f"分片校验和不一致: 期望 {expected_digest}，实际 {hexdigest}")
+    return written, hexdigest
+
+
+def finalize_part_file(path, final_size):
+    """截断到最终大小（总大小未知时最后一个分片可能小于预留空间）并刷到磁盘"""
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() != final_size:
+            f.truncate(final_size)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+上传文件内容摘要工具
+
+上传流在写入磁盘的同时计算 SHA-256，得到 'sha256:<hex>' 形式的内容摘要，
+用于按内容去重（同一内容只保存一份，见 FileService.save_file）。
+"""
+
+import hashlib
+
+HASH_ALGORITHM = 'sha256'
+
+# 读写块大小
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class FileTooLargeError(ValueError):
+    """上传内容超过允许的最大字节数"""
+    pass
+
+
+def format_content_hash(digest):
+    return f"{HASH_ALGORITHM}:{digest.hexdigest()}"
+
+
+def save_stream_with_hash(stream, destination, max_size=None, block_size=HASH_BLOCK_SIZE):
+    """把上传流写入 destination，同时计算内容摘要
+
+    超过 max_size 时立即停止写入并抛出 FileTooLargeError（已写入的部分由调用方删除）。
+
+    Returns:
+        tuple: (字节数, 'sha256:<hex>')
+    """
+    digest = hashlib.new(HASH_ALGORITHM)
+    size = 0
+    with open(destination, 'wb') as f:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            size += len(block)
+            if max_size is not None and size > max_size:
+                raise FileTooLargeError(f"文件太大，最大允许: {max_size / 1024 / 1024}MB")
+            digest.update(block)
+            f.write(block)
+    return size, format_content_hash(digest)
+
+
+def hash_file(path, block_size=HASH_BLOCK_SIZE):
+    """计算已在磁盘上的文件的内容摘要"""
+    digest = hashlib.new(HASH_ALGORITHM)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return format_content_hash(digest)
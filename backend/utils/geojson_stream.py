@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GeoJSON 增量读取工具
+
+按要素逐个解析 FeatureCollection，内存占用只与单个要素大小相关，
+用于替代对整个文件执行 json.loads / json.load。
+"""
+
+import json
+import re
+import shutil
+
+# 读取文件的块大小
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+# 跳过数组/对象时关心的字符：字符串外的括号和引号、字符串内的引号和转义符
+_STRUCTURE_PATTERN = re.compile(r'["\[\]{}]')
+_STRING_PATTERN = re.compile(r'["\\]')
+
+
+class _JSONStreamScanner:
+    """在文本流上按需读取并解码JSON值"""
+
+    def __init__(self, fh, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._fh = fh
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        """读取更多数据，返回是否读到了新数据"""
+        if self._eof:
+            return False
+        # 丢弃已解析的部分，保证缓冲区大小有界
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        data = self._fh.read(size or self._chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        self._buf += data
+        return True
+
+    def peek(self):
+        """跳过空白并返回下一个字符，流结束时返回空字符串"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"无效的GeoJSON格式：期望 '{char}'，实际为 '{found or 'EOF'}'")
+        self._pos += 1
+
+    def skip(self, char):
+        """如果下一个字符是 char 则跳过并返回True"""
+        if self.peek() == char:
+            self._pos += 1
+            return True
+        return False
+
+    def decode_value(self):
+        """解码下一个完整的JSON值"""
+        self.peek()
+        read_size = self._chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # 数值等标量可能恰好在缓冲区末尾被截断，需读取更多数据确认
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise ValueError("无效的GeoJSON格式：JSON解析失败")
+            # 单个值跨越多个块时按倍数扩大读取量，避免反复重试
+            if not self._fill(read_size):
+                continue
+            read_size *= 2
+
+    def skip_value(self):
+        """跳过下一个JSON值而不解码（用于跳过体积很大的features数组）
+
+        只跟踪字符串和括号层级，缓冲区大小与块大小相关，不随数组大小增长
+        """
+        if self.peek() not in ('[', '{'):
+            self.decode_value()
+            return
+        depth = 0
+        in_string = False
+        while True:
+            pattern = _STRING_PATTERN if in_string else _STRUCTURE_PATTERN
+            match = pattern.search(self._buf, self._pos)
+            if match is None:
+                self._pos = len(self._buf)
+            elif match.group() == '\\':
+                if match.end() < len(self._buf):
+                    # 跳过转义符及其后的一个字符
+                    self._pos = match.end() + 1
+                    continue
+                # 转义符位于缓冲区末尾，读取更多数据后重新处理
+                self._pos = match.start()
+            else:
+                self._pos = match.end()
+                char = match.group()
+                if char == '"':
+                    in_string = not in_string
+                elif char in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return
+                continue
+            if not self._fill():
+                raise ValueError("无效的GeoJSON格式：JSON解析失败")
+
+
+class GeoJSONDocument:
+    """按需流式读取的GeoJSON文档
+
+    - get(key) 返回顶层成员（features除外）；首次访问时扫描一遍顶层对象，
+      features 数组只跳过不解码，位于 features 之后的成员（如 type）同样可用
+    - iter_features() 每次调用都会重新打开文件，逐个产出要素
+    """
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._members = None
+        self._has_features = False
+
+    def _open(self):
+        # utf-8-sig 自动去除BOM
+        return open(self.path, 'r', encoding='utf-8-sig')
+
+    def _iter_scan(self, members, skip_features=False):
+        """解析顶层对象，把非features成员写入 members，并逐个产出要素
+
+        skip_features 为True时跳过features数组，只收集其他顶层成员
+        """
+        with self._open() as fh:
+            scanner = _JSONStreamScanner(fh, self.chunk_size)
+            scanner.expect('{')
+            if scanner.skip('}'):
+                return
+            while True:
+                key = scanner.decode_value()
+                scanner.expect(':')
+                if key == 'features' and scanner.peek() == '[':
+                    self._has_features = True
+                    if skip_features:
+                        scanner.skip_value()
+                    else:
+                        scanner.expect('[')
+                        if not scanner.skip(']'):
+                            while True:
+                                yield scanner.decode_value()
+                                if scanner.skip(','):
+                                    continue
+                                scanner.expect(']')
+                                break
+                else:
+                    members[key] = scanner.decode_value()
+                if scanner.skip(','):
+                    continue
+                scanner.expect('}')
+                return
+
+    def _load_header(self):
+        if self._members is None:
+            members = {}
+            for _ in self._iter_scan(members, skip_features=True):
+                pass
+            self._members = members
+
+    def get(self, key, default=None):
+        """获取顶层成员"""
+        self._load_header()
+        return self._members.get(key, default)
+
+    @property
+    def type(self):
+        return self.get('type')
+
+    def __contains__(self, key):
+        self._load_header()
+        return key in self._members
+
+    def __getitem__(self, key):
+        self._load_header()
+        return self._members[key]
+
+    def iter_features(self):
+        """逐个产出要素"""
+        self._load_header()
+        if not self._has_features:
+            # 单个Feature文档
+            if self._members.get('type') == 'Feature':
+                yield dict(self._members)
+            return
+
+        yield from self._iter_scan({})
+
+
+def open_geojson(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """以流式方式打开GeoJSON文件"""
+    return GeoJSONDocument(path, chunk_size)
+
+
+def iter_features(geojson):
+    """逐个产出要素，支持已解析的dict和 GeoJSONDocument"""
+    if isinstance(geojson, GeoJSONDocument):
+        yield from geojson.iter_features()
+        return
+    if geojson.get('type') == 'FeatureCollection':
+        yield from geojson.get('features', [])
+    elif geojson.get('type') == 'Feature':
+        yield geojson
+
+
+def has_features(geojson):
+    """判断GeoJSON中是否至少有一个要素（只读取到第一个要素）"""
+    for _ in iter_features(geojson):
+        return True
+    return False
+
+
+def save_upload_stream(file_obj, file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """将上传的文件流分块写入磁盘，返回写入的字节数"""
+    with open(file_path, 'wb') as f:
+        shutil.copyfileobj(file_obj, f, chunk_size)
+        return f.tell()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+键集（游标）分页工具
+
+按 (排序列, id) 排序，下一页的条件为 (排序列, id) 小于/大于上一页最后一行的值，
+配合 (排序列, id) 复合索引，翻到任意深度都只扫描一页的数据，不再随 OFFSET 变慢。
+游标为上一页最后一行的排序值、id 和排序方式的 base64url 编码，对客户端不透明。
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+
+# 文件列表可排序字段的排序表达式（与 models/db.py 中的索引表达式一致）；
+# 可能为NULL的列用COALESCE取默认值：NULL参与行比较的结果为NULL，游标停在NULL行时后面的数据会被跳过
+FILE_SORT_EXPRESSIONS = {
+    'upload_date': '{prefix}upload_date',
+    'file_name': '{prefix}file_name',
+    'file_size': 'COALESCE({prefix}file_size, 0)',
+    'file_type': "COALESCE({prefix}file_type, '')",
+    'discipline': "COALESCE({prefix}discipline, '')",
+}
+
+# 相关度排序值保留的小数位数：排序值固定为numeric，经游标往返后与SQL中的值完全相等
+RANK_SCALE = 6
+
+
+def file_sort_expression(sort_by, alias=None):
+    """文件列表排序字段对应的SQL表达式"""
+    return FILE_SORT_EXPRESSIONS[sort_by].format(prefix=f"{alias}." if alias else '')
+
+
+def rounded_rank(rank_expression):
+    """把相关度表达式转换为固定精度的numeric，用于排序和键集条件"""
+    return f"round(({rank_expression})::numeric, {RANK_SCALE})"
+
+
+class InvalidCursorError(ValueError):
+    """游标无法解析或与当前排序方式不一致"""
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"无法编码的游标值: {type(value)}")
+
+
+def encode_cursor(sort_value, row_id, sort_by, sort_order):
+    """由一页最后一行生成下一页的游标"""
+    payload = json.dumps([sort_value, str(row_id), sort_by, sort_order], default=_json_default,
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by, sort_order):
+    """解析游标
+
+    Returns:
+        tuple: (排序值, id)
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, row_id, cursor_sort_by, cursor_sort_order = json.loads(
+            base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        row_id = int(row_id)
+    except Exception:
+        raise InvalidCursorError("无效的分页游标")
+    if cursor_sort_by != sort_by or cursor_sort_order != sort_order:
+        raise InvalidCursorError("分页游标与当前排序方式不一致，请从第一页重新获取")
+    return sort_value, row_id
+
+
+def keyset_condition(sort_column, id_column, sort_order, placeholders=('%s', '%s')):
+    """键集分页条件，placeholders 为排序值和id的参数占位符"""
+    operator = '<' if sort_order.lower() == 'desc' else '>'
+    return f"({sort_column}, {id_column}) {operator} ({placeholders[0]}, {placeholders[1]})"
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+栅格瓦片透明度/NoData 掩膜工具
+
+在重投影得到的波段数组上一次性计算掩膜（NumPy向量化），替代逐像素的PIL处理：
+- 每个颜色波段使用各自的nodata值（来自源数据集，缺失时使用配置值）
+- 像素所有颜色波段与nodata的差都不超过容差时视为透明
+- Alpha 波段不参与比较，其值直接作为透明度
+"""
+
+import math
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+
+@dataclass
+class BandMaskSpec:
+    """瓦片掩膜参数"""
+    nodata_values: List[Optional[float]]  # 每个波段的nodata，Alpha波段或不参与比较的波段为None
+    alpha_band: Optional[int] = None  # Alpha波段序号（从0开始）
+    tolerance: float = 0
+
+    @property
+    def color_band_count(self):
+        return len(self.nodata_values) - (1 if self.alpha_band is not None else 0)
+
+    def warp_nodata(self):
+        """用于 gdal.WarpOptions 的 srcNodata/dstNodata 字符串，无法按波段表达时返回None"""
+        values = [v for i, v in enumerate(self.nodata_values) if i != self.alpha_band]
+        if self.alpha_band is not None or not values or any(v is None for v in values):
+            return None
+        return ' '.join('nan' if math.isnan(v) else repr(float(v)) for v in values)
+
+
+def resolve_mask_spec(src_ds, nodata=0, tolerance=0, use_source_nodata=True):
+    """从源数据集读取每个波段的nodata和Alpha波段
+
+    Args:
+        src_ds: GDAL数据集
+        nodata: 源波段未设置nodata时使用的值，None 表示该波段不按nodata透明
+        tolerance: 与nodata比较的容差
+        use_source_nodata: 是否使用源数据集中登记的nodata
+
+    Returns:
+        BandMaskSpec
+    """
+    from osgeo import gdal
+
+    nodata_values = []
+    alpha_band = None
+    for index in range(src_ds.RasterCount):
+        band = src_ds.GetRasterBand(index + 1)
+        if band.GetColorInterpretation() == gdal.GCI_AlphaBand and alpha_band is None:
+            alpha_band = index
+            nodata_values.append(None)
+            continue
+        value = band.GetNoDataValue() if use_source_nodata else None
+        nodata_values.append(value if value is not None else nodata)
+
+    return BandMaskSpec(nodata_values=nodata_values, alpha_band=alpha_band, tolerance=tolerance)
+
+
+def build_nodata_mask(bands, spec):
+    """计算透明像素掩膜
+
+    Args:
+        bands: (波段数, 高, 宽) 的数组，波段顺序与源数据集一致
+        spec: BandMaskSpec
+
+    Returns:
+        (高, 宽) 的bool数组，True 表示透明；没有可比较的波段时返回None
+    """
+    mask = None
+    for index in range(bands.shape[0]):
+        if index >= len(spec.nodata_values) or index == spec.alpha_band:
+            continue
+        nodata = spec.nodata_values[index]
+        if nodata is None:
+            # 任一颜色波段不参与比较时无法判定整像素为nodata
+            return None
+        band = bands[index]
+        if isinstance(nodata, float) and math.isnan(nodata):
+            band_mask = np.isnan(band)
+        elif spec.tolerance:
+            band_mask = np.abs(band.astype(np.float64) - nodata) <= spec.tolerance
+        else:
+            band_mask = band == nodata
+        mask = band_mask if mask is None else (mask & band_mask)
+    return mask
+
+
+def to_rgba(bands, alpha_band=None):
+    """把波段数组转换为 (高, 宽, 4) 的uint8 RGBA数组"""
+    alpha = None
+    if alpha_band is not None and alpha_band < bands.shape[0]:
+        alpha = bands[alpha_band]
+        bands = np.delete(bands, alpha_band, axis=0)
+
+    if bands.dtype != np.uint8:
+        bands = np.nan_to_num(bands, nan=0.0)
+        bands = np.clip(bands, 0, 255).astype(np.uint8)
+
+    height, width = bands.shape[1], bands.shape[2]
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    if bands.shape[0] < 3:
+        rgba[..., 0] = rgba[..., 1] = rgba[..., 2] = bands[0]
+    else:
+        rgba[..., :3] = np.moveaxis(bands[:3], 0, -1)
+    rgba[..., 3] = 255 if alpha is None else np.clip(alpha, 0, 255).astype(np.uint8)
+    return rgba
+
+
+def mask_to_rgba(bands, spec):
+    """应用nodata掩膜并转换为RGBA
+
+    Returns:
+        tuple: (rgba数组, 透明像素数)
+    """
+    mask = build_nodata_mask(bands, spec)
+    rgba = to_rgba(bands, spec.alpha_band)
+    if mask is not None:
+        rgba[mask] = 0
+    transparent = int(np.count_nonzero(rgba[..., 3] == 0))
+    return rgba, transparent
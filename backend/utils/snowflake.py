@@ -118,6 +118,38 @@ class SnowflakeGenerator:
                    (self.datacenter_id << self.datacenter_id_shift) | \
                    (self.worker_id << self.worker_id_shift) | \
                    self.sequence
+    
+    def get_ids(self, count):
+        """
+        一次性生成多个ID（只获取一次锁）
+        
+        Args:
+            count: 需要生成的ID数量
+            
+        Returns:
+            按生成顺序递增的ID列表
+        """
+        ids = []
+        with self.lock:
+            timestamp = self._get_time()
+            if timestamp < self.last_timestamp:
+                timestamp = self._next_millis(self.last_timestamp)
+            
+            for _ in range(count):
+                if timestamp == self.last_timestamp:
+                    self.sequence = (self.sequence + 1) & self.max_sequence
+                    # 同一毫秒内序列号用完，等待下一毫秒
+                    if self.sequence == 0:
+                        timestamp = self._next_millis(self.last_timestamp)
+                else:
+                    self.sequence = 0
+                self.last_timestamp = timestamp
+                
+                ids.append(((timestamp - self.twepoch) << self.timestamp_shift) |
+                           (self.datacenter_id << self.datacenter_id_shift) |
+                           (self.worker_id << self.worker_id_shift) |
+                           self.sequence)
+        return ids
 
 # 创建默认的雪花ID生成器实例
 snowflake = SnowflakeGenerator()
@@ -129,4 +161,16 @@ def get_snowflake_id():
     Returns:
         雪花算法ID
     """
-    return snowflake.get_id() 
\ No newline at end of file
+    return snowflake.get_id() 
+
+def get_snowflake_ids(count):
+    """
+    批量获取雪花算法生成的ID
+    
+    Args:
+        count: 需要生成的ID数量
+        
+    Returns:
+        雪花算法ID列表
+    """
+    return snowflake.get_ids(count)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+关键词搜索工具（pg_trgm 三元组索引）
+
+搜索在多个文本列拼接后的小写表达式上进行，init_database 在同一表达式上建立
+gin_trgm_ops 表达式索引（写入时由索引自动维护），LIKE '%关键词%' 可以走索引，
+搜索耗时不再随表增长线性增加。表达式必须与索引定义逐字一致，统一由 search_expression 生成。
+
+相关度排序：名称完全匹配 > 名称前缀匹配 > 任意词前缀匹配，再加上 pg_trgm 的 word_similarity。
+未安装 pg_trgm 扩展时仍按 LIKE 匹配（顺序扫描），排序只使用前缀规则。
+"""
+
+from models.db import execute_query
+
+# 参与搜索的列（与索引表达式一致）
+FILE_SEARCH_COLUMNS = ('file_name', 'tags', 'description')
+FEEDBACK_SEARCH_COLUMNS = ('title', 'description')
+
+_trgm_available = None
+
+
+def search_expression(columns, alias=None):
+    """多个文本列拼接后的小写搜索表达式"""
+    prefix = f"{alias}." if alias else ''
+    parts = [f"coalesce({prefix}{column}, '')" for column in columns]
+    return "lower(" + " || ' ' || ".join(parts) + ")"
+
+
+def escape_like(value):
+    """转义 LIKE 通配符"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def has_trgm():
+    """数据库是否已安装 pg_trgm 扩展（进程内缓存）"""
+    global _trgm_available
+    if _trgm_available is None:
+        try:
+            result = execute_query("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trgm_available = bool(result)
+        except Exception as e:
+            print(f"⚠️ 检查pg_trgm扩展失败: {str(e)}")
+            return False
+    return _trgm_available
+
+
+def positional_binder(params):
+    """%s 占位符：参数按出现顺序追加到列表"""
+    def bind(value):
+        params.append(value)
+        return '%s'
+    return bind
+
+
+def named_binder(params, prefix='search'):
+    """%(name)s 占位符：参数写入字典"""
+    def bind(value):
+        name = f"{prefix}_{len(params)}"
+        while name in params:
+            name += '_'
+        params[name] = value
+        return f"%({name})s"
+    return bind
+
+
+class TextSearch:
+    """一次关键词搜索的匹配条件和相关度表达式
+
+    Args:
+        columns: 参与搜索的列
+        keyword: 用户输入，按空白拆分为多个词，每个词都必须匹配
+        alias: 表别名
+        primary: 名称列（完全匹配、前缀匹配加权）
+    """
+
+    def __init__(self, columns, keyword, alias=None, primary=None):
+        self.keyword = ' '.join((keyword or '').lower().split())
+        self.terms = self.keyword.split()
+        self.expression = search_expression(columns, alias)
+        primary = primary or columns[0]
+        self.primary = f"lower({alias}.{primary})" if alias else f"lower({primary})"
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    def condition(self, bind):
+        """匹配条件：每个词都出现在搜索表达式中"""
+        clauses = [f"{self.expression} LIKE {bind('%' + escape_like(term) + '%')}" for term in self.terms]
+        return "(" + " AND ".join(clauses) + ")"
+
+    def rank(self, bind):
+        """相关度表达式（越大越相关）"""
+        escaped = escape_like(self.keyword)
+        score = (
+            f"(CASE WHEN {self.primary} = {bind(self.keyword)} THEN 3 "
+            f"WHEN {self.primary} LIKE {bind(escaped + '%')} THEN 2 "
+            f"WHEN (' ' || {self.expression}) LIKE {bind('% ' + escaped + '%')} THEN 1 "
+            f"ELSE 0 END)"
+        )
+        if has_trgm():
+            score += f" + word_similarity({bind(self.keyword)}, {self.expression})"
+        return f"({score})"
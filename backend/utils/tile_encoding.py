@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+栅格瓦片编码工具
+
+把RGBA数组编码为 png / jpeg / webp 瓦片（GDAL /vsimem，不落盘）：
+- png: 无损，保留透明度
+- jpeg: 有损，不支持透明，透明像素填充为黑色
+- webp: 有损（quality）或无损，支持透明度
+- auto: 全部使用webp，完全不透明的瓦片有损压缩，含透明像素的瓦片无损压缩
+
+MBTiles 的 format 元数据只能记录一种格式，Martin 按它返回 Content-Type，
+因此同一瓦片集内所有瓦片（包括空瓦片）必须是同一种格式，auto 只在webp内区分有损/无损。
+瓦片格式按文件头识别（sniff_tile_format），MBTiles 元数据中的 format 据此记录。
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+TILE_FORMATS = ('png', 'jpeg', 'webp', 'auto')
+
+# MBTiles 元数据 format 取值与瓦片文件扩展名
+MBTILES_FORMATS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+_GDAL_DRIVERS = {'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+
+def sniff_tile_format(tile_data):
+    """按文件头识别瓦片格式，返回 MBTiles 元数据取值（png/jpg/webp），无法识别时返回None"""
+    if not tile_data:
+        return None
+    if tile_data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if tile_data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if tile_data[:4] == b'RIFF' and tile_data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+@dataclass(frozen=True)
+class TileEncoding:
+    """瓦片编码参数"""
+    format: str = 'png'  # png / jpeg / webp / auto
+    quality: int = 85  # jpeg / webp 有损压缩质量（1-100）
+
+    @property
+    def tile_format(self):
+        """瓦片实际使用的编码格式（auto 模式为webp）"""
+        return 'webp' if self.format == 'auto' else self.format
+
+    @property
+    def mbtiles_format(self):
+        """MBTiles 元数据中记录的格式"""
+        return MBTILES_FORMATS[self.tile_format]
+
+    @property
+    def supports_alpha(self):
+        """编码结果能否表达透明（jpeg 不能）"""
+        return self.format != 'jpeg'
+
+    def is_lossless(self, rgba):
+        """auto 模式下含透明像素的瓦片使用无损压缩，避免有损压缩在透明边缘产生杂色"""
+        if self.format != 'auto':
+            return False
+        return rgba.shape[2] >= 4 and not bool((rgba[..., 3] == 255).all())
+
+    def encode(self, rgba):
+        """把 (高, 宽, 4) 的uint8 RGBA数组编码为瓦片字节"""
+        return encode_array(rgba, self.tile_format, self.quality, lossless=self.is_lossless(rgba))
+
+
+def encode_array(rgba, tile_format='png', quality=85, lossless=False):
+    """在 /vsimem 中把RGBA数组编码为指定格式
+
+    Args:
+        rgba: (高, 宽, 4) 的uint8数组
+        tile_format: png / jpeg / webp
+        quality: jpeg / webp 压缩质量
+        lossless: webp 使用无损压缩（忽略 quality）
+    """
+    from osgeo import gdal
+
+    height, width = rgba.shape[0], rgba.shape[1]
+    if tile_format == 'jpeg':
+        # JPEG 只有3个颜色波段，按alpha预乘（透明像素为黑色）
+        alpha = rgba[..., 3:4]
+        if (alpha == 255).all():
+            bands = rgba[..., :3]
+        else:
+            bands = (rgba[..., :3].astype(np.uint16) * alpha // 255).astype(np.uint8)
+        options = [f'QUALITY={int(quality)}']
+    elif tile_format == 'webp':
+        bands = rgba
+        options = ['LOSSLESS=YES'] if lossless else [f'QUALITY={int(quality)}']
+    else:
+        bands = rgba
+        options = ['WORLDFILE=NO']
+
+    band_count = bands.shape[2]
+    mem_ds = gdal.GetDriverByName('MEM').Create('', width, height, band_count, gdal.GDT_Byte)
+    for index in range(band_count):
+        mem_ds.GetRasterBand(index + 1).WriteArray(bands[..., index])
+
+    path = f'/vsimem/tile_{os.getpid()}_{id(rgba)}.{MBTILES_FORMATS[tile_format]}'
+    out_ds = gdal.GetDriverByName(_GDAL_DRIVERS[tile_format]).CreateCopy(path, mem_ds, 0, options)
+    if out_ds is None:
+        gdal.Unlink(path)
+        raise Exception(f"瓦片编码失败: {tile_format}")
+    out_ds = None
+    mem_ds = None
+
+    handle = gdal.VSIFOpenL(path, 'rb')
+    if handle is None:
+        return None
+    try:
+        gdal.VSIFSeekL(handle, 0, 2)
+        size = gdal.VSIFTellL(handle)
+        gdal.VSIFSeekL(handle, 0, 0)
+        return gdal.VSIFReadL(1, size, handle)
+    finally:
+        gdal.VSIFCloseL(handle)
+        gdal.Unlink(path)
+
+
+def resolve_tile_encoding(tile_format=None, quality=None, config=None):
+    """根据请求参数和配置确定瓦片编码参数"""
+    config = config or {}
+    tile_format = tile_format or config.get('tile_format', 'png')
+    if tile_format not in TILE_FORMATS:
+        raise Exception(f"不支持的瓦片格式: {tile_format}")
+    if quality is None:
+        quality = config.get('tile_quality', 85)
+    return TileEncoding(format=tile_format, quality=int(quality))
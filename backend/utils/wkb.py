@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GeoJSON几何对象到 (E)WKB 的编码工具
+
+用于批量导入（COPY）时在Python端直接生成PostGIS可接受的十六进制EWKB，
+避免逐要素拼接WKT和调用 ST_GeomFromText。
+只输出二维坐标（X/Y），与导入表的二维几何列保持一致。
+"""
+
+import math
+import struct
+
+WKB_TYPES = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7,
+}
+
+EWKB_SRID_FLAG = 0x20000000
+
+
+class InvalidGeometryError(ValueError):
+    """GeoJSON几何对象无法编码为WKB"""
+    pass
+
+
+def _xy(point):
+    if not isinstance(point, (list, tuple)) or len(point) < 2:
+        raise InvalidGeometryError("无效的点坐标")
+    x = float(point[0])
+    y = float(point[1])
+    if not (math.isfinite(x) and math.isfinite(y)):
+        raise InvalidGeometryError("坐标包含非有限数值")
+    return x, y
+
+
+def _pack_points(points, min_points=0):
+    if not isinstance(points, (list, tuple)):
+        raise InvalidGeometryError("无效的坐标序列")
+    if len(points) < min_points:
+        raise InvalidGeometryError(f"坐标序列至少需要{min_points}个点")
+    flat = []
+    for point in points:
+        flat.extend(_xy(point))
+    return struct.pack('<I', len(points)) + struct.pack(f'<{len(flat)}d', *flat)
+
+
+def _pack_rings(rings):
+    if not isinstance(rings, (list, tuple)):
+        raise InvalidGeometryError("无效的多边形环")
+    parts = [struct.pack('<I', len(rings))]
+    for ring in rings:
+        packed = _pack_points(ring, min_points=4)
+        if _xy(ring[0]) != _xy(ring[-1]):
+            raise InvalidGeometryError("多边形环未闭合：首尾坐标不一致")
+        parts.append(packed)
+    return b''.join(parts)
+
+
+def _encode(geometry, srid=None):
+    if not isinstance(geometry, dict):
+        raise InvalidGeometryError("无效的几何对象：不是字典类型")
+    geom_type = geometry.get('type')
+    if geom_type not in WKB_TYPES:
+        raise InvalidGeometryError(f"不支持的几何类型: {geom_type}")
+
+    type_code = WKB_TYPES[geom_type]
+    if srid is not None:
+        header = struct.pack('<BII', 1, type_code | EWKB_SRID_FLAG, int(srid))
+    else:
+        header = struct.pack('<BI', 1, type_code)
+
+    if geom_type == 'GeometryCollection':
+        members = geometry.get('geometries')
+        if not isinstance(members, list):
+            raise InvalidGeometryError("无效的GeometryCollection：缺少geometries字段")
+        return header + struct.pack('<I', len(members)) + b''.join(_encode(g) for g in members)
+
+    coordinates = geometry.get('coordinates')
+    if coordinates is None:
+        raise InvalidGeometryError("无效的几何对象：缺少coordinates字段")
+
+    if geom_type == 'Point':
+        if len(coordinates) == 0:
+            # 空点按WKB约定编码为NaN
+            return header + struct.pack('<2d', math.nan, math.nan)
+        return header + struct.pack('<2d', *_xy(coordinates))
+    if geom_type == 'LineString':
+        return header + _pack_points(coordinates, min_points=2)
+    if geom_type == 'Polygon':
+        return header + _pack_rings(coordinates)
+
+    # Multi* 类型：每个成员都是完整的WKB几何
+    member_type = geom_type[len('Multi'):]
+    if not isinstance(coordinates, (list, tuple)):
+        raise InvalidGeometryError(f"无效的{geom_type}坐标")
+    members = [_encode({'type': member_type, 'coordinates': c}) for c in coordinates]
+    return header + struct.pack('<I', len(members)) + b''.join(members)
+
+
+def geojson_to_wkb(geometry):
+    """将GeoJSON几何对象编码为二维WKB字节串"""
+    return _encode(geometry)
+
+
+def geojson_to_ewkb_hex(geometry, srid):
+    """将GeoJSON几何对象编码为带SRID的十六进制EWKB（可直接COPY到geometry列）"""
+    return _encode(geometry, srid).hex()
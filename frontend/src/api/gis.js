@@ -208,7 +208,7 @@ export default {
     try {
       // 1. 初始化分片上传
       if (onProgress) onProgress(1)
-      await this.initChunkedUpload(uploadId, file.name, totalChunks, formData)
+      await this.initChunkedUpload(uploadId, file.name, totalChunks, formData, file.size, chunkSize)
       
       // 2. 上传每个分片
       for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
@@ -267,7 +267,7 @@ export default {
   },
 
   // 初始化分片上传
-  initChunkedUpload(uploadId, fileName, totalChunks, formData) {
+  initChunkedUpload(uploadId, fileName, totalChunks, formData, fileSize, chunkSize) {
     const metadata = {}
     for (let [key, value] of formData.entries()) {
       if (key !== 'file') {
@@ -283,6 +283,8 @@ export default {
         upload_id: uploadId,
         file_name: fileName,
         total_chunks: totalChunks,
+        file_size: fileSize,
+        chunk_size: chunkSize,
         metadata: metadata
       },
       timeout: 30000
@@ -290,10 +292,16 @@ export default {
   },
 
   // 上传单个分片
-  uploadChunk(uploadId, chunkIndex, chunk) {
+  async uploadChunk(uploadId, chunkIndex, chunk) {
     const chunkFormData = new FormData()
     chunkFormData.append('upload_id', uploadId)
     chunkFormData.append('chunk_index', chunkIndex)
+    // 分片校验和（服务端写入时校验），非安全上下文下没有 crypto.subtle 时跳过
+    if (window.crypto && window.crypto.subtle) {
+      const digest = await window.crypto.subtle.digest('SHA-256', await chunk.arrayBuffer())
+      const hex = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('')
+      chunkFormData.append('checksum', `sha256:${hex}`)
+    }
     chunkFormData.append('chunk', chunk)
     
     // 使用带认证的axios实例上传分片
@@ -308,6 +316,15 @@ export default {
     })
   },
 
+  // 查询分片上传状态（已接收 / 缺失的分片区间，用于断点续传）
+  getChunkedUploadStatus(uploadId) {
+    return authHttp({
+      url: `/files/upload/chunked/status/${uploadId}`,
+      method: 'get',
+      timeout: 30000
+    })
+  },
+
   // 完成分片上传
   completeChunkedUpload(uploadId) {
     // 使用带认证的axios实例完成分片上传